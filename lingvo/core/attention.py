@@ -1481,17 +1481,23 @@ class MultiHeadedAttention(BaseAttentionLayer, quant_utils.QuantizableLayer):
                          t=None):
     """Extend cached source_vecs and source_contexts by one more timestep.
 
+    When t is None, the cache may also be extended by several timesteps at
+    once, in which case all the new_* tensors get a leading [num_steps]
+    dimension.
+
     Args:
       theta: A `.NestedMap` object containing weights' values of this layer and
         its children layers.
-      new_source_vecs: A tensor of shape [source_batch, source_dim].
-      new_source_contexts: A tensor of shape [source_batch, context_dim].
+      new_source_vecs: A tensor of shape [source_batch, source_dim], or
+        [num_steps, source_batch, source_dim] if t is None.
+      new_source_contexts: A tensor of shape [source_batch, context_dim], or
+        [num_steps, source_batch, context_dim] if t is None.
         new_source_vecs and new_source_contexts are source_vecs and
         source_contexts for the new timestep to be extended.
-      new_source_paddings: If not None, a tensor of shape [source_batch].
-        source_padding for the new timestep.
-      new_source_segment_ids: If not None, a tensor of shape [source_batch].
-        source_segment_id for the new timestep.
+      new_source_paddings: If not None, a tensor of shape [source_batch], or
+        [num_steps, source_batch]. source_padding for the new timestep.
+      new_source_segment_ids: If not None, a tensor of shape [source_batch], or
+        [num_steps, source_batch]. source_segment_id for the new timestep.
       cached_packed_src: a `.NestedMap` object, containing already preprocessed
         source_vecs and source_contexts for the previous t-1 steps. To support
         tf.while_loop on TPU (satisfying static shape requirement), instead of
@@ -1537,26 +1543,44 @@ class MultiHeadedAttention(BaseAttentionLayer, quant_utils.QuantizableLayer):
       'extended_source_context' is of shape [t, batch_size, num_heads * dim];
       'source_padding' is of shape [t, batch_size, num_heads];
       'source_segment_id' is of shape [t, batch_size, num_heads].
+      Extending by num_steps timesteps adds num_steps instead of one to t.
+
+    Raises:
+      ValueError: if several timesteps are extended with t given.
     """
-    batch_size = py_utils.GetShape(new_source_vecs)[0]
+    if new_source_vecs.shape.ndims == 3:
+      if t is not None:
+        raise ValueError('Only one timestep can be extended when t is given.')
+    else:
+      new_source_vecs = tf.expand_dims(new_source_vecs, 0)
+      new_source_contexts = tf.expand_dims(new_source_contexts, 0)
+      if new_source_paddings is not None:
+        new_source_paddings = tf.expand_dims(new_source_paddings, 0)
+      if new_source_segment_ids is not None:
+        new_source_segment_ids = tf.expand_dims(new_source_segment_ids, 0)
+    num_steps, batch_size = py_utils.GetShape(new_source_vecs, 2)
     if new_source_paddings is None:
-      new_source_paddings = tf.zeros([batch_size], dtype=new_source_vecs.dtype)
+      new_source_paddings = tf.zeros([num_steps, batch_size],
+                                     dtype=new_source_vecs.dtype)
     if new_source_segment_ids is None:
-      new_source_segment_ids = tf.zeros([batch_size],
+      new_source_segment_ids = tf.zeros([num_steps, batch_size],
                                         dtype=new_source_vecs.dtype)
     processed_packed_src = self.InitForSourcePacked(
-        theta, tf.expand_dims(new_source_vecs, 0),
-        tf.expand_dims(new_source_contexts, 0),
-        tf.expand_dims(new_source_paddings, 0),
-        tf.expand_dims(new_source_segment_ids, 0))
+        theta, new_source_vecs, new_source_contexts, new_source_paddings,
+        new_source_segment_ids)
     extended_packed_src = py_utils.NestedMap()
     for key in ('source_vecs', 'source_contexts', 'source_padding',
                 'source_segment_id'):
       if cached_packed_src.get(key, None) is None:
         extended_packed_src[key] = None
       else:
+        processed = processed_packed_src[key]
+        if key == 'source_contexts':
+          # The packed contexts are [batch * num_heads, time, dim], see
+          # PackCachedSource(); make them time major like the cache.
+          processed = tf.transpose(processed, [1, 0, 2])
         if t is not None:
-          processed = tf.reshape(processed_packed_src[key], [batch_size, -1])
+          processed = tf.reshape(processed, [batch_size, -1])
           # Make sure t is a scaler instead of tensors having shape like [1,].
           # This could happen in cases where function is called by recurrent.py
           # (for example target_sequence_sampler.)
@@ -1564,7 +1588,7 @@ class MultiHeadedAttention(BaseAttentionLayer, quant_utils.QuantizableLayer):
           extended_packed_src[key] = inplace_ops.alias_inplace_update(
               cached_packed_src[key], t, processed)
         else:
-          processed = tf.reshape(processed_packed_src[key], [1, batch_size, -1])
+          processed = tf.reshape(processed, [num_steps, batch_size, -1])
           extended_packed_src[key] = tf.concat(
               [cached_packed_src[key], processed], axis=0)
     return extended_packed_src
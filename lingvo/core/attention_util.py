@@ -269,6 +269,195 @@ def AttenContext(probs, value):
   return tf.einsum('BNTS,BSNH->BTNH', probs, value)
 
 
+def BlockwiseDotAtten(query,
+                      key,
+                      value,
+                      paddings,
+                      block_size,
+                      segment_mask=None,
+                      per_step_padding=None,
+                      extra_logit=None,
+                      keep_prob=1.0,
+                      dropout_seeds=None):
+  """Exact dot-product attention over blocks of keys with an online softmax.
+
+  Computes the same context vectors as `AttenContext()` of the softmax of
+  `AttenLogits()`, without materializing the [B, N, T, S] logits or
+  probabilities. The keys and values are visited `block_size` positions at a
+  time, keeping a running maximum, a running sum of the exponentiated logits,
+  and a running context of each query, so the memory of the intermediate
+  tensors is O(B * N * T * block_size).
+
+  The gradient recomputes the probabilities of each block from the saved
+  softmax maximum and sum of each query instead of storing them.
+
+  Masked positions have logits of -0.7 * float32 max like in
+  `MultiHeadedAttention.AttenProbs()`, so queries with all their keys masked
+  attend uniformly to all of them.
+
+  Args:
+    query: [B, T, N, H], already scaled.
+    key: [B, S, N, H].
+    value: [B, S, N, H].
+    paddings: [B, S]. Ignored if `segment_mask` is given.
+    block_size: int. Number of keys per block.
+    segment_mask: Optional [B, 1, T, S] of large negative logits, including
+      the paddings, added to the logits.
+    per_step_padding: Optional [B, T, S] paddings of each query, e.g. causal
+      paddings. Ignored if `segment_mask` is given.
+    extra_logit: Optional extra logit of the softmax, as in `py_utils.Softmax`.
+    keep_prob: Keep probability of the dropout of the attention probabilities.
+    dropout_seeds: A Tensor of shape [2], the seeds of the deterministic dropout
+      of the probabilities. Dropout is only applied if set and keep_prob < 1.
+      The masks of each block are derived from them, so that they are the
+      same when the block is recomputed in the gradient.
+
+  Returns:
+    encoded: [B, T, N, H].
+
+  Raises:
+    ValueError: if block_size is not positive.
+  """
+  if block_size < 1:
+    raise ValueError('block_size must be at least 1, got {}'.format(block_size))
+  b, t, n, _ = py_utils.GetShape(query, 4)
+  s = py_utils.GetShape(key, 4)[1]
+  num_blocks = (s + block_size - 1) // block_size
+  apply_dropout = dropout_seeds is not None and not (
+      isinstance(keep_prob, (int, float)) and keep_prob == 1.0)
+  dtype = value.dtype
+  very_negative = tf.float32.max * -0.7
+
+  def _ToBlocks(x, padding_val):
+    # [B, S, ...] -> [num_blocks, B, block_size, ...].
+    x = ConvertToBlocks(x, block_size, padding_val)
+    return tf.transpose(x, [1, 0] + list(range(2, x.shape.ndims)))
+
+  # The positions appended to the last block only add zeros to the softmax
+  # sums, and their logits are masked so that they never raise the maximum.
+  if segment_mask is not None:
+    # [num_blocks, B, block_size, 1, T].
+    mask_blocks = _ToBlocks(
+        tf.transpose(tf.cast(segment_mask, tf.float32), [0, 3, 1, 2]),
+        very_negative)
+  else:
+    paddings = py_utils.HasShape(paddings, [b, s])
+    # [num_blocks, B, block_size].
+    padding_blocks = _ToBlocks(tf.cast(paddings, tf.float32), 1.0)
+    if per_step_padding is not None:
+      per_step_padding = py_utils.HasShape(per_step_padding, [b, t, s])
+      # [num_blocks, B, block_size, T].
+      per_step_blocks = _ToBlocks(
+          tf.transpose(tf.cast(per_step_padding, tf.float32), [0, 2, 1]), 1.0)
+
+  def _BlockLogits(q, k, i):
+    """Returns the masked logits [B, N, T, K] and where they are unmasked."""
+    logits = tf.einsum('BTNH,BKNH->BNTK', q, k)
+    if segment_mask is not None:
+      return (logits + tf.transpose(tf.gather(mask_blocks, i), [0, 2, 3, 1]),
+              None)
+    # [B, 1, 1, K].
+    pad = tf.expand_dims(tf.expand_dims(tf.gather(padding_blocks, i), 1), 1)
+    if per_step_padding is not None:
+      # [B, 1, T, K].
+      pad += tf.expand_dims(
+          tf.transpose(tf.gather(per_step_blocks, i), [0, 2, 1]), 1)
+    unmasked = tf.cast(tf.equal(pad, 0.0), tf.float32)
+    return logits * unmasked + very_negative * (1.0 - unmasked), unmasked
+
+  def _BlockValid(i):
+    """Returns [K], 1 for the positions of block i within the S keys."""
+    return tf.cast(tf.range(block_size) + i * block_size < s, tf.float32)
+
+  def _BlockDropout(x, i):
+    if not apply_dropout:
+      return x
+    seeds = dropout_seeds + tf.stack(
+        [tf.zeros([], dropout_seeds.dtype),
+         tf.cast(i, dropout_seeds.dtype)])
+    return py_utils.DeterministicDropout(x, keep_prob, seeds)
+
+  @tf.custom_gradient
+  def _Atten(q, k, v):
+    """Online softmax attention of float32 q, k, v."""
+    # [num_blocks, B, block_size, N, H].
+    k_blocks = _ToBlocks(k, 0.0)
+    v_blocks = _ToBlocks(v, 0.0)
+
+    def _FwdStep(i, m, l, acc):
+      logits, _ = _BlockLogits(q, tf.gather(k_blocks, i), i)
+      new_m = tf.maximum(m, tf.reduce_max(logits, -1))
+      # [B, N, T].
+      alpha = tf.exp(m - new_m)
+      probs = tf.exp(logits - tf.expand_dims(new_m, -1)) * _BlockValid(i)
+      l = l * alpha + tf.reduce_sum(probs, -1)
+      acc = acc * tf.expand_dims(tf.transpose(alpha, [0, 2, 1]), -1)
+      acc += tf.einsum('BNTK,BKNH->BTNH', _BlockDropout(probs, i),
+                       tf.gather(v_blocks, i))
+      return i + 1, new_m, l, acc
+
+    if extra_logit is None:
+      m0 = tf.fill([b, n, t], -tf.float32.max)
+      l0 = tf.zeros([b, n, t], tf.float32)
+    else:
+      m0 = tf.fill([b, n, t], tf.cast(extra_logit, tf.float32))
+      l0 = tf.ones([b, n, t], tf.float32)
+    _, m, l, acc = tf.while_loop(
+        lambda i, *_: i < num_blocks,
+        _FwdStep,
+        loop_vars=(tf.constant(0), m0, l0, tf.zeros_like(q)))
+    encoded = acc / tf.expand_dims(tf.transpose(l, [0, 2, 1]), -1)
+    # [B, N, T, 1]. Not summed into a log-sum-exp, which would lose log(l) to
+    # rounding when all the logits are masked.
+    m = tf.expand_dims(m, -1)
+    l = tf.expand_dims(l, -1)
+
+    def _Grad(d_encoded):
+      # [B, N, T, 1].
+      d_sum = tf.expand_dims(
+          tf.transpose(tf.reduce_sum(d_encoded * encoded, -1), [0, 2, 1]), -1)
+
+      def _BwdStep(i, dq, dks, dvs):
+        k_i = tf.gather(k_blocks, i)
+        v_i = tf.gather(v_blocks, i)
+        logits, unmasked = _BlockLogits(q, k_i, i)
+        probs = tf.exp(logits - m) / l * _BlockValid(i)
+        dvs = dvs.write(
+            i,
+            tf.einsum('BNTK,BTNH->BKNH', _BlockDropout(probs, i), d_encoded))
+        d_probs = _BlockDropout(
+            tf.einsum('BTNH,BKNH->BNTK', d_encoded, v_i), i)
+        d_logits = probs * (d_probs - d_sum)
+        if unmasked is not None:
+          d_logits *= unmasked
+        dq += tf.einsum('BNTK,BKNH->BTNH', d_logits, k_i)
+        dks = dks.write(i, tf.einsum('BNTK,BTNH->BKNH', d_logits, q))
+        return i + 1, dq, dks, dvs
+
+      _, dq, dks, dvs = tf.while_loop(
+          lambda i, *_: i < num_blocks,
+          _BwdStep,
+          loop_vars=(tf.constant(0), tf.zeros_like(q),
+                     tf.TensorArray(tf.float32, size=num_blocks),
+                     tf.TensorArray(tf.float32, size=num_blocks)))
+
+      def _FromBlocks(ta):
+        # [num_blocks, B, block_size, N, H] -> [B, S, N, H].
+        x = tf.transpose(ta.stack(), [1, 0, 2, 3, 4])
+        x = tf.reshape(x, [b, num_blocks * block_size] +
+                       py_utils.GetShape(x)[3:])
+        return x[:, :s]
+
+      return dq, _FromBlocks(dks), _FromBlocks(dvs)
+
+    return encoded, _Grad
+
+  encoded = _Atten(
+      tf.cast(query, tf.float32), tf.cast(key, tf.float32),
+      tf.cast(value, tf.float32))
+  return tf.cast(encoded, dtype)
+
+
 def _AttenLogitsXL(query,
                    key,
                    abs_pos_emb,
@@ -19,6 +19,7 @@ from absl.testing import parameterized
 
 from lingvo import compat as tf
 from lingvo.core import attention_util
+from lingvo.core import py_utils
 from lingvo.core import test_utils
 
 import numpy as np
@@ -507,5 +508,104 @@ class ComputeSparseAttention(test_utils.TestCase):
     self.assertAllClose(out, expected_output)
 
 
+class BlockwiseDotAttenTest(test_utils.TestCase, parameterized.TestCase):
+
+  def _Inputs(self, b=2, t=5, s=10, n=2, h=3):
+    np.random.seed(12345)
+    query = tf.constant(np.random.normal(size=[b, t, n, h]), tf.float32)
+    key = tf.constant(np.random.normal(size=[b, s, n, h]), tf.float32)
+    value = tf.constant(np.random.normal(size=[b, s, n, h]), tf.float32)
+    paddings = np.zeros([b, s], np.float32)
+    paddings[0, 7:] = 1.0
+    # All the keys of the second sequence are padded.
+    paddings[1, :] = 1.0
+    per_step_padding = np.zeros([b, t, s], np.float32)
+    per_step_padding[:, :, 8:] = 1.0
+    per_step_padding[:, 2, 1:3] = 1.0
+    return query, key, value, tf.constant(paddings), tf.constant(
+        per_step_padding)
+
+  def _Dense(self, query, key, value, mask, extra_logit=None):
+    logits = attention_util.AttenLogits(query, key)
+    if mask.dtype == tf.bool:
+      # Same as MultiHeadedAttention.AttenProbs().
+      logits = tf.where(mask, tf.ones_like(logits) * tf.float32.max * -0.7,
+                        logits)
+    else:
+      logits += mask
+    probs = py_utils.Softmax(logits, extra_logit=extra_logit)
+    return attention_util.AttenContext(probs, value)
+
+  @parameterized.named_parameters(
+      ('_Block1', 1, None, False),
+      ('_Block3', 3, None, False),
+      ('_Block4SegmentMask', 4, None, True),
+      ('_Block10ExtraLogit', 10, 0.5, False),
+      ('_Block16', 16, None, False),
+  )
+  def testMatchesDense(self, block_size, extra_logit, use_segment_mask):
+    with self.session(graph=tf.Graph()) as sess:
+      query, key, value, paddings, per_step_padding = self._Inputs()
+      b, t, _, _ = py_utils.GetShape(query)
+      s = py_utils.GetShape(key)[1]
+      mask = tf.tile(
+          tf.reshape(paddings, [b, 1, 1, s]) +
+          tf.expand_dims(per_step_padding, 1), [1, 2, 1, 1]) > 0.0
+      if use_segment_mask:
+        # A different mask from the paddings, to check that it replaces them.
+        segment_mask = tf.reverse(
+            tf.cast(mask[:, :1], tf.float32) * tf.float32.max * -0.7, [2])
+        expected = self._Dense(query, key, value, segment_mask, extra_logit)
+      else:
+        segment_mask = None
+        expected = self._Dense(query, key, value, mask, extra_logit)
+      actual = attention_util.BlockwiseDotAtten(
+          query,
+          key,
+          value,
+          paddings,
+          block_size,
+          segment_mask=segment_mask,
+          per_step_padding=per_step_padding,
+          extra_logit=extra_logit)
+      self.assertAllEqual([b, t, 2, 3], actual.shape.as_list())
+      loss_weights = tf.constant(np.random.normal(size=[b, t, 2, 3]),
+                                 tf.float32)
+      expected_grads = tf.gradients(
+          tf.reduce_sum(expected * loss_weights), [query, key, value])
+      actual_grads = tf.gradients(
+          tf.reduce_sum(actual * loss_weights), [query, key, value])
+      expected_vals, actual_vals = sess.run(
+          [[expected] + expected_grads, [actual] + actual_grads])
+    for expected_val, actual_val in zip(expected_vals, actual_vals):
+      self.assertAllClose(expected_val, actual_val, atol=1e-5, rtol=1e-5)
+
+  def testDropout(self):
+    with self.session(graph=tf.Graph()) as sess:
+      query, key, value, paddings, per_step_padding = self._Inputs(s=7)
+      seeds = tf.constant([1234, 5678], tf.int64)
+
+      def _Atten(keep_prob):
+        return attention_util.BlockwiseDotAtten(
+            query,
+            key,
+            value,
+            paddings,
+            3,
+            per_step_padding=per_step_padding,
+            keep_prob=keep_prob,
+            dropout_seeds=seeds)
+
+      dropped = _Atten(0.5)
+      self.assertNotAllClose(*sess.run([_Atten(1.0), dropped]))
+      self.assertAllEqual(*sess.run([dropped, _Atten(0.5)]))
+      # The gradients recompute the blocks with the same dropout masks.
+      for x in (query, key, value):
+        err = tf.test.compute_gradient_error(
+            x, py_utils.GetShape(x), dropped, py_utils.GetShape(dropped),
+            x_init_value=sess.run(x), delta=1e-3)
+        self.assertLess(err, 2e-2)
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -171,11 +171,14 @@ class BaseBeamSearchDecoder(BaseDecoder):
                                 theta,
                                 encoder_outputs,
                                 num_hyps_per_beam_override=0):
-    return self.beam_search.BeamSearchDecode(theta, encoder_outputs,
-                                             num_hyps_per_beam_override,
-                                             self._InitBeamSearchStateCallback,
-                                             self._PreBeamSearchStepCallback,
-                                             self._PostBeamSearchStepCallback)
+    return self.beam_search.BeamSearchDecode(
+        theta,
+        encoder_outputs,
+        num_hyps_per_beam_override,
+        self._InitBeamSearchStateCallback,
+        self._PreBeamSearchStepCallback,
+        self._PostBeamSearchStepCallback,
+        compact_encoder_outputs_callback=self._CompactEncoderOutputsCallback)
 
   def GreedySearchDecode(self, encoder_outputs):
     """Performs beam search based decoding.
@@ -193,7 +196,27 @@ class BaseBeamSearchDecoder(BaseDecoder):
         theta, encoder_outputs,
         self._InitBeamSearchStateCallback,
         self._PreBeamSearchStepCallback,
-        self._PostBeamSearchStepCallback)
+        self._PostBeamSearchStepCallback,
+        compact_encoder_outputs_callback=self._CompactEncoderOutputsCallback)
+
+  def _CompactEncoderOutputsCallback(self, theta, encoder_outputs, beam_ids):
+    """Returns encoder_outputs with only the source sequences of beam_ids.
+
+    Only called if p.beam_search.compact_interval > 0 or
+    p.greedy_search.compact_interval > 0, see `.BeamSearchHelper`.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      encoder_outputs: A `.NestedMap` computed by encoder.
+      beam_ids: An int32 tensor of shape [new_src_batch], the increasing indices
+        of the source sequences to keep.
+
+    Returns:
+      A `.NestedMap` of the same structure as encoder_outputs.
+    """
+    raise NotImplementedError('%s does not support compact_interval.' %
+                              type(self).__name__)
 
   def SampleTargetSequences(self, theta, encoder_outputs, random_seed):
     """Performs target sequence sampling.
@@ -40,10 +40,12 @@ from lingvo.core import base_layer
 from lingvo.core import batch_utils
 from lingvo.core import datasource
 from lingvo.core import hyperparams
+from lingvo.core import input_cache
 from lingvo.core import input_generator_helper as ig_helper
 from lingvo.core import inspect_utils
 from lingvo.core import ops
 from lingvo.core import py_utils
+from lingvo.core import tfrecord_index
 from lingvo.core import tokenizers
 
 # pylint: disable=g-direct-tensorflow-import
@@ -144,6 +146,12 @@ class BaseInputGenerator(base_layer.BaseLayer):
         'decoder_samples_per_summary', None, 'If not None, overrides '
         'task_p.eval.decoder_samples_per_summary directly. Allowed to be 0, '
         'which means to use the entire dataset.')
+    p.Define(
+        'preprocessed_cache_dir', None,
+        'If set, a resettable input used by the Evaler or Decoder writes the '
+        'preprocessed batches of its first pass to a cache in this directory, '
+        'and replays them on later passes instead of running the input '
+        'pipeline again. The cache is keyed by a fingerprint of these params.')
     p.Define(
         'filter_sparse_tensors', False,
         'If true, filter out SparseTensors in input_batch before enqueuing '
@@ -178,6 +186,8 @@ class BaseInputGenerator(base_layer.BaseLayer):
 
     # Set to true in GetPreprocessedInputBatch() (and thus _InputBatch())
     self._in_get_processed_input_batch = False
+    # Set in GetPreprocessedInputBatch() if p.preprocessed_cache_dir is set.
+    self._preprocessed_cache = None
 
   def CommonInputOpArgs(self):
     """Common input params."""
@@ -246,6 +256,15 @@ class BaseInputGenerator(base_layer.BaseLayer):
     res = self._PreprocessInputBatch(self._InputBatch())
     self._in_get_processed_input_batch = False
 
+    p = self.params
+    if p.preprocessed_cache_dir:
+      if not p.resettable:
+        raise ValueError('preprocessed_cache_dir requires a resettable input.')
+      if not isinstance(res, py_utils.NestedMap):
+        raise ValueError('preprocessed_cache_dir requires a NestedMap batch.')
+      self._preprocessed_cache = input_cache.PreprocessedBatchCache(
+          p.preprocessed_cache_dir, p, res)
+
     if py_utils.GetUnitTestSession():
       self.Initialize(py_utils.GetUnitTestSession())
     return res
@@ -692,6 +711,22 @@ class BaseInputGenerator(base_layer.BaseLayer):
     """
     raise NotImplementedError()
 
+  def StartPreprocessedCachePass(self):
+    """Starts a pass over the preprocessed cache, if any, after Reset()."""
+    if self._preprocessed_cache:
+      self._preprocessed_cache.StartPass()
+
+  def FinishPreprocessedCachePass(self):
+    """Finishes a pass over the preprocessed cache, if any."""
+    if self._preprocessed_cache:
+      self._preprocessed_cache.FinishPass()
+
+  def RunWithPreprocessedCache(self, sess, fetches, **kwargs):
+    """Runs `fetches` like `sess.run()`, replaying cached batches if any."""
+    if self._preprocessed_cache:
+      return self._preprocessed_cache.Run(sess, fetches, **kwargs)
+    return sess.run(fetches, **kwargs)
+
 
 def FilePatternToDataSource(p):
   """Helper to turn p.file_pattern (deprecated) into p.file_datasource."""
@@ -852,6 +887,10 @@ class BaseInputGeneratorFromFiles(BaseInputGenerator):
     args.update(self._InputOpBucketingArgs())
     return args
 
+  def Initialize(self, sess):
+    self.datasource.Initialize(sess)
+    super().Initialize(sess)
+
   def _InputOpBucketingArgs(self):
     return {
         'bucket_upper_bound': [1000000],
@@ -1007,6 +1046,7 @@ class BaseSequenceInputGenerator(BaseInputGeneratorFromFiles):
 
     if DEFAULT_TOKENIZER_KEY in self.tokenizer_dict:
       self.tokenizer = self.tokenizer_dict[DEFAULT_TOKENIZER_KEY]
+    self._host_detokenizers = {}
 
   @property  # Adjust batch size according to the cluster spec.
   def infeed_bucket_batch_limit(self):
@@ -1116,6 +1156,23 @@ class BaseSequenceInputGenerator(BaseInputGeneratorFromFiles):
     key = key or DEFAULT_TOKENIZER_KEY
     return self.tokenizer_dict[key].IdsToStrings(ids, lens)
 
+  def HostIdsToStrings(self, ids, lens, key=None):
+    """Same as `IdsToStrings()` on numpy arrays, without running any op.
+
+    Args:
+      ids: An int array of shape [..., seqlen].
+      lens: An int array of shape [...], the sequence lengths.
+      key: A string key in case the model has multiple tokenizers.
+
+    Returns:
+      An object array of shape [...] of the bytes of the converted strings.
+    """
+    key = key or DEFAULT_TOKENIZER_KEY
+    if key not in self._host_detokenizers:
+      self._host_detokenizers[key] = (
+          self.tokenizer_dict[key].CreateHostDetokenizer())
+    return self._host_detokenizers[key].IdsToStrings(ids, lens)
+
   def Cast(self, v):
     """Cast tensor dtype to fprop_dtype."""
     if not v.dtype.is_floating:
@@ -1190,6 +1247,20 @@ class BaseTinyDatasetInput(BaseInputGenerator):
 class TFDataSequenceInputGenerator(BaseSequenceInputGenerator):
   """tf.data input pipeline for sequences."""
 
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.Define(
+        'use_record_index', False,
+        'If True, reads TFRecord files indexed by '
+        '//lingvo/tools:build_tfrecord_index record by record: records are '
+        'striped across input hosts, shuffled with a permutation of all the '
+        'records of each epoch, and the number of records read by each host '
+        'is kept in a variable saved with checkpoints, from which reading '
+        'resumes. Only supports a single file pattern, and _ProcessDataset() '
+        'must keep the record_position of the examples.')
+    return p
+
   def __init__(self, params):
     """Constructor."""
     if params.file_datasource:
@@ -1197,6 +1268,10 @@ class TFDataSequenceInputGenerator(BaseSequenceInputGenerator):
           'TFDataSequenceInputGenerator does not support p.file_datasource.')
     super().__init__(params)
     self._iterator = {}
+    # The start position and read position variable of each host, with
+    # p.use_record_index.
+    self._start_positions = {}
+    self._read_positions = {}
 
   @property
   def host_id(self):
@@ -1225,7 +1300,18 @@ class TFDataSequenceInputGenerator(BaseSequenceInputGenerator):
     if self.host_id not in self._iterator:
       self._InitIterator()
     if not tf.executing_eagerly():
-      sess.run([it.initializer for it in self._iterator.values()])
+      feed_dict = {}
+      for host_id, read_position in self._read_positions.items():
+        try:
+          position = sess.run(read_position)
+        except tf.errors.FailedPreconditionError:
+          # Not restored from a checkpoint yet.
+          continue
+        tf.logging.info('Host %d resumes reading at record %d.', host_id,
+                        position)
+        feed_dict[self._start_positions[host_id]] = position
+      sess.run([it.initializer for it in self._iterator.values()],
+               feed_dict=feed_dict)
     super().Initialize(sess)
 
   def _InputBatch(self):
@@ -1233,6 +1319,14 @@ class TFDataSequenceInputGenerator(BaseSequenceInputGenerator):
     if self.host_id not in self._iterator:
       self._InitIterator()
     batch = self._iterator[self.host_id].get_next()
+    record_position = batch.pop('record_position', None)
+    read_position = self._read_positions.get(self.host_id)
+    if record_position is not None and read_position is not None:
+      # Padded examples have position 0, which never moves the position back.
+      update = read_position.assign(
+          tf.maximum(read_position, tf.reduce_max(record_position) + 1))
+      with tf.control_dependencies([update]):
+        batch = batch.Transform(tf.identity)
 
     # Set tensor shapes.
     if py_utils.use_tpu():
@@ -1280,6 +1374,37 @@ class TFDataSequenceInputGenerator(BaseSequenceInputGenerator):
             f'p.file_pattern must be all strings or all tuples, but got: '
             f'{p.file_pattern}.')
 
+    def LoadIndexedDataset(file_pattern_glob):
+      if self.host_id not in self._start_positions:
+        if tf.executing_eagerly():
+          self._start_positions[self.host_id] = 0
+        else:
+          self._start_positions[self.host_id] = tf.placeholder_with_default(
+              tf.constant(0, tf.int64), [])
+      if not self.do_eval and not tf.executing_eagerly():
+        self._read_positions[self.host_id] = tf.Variable(
+            0,
+            dtype=tf.int64,
+            trainable=False,
+            name='%s_read_position_host%d' % (p.name, self.host_id))
+      num_input_replicas = 1
+      if p.use_per_host_infeed:
+        num_input_replicas = GetInfeedContext().num_infeed_hosts
+      dataset = tfrecord_index.IndexedRecordDataset(
+          sorted(tf.io.gfile.glob(file_pattern_glob)),
+          num_shards=num_input_replicas,
+          shard_id=self.host_id,
+          shuffle_seed=(None
+                        if require_sequential_order else p.file_random_seed),
+          repeat=not self.do_eval,
+          start_position=self._start_positions[self.host_id])
+
+      def MakeExample(position, record):
+        return py_utils.NestedMap(
+            data=record, source_id=0, record_position=position)
+
+      return dataset.map(MakeExample, **self._map_args)
+
     def LoadDatasetFromSingleGlob(file_pattern_glob, source_id):
       dataset = tf.data.Dataset.list_files(
           file_pattern_glob,
@@ -1305,11 +1430,16 @@ class TFDataSequenceInputGenerator(BaseSequenceInputGenerator):
       dataset = dataset.map(MakeExample, **self._map_args)
       return dataset
 
+    if p.use_record_index and len(file_patterns) > 1:
+      raise ValueError('p.use_record_index only supports one file pattern.')
     datasets = []
     for i, file_pattern in enumerate(file_patterns):
       file_pattern = self._PreprocessFilePattern(file_pattern)
       file_pattern = py_utils.ShardedFilePatternToGlob(file_pattern)
-      datasets.append(LoadDatasetFromSingleGlob(file_pattern, i))
+      if p.use_record_index:
+        datasets.append(LoadIndexedDataset(file_pattern))
+      else:
+        datasets.append(LoadDatasetFromSingleGlob(file_pattern, i))
     if len(file_patterns) > 1:
       tf.logging.info(f'Mixing files {file_patterns} with weights {weights}.')
       dataset = tf.data.experimental.sample_from_datasets(
@@ -1384,7 +1514,8 @@ class TFDataSequenceInputGenerator(BaseSequenceInputGenerator):
         tf.data.experimental.get_structure(dataset))
 
     padded_shapes = dataset_structure.TransformWithKey(
-        lambda k, _: tf.TensorShape(self._InputShape(k)))
+        lambda k, _: tf.TensorShape(  # pylint: disable=g-long-lambda
+            () if k == 'record_position' else self._InputShape(k)))
     padding_values = dataset_structure.TransformWithKey(self._InputPaddingValue)
 
     dataset_structure.VLog(0, 'dataset_structure:')
@@ -26,6 +26,7 @@ from lingvo.core import cluster_factory
 from lingvo.core import hyperparams
 from lingvo.core import py_utils
 from lingvo.core import test_utils
+from lingvo.core import tfrecord_index
 import mock
 import numpy as np
 
@@ -237,6 +238,70 @@ class BaseExampleInputGeneratorTest(test_utils.TestCase):
     mock_method.assert_called()
 
 
+class _ToyIndexedSequenceInput(
+    base_input_generator.TFDataSequenceInputGenerator):
+  """Reads records of space separated ids."""
+
+  def _ProcessDataset(self, dataset):
+
+    def Process(example):
+      ids = tf.strings.to_number(
+          tf.strings.split([example.data], ' ').values, out_type=tf.int32)
+      return py_utils.NestedMap(
+          ids=ids, record_position=example.record_position)
+
+    return dataset.map(Process, **self._map_args)
+
+  def _InputShape(self, key):
+    if key == 'ids':
+      return (4,)
+    if key == 'bucket_keys':
+      return ()
+    return super()._InputShape(key)
+
+  def _GetBucketId(self, example):
+    return tf.shape(example.ids)[0]
+
+
+class TFDataSequenceInputGeneratorTest(test_utils.TestCase):
+
+  def _Params(self):
+    path = os.path.join(self.get_temp_dir(), 'ids.tfrecord')
+    with tf.io.TFRecordWriter(path) as w:
+      for i in range(1, 8):
+        w.write(b' '.join(b'%d' % i for _ in range(i % 4 + 1)))
+    tfrecord_index.BuildIndex(path)
+    p = _ToyIndexedSequenceInput.Params()
+    p.file_pattern = path
+    p.use_record_index = True
+    p.bucket_upper_bound = [4]
+    p.bucket_batch_limit = [2]
+    return p
+
+  def testRecordIndexResume(self):
+    p = self._Params()
+    with self.session(graph=tf.Graph()) as sess:
+      inp = p.Instantiate()
+      batch = inp.GetPreprocessedInputBatch()
+      sess.run(tf.global_variables_initializer())
+      inp.Initialize(sess)
+      ids = [sess.run(batch.ids)[:, 0] for _ in range(7)]
+      read_position = inp._read_positions[0]
+      self.assertEqual(14, sess.run(read_position))
+      # Each epoch reads the 7 records once.
+      self.assertCountEqual(range(1, 8), list(np.concatenate(ids)[:7]))
+
+    with self.session(graph=tf.Graph()) as sess:
+      inp = p.Instantiate()
+      batch = inp.GetPreprocessedInputBatch()
+      sess.run(tf.global_variables_initializer())
+      # As if restored from a checkpoint saved after 2 batches.
+      sess.run(inp._read_positions[0].assign(4))
+      inp.Initialize(sess)
+      self.assertAllEqual(ids[2], sess.run(batch.ids)[:, 0])
+      self.assertAllEqual(ids[3], sess.run(batch.ids)[:, 0])
+
+
 # Dataset pipelines for TFDataInputTest.
 def _TestDatasetFn(begin=0, end=10):
   """Test tf.data pipeline."""
@@ -113,6 +113,25 @@ def SegmentMask(segment_id,
   return tf.expand_dims(ret, axis=1)
 
 
+def QuantizeToInt8(x):
+  """Symmetrically quantizes x to int8 with a scale per vector of the last dim.
+
+  Args:
+    x: A float Tensor of shape [..., H].
+
+  Returns:
+    quantized: An int8 Tensor of shape [..., H].
+    scale: A float32 Tensor of shape [...], such that x is approximately
+    tf.cast(quantized, tf.float32) * scale[..., tf.newaxis], with an error of
+    at most scale / 2 per element.
+  """
+  x = tf.cast(x, tf.float32)
+  scale = tf.reduce_max(tf.abs(x), axis=-1) / 127.
+  quantized = tf.cast(
+      tf.round(tf.math.divide_no_nan(x, tf.expand_dims(scale, -1))), tf.int8)
+  return quantized, scale
+
+
 class PerDimScaleLayer(base_layer.BaseLayer):
   """A layer to scale individual dims of the input."""
 
@@ -395,6 +414,16 @@ class MultiHeadedAttention(base_layer.BaseLayer):
     p.Define(
         'atten_extra_logit', None, 'Extra logit for attention softmax.'
         'Notice None and 0 are different.')
+    p.Define(
+        'quantize_kv_cache', False, 'If True, ExtendStep caches the keys and '
+        'values as int8 with a float32 scale per step and head, which are '
+        'applied to the logits and probabilities in _DotAttenOneStep.')
+    p.Define(
+        'atten_block_size', 0, 'If > 0, computes the attention over blocks of '
+        'this many keys with an online softmax, without materializing the '
+        '[B, N, T, S] logits and probabilities, which are then not returned. '
+        'The gradient recomputes the blocks. The result is exact, but the '
+        'attention dropout masks differ from those of dropout_tpl.')
     # SPMD partition related params.
     #
     # d - model_dim
@@ -429,6 +458,18 @@ class MultiHeadedAttention(base_layer.BaseLayer):
       assert p.weight_split_dims_mapping is not None
       assert p.activation_split_dims_mapping is not None
 
+    if p.atten_block_size and (
+        type(self)._AttenLogits is not MultiHeadedAttention._AttenLogits or
+        type(self).AttenProbs is not MultiHeadedAttention.AttenProbs):
+      raise ValueError('atten_block_size is not supported by {}.'.format(
+          type(self).__name__))
+    if p.quantize_kv_cache and any(
+        getattr(type(self), f) is not getattr(MultiHeadedAttention, f)
+        for f in ('InitStates', 'ExtendStep', '_DotAttenOneStep',
+                  '_AttenLogitsOneStep', '_AttenContextOneStep')):
+      raise ValueError('quantize_kv_cache is not supported by {}.'.format(
+          type(self).__name__))
+
     def ProjectInput():
       return p.proj_tpl.Copy().Set(
           input_dim=p.input_dim,
@@ -612,6 +653,10 @@ class MultiHeadedAttention(base_layer.BaseLayer):
     else:
       query *= (p.hidden_dim // p.num_heads)**-0.5
 
+    if p.atten_block_size:
+      return self._BlockwiseDotAtten(theta, query, key, value, paddings,
+                                     segment_mask, per_step_padding), None
+
     # Compute prob with shape [batch, heads, target_time, source_time].
     with tf.name_scope('probs'):
       probs, probs_sum = self.AttenProbs(theta, query, key, paddings,
@@ -630,6 +675,48 @@ class MultiHeadedAttention(base_layer.BaseLayer):
                                      p.activation_split_dims_mapping.blnh)
     return encoded, probs
 
+  def _BlockwiseDotAtten(self, theta, query, key, value, paddings, segment_mask,
+                         per_step_padding):
+    """Computes `_DotAtten()` of the scaled query over blocks of keys.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      query:    [B, T, N, H], already scaled.
+      key:      [B, S, N, H].
+      value:    [B, S, N, H].
+      paddings: [B, S].
+      segment_mask: [B, 1, T, S]. Only applied if packed_input = True.
+      per_step_padding: [B, T, S] or None.
+
+    Returns:
+      encoded: [B, T, N, H].
+    """
+    p = self.params
+    dropout_p = self.atten_dropout.params
+    keep_prob = 1.0
+    dropout_seeds = None
+    if p.atten_dropout_prob > 0.0 and (not self.do_eval or
+                                       dropout_p.dropout_at_eval):
+      keep_prob = 1.0 - p.atten_dropout_prob
+      dropout_seeds = py_utils.GenerateStepSeedPair(dropout_p)
+    if not p.packed_input:
+      segment_mask = None
+    with tf.name_scope('blockwise_ctx'):
+      encoded = attention_util.BlockwiseDotAtten(
+          query,
+          key,
+          value,
+          paddings,
+          p.atten_block_size,
+          segment_mask=segment_mask,
+          per_step_padding=per_step_padding,
+          extra_logit=p.atten_extra_logit,
+          keep_prob=keep_prob,
+          dropout_seeds=dropout_seeds)
+    return gshard_utils.MeshSplit(encoded, p.device_mesh,
+                                  p.activation_split_dims_mapping.blnh)
+
   def _DotAttenOneStep(self,
                        theta,
                        query,
@@ -639,7 +726,9 @@ class MultiHeadedAttention(base_layer.BaseLayer):
                        segment_mask,
                        per_step_padding=None,
                        time_step=None,
-                       use_short_seq_opt=False):
+                       use_short_seq_opt=False,
+                       key_scale=None,
+                       value_scale=None):
     """Dot attention function for queries with 1 time step.
 
     Args:
@@ -657,6 +746,10 @@ class MultiHeadedAttention(base_layer.BaseLayer):
         not None.
       time_step: Current time step.
       use_short_seq_opt: A bool, whether using short sequence optimization.
+      key_scale: [S, B, N] if key is quantized to int8, or None. The scales are
+        applied to the logits.
+      value_scale: [S, B, N] if value is quantized to int8, or None. The scales
+        are applied to the probabilities.
 
     Returns:
       encoded: [B, 1, N, H].
@@ -678,6 +771,13 @@ class MultiHeadedAttention(base_layer.BaseLayer):
     if per_step_padding is not None:
       paddings += tf.squeeze(per_step_padding, 1)
 
+    if key_scale is not None:
+      key = tf.cast(key, query.dtype)
+      key_scale = tf.cast(key_scale, query.dtype)
+    if value_scale is not None:
+      value = tf.cast(value, query.dtype)
+      value_scale = tf.cast(value_scale, query.dtype)
+
     query = tf.reshape(query, [b, n, h])
     pad = tf.reshape(
         tf.tile(tf.expand_dims(tf.transpose(paddings), 2), [1, 1, n]), [s, -1])
@@ -688,12 +788,16 @@ class MultiHeadedAttention(base_layer.BaseLayer):
     def _LongSeq():
       """For long sequence, directly apply to the entire tensor with padding."""
       logits = self._AttenLogitsOneStep(theta, query, key, time_step)
+      if key_scale is not None:
+        logits *= key_scale
 
       logits = tf.reshape(logits, [s, -1])
       padded_logits = tf.where(pad > 0.0, very_negative_logits, logits)
       probs = py_utils.Softmax(
           padded_logits, axis=0, extra_logit=p.atten_extra_logit)
       probs = tf.reshape(probs, [s, b, n])
+      if value_scale is not None:
+        probs *= value_scale
 
       encoded = self._AttenContextOneStep(theta, probs, value, time_step, h)
       return tf.expand_dims(encoded, 1)
@@ -724,10 +828,14 @@ class MultiHeadedAttention(base_layer.BaseLayer):
           loop_vars=(inplace_ops.empty([s, b * n], query.dtype,
                                        init=True), key, query,
                      tf.zeros([], tf.int32)))
+      if key_scale is not None:
+        logits *= tf.reshape(key_scale, [s, -1])
 
       padded_logits = tf.where(pad > 0.0, very_negative_logits, logits)
       probs = py_utils.Softmax(
           padded_logits, axis=0, extra_logit=p.atten_extra_logit)
+      if value_scale is not None:
+        probs *= tf.reshape(value_scale, [s, -1])
 
       def _DotStep(o, p, v, ts):
         """Computes encoded activation.
@@ -754,6 +862,76 @@ class MultiHeadedAttention(base_layer.BaseLayer):
 
     return _ShortSeq() if use_short_seq_opt else _LongSeq()
 
+  def _DotAttenOneStepWithPrefix(self, theta, query, key, value, paddings,
+                                 per_step_padding, prefix_states):
+    """Dot attention for queries with 1 time step, over a shared prefix.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      query:    [B, 1, N, H].
+      key:      [T, B, N, H].
+      value:    [T, B, N, H].
+      paddings: [B, T].
+      per_step_padding: [B, 1, T] or None, the causal padding.
+      prefix_states: A `.NestedMap` with key: [S, P, N, H], value: [S, P, N, H]
+        and paddings: [P, S]. Queries [i * B / P, (i + 1) * B / P) share the
+        prefix i.
+
+    Returns:
+      encoded: [B, 1, N, H].
+    """
+    p = self.params
+    # Scale the query projection.
+    if p.enable_per_dim_scale:
+      query = self.per_dim_scale.FProp(theta.per_dim_scale, query)
+    else:
+      query *= (p.hidden_dim // p.num_heads)**-0.5
+
+    b, _, n, h = py_utils.GetShape(query, 4)
+    t = py_utils.GetShape(key, 4)[0]
+    s, num_prefixes = py_utils.GetShape(prefix_states.key, 4)[:2]
+    paddings = py_utils.HasShape(paddings, [b, t])
+    prefix_paddings = py_utils.HasShape(prefix_states.paddings,
+                                        [num_prefixes, s])
+    if per_step_padding is not None:
+      paddings += tf.squeeze(per_step_padding, 1)
+
+    query = tf.reshape(query, [b, n, h])
+    # [B, N, H] -> [P, B / P, N, H], the queries of each prefix.
+    grouped_query = tf.reshape(query, [num_prefixes, -1, n, h])
+    # [S, P, B / P, N] -> [S, B, N]
+    prefix_logits = tf.reshape(
+        tf.einsum('PMNH,SPNH->SPMN', grouped_query,
+                  tf.cast(prefix_states.key, query.dtype)), [s, b, n])
+    # [S + T, B, N]
+    logits = tf.concat(
+        [prefix_logits,
+         self._AttenLogitsOneStep(theta, query, key, None)], 0)
+    # [P, S] -> [B, S]
+    prefix_paddings = tf.reshape(
+        tf.tile(tf.expand_dims(prefix_paddings, 1), [1, b // num_prefixes, 1]),
+        [b, s])
+    # [S + T, B, N]
+    pad = tf.tile(
+        tf.expand_dims(
+            tf.transpose(tf.concat([prefix_paddings, paddings], 1)), 2),
+        [1, 1, n])
+    very_negative_logits = (
+        tf.ones_like(logits) * logits.dtype.max *
+        tf.constant(-0.7, dtype=logits.dtype))
+    padded_logits = tf.where(pad > 0.0, very_negative_logits, logits)
+    probs = py_utils.Softmax(
+        padded_logits, axis=0, extra_logit=p.atten_extra_logit)
+    prefix_probs, probs = tf.split(probs, [s, t], 0)
+    prefix_encoded = tf.einsum(
+        'SPMN,SPNH->PMNH', tf.reshape(prefix_probs,
+                                      [s, num_prefixes, -1, n]),
+        tf.cast(prefix_states.value, query.dtype))
+    encoded = tf.reshape(prefix_encoded, [b, n, h]) + self._AttenContextOneStep(
+        theta, probs, value, None, h)
+    return tf.expand_dims(encoded, 1)
+
   def FProp(self,
             theta,
             query_vec,
@@ -836,9 +1014,11 @@ class MultiHeadedAttention(base_layer.BaseLayer):
     dtype = py_utils.FPropDtype(p)
     if dtype == tf.bfloat16 and not py_utils.use_tpu():
       dtype = tf.float32
+    if p.quantize_kv_cache:
+      dtype = tf.int8
     # TODO(shafey): Determine if we want to make the cached shape 128 to
     # avoid padding and more efficient interpolation in beamsearch.
-    return py_utils.NestedMap(
+    states = py_utils.NestedMap(
         key=inplace_ops.empty(
             shape=(target_max_length, target_batch_size, num_heads,
                    dim_per_head),
@@ -849,6 +1029,30 @@ class MultiHeadedAttention(base_layer.BaseLayer):
                    dim_per_head),
             dtype=dtype,
             init=True))
+    if p.quantize_kv_cache:
+      for k in ('key_scale', 'value_scale'):
+        states[k] = inplace_ops.empty(
+            shape=(target_max_length, target_batch_size, num_heads),
+            dtype=tf.float32,
+            init=True)
+    return states
+
+  def PrefixStates(self, theta, query_vec):
+    """Computes the keys and values of prefixes, for `ExtendStep()`.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      query_vec: [P, S, D], the inputs of the prefixes.
+
+    Returns:
+      A `.NestedMap` with key - [S, P, N, H] and value - [S, P, N, H].
+    """
+    # [P, S, N, H] -> [S, P, N, H]
+    key_proj = tf.transpose(self.key.FProp(theta.key, query_vec), [1, 0, 2, 3])
+    value_proj = tf.transpose(
+        self.value.FProp(theta.value, query_vec), [1, 0, 2, 3])
+    return py_utils.NestedMap(key=key_proj, value=value_proj)
 
   def ExtendStep(self,
                  theta,
@@ -858,7 +1062,8 @@ class MultiHeadedAttention(base_layer.BaseLayer):
                  segment_mask,
                  per_step_padding,
                  time_step,
-                 use_short_seq_opt=False):
+                 use_short_seq_opt=False,
+                 prefix_states=None):
     """Computes the value vector given the query of the current step.
 
     This function is used by autoregressive decoding.
@@ -869,7 +1074,8 @@ class MultiHeadedAttention(base_layer.BaseLayer):
       query_vec:        [B, 1, D].
       cached_states: A `.NestedMap` object containing tensors which are the
         results of previous attentions, used for fast decoding. key   - [T, B,
-        N, H]. value - [T, B, N, H].
+        N, H]. value - [T, B, N, H]. With p.quantize_kv_cache, key and value
+        are int8, and key_scale and value_scale are their [T, B, N] scales.
       paddings:         [B, T], or None if there is no padding.
       segment_mask:     [B, 1, T, S] or None.
       per_step_padding: A mask used by decoder self-attention to prevent
@@ -879,6 +1085,11 @@ class MultiHeadedAttention(base_layer.BaseLayer):
         it's a scalar, all the time step are the same decode step. if it's a
         tensor, it represents current decode step for each sample.
       use_short_seq_opt: A bool, whether using short sequence optimization.
+      prefix_states: If not None, a `.NestedMap` with the keys and values of a
+        prefix shared by groups of B / P consecutive queries, which attend to
+        them before cached_states. key - [S, P, N, H]. value - [S, P, N, H].
+        paddings - [P, S]. The prefix is not copied per query, and is not part
+        of the updated states, so e.g. beam search reorders only the latter.
 
     Returns:
       encoded:           [B, 1, D].
@@ -886,12 +1097,22 @@ class MultiHeadedAttention(base_layer.BaseLayer):
       updated_value_vec: [T, B, N, H].
 
     Raises:
-      ValueError: If value projection is disabled.
+      ValueError: If value projection is disabled, or if prefix_states is not
+        supported with this configuration.
     """
     p = self.params
     if not p.enable_value_proj:
       raise ValueError('Value projection must be enabled for Transformer '
                        'machine translation.')
+    if prefix_states is not None and (
+        p.quantize_kv_cache or use_short_seq_opt or any(
+            getattr(type(self), f) is not getattr(MultiHeadedAttention, f)
+            for f in ('_DotAttenOneStep', '_AttenLogitsOneStep',
+                      '_AttenContextOneStep'))):
+      raise ValueError(
+          'prefix_states is not supported by {} with quantize_kv_cache={} and '
+          'use_short_seq_opt={}.'.format(
+              type(self).__name__, p.quantize_kv_cache, use_short_seq_opt))
 
     time_step = tf.convert_to_tensor(time_step)
     synced_time_step = (time_step.shape.ndims == 0)
@@ -902,44 +1123,67 @@ class MultiHeadedAttention(base_layer.BaseLayer):
     new_value_proj = self.value.FProp(theta.value, query_vec)
     query_proj = self.query.FProp(theta.query, query_vec)
 
-    # Using a if condtion, in case it's more efficient to update the same index.
-    new_key_proj = tf.cast(
-        tf.reshape(new_key_proj, [b, n, h]), dtype=cached_states.key.dtype)
-    new_value_proj = tf.cast(
-        tf.reshape(new_value_proj, [b, n, h]), dtype=cached_states.value.dtype)
-    if synced_time_step:
-      # The extended_key and extended_value have shape [T, B, N, H].
-      extended_key = inplace_ops.alias_inplace_update(cached_states.key,
-                                                      time_step, new_key_proj)
-      extended_value = inplace_ops.alias_inplace_update(cached_states.value,
-                                                        time_step,
-                                                        new_value_proj)
-    else:
-      # The extended_key and extended_value have shape [T, B, N, H].
+    def _Update(cached, new):
+      """Writes new: [B, ...] at time_step of cached: [T, B, ...]."""
+      # Using a if condtion, in case it's more efficient to update the same
+      # index.
+      if synced_time_step:
+        return inplace_ops.alias_inplace_update(cached, time_step, new)
+      shape = py_utils.GetShape(cached)
       selected_indices = tf.range(b) + time_step * b
-      extended_key = inplace_ops.alias_inplace_update(
-          tf.reshape(cached_states.key, [-1, n, h]), selected_indices,
-          new_key_proj)
-      extended_value = inplace_ops.alias_inplace_update(
-          tf.reshape(cached_states.value, [-1, n, h]), selected_indices,
-          new_value_proj)
-      extended_key = tf.reshape(extended_key, [t, b, n, h])
-      extended_value = tf.reshape(extended_value, [t, b, n, h])
+      updated = inplace_ops.alias_inplace_update(
+          tf.reshape(cached, [-1] + shape[2:]), selected_indices, new)
+      return tf.reshape(updated, shape)
+
+    new_key_proj = tf.reshape(new_key_proj, [b, n, h])
+    new_value_proj = tf.reshape(new_value_proj, [b, n, h])
+    if p.quantize_kv_cache:
+      new_key_proj, new_key_scale = QuantizeToInt8(new_key_proj)
+      new_value_proj, new_value_scale = QuantizeToInt8(new_value_proj)
+    else:
+      new_key_proj = tf.cast(new_key_proj, dtype=cached_states.key.dtype)
+      new_value_proj = tf.cast(new_value_proj, dtype=cached_states.value.dtype)
+    # The extended_key and extended_value have shape [T, B, N, H].
+    extended_key = _Update(cached_states.key, new_key_proj)
+    extended_value = _Update(cached_states.value, new_value_proj)
     updated_state = py_utils.NestedMap(key=extended_key, value=extended_value)
+    if p.quantize_kv_cache:
+      updated_state.key_scale = _Update(cached_states.key_scale, new_key_scale)
+      updated_state.value_scale = _Update(cached_states.value_scale,
+                                          new_value_scale)
 
     if paddings is None:
       paddings = tf.zeros([b, t], dtype=query_vec.dtype)
 
-    encoded = self._DotAttenOneStep(
-        theta,
-        query_proj,
-        self._CastToFPropDtype(extended_key),
-        self._CastToFPropDtype(extended_value),
-        paddings,
-        segment_mask,
-        per_step_padding,
-        time_step=time_step,
-        use_short_seq_opt=use_short_seq_opt)
+    if prefix_states is not None:
+      encoded = self._DotAttenOneStepWithPrefix(
+          theta, query_proj, self._CastToFPropDtype(extended_key),
+          self._CastToFPropDtype(extended_value), paddings, per_step_padding,
+          prefix_states)
+    elif p.quantize_kv_cache:
+      encoded = self._DotAttenOneStep(
+          theta,
+          query_proj,
+          extended_key,
+          extended_value,
+          paddings,
+          segment_mask,
+          per_step_padding,
+          time_step=time_step,
+          use_short_seq_opt=use_short_seq_opt,
+          key_scale=updated_state.key_scale,
+          value_scale=updated_state.value_scale)
+    else:
+      encoded = self._DotAttenOneStep(
+          theta,
+          query_proj,
+          self._CastToFPropDtype(extended_key),
+          self._CastToFPropDtype(extended_value),
+          paddings,
+          segment_mask,
+          per_step_padding,
+          time_step=time_step,
+          use_short_seq_opt=use_short_seq_opt)
 
     # Post projection.
     encoded = self.post.FProp(theta.post, encoded)
@@ -974,6 +1218,14 @@ class MultiHeadedFavorAttention(MultiHeadedAttention):
              'relu|softmax, performer kernel transformation methods')
     p.Define('redraw', False,
              'Whether kernel features should be redrawn (N/A if not random).')
+    p.Define(
+        'causal', False, 'Whether each position only attends to itself and '
+        'the previous positions, for the relu and softmax attention types.')
+    p.Define(
+        'causal_chunk_size', favor.CAUSAL_CHUNK_SIZE,
+        'Number of positions processed at once by the causal attention, '
+        'whose memory is O(L * (C + M * D / C)) for length L, chunk size C, '
+        'M random features and head dimension D.')
     return p
 
   def _DotAtten(self,
@@ -1015,16 +1267,27 @@ class MultiHeadedFavorAttention(MultiHeadedAttention):
 
     if p.attention_type == 'relu':
       kernel_transformation = favor.relu_kernel_transformation
-      encoded = favor.favor_attention(query, key, value, kernel_transformation,
-                                      False)
+      encoded = favor.favor_attention(
+          query,
+          key,
+          value,
+          kernel_transformation,
+          p.causal,
+          causal_chunk_size=p.causal_chunk_size)
     elif p.attention_type == 'softmax':
       kernel_transformation = favor.softmax_kernel_transformation
       # TODO(kchoro): Add the option of redrawing projection matrices. This
       # improves in several applications.
       projection_matrix = favor.create_projection_matrix(
           p.num_random_features, query.shape[-1], None if p.redraw else 0)
-      encoded = favor.favor_attention(query, key, value, kernel_transformation,
-                                      False, projection_matrix)
+      encoded = favor.favor_attention(
+          query,
+          key,
+          value,
+          kernel_transformation,
+          p.causal,
+          projection_matrix,
+          causal_chunk_size=p.causal_chunk_size)
     elif p.attention_type == 'cossim':
       projection_matrix = favor.create_projection_matrix(
           p.num_random_features, query.shape[-1], None if p.redraw else 0)
@@ -3274,6 +3537,22 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
       ctx_vec += input_to_add
     return ctx_vec, atten_probs
 
+  @classmethod
+  def FPropMeta(cls, p, query_vec, source_vecs=None, *args):
+    # query_vec: [b, t, d], source_vecs: [b, s, d] or None for self-attention.
+    py_utils.CheckShapes((query_vec,))
+    b, t, d = query_vec
+    s = t if source_vecs is None else source_vecs[1]
+    h = p.hidden_dim or p.input_dim
+    n = sum(p.num_heads) if isinstance(p.num_heads, list) else p.num_heads
+    # As MultiHeadedAttention, with the query and output projections of
+    # O(b * t * d * h) and the key and value ones of O(b * s * d * h), plus
+    # about 10 flops per element of the layer norm and 2 of the residual.
+    flops = (15 * b * t * s * h + 2 * 2 * (b * t * d * h + b * s * d * h) +
+             12 * b * t * d)
+    return py_utils.NestedMap(
+        flops=flops, out_shapes=(query_vec, tshape.Shape([b, n, t, s])))
+
   def InitStates(self, theta, target_batch_size, target_max_length):
     if isinstance(self.atten, list):
       return py_utils.NestedMap(atten=[
@@ -3283,12 +3562,37 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
     return self.atten.InitStates(theta.atten, target_batch_size,
                                  target_max_length)
 
+  def PrefixStates(self, theta, query_vec):
+    """Computes the keys and values of prefixes, for `ExtendStep()`.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      query_vec: [P, S, D], the inputs of the prefixes.
+
+    Returns:
+      A `.NestedMap` with key - [S, P, N, H] and value - [S, P, N, H].
+
+    Raises:
+      ValueError: If used with multiple attention layers.
+    """
+    p = self.params
+    if isinstance(self.atten, list):
+      raise ValueError('prefix_states is not supported with multiple '
+                       'attention layers.')
+    query_vec = self._CastToFPropDtype(query_vec)
+    if p.ln_tpl:
+      query_vec = self.layer_norm.FProp(theta.layer_norm, query_vec)
+      query_vec = self._CastToFPropDtype(query_vec)
+    return self.atten.PrefixStates(theta.atten, query_vec)
+
   def ExtendStep(self,
                  theta,
                  query_vec,
                  cached_states,
                  time_step,
-                 use_short_seq_opt=False):
+                 use_short_seq_opt=False,
+                 prefix_states=None):
     """Compute the result and update cached states for the current step.
 
     This function is used by autoregressive decoding. This function knows the
@@ -3305,6 +3609,9 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
         it's a scalar, all the time step are the same decode step. if it's a
         tensor, it represents current decode step for each sample.
       use_short_seq_opt: A bool, whether using short sequence optimization.
+      prefix_states: If not None, a `.NestedMap` with the keys and values of a
+        shared prefix attended to before cached_states. See
+        `MultiHeadedAttention.ExtendStep()`.
 
     Returns:
       cur_output: [B, 1, D]
@@ -3313,13 +3620,17 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
       value - [T, B, N, H].
 
     Raises:
-      ValueError: If not used as masked/causal self-attention.
+      ValueError: If not used as masked/causal self-attention, or if
+        prefix_states is set with multiple attention layers.
     """
     p = self.params
     query_vec = self._CastToFPropDtype(query_vec)
     if not p.is_masked:
       raise ValueError(
           'ExtendStep should be used only by masked/causal self-attention.')
+    if prefix_states is not None and isinstance(self.atten, list):
+      raise ValueError('prefix_states is not supported with multiple '
+                       'attention layers.')
     if isinstance(self.atten, list):
       t, b, _, _ = py_utils.GetShape(cached_states.atten[0].key, 4)
     else:
@@ -3350,8 +3661,20 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
 
     # Multiheaded masked/causal self-attention.
     def _AttenExtendStep(atten, theta, cached_states):
-      return atten.ExtendStep(theta, query_vec, cached_states, None, None,
-                              per_step_padding, time_step, use_short_seq_opt)
+      # Only MultiHeadedAttention.ExtendStep() takes prefix_states.
+      if prefix_states is None:
+        return atten.ExtendStep(theta, query_vec, cached_states, None, None,
+                                per_step_padding, time_step, use_short_seq_opt)
+      return atten.ExtendStep(
+          theta,
+          query_vec,
+          cached_states,
+          None,
+          None,
+          per_step_padding,
+          time_step,
+          use_short_seq_opt,
+          prefix_states=prefix_states)
 
     if isinstance(self.atten, list):
       updated_states = py_utils.NestedMap(atten=[])
@@ -3781,10 +4104,59 @@ class TransformerLayer(base_layer.BaseLayer):
     with tf.name_scope('fflayer'):
       return self.fflayer.FProp(theta.fflayer, atten_vec, paddings), atten_probs
 
+  @classmethod
+  def FPropMeta(cls, p, query_vec, paddings, aux_vec=None, *args):
+    py_utils.CheckShapes((query_vec, paddings))
+    with tf.Graph().as_default():  # throw-away graph.
+      instance = p.Instantiate()
+    children = [(instance.self_atten.params, None)]
+    if p.has_aux_atten:
+      children.append((instance.cross_atten.params, aux_vec))
+    flops = 0
+    atten_probs = py_utils.NestedMap()
+    for (atten_p, source_vecs), key in zip(children, ['self_atten',
+                                                      'aux_atten']):
+      meta = atten_p.cls.FPropMeta(atten_p, query_vec, source_vecs)
+      flops += meta.flops
+      atten_probs[key] = meta.out_shapes[1]
+    fflayer_p = instance.fflayer.params
+    meta = fflayer_p.cls.FPropMeta(fflayer_p, query_vec, paddings)
+    flops += meta.flops
+    return py_utils.NestedMap(
+        flops=flops, out_shapes=(meta.out_shapes[0], atten_probs))
+
   def InitStates(self, theta, target_batch_size, target_max_length):
     return self.self_atten.InitStates(theta.self_atten, target_batch_size,
                                       target_max_length)
 
+  def PrefixStates(self,
+                   theta,
+                   query_vec,
+                   paddings,
+                   aux_vec=None,
+                   aux_paddings=None):
+    """Computes the self-attention states of prefixes, for `ExtendStep()`.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      query_vec:    [num_prefixes, prefix_time, dim].
+      paddings:     [num_prefixes, prefix_time].
+      aux_vec:      [num_prefixes, source_time, dim], or None.
+      aux_paddings: [num_prefixes, source_time], or None.
+
+    Returns:
+      (cur_output, states)
+      * cur_output: [num_prefixes, prefix_time, dim], the output of FProp().
+      * states: A `.NestedMap` with the self-attention keys and values.
+      key   - [prefix_time, num_prefixes, num_heads, dim_per_head].
+      value - [prefix_time, num_prefixes, num_heads, dim_per_head].
+    """
+    states = self.self_atten.PrefixStates(theta.self_atten, query_vec)
+    cur_output, _ = self.FProp(theta, query_vec, paddings, aux_vec,
+                               aux_paddings)
+    return cur_output, states
+
   def ExtendStep(self,
                  theta,
                  query_vec,
@@ -3794,7 +4166,8 @@ class TransformerLayer(base_layer.BaseLayer):
                  time_step,
                  use_short_seq_opt=False,
                  *,
-                 compute_atten_probs=False):
+                 compute_atten_probs=False,
+                 prefix_states=None):
     """Transformer decoder layer, extend one step in autoregressive decoding.
 
     query_vec and aux_* may have different batch sizes, e.g., during a beam
@@ -3821,6 +4194,11 @@ class TransformerLayer(base_layer.BaseLayer):
       use_short_seq_opt: A bool, whether using short sequence optimization.
       compute_atten_probs: A bool, whether attention probabilities should be
         computed. If false, returns None for atten_probs.
+      prefix_states: If not None, a `.NestedMap` with the self-attention keys
+        and values of a prefix shared by groups of consecutive queries. key -
+        [prefix_time, num_prefixes, num_heads, dim_per_head]. value -
+        [prefix_time, num_prefixes, num_heads, dim_per_head]. paddings -
+        [num_prefixes, prefix_time].
 
     Returns:
       (cur_output, atten_probs, updated_states)
@@ -3836,8 +4214,12 @@ class TransformerLayer(base_layer.BaseLayer):
 
     # First the self-attention layer.
     atten_vec, updated_states = self.self_atten.ExtendStep(
-        theta.self_atten, query_vec, cached_states, time_step,
-        use_short_seq_opt)
+        theta.self_atten,
+        query_vec,
+        cached_states,
+        time_step,
+        use_short_seq_opt,
+        prefix_states=prefix_states)
     atten_vec = py_utils.HasShape(atten_vec, [target_batch, 1, dim])
     cross_atten_probs = None
     if self.params.has_aux_atten:
@@ -4087,8 +4469,38 @@ class StackedTransformerLayers(base_layer.BaseLayer):
         'are placed on the same and only one partition. Else, len(splits) is '
         'the number of partitions the stack is sliced into. layer_i is placed '
         'on the kth partition (0-based) where split[k] < i <= split[k+1].')
+    p.Define(
+        'remat_segments', None, 'None or a list of (start, end) layer '
+        'indices, end excluded. The activations of the layers of each '
+        'segment are recomputed in the backward pass instead of being kept, '
+        'e.g. as planned by remat_planner.PlanRematerialization().')
     return p
 
+  @classmethod
+  def LayerParams(cls, p, layer_index):
+    """Returns the params of the layer_index-th layer of stack `p`."""
+    if isinstance(p.transformer_layer_params_tpl, list):
+      factor = p.num_layers // len(p.transformer_layer_params_tpl)
+      i = layer_index // factor
+      p_ii = p.transformer_layer_params_tpl[i].Copy()
+    else:
+      p_ii = p.transformer_layer_params_tpl.Copy()
+    p_ii.name = 'layer_%d' % layer_index
+    p_ii.has_aux_atten = p.has_aux_atten
+    p_ii.mask_self_atten = p.mask_self_atten
+    p_ii.input_dim = p.mdl_dim
+    p_ii.output_dim = p.mdl_dim
+    p_ii.packed_input = p.packed_input
+    if not isinstance(p_ii.tr_atten_tpl.num_heads, list):
+      p_ii.tr_atten_tpl.num_heads = p.num_atten_heads
+    p_ii.tr_atten_tpl.atten_dropout_prob = p.dropout_prob
+    p_ii.tr_atten_tpl.residual_dropout_prob = p.dropout_prob
+    p_ii.tr_atten_tpl.add_unnormalized_input = p.add_unnormalized_input
+    p_ii.tr_fflayer_tpl.hidden_dim = p.hidden_dim
+    p_ii.tr_fflayer_tpl.residual_dropout_prob = p.dropout_prob
+    p_ii.tr_fflayer_tpl.relu_dropout_prob = p.dropout_prob
+    return p_ii
+
   def __init__(self, params):
     if params.splits:
       assert all(x <= params.num_layers - 1 for x in params.splits)
@@ -4112,31 +4524,11 @@ class StackedTransformerLayers(base_layer.BaseLayer):
         raise ValueError('num_layers should be divisible by '
                          'transformer_layer_params_tpl')
 
-    def _LayerParams(ii):
-      """Construct ii-th layer params."""
-      if isinstance(p.transformer_layer_params_tpl, list):
-        factor = p.num_layers // len(p.transformer_layer_params_tpl)
-        i = ii // factor
-        p_ii = p.transformer_layer_params_tpl[i].Copy()
-      else:
-        p_ii = p.transformer_layer_params_tpl.Copy()
-      p_ii.name = 'layer_%d' % ii
-      p_ii.has_aux_atten = p.has_aux_atten
-      p_ii.mask_self_atten = p.mask_self_atten
-      p_ii.input_dim = p.mdl_dim
-      p_ii.output_dim = p.mdl_dim
-      p_ii.packed_input = p.packed_input
-      if not isinstance(p_ii.tr_atten_tpl.num_heads, list):
-        p_ii.tr_atten_tpl.num_heads = p.num_atten_heads
-      p_ii.tr_atten_tpl.atten_dropout_prob = p.dropout_prob
-      p_ii.tr_atten_tpl.residual_dropout_prob = p.dropout_prob
-      p_ii.tr_atten_tpl.add_unnormalized_input = p.add_unnormalized_input
-      p_ii.tr_fflayer_tpl.hidden_dim = p.hidden_dim
-      p_ii.tr_fflayer_tpl.residual_dropout_prob = p.dropout_prob
-      p_ii.tr_fflayer_tpl.relu_dropout_prob = p.dropout_prob
-      return p_ii
-
-    layer_params = [_LayerParams(ii) for ii in range(p.num_layers)]
+    if p.remat_segments:
+      for start, end in p.remat_segments:
+        assert 0 <= start < end <= p.num_layers, p.remat_segments
+
+    layer_params = [self.LayerParams(p, ii) for ii in range(p.num_layers)]
 
     self.CreateChildren('x_layers', layer_params)
 
@@ -4185,25 +4577,72 @@ class StackedTransformerLayers(base_layer.BaseLayer):
     """
     p = self.params
     x_out = query_vec
+    inputs = py_utils.NestedMap(
+        paddings=paddings,
+        aux_vec=aux_vec,
+        aux_paddings=aux_paddings,
+        segment_mask=segment_mask,
+        aux_segment_mask=aux_segment_mask)
+    remat_segments = dict(p.remat_segments or [])
 
     with tf.name_scope(p.name):
-      for i in range(p.num_layers):
-        x_in = x_out
-        with tf.device(self._GetDeviceOfLayer(i)):
-          x_out, _ = self.x_layers[i].FProp(
-              theta.x_layers[i],
-              x_in,
-              paddings,
-              aux_vec,
-              aux_paddings,
-              segment_mask=segment_mask,
-              aux_segment_mask=aux_segment_mask)
+      i = 0
+      while i < p.num_layers:
+        if i in remat_segments:
+          end = remat_segments[i]
+          x_out = self._RematFPropLayers(theta, i, end, x_out, inputs)
+        else:
+          end = i + 1
+          x_out = self._FPropLayers(theta, i, end, x_out, inputs)
+        i = end
     if p.final_layer_norm:
       # Place on the last device.
       with tf.device(self._GetDeviceOfLayer(p.num_layers - 1)):
         x_out = self.final_ln.FProp(theta.final_ln, x_out)
     return x_out, paddings
 
+  def _FPropLayers(self, theta, start, end, x_out, inputs):
+    """FProps the layers [start, end) on x_out and the other inputs."""
+    for i in range(start, end):
+      with tf.device(self._GetDeviceOfLayer(i)):
+        x_out, _ = self.x_layers[i].FProp(
+            theta.x_layers[i],
+            x_out,
+            inputs.paddings,
+            inputs.get('aux_vec'),
+            inputs.get('aux_paddings'),
+            segment_mask=inputs.get('segment_mask'),
+            aux_segment_mask=inputs.get('aux_segment_mask'))
+    return x_out
+
+  def _RematFPropLayers(self, theta, start, end, x_out, inputs):
+    """As _FPropLayers(), recomputing the activations in the backward pass."""
+    xs = py_utils.NestedMap(
+        theta=theta.x_layers[start:end],
+        x=x_out,
+        inputs=inputs.Filter(lambda v: v is not None))
+
+    def Fn(*args):
+      xs_i = xs.Pack(args)
+      layers_theta = py_utils.NestedMap(x_layers=[None] * start + xs_i.theta)
+      return self._FPropLayers(layers_theta, start, end, xs_i.x, xs_i.inputs)
+
+    return py_utils.RematerializeFn(Fn, *xs.Flatten())
+
+  @classmethod
+  def FPropMeta(cls, p, query_vec, paddings, *args):
+    py_utils.CheckShapes((query_vec, paddings))
+    flops = 0
+    x = query_vec
+    for i in range(p.num_layers):
+      layer_p = cls.LayerParams(p, i)
+      meta = layer_p.cls.FPropMeta(layer_p, x, paddings, *args)
+      flops += meta.flops
+      x = meta.out_shapes[0]
+    if p.final_layer_norm:
+      flops += x.num_elements() * 10
+    return py_utils.NestedMap(flops=flops, out_shapes=(x, paddings))
+
   def InitStates(self, theta, *args, **kwargs):
     return py_utils.NestedMap(x_layers=[
         layer.InitStates(layer_theta, *args, **kwargs)
@@ -4217,7 +4656,8 @@ class StackedTransformerLayers(base_layer.BaseLayer):
                  aux_paddings,
                  cached_states,
                  time_step,
-                 use_short_seq_opt=False):
+                 use_short_seq_opt=False,
+                 prefix_states=None):
     """Transformer decoder layer, extend one step in autoregressive decoding.
 
     Args:
@@ -4234,6 +4674,10 @@ class StackedTransformerLayers(base_layer.BaseLayer):
         - value: [target_time, target_batch, num_heads, dim_per_head].
       time_step: A scalar, the current decode step, 0-based.
       use_short_seq_opt: A bool, whether using short sequence optimization.
+      prefix_states: If not None, the states of prefixes shared by groups of
+        target_batch / num_prefixes consecutive queries, as returned by
+        `PrefixStates()`. The queries attend to them before cached_states, and
+        time_step then counts the steps after the prefix.
 
     Returns:
       cur_output: The last decoder layer output of shape [target_batch, 1, dim].
@@ -4248,15 +4692,62 @@ class StackedTransformerLayers(base_layer.BaseLayer):
     with tf.name_scope(p.name):
       updated_states = py_utils.NestedMap(x_layers=[])
       decoder_input = query_vec
-      for layer, layer_theta, layer_states in zip(self.x_layers, theta.x_layers,
-                                                  cached_states.x_layers):
+      for i, (layer, layer_theta, layer_states) in enumerate(
+          zip(self.x_layers, theta.x_layers, cached_states.x_layers)):
+        kwargs = {}
+        if prefix_states is not None:
+          kwargs['prefix_states'] = prefix_states.x_layers[i].copy()
+          kwargs['prefix_states'].paddings = prefix_states.paddings
         decoder_output, _, updated_layer_states = layer.ExtendStep(
             layer_theta, decoder_input, aux_vec, aux_paddings, layer_states,
-            time_step, use_short_seq_opt)
+            time_step, use_short_seq_opt, **kwargs)
         updated_states.x_layers.append(updated_layer_states)
         decoder_input = decoder_output
     return decoder_output, updated_states
 
+  def PrefixStates(self,
+                   theta,
+                   prefix_vec,
+                   prefix_paddings,
+                   aux_vec=None,
+                   aux_paddings=None):
+    """Computes the self-attention states of prefixes, for `ExtendStep()`.
+
+    The states of all the prefix steps are computed at once, with one causal
+    FProp() of each layer. The states of a prefix can then be shared by all the
+    queries extending it, e.g. by the hyps of a beam search, or by the requests
+    with the same prompt.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      prefix_vec: [num_prefixes, prefix_time, dim], the decoder inputs of the
+        prefixes.
+      prefix_paddings: [num_prefixes, prefix_time], with the paddings after the
+        prefixes.
+      aux_vec: [num_prefixes, source_time, dim], or None without aux attention.
+      aux_paddings: [num_prefixes, source_time], or None without aux attention.
+
+    Returns:
+      A `.NestedMap` with x_layers, a list corresponding to self.x_layers, where
+      each element is a NestedMap with attention keys and values:
+
+      - key: [prefix_time, num_prefixes, num_heads, dim_per_head].
+      - value: [prefix_time, num_prefixes, num_heads, dim_per_head].
+
+      and paddings, the prefix_paddings.
+    """
+    p = self.params
+    states = py_utils.NestedMap(x_layers=[], paddings=prefix_paddings)
+    x_out = prefix_vec
+    with tf.name_scope(p.name):
+      for i in range(p.num_layers):
+        with tf.device(self._GetDeviceOfLayer(i)):
+          x_out, layer_states = self.x_layers[i].PrefixStates(
+              theta.x_layers[i], x_out, prefix_paddings, aux_vec, aux_paddings)
+        states.x_layers.append(layer_states)
+    return states
+
 
 class TransformerFeedForwardLayerWithTaskId(
     layers_with_attention.TransformerFeedForwardLayer):
@@ -5580,6 +6071,14 @@ class PerformerBuilder(Builder):
              'relu|softmax, performer kernel transformation methods')
     p.Define('redraw', False,
              'Whether kernel features should be redrawn (N/A if not random).')
+    p.Define(
+        'causal', False, 'Whether each position only attends to itself and '
+        'the previous positions, for the relu and softmax attention types.')
+    p.Define(
+        'causal_chunk_size', favor.CAUSAL_CHUNK_SIZE,
+        'Number of positions processed at once by the causal attention, '
+        'whose memory is O(L * (C + M * D / C)) for length L, chunk size C, '
+        'M random features and head dimension D.')
     return p
 
   def _MultiHeadedAtten(self, name, num_heads=None):
@@ -26,6 +26,7 @@ from lingvo.core import batch_major_attention as attention
 from lingvo.core import hyperparams
 from lingvo.core import py_utils
 from lingvo.core import test_utils
+from lingvo.core import tshape
 import numpy as np
 
 
@@ -64,6 +65,37 @@ class FAVORDotAttenTest(test_utils.TestCase, parameterized.TestCase):
       self.assertLess(error, max_error)
 
 
+  @parameterized.named_parameters(('Relu', 'relu'), ('Softmax', 'softmax'))
+  def test_favor_causal_output(self, attention_type):
+    params = attention.MultiHeadedFavorAttention.Params().Set(
+        name='atten',
+        input_dim=4,
+        hidden_dim=4,
+        enable_per_dim_scale=False,
+        attention_type=attention_type,
+        num_random_features=16)
+    causal = params.Copy().Set(
+        name='causal', causal=True, causal_chunk_size=2).Instantiate()
+    noncausal = params.Instantiate()
+    batch_size = 2
+    length = 5
+    num_heads = 2
+    dim = 4
+    query = tf.random.normal([batch_size, length, num_heads, dim], seed=1)
+    key = tf.random.normal([batch_size, length, num_heads, dim], seed=2)
+    value = tf.random.normal([batch_size, length, num_heads, dim], seed=3)
+    encoded, _ = causal._DotAtten(None, query, key, value, None, None)
+    # Each position attends to the prefix of the keys ending at it.
+    expected = [
+        noncausal._DotAtten(None, query[:, t:t + 1], key[:, :t + 1],
+                            value[:, :t + 1], None, None)[0]
+        for t in range(length)
+    ]
+    with self.session(use_gpu=False) as sess:
+      encoded, expected = sess.run([encoded, tf.concat(expected, axis=1)])
+      self.assertAllClose(expected, encoded, rtol=1e-4, atol=1e-4)
+
+
 class MultiHeadSelfAttentionTest(test_utils.TestCase, parameterized.TestCase):
   """Test attention models."""
 
@@ -460,6 +492,46 @@ class MultiHeadedAttentionTest(test_utils.TestCase, parameterized.TestCase):
           [24.624561, 27.805634, 23.358835, 11.085404, 27.165989, 23.750813],
           np.sum(context_vec_out, axis=1))
 
+  @parameterized.named_parameters(('_Paddings', False), ('_Packed', True))
+  def testFPropBlockwise(self, packed_input):
+    with self.session(use_gpu=False) as sess:
+      query_vec, _, paddings, per_step_padding, _, _, _, _ = (
+          _AttentionInputs())
+      segment_ids = tf.constant([[0, 0, 0, 1, 1, 1]] * 6, tf.float32)
+      segment_mask = attention.SegmentMask(segment_ids, segment_ids)
+      p = attention.MultiHeadedAttention.Params().Set(
+          name='self_atten',
+          num_heads=2,
+          input_dim=4,
+          hidden_dim=4,
+          packed_input=packed_input)
+      p.params_init = py_utils.WeightInit.Xavier(scale=1.0, seed=0)
+      l = p.Instantiate()
+      blockwise = p.Copy().Set(name='blockwise', atten_block_size=4)
+      blockwise_l = blockwise.Instantiate()
+      tf.global_variables_initializer().run()
+      args = (query_vec, query_vec, query_vec, paddings, segment_mask,
+              per_step_padding)
+      ctx_vec, _ = l.FProp(l.theta, *args)
+      # Same weights.
+      blockwise_ctx_vec, atten_probs = blockwise_l.FProp(l.theta, *args)
+      self.assertIsNone(atten_probs)
+      grads = tf.gradients(
+          tf.reduce_sum(tf.square(ctx_vec)), l.theta.Flatten() + [query_vec])
+      blockwise_grads = tf.gradients(
+          tf.reduce_sum(tf.square(blockwise_ctx_vec)),
+          l.theta.Flatten() + [query_vec])
+      expected, actual = sess.run([[ctx_vec] + grads,
+                                   [blockwise_ctx_vec] + blockwise_grads])
+      for expected_val, actual_val in zip(expected, actual):
+        self.assertAllClose(expected_val, actual_val, atol=1e-5, rtol=1e-5)
+
+  def testBlockwiseNotSupported(self):
+    p = attention.MultiHeadedAttentionXL.Params().Set(
+        name='atten', input_dim=4, hidden_dim=4, atten_block_size=4)
+    with self.assertRaisesRegex(ValueError, 'atten_block_size'):
+      p.Instantiate()
+
   @parameterized.named_parameters(
       {
           'testcase_name': '_short_seq',
@@ -745,6 +817,92 @@ class MultiSourceMultiHeadedAttentionTest(MultiHeadedAttentionTest):
       ], np.sum(context_vec_out, axis=1))
 
 
+class QuantizedKVCacheTest(test_utils.TestCase, parameterized.TestCase):
+  """Test the int8 KV cache of MultiHeadedAttention."""
+
+  def testQuantizeToInt8LogitError(self):
+    with self.session(use_gpu=False) as sess:
+      np.random.seed(12345)
+      query = np.random.normal(0., 1., [4, 2, 8]).astype(np.float32)
+      key = np.random.normal(0., 3., [6, 4, 2, 8]).astype(np.float32)
+      key[0, 0, 0] = 0.
+      quantized, scale = attention.QuantizeToInt8(tf.constant(key))
+      quantized, scale = sess.run([quantized, scale])
+      self.assertEqual(np.int8, quantized.dtype)
+      self.assertEqual((6, 4, 2), scale.shape)
+      self.assertAllEqual(np.zeros([8]), quantized[0, 0, 0])
+      logits = np.einsum('BNH,SBNH->SBN', query, key)
+      dequantized_logits = np.einsum('BNH,SBNH->SBN', query,
+                                     quantized.astype(np.float32)) * scale
+      # Each element is off by at most half of its scale.
+      bound = np.sum(np.abs(query), axis=-1) * scale / 2
+      self.assertAllLessEqual(np.abs(logits - dequantized_logits) - bound,
+                              1e-5)
+
+  @parameterized.named_parameters(
+      {
+          'testcase_name': '_short_seq',
+          'use_short_seq_opt': True,
+      }, {
+          'testcase_name': '_long_seq',
+          'use_short_seq_opt': False,
+      })
+  def testExtendStepQuantizedKVCache(self, use_short_seq_opt):
+    num_heads, input_dim, hidden_dim, batch, seqlen = 2, 8, 8, 3, 6
+    with self.session(use_gpu=False) as sess:
+      np.random.seed(12345)
+      query_vec = tf.constant(
+          np.random.normal(0., 1., [batch, seqlen, input_dim]),
+          dtype=tf.float32)
+      p = attention.MultiHeadedAttention.Params().Set(
+          name='atten',
+          num_heads=num_heads,
+          input_dim=input_dim,
+          hidden_dim=hidden_dim)
+      p.params_init = py_utils.WeightInit.Xavier(scale=1.0, seed=0)
+      l = p.Instantiate()
+      quantized_l = p.Copy().Set(
+          name='quantized_atten', quantize_kv_cache=True).Instantiate()
+
+      def _Decode(layer, async_time_step):
+        cached_states = layer.InitStates(layer.theta, batch, seqlen)
+        encoded_all = []
+        for i in range(seqlen):
+          per_step_paddings = 1. - tf.cast(
+              tf.sequence_mask([i + 1] * batch, seqlen), tf.float32)
+          per_step_paddings = tf.expand_dims(per_step_paddings, 1)
+          time_step = tf.constant([i] * batch) if async_time_step else i
+          # Both layers use the weights of l.
+          encoded, cached_states = layer.ExtendStep(l.theta,
+                                                    query_vec[:, i:i + 1, :],
+                                                    cached_states, None, None,
+                                                    per_step_paddings,
+                                                    time_step,
+                                                    use_short_seq_opt)
+          encoded_all.append(encoded)
+        return tf.concat(encoded_all, axis=1), cached_states
+
+      expected, _ = _Decode(l, False)
+      actual, states = _Decode(quantized_l, False)
+      tf.global_variables_initializer().run()
+      expected, actual, states = sess.run([expected, actual, states])
+      self.assertEqual(np.int8, states.key.dtype)
+      self.assertEqual(np.int8, states.value.dtype)
+      self.assertEqual((seqlen, batch, num_heads), states.key_scale.shape)
+      self.assertEqual((seqlen, batch, num_heads), states.value_scale.shape)
+      self.assertAllClose(expected, actual, atol=0.05, rtol=0.05)
+      if not use_short_seq_opt:
+        # Only the long sequence path supports unsynced time steps.
+        actual_async, _ = _Decode(quantized_l, True)
+        self.assertAllClose(actual, self.evaluate(actual_async))
+
+  def testQuantizedKVCacheNotSupported(self):
+    p = attention.MultiHeadedAttentionXL.Params().Set(
+        name='atten', input_dim=4, hidden_dim=4, quantize_kv_cache=True)
+    with self.assertRaisesRegex(ValueError, 'quantize_kv_cache'):
+      p.Instantiate()
+
+
 class MultiHeadedAttentionXLTest(test_utils.TestCase, parameterized.TestCase):
   """Test dot-product multiheaded attention."""
 
@@ -2396,6 +2554,23 @@ class TransformerLayerTest(test_utils.TestCase, parameterized.TestCase):
       ]
       self.assertAllClose(expected_ctx, np.sum(actual_ctx, axis=1))
 
+  def testTransformerLayerFPropMeta(self):
+    p = attention.TransformerLayer.CommonParams(
+        input_dim=4,
+        atten_num_heads=2,
+        has_aux_atten=True,
+        fflayer_hidden_dim=7,
+        fflayer_output_dim=6)
+    meta = p.cls.FPropMeta(p, tshape.Shape([2, 5, 4]), tshape.Shape([2, 5]),
+                           tshape.Shape([2, 3, 4]), tshape.Shape([2, 3]))
+    out, atten_probs = meta.out_shapes
+    self.assertEqual([2, 5, 6], out.ToTensorShape().as_list())
+    self.assertEqual([2, 2, 5, 5],
+                     atten_probs.self_atten.ToTensorShape().as_list())
+    self.assertEqual([2, 2, 5, 3],
+                     atten_probs.aux_atten.ToTensorShape().as_list())
+    self.assertGreater(meta.flops, 0)
+
   @parameterized.named_parameters(
       ('F32FPropF32Input', tf.float32, tf.float32),
       ('F32FPropBF16Input', tf.float32, tf.bfloat16),
@@ -2719,6 +2894,80 @@ class TransformerLayerTest(test_utils.TestCase, parameterized.TestCase):
       self.assertAllClose(expected_layer_output,
                           np.sum(actual_layer_output, axis=0))
 
+  def testTransformerDecoderLayerStackExtendStepWithPrefixStates(self):
+    num_prefixes, num_hyps, prefix_len, suffix_len, dim = 2, 3, 4, 3, 4
+    batch = num_prefixes * num_hyps
+    rng = np.random.RandomState(1234)
+    prefix_vec = rng.normal(size=[num_prefixes, prefix_len, dim])
+    suffix_vec = rng.normal(size=[batch, suffix_len, dim])
+    aux_vec = tf.constant(rng.normal(size=[num_prefixes, 5, dim]), tf.float32)
+    aux_paddings = tf.constant([[0, 0, 0, 0, 0], [0, 0, 0, 1, 1]], tf.float32)
+    with self.session(use_gpu=False) as sess:
+      l = self._ConstructTransformerDecoderLayerStack(dropout_prob=0.)
+
+      def _ExtendSteps(inputs, states, **kwargs):
+        outputs = []
+        for i in range(inputs.shape[1]):
+          output, states = l.ExtendStep(l.theta,
+                                        tf.constant(inputs[:, i:i + 1],
+                                                    tf.float32), aux_vec,
+                                        aux_paddings, states, i, **kwargs)
+          outputs.append(output)
+        return tf.concat(outputs, 1)
+
+      # Each hyp decodes its whole sequence.
+      full_vec = np.concatenate(
+          [np.repeat(prefix_vec, num_hyps, axis=0), suffix_vec], 1)
+      expected = _ExtendSteps(
+          full_vec, l.InitStates(l.theta, batch,
+                                 prefix_len + suffix_len))[:, prefix_len:]
+      # The hyps share the states of their prefix.
+      prefix_states = l.PrefixStates(
+          l.theta, tf.constant(prefix_vec, tf.float32),
+          tf.zeros([num_prefixes, prefix_len]), aux_vec, aux_paddings)
+      actual = _ExtendSteps(
+          suffix_vec,
+          l.InitStates(l.theta, batch, suffix_len),
+          prefix_states=prefix_states)
+      # The padded steps of a prefix are ignored.
+      padded_prefix_states = l.PrefixStates(
+          l.theta,
+          tf.constant(
+              np.concatenate([prefix_vec, prefix_vec[:, :1]], 1), tf.float32),
+          tf.constant([[0] * prefix_len + [1]] * num_prefixes, tf.float32),
+          aux_vec, aux_paddings)
+      actual_padded = _ExtendSteps(
+          suffix_vec,
+          l.InitStates(l.theta, batch, suffix_len),
+          prefix_states=padded_prefix_states)
+      tf.global_variables_initializer().run()
+      expected, actual, actual_padded = sess.run(
+          [expected, actual, actual_padded])
+      self.assertEqual((prefix_len, num_prefixes, 2, 2),
+                       prefix_states.x_layers[0].key.shape)
+      self.assertAllClose(expected, actual)
+      self.assertAllClose(expected, actual_padded)
+
+  def testPrefixStatesNotSupported(self):
+    p = attention.MultiHeadedAttention.Params().Set(
+        name='atten', input_dim=4, hidden_dim=4, num_heads=2,
+        quantize_kv_cache=True)
+    l = p.Instantiate()
+    prefix_states = py_utils.NestedMap(
+        key=tf.zeros([2, 1, 2, 2]),
+        value=tf.zeros([2, 1, 2, 2]),
+        paddings=tf.zeros([1, 2]))
+    with self.assertRaisesRegex(ValueError, 'prefix_states is not supported'):
+      l.ExtendStep(
+          l.theta,
+          tf.zeros([2, 1, 4]),
+          l.InitStates(l.theta, 2, 3),
+          None,
+          None,
+          None,
+          0,
+          prefix_states=prefix_states)
+
   @parameterized.named_parameters(
       {
           'testcase_name': '_short_seq',
@@ -23,6 +23,10 @@ import lingvo.compat as tf
 from lingvo.core import base_layer
 from lingvo.core import ops
 from lingvo.core import py_utils
+from lingvo.core.ops import hyps_pb2
+import numpy as np
+
+from google.protobuf import descriptor_pb2
 
 from tensorflow.python.ops import inplace_ops
 
@@ -77,6 +81,110 @@ POSSIBLY_TIME_MAJOR_STATE_KEYS = [
 ]
 
 
+def _HypAxis(key, x, batch_major_state):
+  """Returns the axis of the hyps of the state `key`, or None if it has none."""
+  if not isinstance(x, tf.Tensor) or not x.shape.ndims:
+    return None
+  if x.shape.ndims > 2 and not batch_major_state:
+    return 1
+  if key in POSSIBLY_TIME_MAJOR_STATE_KEYS:
+    return x.shape.ndims - 1
+  return 0
+
+
+def _HypIds(beam_ids, num_beams, num_hyps_per_beam):
+  """Returns the ids of the hyps of beam_ids, hyp 'h' of beam 'b' at h * B + b.
+
+  Args:
+    beam_ids: An int32 tensor of shape [num_selected_beams].
+    num_beams: The number of beams B.
+    num_hyps_per_beam: The number of hyps of each beam.
+
+  Returns:
+    An int32 tensor of shape [num_hyps_per_beam * num_selected_beams], in the
+    order of the hyps of a batch of the selected beams.
+  """
+  return tf.reshape(
+      tf.range(num_hyps_per_beam)[:, tf.newaxis] * num_beams +
+      beam_ids[tf.newaxis, :], [-1])
+
+
+def _HypIdsInCacheOrder(beam_ids, num_hyps_per_beam):
+  """Same as _HypIds(), for the hyp 'h' of beam 'b' at b * H + h."""
+  return tf.reshape(
+      beam_ids[:, tf.newaxis] * num_hyps_per_beam +
+      tf.range(num_hyps_per_beam)[tf.newaxis, :], [-1])
+
+
+def _HypsDescriptorSet():
+  """Returns a string for tf.io.encode_proto's descriptor_source."""
+  file_descriptor_set = descriptor_pb2.FileDescriptorSet()
+  hyps_pb2.DESCRIPTOR.CopyToProto(file_descriptor_set.file.add())
+  return b'bytes://' + file_descriptor_set.SerializeToString()
+
+
+def _ReplaceDoneHypsBeamIds(done_hyps, old_beam_ids, new_beam_ids):
+  """Replaces the beam ids of the serialized done hyps.
+
+  The beam search step writes the index of the beam in the batch as the beam id
+  of a done hyp, which is serialized first, as the field of lowest number of
+  the `Hypothesis`. This replaces that prefix.
+
+  Args:
+    done_hyps: A string tensor of shape [tgt_seq_len, num_hyps], of serialized
+      `Hypothesis` or empty strings.
+    old_beam_ids: An int32 tensor of shape [num_hyps], the beam id of the done
+      hyps of each column of done_hyps.
+    new_beam_ids: An int32 tensor of shape [num_hyps], the new beam id of the
+      done hyps of each column.
+
+  Returns:
+    done_hyps with the new beam ids.
+  """
+
+  def _Prefixes(beam_ids):
+    return tf.io.encode_proto(
+        sizes=tf.ones_like(beam_ids)[:, tf.newaxis],
+        values=[beam_ids[:, tf.newaxis]],
+        field_names=['beam_id'],
+        message_type='tensorflow.lingvo.Hypothesis',
+        descriptor_source=_HypsDescriptorSet())
+
+  shape = tf.shape(done_hyps)
+  is_hyp = tf.not_equal(done_hyps, '')
+  old_prefix_lens = tf.where(
+      is_hyp, tf.broadcast_to(tf.strings.length(_Prefixes(old_beam_ids)),
+                              shape), tf.zeros(shape, tf.int32))
+  replaced = tf.strings.join([
+      tf.broadcast_to(_Prefixes(new_beam_ids), shape),
+      tf.strings.substr(done_hyps, old_prefix_lens, tf.fill(shape, -1))
+  ])
+  return tf.where(is_hyp, replaced, done_hyps)
+
+
+def _EncoderOutputsTensors(encoder_outputs):
+  """Returns the tensors of encoder_outputs, which may also contain None."""
+  return [x for x in encoder_outputs.Flatten() if x is not None]
+
+
+def _PackEncoderOutputs(encoder_outputs, tensors):
+  """Returns encoder_outputs with its tensors replaced by tensors."""
+  tensors = iter(tensors)
+  return encoder_outputs.Transform(lambda x: x if x is None else next(tensors))
+
+
+def _ScatterAlongAxis(x, ids, updates, axis):
+  """Returns x with x[..., ids[i], ...] = updates[..., i, ...] along axis."""
+  if axis == 0:
+    return tf.tensor_scatter_nd_update(x, ids[:, tf.newaxis], updates)
+  perm = [axis] + [i for i in range(x.shape.ndims) if i != axis]
+  inverse_perm = [perm.index(i) for i in range(x.shape.ndims)]
+  return tf.transpose(
+      tf.tensor_scatter_nd_update(
+          tf.transpose(x, perm), ids[:, tf.newaxis],
+          tf.transpose(updates, perm)), inverse_perm)
+
+
 class BeamSearchHelper(base_layer.BaseLayer):
   """Helper class for performing beam search.
 
@@ -172,6 +280,25 @@ class BeamSearchHelper(base_layer.BaseLayer):
 
         Returns:
           final_states, A `.NestedMap`.
+
+  This callback is optional, and only called every p.compact_interval steps if
+  p.compact_interval > 0, to remove the finished source sequences from the
+  encoder outputs:
+
+  .. code-block:: none
+
+      def CompactEncoderOutputsCallback(theta, encoder_outputs, beam_ids):
+        Args:
+          theta: A NestedMap object containing weights' values of this layer and
+            its children layers.
+          encoder_outputs: A NestedMap of tensors computed by encoder, or
+            returned by the previous call.
+          beam_ids: An int32 tensor of shape [new_src_batch], the increasing
+            indices in encoder_outputs of the source sequences to keep.
+
+        Returns:
+          encoder_outputs, a `.NestedMap` of the same structure, with only the
+          source sequences of beam_ids.
   """
 
   @classmethod
@@ -268,6 +395,20 @@ class BeamSearchHelper(base_layer.BaseLayer):
         'local_eos_threshold', -100.0,
         'During beam search, allow </s> to terminate a hyp if the local score '
         'for </s> is greater than local_eos_threshold.')
+    p.Define(
+        'compact_interval', 0,
+        'If > 0, every compact_interval steps the beams whose top hyps can no '
+        'longer change are removed from the batch, with their hyps, states '
+        'and encoder outputs, so that the next steps only run on the other '
+        'beams. The topk results are the same as with compact_interval=0 if '
+        'the log_probs of the PreBeamSearchStepCallback are <= 0 and do not '
+        'depend on the other hyps of the batch, bit for bit, which batched '
+        'ops of different batch sizes may not ensure. The done_hyps and '
+        'other_states of a beam are those at its removal. Beams are removed '
+        'later with length_normalization or coverage_penalty, which loosen '
+        'the bound on the scores of the hyps a beam may terminate. Not '
+        'supported with ensure_full_beam or merge_paths. Requires a '
+        'CompactEncoderOutputsCallback.')
     p.name = 'beam_search'
     return p
 
@@ -373,23 +514,20 @@ class BeamSearchHelper(base_layer.BaseLayer):
 
     def ReOrderHyps(key, x_in):
       """Reorders x_in based on prev hyp ids."""
-      if (isinstance(x_in, tf.Tensor) and x_in.shape.ndims and
-          x_in.shape.ndims > 0):
-        if x_in.shape.ndims > 2 and not p.batch_major_state:
-          # Use corrected indices only here for batch major compute as key/value
-          # caches are the states being affected.
-          correct_old_hyp_ids = (
-              old_hyp_ids_in_cache_order
-              if p.batch_major_compute else old_hyp_ids)
-          x_out = tf.gather(x_in, correct_old_hyp_ids, axis=1)
-        elif key in POSSIBLY_TIME_MAJOR_STATE_KEYS:
-          x_out = tf.gather(x_in, old_hyp_ids, axis=-1)
-        else:
-          x_out = tf.gather(x_in, old_hyp_ids)
-        x_out.set_shape(x_in.get_shape())
-        return x_out
-      else:
+      axis = _HypAxis(key, x_in, p.batch_major_state)
+      if axis is None:
         return x_in
+      if axis == 1:
+        # Use corrected indices only here for batch major compute as key/value
+        # caches are the states being affected.
+        correct_old_hyp_ids = (
+            old_hyp_ids_in_cache_order
+            if p.batch_major_compute else old_hyp_ids)
+        x_out = tf.gather(x_in, correct_old_hyp_ids, axis=1)
+      else:
+        x_out = tf.gather(x_in, old_hyp_ids, axis=axis)
+      x_out.set_shape(x_in.get_shape())
+      return x_out
 
     new_other_states = other_states.TransformWithKey(ReOrderHyps)
 
@@ -400,6 +538,273 @@ class BeamSearchHelper(base_layer.BaseLayer):
     return (cur_step + 1, all_done, new_step_ids, new_bs_states,
             final_other_states)
 
+  def _BeamsToKeep(self, core_bs_states, src_seq_lengths, num_hyps_per_beam,
+                   max_steps):
+    """Returns whether the later steps may change the top hyps of each beam.
+
+    A beam can be removed once it is done under the all_done condition of the
+    beam search step, and no hyp it terminates later can be in its top k
+    terminated hyps. As the cumulative scores of the hyps do not increase, the
+    beam is then done at all the later steps, and a hyp it terminates later
+    has a normalized score of at most that of its best live hyp at a length of
+    max_steps with full coverage. The k-th top hyp must be strictly better
+    than that, and the top k + 1 hyps strictly ordered, as the order of equal
+    hyps depends on the hyps added after them.
+
+    Args:
+      core_bs_states: A tuple of core beam search states.
+      src_seq_lengths: An int32 tensor of shape [num_beams].
+      num_hyps_per_beam: Num of hyps to keep per beam.
+      max_steps: maximum beam search steps.
+
+    Returns:
+      A bool tensor of shape [num_beams].
+    """
+    p = self.params
+    best_scores, cumulative_scores, _, _, _, done_hyps, _ = core_bs_states
+    num_beams = tf.shape(best_scores)[0]
+    # [num_beams].
+    max_scores = tf.reduce_max(
+        tf.reshape(cumulative_scores, [num_hyps_per_beam, num_beams]), axis=0)
+    done = max_scores <= best_scores - p.beam_size
+
+    k = num_hyps_per_beam
+    # [num_beams, k + 1].
+    topk_hyps = ops.top_k_terminated_hyps(
+        done_hyps,
+        src_seq_lengths,
+        k=k + 1,
+        num_hyps_per_beam=num_hyps_per_beam,
+        length_normalization=p.length_normalization,
+        coverage_penalty=p.coverage_penalty,
+        target_seq_length_ratio=p.target_seq_length_ratio,
+        eoc_id=p.target_eoc_id,
+        merge_paths=p.merge_paths)
+    _, topk_lens, topk_scores = ops.unpack_hyp(tf.reshape(topk_hyps, [-1]))
+    topk_lens = tf.reshape(topk_lens, [num_beams, k + 1])
+    topk_scores = tf.reshape(topk_scores, [num_beams, k + 1])
+
+    # See NormalizedScore() of TopKTerminatedHypsOp.
+    length_norm = tf.pow((tf.cast(max_steps, p.dtype) + 5.) / 5.,
+                         p.length_normalization)
+    max_coverage_penalty = (
+        p.target_seq_length_ratio * p.coverage_penalty * np.log(0.5) *
+        tf.cast(src_seq_lengths, p.dtype))
+    max_later_scores = tf.where(max_scores <= 0., max_scores / length_norm,
+                                max_scores) + max_coverage_penalty
+    # Allows for the rounding errors of the step.
+    max_later_scores += 1e-4 * tf.abs(max_later_scores) + 1e-6
+    topk_final = tf.math.logical_and(topk_lens[:, k - 1] > 0,
+                                     topk_scores[:, k - 1] > max_later_scores)
+    topk_ordered = tf.reduce_all(
+        tf.math.logical_or(
+            tf.math.logical_or(topk_scores[:, :-1] > topk_scores[:, 1:],
+                               topk_lens[:, :-1] < topk_lens[:, 1:]),
+            topk_lens[:, 1:] == 0),
+        axis=1)
+    return tf.math.logical_not(
+        tf.math.logical_and(done,
+                            tf.math.logical_and(topk_final, topk_ordered)))
+
+  def _GatherHypStates(self, states, beam_ids, num_beams, num_hyps_per_beam):
+    """Returns the states of the hyps of beam_ids, see _HypIds()."""
+    p = self.params
+    hyp_ids = _HypIds(beam_ids, num_beams, num_hyps_per_beam)
+    if p.batch_major_compute:
+      cache_hyp_ids = _HypIdsInCacheOrder(beam_ids, num_hyps_per_beam)
+    else:
+      cache_hyp_ids = hyp_ids
+
+    def _Gather(key, x):
+      axis = _HypAxis(key, x, p.batch_major_state)
+      if axis is None:
+        return x
+      return tf.gather(x, cache_hyp_ids if axis == 1 else hyp_ids, axis=axis)
+
+    return states.TransformWithKey(_Gather)
+
+  def _ScatterHypStates(self, states, updates, beam_ids, num_beams,
+                        num_hyps_per_beam):
+    """Writes the states of the hyps of beam_ids, the inverse of the above."""
+    p = self.params
+    hyp_ids = _HypIds(beam_ids, num_beams, num_hyps_per_beam)
+    if p.batch_major_compute:
+      cache_hyp_ids = _HypIdsInCacheOrder(beam_ids, num_hyps_per_beam)
+    else:
+      cache_hyp_ids = hyp_ids
+    scattered = []
+    for (key, x), update in zip(states.FlattenItems(), updates.Flatten()):
+      axis = _HypAxis(key, x, p.batch_major_state)
+      if axis is not None:
+        x = _ScatterAlongAxis(x, cache_hyp_ids if axis == 1 else hyp_ids,
+                              update, axis)
+      scattered.append(x)
+    return states.Pack(scattered)
+
+  def _CompactBeams(self, keep, step_ids, core_bs_states, other_states,
+                    num_hyps_per_beam):
+    """Removes the beams which are not kept from the beam search states.
+
+    Args:
+      keep: A bool tensor of shape [num_beams], whether to keep each beam.
+      step_ids: An int tensor of shape [num_hyps, 1].
+      core_bs_states: A tuple of core beam search states.
+      other_states: A `.NestedMap` of other beam search states.
+      num_hyps_per_beam: Num of hyps to keep per beam.
+
+    Returns:
+      A tuple (beam_ids, step_ids, core_bs_states, other_states), where
+      beam_ids are the indices of the kept beams, and the states are those of
+      a batch of the kept beams only, with the done hyps of each beam renumbered
+      as its index in that batch.
+    """
+    num_beams = tf.shape(keep)[0]
+    beam_ids = tf.cast(tf.reshape(tf.where(keep), [-1]), tf.int32)
+    num_kept_beams = tf.shape(beam_ids)[0]
+    hyp_ids = _HypIds(beam_ids, num_beams, num_hyps_per_beam)
+
+    (best_scores, cumulative_scores, scores, hyps, prev_hyps, done_hyps,
+     atten_probs) = core_bs_states
+    # The previous hyp of a hyp is in the same beam. Renumbers them for the
+    # new batch.
+    new_beam_ids = tf.scatter_nd(beam_ids[:, tf.newaxis],
+                                 tf.range(num_kept_beams), [num_beams])
+    prev_hyps = tf.gather(prev_hyps, hyp_ids, axis=1)
+    prev_hyps = ((prev_hyps // num_beams) * num_kept_beams +
+                 tf.gather(new_beam_ids, prev_hyps % num_beams))
+    core_bs_states = (tf.gather(best_scores, beam_ids),
+                      tf.gather(cumulative_scores, hyp_ids),
+                      tf.gather(scores, hyp_ids, axis=1),
+                      tf.gather(hyps, hyp_ids, axis=1), prev_hyps,
+                      _ReplaceDoneHypsBeamIds(
+                          tf.gather(done_hyps, hyp_ids, axis=1),
+                          tf.tile(beam_ids, [num_hyps_per_beam]),
+                          tf.tile(tf.range(num_kept_beams),
+                                  [num_hyps_per_beam])),
+                      tf.gather(atten_probs, hyp_ids, axis=1))
+    return (beam_ids, tf.gather(step_ids, hyp_ids), core_bs_states,
+            self._GatherHypStates(other_states, beam_ids, num_beams,
+                                  num_hyps_per_beam))
+
+  def _BeamSearchLoopWithCompaction(self, theta, encoder_outputs,
+                                    src_seq_lengths, step_ids, core_bs_states,
+                                    other_states,
+                                    num_hyps_per_beam, max_steps,
+                                    pre_beam_search_step_callback,
+                                    post_beam_search_step_callback,
+                                    compact_encoder_outputs_callback):
+    """Runs the beam search steps, removing the finished beams periodically.
+
+    Every p.compact_interval steps, the done hyps and other states of all the
+    beams are written to the results, and the batch is reduced to the beams
+    for which `_BeamsToKeep()`.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of the decoder
+        layer and its children layers.
+      encoder_outputs: A `.NestedMap` containing encoder outputs to be passed to
+        the callbacks.
+      src_seq_lengths: An int32 tensor of shape [num_beams].
+      step_ids: An int tensor of shape [num_hyps, 1].
+      core_bs_states: A tuple of the initial core beam search states.
+      other_states: A `.NestedMap` of the initial other beam search states.
+      num_hyps_per_beam: Num of hyps to keep per beam.
+      max_steps: maximum beam search steps.
+      pre_beam_search_step_callback: The `PreBeamSearchStepCallback` callback.
+      post_beam_search_step_callback: The `PostBeamSearchStepCallback` callback.
+      compact_encoder_outputs_callback: The `CompactEncoderOutputsCallback`
+        callback.
+
+    Returns:
+      A tuple (final_done_hyps, final_other_states) of all the beams.
+    """
+    p = self.params
+    num_beams = tf.shape(core_bs_states[0])[0]
+
+    def LoopContinue(cur_step, all_done, beam_ids, *unused_args):
+      return tf.math.logical_and(
+          tf.math.logical_and(cur_step < max_steps,
+                              tf.math.logical_not(all_done)),
+          tf.shape(beam_ids)[0] > 0)
+
+    def LoopBody(cur_step, all_done, beam_ids, step_ids, core_bs_states,
+                 other_states_list, encoder_outputs_list, final_done_hyps,
+                 final_other_states_list):
+      """Runs p.compact_interval steps, then compacts the batch."""
+      compacted_encoder_outputs = _PackEncoderOutputs(encoder_outputs,
+                                                      encoder_outputs_list)
+      last_step = tf.minimum(cur_step + p.compact_interval, max_steps)
+
+      def StepsContinue(cur_step, all_done, unused_step_ids,
+                        unused_core_bs_states, unused_other_states_list):
+        return tf.math.logical_and(cur_step < last_step,
+                                   tf.math.logical_not(all_done))
+
+      def StepsBody(cur_step, unused_all_done, step_ids, core_bs_states,
+                    other_states_list):
+        (cur_step, all_done, new_step_ids, new_bs_states,
+         new_other_states) = self._BeamSearchStep(
+             theta, compacted_encoder_outputs, cur_step, step_ids,
+             core_bs_states, other_states.Pack(other_states_list),
+             num_hyps_per_beam, pre_beam_search_step_callback,
+             post_beam_search_step_callback)
+        return (cur_step, all_done, new_step_ids, new_bs_states,
+                new_other_states.Flatten())
+
+      loop_vars = (cur_step, all_done, step_ids, core_bs_states,
+                   other_states_list)
+      (cur_step, all_done, step_ids, core_bs_states,
+       other_states_list) = tf.while_loop(
+           StepsContinue,
+           StepsBody,
+           loop_vars=loop_vars,
+           parallel_iterations=10,
+           back_prop=False,
+           swap_memory=False,
+           shape_invariants=_GetShapes(loop_vars, none_shapes=True))
+
+      # Writes the results of the beams of the batch, with the beam ids of the
+      # done hyps in the full batch.
+      compacted_other_states = other_states.Pack(other_states_list)
+      hyp_ids = _HypIds(beam_ids, num_beams, num_hyps_per_beam)
+      done_hyps = _ReplaceDoneHypsBeamIds(
+          core_bs_states[5],
+          tf.tile(tf.range(tf.shape(beam_ids)[0]), [num_hyps_per_beam]),
+          tf.tile(beam_ids, [num_hyps_per_beam]))
+      final_done_hyps = _ScatterAlongAxis(final_done_hyps, hyp_ids, done_hyps,
+                                          1)
+      final_other_states_list = self._ScatterHypStates(
+          other_states.Pack(final_other_states_list), compacted_other_states,
+          beam_ids, num_beams, num_hyps_per_beam).Flatten()
+
+      keep = self._BeamsToKeep(core_bs_states,
+                               tf.gather(src_seq_lengths, beam_ids),
+                               num_hyps_per_beam, max_steps)
+      kept_beam_ids, step_ids, core_bs_states, compacted_other_states = (
+          self._CompactBeams(keep, step_ids, core_bs_states,
+                             compacted_other_states, num_hyps_per_beam))
+      compacted_encoder_outputs = compact_encoder_outputs_callback(
+          theta, compacted_encoder_outputs, kept_beam_ids)
+      return (cur_step, all_done, tf.gather(beam_ids, kept_beam_ids),
+              step_ids, core_bs_states, compacted_other_states.Flatten(),
+              _EncoderOutputsTensors(compacted_encoder_outputs),
+              final_done_hyps, final_other_states_list)
+
+    loop_vars = (tf.constant(0, dtype=tf.int32),
+                 tf.constant(False, dtype=tf.bool), tf.range(num_beams),
+                 step_ids, core_bs_states, other_states.Flatten(),
+                 _EncoderOutputsTensors(encoder_outputs), core_bs_states[5],
+                 other_states.Flatten())
+    final_loop_vars = tf.while_loop(
+        LoopContinue,
+        LoopBody,
+        loop_vars=loop_vars,
+        parallel_iterations=10,
+        back_prop=False,
+        swap_memory=False,
+        shape_invariants=_GetShapes(loop_vars, none_shapes=True))
+    return final_loop_vars[-2], other_states.Pack(final_loop_vars[-1])
+
   def BeamSearchDecode(self,
                        theta,
                        encoder_outputs,
@@ -407,7 +812,8 @@ class BeamSearchHelper(base_layer.BaseLayer):
                        init_beam_search_state=None,
                        pre_beam_search_step_callback=None,
                        post_beam_search_step_callback=None,
-                       max_steps=None):
+                       max_steps=None,
+                       compact_encoder_outputs_callback=None):
     """Performs beam-search based decoding.
 
     Args:
@@ -428,11 +834,28 @@ class BeamSearchHelper(base_layer.BaseLayer):
         Please refer to the class header comments for more details.
       max_steps: maximum beam search steps. If None, use
         self.params.target_seq_len.
+      compact_encoder_outputs_callback: The `CompactEncoderOutputsCallback`
+        callback, required if p.compact_interval > 0. Please refer to the class
+        header comments for more details.
 
     Returns:
       A `BeamSearchDecodeOutput`.
+
+    Raises:
+      ValueError: if p.compact_interval > 0 without
+        compact_encoder_outputs_callback, or with p.ensure_full_beam or
+        p.merge_paths.
     """
     p = self.params
+    if p.compact_interval > 0:
+      if compact_encoder_outputs_callback is None:
+        raise ValueError(
+            'compact_interval requires a compact_encoder_outputs_callback.')
+      # The all_done condition of ensure_full_beam counts the done hyps of
+      # other beams, and merging paths may increase the scores of hyps.
+      if p.ensure_full_beam or p.merge_paths:
+        raise ValueError('compact_interval does not support ensure_full_beam '
+                         'or merge_paths.')
     num_hyps_per_beam = p.num_hyps_per_beam
     if num_hyps_per_beam_override > 0:
       num_hyps_per_beam = num_hyps_per_beam_override
@@ -483,24 +906,6 @@ class BeamSearchHelper(base_layer.BaseLayer):
       return (cur_step, all_done, new_step_ids, new_bs_states,
               new_other_states.Flatten())
 
-    flat_other_states = other_states.Flatten()
-    _, _, _, final_bs_states, flat_final_other_states = tf.while_loop(
-        LoopContinue,
-        LoopBody,
-        loop_vars=(cur_step, all_done, step_ids, core_bs_states,
-                   flat_other_states),
-        parallel_iterations=10,
-        back_prop=False,
-        swap_memory=False,
-        shape_invariants=(tf.TensorShape(cur_step.get_shape()),
-                          tf.TensorShape(all_done.get_shape()),
-                          tf.TensorShape(step_ids.get_shape()),
-                          _GetShapes(core_bs_states),
-                          _GetShapes(flat_other_states, none_shapes=True)))
-    # [target_seq_len, num_beams * num_hyps_per_beam].
-    final_done_hyps = final_bs_states[5]
-    final_other_states = other_states.Pack(flat_final_other_states)
-
     # Assume that `paddings` has shape [source_max_lengths, source_batch_size]
     # by default, and compute `encoded_seq_lengths` accordingly. This can be
     # overridden by directly passing `seq_lengths` in the `encoder_outputs`
@@ -520,6 +925,32 @@ class BeamSearchHelper(base_layer.BaseLayer):
                     1.0 - tf.cast(tf.transpose(source_paddings), tf.float32),
                     1)), tf.int32)
 
+    if p.compact_interval > 0:
+      final_done_hyps, final_other_states = (
+          self._BeamSearchLoopWithCompaction(
+              theta, encoder_outputs, encoded_seq_lengths, step_ids,
+              core_bs_states, other_states, num_hyps_per_beam, max_steps,
+              pre_beam_search_step_callback, post_beam_search_step_callback,
+              compact_encoder_outputs_callback))
+    else:
+      flat_other_states = other_states.Flatten()
+      _, _, _, final_bs_states, flat_final_other_states = tf.while_loop(
+          LoopContinue,
+          LoopBody,
+          loop_vars=(cur_step, all_done, step_ids, core_bs_states,
+                     flat_other_states),
+          parallel_iterations=10,
+          back_prop=False,
+          swap_memory=False,
+          shape_invariants=(tf.TensorShape(cur_step.get_shape()),
+                            tf.TensorShape(all_done.get_shape()),
+                            tf.TensorShape(step_ids.get_shape()),
+                            _GetShapes(core_bs_states),
+                            _GetShapes(flat_other_states, none_shapes=True)))
+      # [target_seq_len, num_beams * num_hyps_per_beam].
+      final_done_hyps = final_bs_states[5]
+      final_other_states = other_states.Pack(flat_final_other_states)
+
     # [num_beams, num_hyps_per_beam].
     topk_hyps = ops.top_k_terminated_hyps(
         final_done_hyps,
@@ -653,6 +1084,19 @@ class GreedySearchHelper(base_layer.BaseLayer):
         'target_seq_len', 0, 'Maximum allowed target seq length. Note '
         'that decoding terminates if an end of sentence token '
         'is not emitted after target_seq_len decode steps.')
+    p.Define(
+        'compact_interval', 0,
+        'If > 0, every compact_interval steps the hyps which are done are '
+        'removed from the batch, with their states and encoder outputs, so '
+        'that the next steps only run on the hyps still being decoded. The '
+        'results are the same, except for the ids past the length of the '
+        'hyps, which are not decoded after their removal. Requires a '
+        'CompactEncoderOutputsCallback, see BeamSearchHelper.')
+    p.Define(
+        'batch_major_state', True, 'If True, we use batch as the major '
+        'dimension of the hyp states. Otherwise, timing becomes the major '
+        'dimension, and the hyps are removed along the second-to-major '
+        'dimension. Only used if compact_interval > 0.')
     p.name = 'greedy_search'
     return p
 
@@ -711,13 +1155,131 @@ class GreedySearchHelper(base_layer.BaseLayer):
     return (cur_step + 1, new_step_ids, hyp_ids, hyp_lens, done_hyps,
             final_other_states)
 
+  def _GreedySearchLoopWithCompaction(self, theta, encoder_outputs, step_ids,
+                                      hyp_ids, hyp_lens, done_hyps,
+                                      other_states, max_steps,
+                                      pre_beam_search_step_callback,
+                                      post_beam_search_step_callback,
+                                      compact_encoder_outputs_callback):
+    """Runs the greedy search steps, removing the finished hyps periodically.
+
+    Every p.compact_interval steps, the hyps of the batch are written to the
+    results, and the batch is reduced to the hyps which are not done.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of the decoder
+        layer and its children layers.
+      encoder_outputs: A `.NestedMap` containing encoder outputs to be passed to
+        the callbacks.
+      step_ids: An int tensor of shape [num_hyps, 1].
+      hyp_ids: An int tensor of shape [max_steps, num_hyps].
+      hyp_lens: An int tensor of shape [num_hyps].
+      done_hyps: A bool tensor of shape [num_hyps].
+      other_states: A `.NestedMap` of the initial other search states.
+      max_steps: maximum search steps.
+      pre_beam_search_step_callback: The `PreBeamSearchStepCallback` callback.
+      post_beam_search_step_callback: The `PostBeamSearchStepCallback` callback.
+      compact_encoder_outputs_callback: The `CompactEncoderOutputsCallback`
+        callback.
+
+    Returns:
+      A tuple (hyp_ids, hyp_lens, done_hyps) of all the hyps.
+    """
+    p = self.params
+    num_hyps = tf.shape(hyp_lens)[0]
+
+    def LoopContinue(cur_step, unused_row_ids, unused_step_ids, unused_hyp_ids,
+                     unused_hyp_lens, done_hyps, *unused_args):
+      return tf.math.logical_and(cur_step < max_steps,
+                                 tf.math.logical_not(tf.reduce_all(done_hyps)))
+
+    def LoopBody(cur_step, row_ids, step_ids, hyp_ids, hyp_lens, done_hyps,
+                 other_states_list, encoder_outputs_list, final_hyp_ids,
+                 final_hyp_lens, final_done_hyps):
+      """Runs p.compact_interval steps, then compacts the batch."""
+      compacted_encoder_outputs = _PackEncoderOutputs(encoder_outputs,
+                                                      encoder_outputs_list)
+      last_step = tf.minimum(cur_step + p.compact_interval, max_steps)
+
+      def StepsContinue(cur_step, unused_step_ids, unused_hyp_ids,
+                        unused_hyp_lens, done_hyps, unused_other_states_list):
+        return tf.math.logical_and(
+            cur_step < last_step,
+            tf.math.logical_not(tf.reduce_all(done_hyps)))
+
+      def StepsBody(cur_step, step_ids, hyp_ids, hyp_lens, done_hyps,
+                    other_states_list):
+        (cur_step, new_step_ids, hyp_ids, hyp_lens, done_hyps,
+         new_other_states) = self._GreedySearchStep(
+             theta, compacted_encoder_outputs, cur_step, step_ids, hyp_ids,
+             hyp_lens, done_hyps, other_states.Pack(other_states_list),
+             pre_beam_search_step_callback, post_beam_search_step_callback)
+        return (cur_step, new_step_ids, hyp_ids, hyp_lens, done_hyps,
+                new_other_states.Flatten())
+
+      loop_vars = (cur_step, step_ids, hyp_ids, hyp_lens, done_hyps,
+                   other_states_list)
+      (cur_step, step_ids, hyp_ids, hyp_lens, done_hyps,
+       other_states_list) = tf.while_loop(
+           StepsContinue,
+           StepsBody,
+           loop_vars=loop_vars,
+           parallel_iterations=10,
+           back_prop=False,
+           swap_memory=False,
+           shape_invariants=_GetShapes(loop_vars, none_shapes=True))
+
+      # Writes the hyps of the batch.
+      final_hyp_ids = _ScatterAlongAxis(final_hyp_ids, row_ids, hyp_ids, 1)
+      final_hyp_lens = _ScatterAlongAxis(final_hyp_lens, row_ids, hyp_lens, 0)
+      final_done_hyps = _ScatterAlongAxis(final_done_hyps, row_ids, done_hyps,
+                                          0)
+
+      kept_row_ids = tf.cast(
+          tf.reshape(tf.where(tf.math.logical_not(done_hyps)), [-1]),
+          tf.int32)
+
+      def _Gather(key, x):
+        axis = _HypAxis(key, x, p.batch_major_state)
+        if axis is None:
+          return x
+        return tf.gather(x, kept_row_ids, axis=axis)
+
+      compacted_other_states = other_states.Pack(
+          other_states_list).TransformWithKey(_Gather)
+      compacted_encoder_outputs = compact_encoder_outputs_callback(
+          theta, compacted_encoder_outputs, kept_row_ids)
+      return (cur_step, tf.gather(row_ids, kept_row_ids),
+              tf.gather(step_ids, kept_row_ids),
+              tf.gather(hyp_ids, kept_row_ids, axis=1),
+              tf.gather(hyp_lens, kept_row_ids),
+              tf.gather(done_hyps, kept_row_ids),
+              compacted_other_states.Flatten(),
+              _EncoderOutputsTensors(compacted_encoder_outputs), final_hyp_ids,
+              final_hyp_lens, final_done_hyps)
+
+    loop_vars = (tf.constant(0, dtype=tf.int32), tf.range(num_hyps), step_ids,
+                 hyp_ids, hyp_lens, done_hyps, other_states.Flatten(),
+                 _EncoderOutputsTensors(encoder_outputs), hyp_ids, hyp_lens,
+                 done_hyps)
+    final_loop_vars = tf.while_loop(
+        LoopContinue,
+        LoopBody,
+        loop_vars=loop_vars,
+        parallel_iterations=10,
+        back_prop=False,
+        swap_memory=False,
+        shape_invariants=_GetShapes(loop_vars, none_shapes=True))
+    return final_loop_vars[-3:]
+
   def GreedySearchDecode(self,
                          theta,
                          encoder_outputs,
                          init_beam_search_state=None,
                          pre_beam_search_step_callback=None,
                          post_beam_search_step_callback=None,
-                         max_steps=None):
+                         max_steps=None,
+                         compact_encoder_outputs_callback=None):
     """Performs greedy-search based decoding.
 
     Args:
@@ -733,6 +1295,9 @@ class GreedySearchHelper(base_layer.BaseLayer):
         Please refer to the class header comments for more details.
       max_steps: maximum beam search steps. If None, use
         self.params.target_seq_len.
+      compact_encoder_outputs_callback: The `CompactEncoderOutputsCallback`
+        callback, required if p.compact_interval > 0. Please refer to the
+        `BeamSearchHelper` class header comments for more details.
 
     Returns:
       A tuple (hyp_ids, hyp_lens, done_hyps). Note that num_hyps is same as
@@ -742,8 +1307,15 @@ class GreedySearchHelper(base_layer.BaseLayer):
           token is encountered during search.
         - hyp_lens: [num_hyps].
         - done_hyps: [num_hyps], whether or not an eos is encountered.
+
+    Raises:
+      ValueError: if p.compact_interval > 0 without
+        compact_encoder_outputs_callback.
     """
     p = self.params
+    if p.compact_interval > 0 and compact_encoder_outputs_callback is None:
+      raise ValueError(
+          'compact_interval requires a compact_encoder_outputs_callback.')
     if max_steps is None:
       max_steps = p.target_seq_len
 
@@ -787,21 +1359,29 @@ class GreedySearchHelper(base_layer.BaseLayer):
       return (cur_step, new_step_ids, hyp_ids, hyp_lens, done_hyps,
               new_other_states.Flatten())
 
-    flat_other_states = other_states.Flatten()
-    _, _, final_hyp_ids, final_hyp_lens, final_done_hyps, _ = tf.while_loop(
-        LoopContinue,
-        LoopBody,
-        loop_vars=(cur_step, step_ids, hyp_ids, hyp_lens, done_hyps,
-                   flat_other_states),
-        parallel_iterations=10,
-        back_prop=False,
-        swap_memory=False,
-        shape_invariants=(tf.TensorShape(cur_step.get_shape()),
-                          tf.TensorShape(step_ids.get_shape()),
-                          tf.TensorShape(hyp_ids.get_shape()),
-                          tf.TensorShape(hyp_lens.get_shape()),
-                          tf.TensorShape(done_hyps.get_shape()),
-                          _GetShapes(flat_other_states, none_shapes=True)))
+    if p.compact_interval > 0:
+      final_hyp_ids, final_hyp_lens, final_done_hyps = (
+          self._GreedySearchLoopWithCompaction(
+              theta, encoder_outputs, step_ids, hyp_ids, hyp_lens, done_hyps,
+              other_states, max_steps, pre_beam_search_step_callback,
+              post_beam_search_step_callback,
+              compact_encoder_outputs_callback))
+    else:
+      flat_other_states = other_states.Flatten()
+      _, _, final_hyp_ids, final_hyp_lens, final_done_hyps, _ = tf.while_loop(
+          LoopContinue,
+          LoopBody,
+          loop_vars=(cur_step, step_ids, hyp_ids, hyp_lens, done_hyps,
+                     flat_other_states),
+          parallel_iterations=10,
+          back_prop=False,
+          swap_memory=False,
+          shape_invariants=(tf.TensorShape(cur_step.get_shape()),
+                            tf.TensorShape(step_ids.get_shape()),
+                            tf.TensorShape(hyp_ids.get_shape()),
+                            tf.TensorShape(hyp_lens.get_shape()),
+                            tf.TensorShape(done_hyps.get_shape()),
+                            _GetShapes(flat_other_states, none_shapes=True)))
 
     # transpose hyp_ids so it matches BeamSearchDecode's output
     final_hyp_ids = tf.transpose(final_hyp_ids)
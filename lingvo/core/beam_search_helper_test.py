@@ -15,10 +15,12 @@
 # ==============================================================================
 """Tests for beam_search_helper."""
 
+from absl.testing import parameterized
 import lingvo.compat as tf
 from lingvo.core import beam_search_helper
 from lingvo.core import py_utils
 from lingvo.core import test_utils
+from lingvo.core.ops import hyps_pb2
 import numpy as np
 
 
@@ -79,7 +81,79 @@ def GetBeamSearchHelperResults(sess, num_hyps_per_beam, pass_seq_lengths=False):
   return topk_ids, topk_lens, topk_scores
 
 
-class BeamSearchHelperTest(test_utils.TestCase):
+def _ToyDecoderCallbacks(vocab_size, tgt_len, num_hyps_per_beam):
+  """Returns the callbacks of a deterministic decoder with a time-major cache.
+
+  The log probs of a hyp only depend on its source sequence and its previous
+  ids, and the eos gets likelier as the hyp gets longer, at a rate set by the
+  source sequence.
+
+  Args:
+    vocab_size: The vocab size.
+    tgt_len: The maximum target length.
+    num_hyps_per_beam: Num of hyps per beam.
+
+  Returns:
+    A tuple of the InitBeamSearchState, PreBeamSearchStepCallback,
+    PostBeamSearchStepCallback and CompactEncoderOutputsCallback callbacks.
+  """
+
+  def _Features(encoder_outputs):
+    # The features of the source sequence of each hyp, at h * src_batch + b.
+    return tf.tile(encoder_outputs.features, [num_hyps_per_beam])
+
+  def _LogProbs(encoder_outputs, states):
+    features = _Features(encoder_outputs)
+    history = tf.reduce_sum(states.cache, axis=[0, 2])
+    logits = 3. * tf.math.cos(
+        tf.range(1., vocab_size + 1.)[tf.newaxis, :] *
+        (features + 0.37 * history)[:, tf.newaxis])
+    eos_logit = tf.cast(states.pos, tf.float32) * features - 2.
+    logits += tf.one_hot(2, vocab_size) * eos_logit[:, tf.newaxis]
+    # Rounds the log probs, so that they and their sums are exact whatever the
+    # size of the batch in the vectorized ops.
+    return tf.round(tf.nn.log_softmax(logits) * 1024.) / 1024.
+
+  def InitBeamSearchState(unused_theta, encoder_outputs,
+                          unused_num_hyps_per_beam):
+    num_hyps = tf.shape(_Features(encoder_outputs))[0]
+    states = py_utils.NestedMap(
+        pos=tf.zeros([num_hyps], tf.int32),
+        cache=tf.zeros([tgt_len, num_hyps, 1]))
+    return py_utils.NestedMap(
+        log_probs=_LogProbs(encoder_outputs, states),
+        atten_probs=tf.ones([num_hyps, 1])), states
+
+  def PreBeamSearchStepCallback(unused_theta, encoder_outputs, unused_step_ids,
+                                states, unused_num_hyps_per_beam):
+    log_probs = _LogProbs(encoder_outputs, states)
+    return py_utils.NestedMap(
+        log_probs=log_probs,
+        atten_probs=tf.ones_like(log_probs[:, :1])), states
+
+  def PostBeamSearchStepCallback(unused_theta, unused_encoder_outputs,
+                                 new_step_ids, states):
+    cache = states.cache + (
+        tf.one_hot(states.pos, tgt_len, axis=0) *
+        tf.cast(tf.transpose(new_step_ids), tf.float32))[:, :, tf.newaxis]
+    return py_utils.NestedMap(pos=states.pos + 1, cache=cache)
+
+  def CompactEncoderOutputsCallback(unused_theta, encoder_outputs, beam_ids):
+    return py_utils.NestedMap(
+        features=tf.gather(encoder_outputs.features, beam_ids),
+        padding=tf.gather(encoder_outputs.padding, beam_ids, axis=1))
+
+  return (InitBeamSearchState, PreBeamSearchStepCallback,
+          PostBeamSearchStepCallback, CompactEncoderOutputsCallback)
+
+
+def _ToyEncoderOutputs(features):
+  return py_utils.NestedMap(
+      features=tf.constant(features, tf.float32),
+      padding=tf.zeros([5, len(features)]))
+
+
+class BeamSearchHelperTest(test_utils.TestCase, parameterized.TestCase):
 
   # TODO(yonghui): Add more thorough tests.
   def testBeamSearchHelper(self):
@@ -199,6 +273,131 @@ class BeamSearchHelperTest(test_utils.TestCase):
       self.assertEqual(expected_topk_lens, topk_lens.tolist())
       self.assertAllClose(expected_topk_scores, topk_scores)
 
+  def testCompactBeams(self):
+    with self.session(use_gpu=False):
+      p = beam_search_helper.BeamSearchHelper.Params().Set(
+          name='bsh', batch_major_state=False, batch_major_compute=True)
+      bs_helper = p.Instantiate()
+      num_hyps_per_beam, num_beams, tgt_len = 2, 3, 2
+      num_hyps = num_hyps_per_beam * num_beams
+      hyp_ids = np.arange(num_hyps)
+      # Swaps the 2 hyps of each beam at each step.
+      prev_hyps = np.tile((hyp_ids + num_beams) % num_hyps, [tgt_len, 1])
+
+      def _Hyp(beam_id, ids):
+        return hyps_pb2.Hypothesis(
+            beam_id=beam_id, ids=ids, scores=[-1.] * len(ids))
+
+      done_hyps = np.array(
+          [[b'', _Hyp(1, [2]).SerializeToString(), b'', b'', b'',
+            _Hyp(2, [2]).SerializeToString()],
+           [_Hyp(0, [1, 2]).SerializeToString(), b'', b'', b'', b'', b'']])
+      core_bs_states = (tf.constant([0., 1., 2.]),
+                        tf.constant(hyp_ids, tf.float32),
+                        tf.zeros([tgt_len, num_hyps]),
+                        tf.tile(tf.range(num_hyps)[tf.newaxis], [tgt_len, 1]),
+                        tf.constant(prev_hyps, tf.int32),
+                        tf.constant(done_hyps),
+                        tf.zeros([tgt_len, num_hyps, 1]))
+      other_states = py_utils.NestedMap(
+          hyp_ids=tf.constant(hyp_ids),
+          # In cache order, hyp 'h' of beam 'b' at b * num_hyps_per_beam + h.
+          cache=tf.reshape(tf.range(tgt_len * num_hyps), [tgt_len, -1, 1]))
+      step_ids = tf.constant(hyp_ids[:, np.newaxis], tf.int32)
+
+      beam_ids, step_ids, core_bs_states, compacted_states = (
+          bs_helper._CompactBeams(
+              tf.constant([True, False, True]), step_ids, core_bs_states,
+              other_states, num_hyps_per_beam))
+      self.assertAllEqual([0, 2], beam_ids)
+      self.assertAllEqual([[0], [2], [3], [5]], step_ids)
+      self.assertAllEqual([0., 2.], core_bs_states[0])
+      self.assertAllEqual([0., 2., 3., 5.], core_bs_states[1])
+      self.assertAllEqual([[0, 2, 3, 5]] * tgt_len, core_bs_states[3])
+      # The prev hyps are renumbered in the batch of the 2 kept beams.
+      self.assertAllEqual([[2, 3, 0, 1]] * tgt_len, core_bs_states[4])
+      # The done hyps are renumbered as well.
+      compacted_done_hyps = self.evaluate(core_bs_states[5])
+      self.assertAllEqual([[b'', b'', b'', b'x'], [b'x', b'', b'', b'']],
+                          np.where(compacted_done_hyps, b'x', b''))
+      self.assertEqual(
+          _Hyp(1, [2]),
+          hyps_pb2.Hypothesis.FromString(compacted_done_hyps[0, 3]))
+      self.assertEqual(
+          _Hyp(0, [1, 2]),
+          hyps_pb2.Hypothesis.FromString(compacted_done_hyps[1, 0]))
+      self.assertAllEqual([0, 2, 3, 5], compacted_states.hyp_ids)
+      self.assertAllEqual([[0, 1, 4, 5], [6, 7, 10, 11]],
+                          compacted_states.cache[:, :, 0])
+
+      # Writes back the compacted states, as the results of the kept beams.
+      scattered = bs_helper._ScatterHypStates(
+          other_states.Transform(tf.zeros_like), compacted_states, beam_ids,
+          num_beams, num_hyps_per_beam)
+      self.assertAllEqual([0, 0, 2, 3, 0, 5], scattered.hyp_ids)
+      self.assertAllEqual([[0, 1, 0, 0, 4, 5], [6, 7, 0, 0, 10, 11]],
+                          scattered.cache[:, :, 0])
+
+  @parameterized.named_parameters(
+      ('Interval1', 1, {}),
+      ('Interval3', 3, {}),
+      ('LengthNormalization', 1, dict(length_normalization=1.)),
+      ('CoveragePenalty', 2, dict(coverage_penalty=0.2)),
+      ('ForceEos', 1, dict(force_eos_in_last_step=True)),
+  )
+  def testBeamSearchCompaction(self, compact_interval, params):
+    vocab_size, tgt_len, num_hyps_per_beam = 8, 10, 2
+    features = [0.9, 0.2, 0.5, 1.3, 0.05]
+    p = beam_search_helper.BeamSearchHelper.Params().Set(
+        name='bsh',
+        target_seq_len=tgt_len,
+        num_hyps_per_beam=num_hyps_per_beam,
+        beam_size=2.,
+        batch_major_state=False,
+        **params)
+    callbacks = _ToyDecoderCallbacks(vocab_size, tgt_len, num_hyps_per_beam)
+
+    def _Decode(compact_interval):
+      bs_helper = p.Copy().Set(compact_interval=compact_interval).Instantiate()
+      return bs_helper.BeamSearchDecode(
+          py_utils.NestedMap(),
+          _ToyEncoderOutputs(features),
+          init_beam_search_state=callbacks[0],
+          pre_beam_search_step_callback=callbacks[1],
+          post_beam_search_step_callback=callbacks[2],
+          compact_encoder_outputs_callback=callbacks[3])
+
+    with self.session(use_gpu=False):
+      decoded, expected = self.evaluate([
+          (x.topk_hyps, x.topk_ids, x.topk_lens, x.topk_scores)
+          for x in (_Decode(compact_interval), _Decode(0))
+      ])
+      for decoded_x, expected_x in zip(decoded, expected):
+        self.assertAllEqual(expected_x, decoded_x)
+
+  def testCompactionUnsupportedParams(self):
+    callbacks = _ToyDecoderCallbacks(8, 4, 2)
+    for params in (dict(ensure_full_beam=True), dict(merge_paths=True)):
+      p = beam_search_helper.BeamSearchHelper.Params().Set(
+          name='bsh', target_seq_len=4, compact_interval=2, **params)
+      with self.assertRaisesRegex(ValueError, 'does not support'):
+        p.Instantiate().BeamSearchDecode(
+            py_utils.NestedMap(),
+            _ToyEncoderOutputs([0.5]),
+            init_beam_search_state=callbacks[0],
+            pre_beam_search_step_callback=callbacks[1],
+            post_beam_search_step_callback=callbacks[2],
+            compact_encoder_outputs_callback=callbacks[3])
+
+  def testCompactionRequiresCallback(self):
+    p = beam_search_helper.BeamSearchHelper.Params().Set(
+        name='bsh', target_seq_len=4, compact_interval=2)
+    callbacks = _ToyDecoderCallbacks(8, 4, 8)
+    with self.assertRaisesRegex(ValueError, 'compact_encoder_outputs_callback'):
+      p.Instantiate().BeamSearchDecode(py_utils.NestedMap(),
+                                       _ToyEncoderOutputs([0.5]), 0,
+                                       *callbacks[:3])
+
 
 class MergeBeamSearchOutputsTest(test_utils.TestCase):
 
@@ -303,6 +502,38 @@ class GreedySearchHelperTest(test_utils.TestCase):
       self.assertEqual(expected_hyp_lens, final_hyp_lens.tolist())
       self.assertEqual(expected_done_hyps, final_done_hyps.tolist())
 
+  def testGreedySearchCompaction(self):
+    vocab_size, tgt_len = 8, 12
+    features = [0.9, 0.2, 1.5, 0.5, 0.7]
+    p = beam_search_helper.GreedySearchHelper.Params().Set(
+        name='gsh', target_seq_len=tgt_len, batch_major_state=False)
+    callbacks = _ToyDecoderCallbacks(vocab_size, tgt_len, 1)
+
+    def _Decode(compact_interval):
+      gs_helper = p.Copy().Set(compact_interval=compact_interval).Instantiate()
+      return gs_helper.GreedySearchDecode(
+          py_utils.NestedMap(),
+          _ToyEncoderOutputs(features),
+          *callbacks[:3],
+          compact_encoder_outputs_callback=callbacks[3])
+
+    with self.session(use_gpu=False):
+      expected, compacted_1, compacted_3 = self.evaluate(
+          [_Decode(0), _Decode(1), _Decode(3)])
+      hyp_ids, hyp_lens, done_hyps = expected
+      # The hyps finish at different steps.
+      self.assertGreater(len(set(hyp_lens.tolist())), 2)
+      self.assertTrue(np.any(done_hyps))
+      mask = np.arange(tgt_len)[np.newaxis, :] < hyp_lens[:, np.newaxis]
+      for actual_hyp_ids, actual_hyp_lens, actual_done_hyps in (compacted_1,
+                                                                compacted_3):
+        self.assertAllEqual(hyp_lens, actual_hyp_lens)
+        self.assertAllEqual(done_hyps, actual_done_hyps)
+        self.assertAllEqual(hyp_ids * mask, actual_hyp_ids * mask)
+      # The hyps are removed as soon as they are done, so the ids past their
+      # length are not decoded.
+      self.assertAllEqual(compacted_1[0], compacted_1[0] * mask)
+
 
 if __name__ == '__main__':
   tf.test.main()
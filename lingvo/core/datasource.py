@@ -15,11 +15,16 @@
 # ==============================================================================
 """DataSources describe how files should be used to provide data."""
 
+import functools
 import os
+import threading
+import time
 
 import lingvo.compat as tf
 from lingvo.core import base_layer
 from lingvo.core import py_utils
+from lingvo.core import summary_utils
+import numpy as np
 
 
 class DataSource(base_layer.BaseLayer):
@@ -57,6 +62,12 @@ class DataSource(base_layer.BaseLayer):
     """
     raise NotImplementedError()
 
+  def Initialize(self, sess):
+    """Initializes the data source using a session, e.g. starts readers."""
+    for child in py_utils.Flatten(self.children):
+      if isinstance(child, DataSource):
+        child.Initialize(sess)
+
 
 class SimpleDataSource(DataSource):
   """A simple file based data source.
@@ -225,6 +236,197 @@ class CrossBatchMixingDataSource(DataSource):
     return ret
 
 
+class AdaptiveMixingDataSource(CrossBatchMixingDataSource):
+  """Mixes batches from different sources without blocking on slow sources.
+
+  `Initialize()` starts a thread per source which reads batches ahead into a
+  queue of at most `p.buffer_size` batches. Each batch is taken from the source
+  which is furthest behind its share of `p.weights` of the batches produced so
+  far, so the mix follows the weights as long as the sources keep up. If that
+  source has no batch ready and is much slower than the fastest source, the
+  batch is taken from the source with a batch ready which is furthest behind,
+  or from the fastest source when none is ready.
+
+  The read rate and latency of each source, and its share of the batches
+  produced, are exported as summaries.
+  """
+
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.Define('buffer_size', 4, 'Max number of batches read ahead per source.')
+    p.Define(
+        'rate_decay', 0.9, 'Decay of the moving averages of the read rate and '
+        'latency of each source.')
+    p.Define(
+        'max_latency_ratio', 2.0,
+        'A source with no batch ready is waited on only if its read latency '
+        'is at most this times the latency of the fastest source.')
+    return p
+
+  def __init__(self, params):
+    super().__init__(params)
+    p = self.params
+    num_sources = len(p.sub)
+    self._lock = threading.Lock()
+    self._num_produced = np.zeros(num_sources)
+    self._read_latency = np.zeros(num_sources)
+    self._exhausted = np.zeros(num_sources, dtype=bool)
+    # A (source index, enqueue op, size op, close op) tuple per source queue.
+    self._queue_ops = []
+    self._sessions = []
+    self._threads = []
+
+  def _ReadLoop(self, sess, index, enqueue_op, size_op, close_op):
+    """Reads the batches of source `index` into its queue."""
+    p = self.params
+    try:
+      while True:
+        # Only run the enqueue op when there is room in the queue, so that its
+        # run time is the latency of reading a batch.
+        if sess.run(size_op) >= p.buffer_size:
+          with self._lock:
+            latency = self._read_latency[index]
+          time.sleep(min(max(latency / 4., 1e-3), 0.01))
+          continue
+        start = time.time()
+        sess.run(enqueue_op)
+        latency = time.time() - start
+        with self._lock:
+          if self._read_latency[index]:
+            latency = (p.rate_decay * self._read_latency[index] +
+                       (1. - p.rate_decay) * latency)
+          self._read_latency[index] = latency
+    except (tf.errors.OutOfRangeError, tf.errors.CancelledError):
+      pass
+    except Exception as e:  # pylint: disable=broad-except
+      tf.logging.error('Stopped reading source %d: %s', index, e)
+    with self._lock:
+      self._exhausted[index] = True
+    try:
+      sess.run(close_op)
+    except Exception:  # pylint: disable=broad-except
+      pass
+
+  def Initialize(self, sess):
+    super().Initialize(sess)
+    if any(s is sess for s in self._sessions):
+      return
+    self._sessions.append(sess)
+    for queue_ops in self._queue_ops:
+      t = threading.Thread(
+          target=self._ReadLoop, args=(sess,) + queue_ops, daemon=True)
+      t.start()
+      self._threads.append(t)
+
+  def _Select(self, sizes):
+    """Returns the index of the next source, and statistics of all sources."""
+    p = self.params
+    weights = np.array(p.weights, dtype=np.float64)
+    weights /= np.sum(weights)
+    with self._lock:
+      eligible = (weights > 0) & ~self._exhausted
+      if not np.any(eligible):
+        # Every source is exhausted: dequeuing raises an OutOfRangeError.
+        eligible = weights > 0
+      deficit = (weights * (np.sum(self._num_produced) + 1) -
+                 self._num_produced)
+      index = np.argmax(np.where(eligible, deficit, -np.inf))
+      measured = eligible & (self._read_latency > 0)
+      if not sizes[index] and np.any(measured):
+        # Only wait for the source furthest behind if it is about as fast as
+        # the fastest source.
+        fastest = np.min(self._read_latency[measured])
+        latency = self._read_latency[index]
+        if not latency or latency > p.max_latency_ratio * fastest:
+          ready = eligible & (sizes > 0)
+          if np.any(ready):
+            index = np.argmax(np.where(ready, deficit, -np.inf))
+          else:
+            index = np.argmin(np.where(measured, self._read_latency, np.inf))
+      self._num_produced[index] += 1
+      read_rate = np.where(self._read_latency > 0,
+                           1. / np.maximum(self._read_latency, 1e-9), 0.)
+      stats = np.stack([
+          read_rate, self._read_latency,
+          self._num_produced / np.sum(self._num_produced)
+      ], 1)
+    return np.int32(index), stats.astype(np.float32)
+
+  def BuildDataSource(self, data_source_from_file_pattern_fn):
+    """Read and return input batch from the queues of the p.sub sources.
+
+    Args:
+      data_source_from_file_pattern_fn: a function that takes file_pattern as an
+        argument and returns an input batch.
+
+    Returns:
+      A NestedMap as in `CrossBatchMixingDataSource.BuildDataSource()`.
+
+    Raises:
+      ValueError: If the sources have different structures or dtypes.
+    """
+    p = self.params
+    num_sources = len(p.sub)
+    if len(p.weights) != num_sources:
+      raise ValueError('Expected p.sub and p.weights to be the same length. '
+                       'Found %d sub, and %d weights' %
+                       (num_sources, len(p.weights)))
+
+    datas = [
+        sub.BuildDataSource(data_source_from_file_pattern_fn).data
+        for sub in self.sub
+    ]
+    flat_datas = [py_utils.Flatten(data) for data in datas]
+    dtypes = [t.dtype for t in flat_datas[0]]
+    for flat_data in flat_datas[1:]:
+      if [t.dtype for t in flat_data] != dtypes:
+        raise ValueError('All sources must have the same structure and dtypes.')
+    shapes = [
+        functools.reduce(lambda a, b: a.most_specific_compatible_shape(b),
+                         [flat_data[i].shape for flat_data in flat_datas])
+        for i in range(len(dtypes))
+    ]
+
+    queues = []
+    for i, flat_data in enumerate(flat_datas):
+      queue = tf.queue.FIFOQueue(
+          p.buffer_size, dtypes, name='%s_source%d' % (p.name, i))
+      self._queue_ops.append(
+          (i, queue.enqueue(flat_data), queue.size(), queue.close()))
+      queues.append(queue)
+
+    sizes = tf.stack([queue.size() for queue in queues])
+    index, stats = tf.py_func(
+        self._Select, [sizes], [tf.int32, tf.float32], stateful=True)
+    index.set_shape([])
+    stats.set_shape([num_sources, 3])
+    flat_data = tf.case(
+        [(tf.equal(index, i), lambda q=queue: tf.nest.flatten(q.dequeue()))
+         for i, queue in enumerate(queues)],
+        exclusive=True)
+    for t, shape in zip(flat_data, shapes):
+      t.set_shape(shape)
+
+    for i in range(num_sources):
+      summary_utils.scalar('input_source_%d/batches_per_sec' % i, stats[i, 0])
+      summary_utils.scalar('input_source_%d/read_latency_secs' % i,
+                           stats[i, 1])
+      summary_utils.scalar('input_source_%d/share' % i, stats[i, 2])
+
+    data_source = py_utils.Pack(datas[0], flat_data)
+    selected_bprop = tf.one_hot(index, num_sources, dtype=tf.float32)
+    batch_size = py_utils.GetShape(flat_data[0])[0]
+    ret = py_utils.NestedMap()
+    ret.data = data_source
+    ret.bprop_variable_filters = (
+        p.bprop_variable_filters or [''] * num_sources)
+    ret.selected_bprop = selected_bprop
+    ret.source_selected = tf.tile(
+        tf.expand_dims(selected_bprop, 0), [batch_size, 1])
+    return ret
+
+
 class CurriculumDataSource(DataSource):
   """A data source that reads different DataSources in stages.
 
@@ -15,6 +15,8 @@
 # ==============================================================================
 """Tests for lingvo.core.datasource."""
 
+import time
+
 import lingvo.compat as tf
 
 from lingvo.core import datasource
@@ -40,6 +42,19 @@ def _MockDataSourceFromFilePattern(file_pattern, input_source_weights=None):
   return tf.constant([file_pattern])
 
 
+def _SlowDataSourceFromFilePattern(file_pattern, input_source_weights=None):
+  """Like _MockDataSourceFromFilePattern, but 'slow' patterns take 0.5s."""
+  del input_source_weights  # Unused.
+
+  def Read(pattern):
+    if pattern == b'slow':
+      time.sleep(0.5)
+    return pattern
+
+  return tf.reshape(
+      tf.py_func(Read, [tf.constant(file_pattern)], tf.string), [1])
+
+
 class DatasourceTest(test_utils.TestCase):
 
   def testSimpleDataSourceSucceedsWithStringInput(self):
@@ -257,6 +272,67 @@ class DatasourceTest(test_utils.TestCase):
 
     self.assertAllEqual(ret.data, [[b'tfrecord:dir/filename-*.tfrecord']])
 
+  def testAdaptiveMixingDataSourceFollowsWeights(self):
+    sources = [
+        datasource.SimpleDataSource.Params().Set(file_pattern='a'),
+        datasource.SimpleDataSource.Params().Set(file_pattern='b'),
+    ]
+    ds_params = datasource.AdaptiveMixingDataSource.Params().Set(
+        sub=sources, weights=[0.75, 0.25])
+    ds = ds_params.Instantiate()
+    ret = ds.BuildDataSource(_MockDataSourceFromFilePattern)
+    with self.session(graph=tf.get_default_graph()) as sess:
+      ds.Initialize(sess)
+      fetches = py_utils.NestedMap(
+          data=ret.data,
+          selected_bprop=ret.selected_bprop,
+          source_selected=ret.source_selected)
+      outputs = [sess.run(fetches) for _ in range(200)]
+    self.assertEqual(ret.bprop_variable_filters, ['', ''])
+    for out in outputs:
+      self.assertEqual(out.data[0], [b'a', b'b'][out.selected_bprop.argmax()])
+      self.assertAllEqual([out.selected_bprop], out.source_selected)
+    num_a = sum(out.data[0] == b'a' for out in outputs)
+    self.assertBetween(num_a, 140, 160)
+
+  def testAdaptiveMixingDataSourceDoesNotBlockOnSlowSource(self):
+    sources = [
+        datasource.SimpleDataSource.Params().Set(file_pattern='fast'),
+        datasource.SimpleDataSource.Params().Set(file_pattern='slow'),
+    ]
+    ds_params = datasource.AdaptiveMixingDataSource.Params().Set(
+        sub=sources, weights=[0.5, 0.5], buffer_size=2)
+    ds = ds_params.Instantiate()
+    ret = ds.BuildDataSource(_SlowDataSourceFromFilePattern)
+    config = tf.config_pb2.ConfigProto(inter_op_parallelism_threads=4)
+    with self.session(graph=tf.get_default_graph(), config=config) as sess:
+      ds.Initialize(sess)
+      start = time.time()
+      outputs = [sess.run(ret.data) for _ in range(20)]
+      elapsed = time.time() - start
+    num_slow = sum(out[0] == b'slow' for out in outputs)
+    # Mixing by weight would take at least 10 * 0.5s.
+    self.assertLess(num_slow, 10)
+    self.assertLess(elapsed, 4.)
+
+  def testAdaptiveMixingDataSourceFailsWithMismatchedDtypes(self):
+
+    def _DataFromFilePattern(file_pattern, input_source_weights=None):
+      del input_source_weights  # Unused.
+      if file_pattern == 'a':
+        return tf.constant([1])
+      return tf.constant([file_pattern])
+
+    sources = [
+        datasource.SimpleDataSource.Params().Set(file_pattern='a'),
+        datasource.SimpleDataSource.Params().Set(file_pattern='b'),
+    ]
+    ds_params = datasource.AdaptiveMixingDataSource.Params().Set(
+        sub=sources, weights=[0.5, 0.5])
+    ds = ds_params.Instantiate()
+    with self.assertRaisesRegex(ValueError, 'same structure and dtypes'):
+      ds.BuildDataSource(_DataFromFilePattern)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -234,60 +234,107 @@ def noncausal_denominator(qs, ks):
   return tf.einsum("lbhm,bhm->lbh", qs, ks_sum)
 
 
-@tf.custom_gradient
-def causal_numerator(qs, ks, vs):
+# Number of positions processed at once by the causal prefix sums.
+CAUSAL_CHUNK_SIZE = 128
+
+
+def _to_chunks(x, chunk_size):
+  """Pads x: [L,...] with zeros and reshapes it to [L/C,C,...]."""
+  length = tf.shape(x)[0]
+  num_chunks = (length + chunk_size - 1) // chunk_size
+  paddings = [[0, num_chunks * chunk_size - length]
+             ] + [[0, 0]] * (x.shape.ndims - 1)
+  x = tf.pad(x, paddings)
+  return tf.reshape(
+      x, tf.concat([[num_chunks, chunk_size], tf.shape(x)[1:]], axis=0))
+
+
+def _from_chunks(x, length, static_shape):
+  """Reshapes x: [L/C,C,...] to [L,...], removing the padding."""
+  x = tf.reshape(x, tf.concat([[-1], tf.shape(x)[2:]], axis=0))[:length]
+  x.set_shape(static_shape)
+  return x
+
+
+def causal_numerator(qs, ks, vs, chunk_size=CAUSAL_CHUNK_SIZE):
   """Computes not-normalized FAVOR causal attention A_{masked}V.
 
+  The positions are split into chunks of chunk_size. The prefix sums of
+  ks[i] x vs[i] up to the start of each chunk are computed for all the chunks
+  at once, and the attention within each chunk with a lower triangular mask.
+  The graph has a fixed number of ops for any length, and the memory is
+  O(L * (C + M * D / C)) for chunk size C. The gradient recomputes the prefix
+  sums and the chunk scores from the inputs, so that they are not kept
+  between the forward and the backward pass.
+
   Args:
     qs: query_prime tensor of the shape [L,B,H,M].
     ks: key_prime tensor of the shape [L,B,H,M].
     vs: value tensor of the shape [L,B,H,D].
+    chunk_size: number of positions of each chunk.
 
   Returns:
     Not-normalized FAVOR causal attention A_{masked}V.
   """
+  length = tf.shape(qs)[0]
+  # [C,C], mask[c,d] = 1 iff the position c of a chunk attends to position d.
+  mask = tf.linalg.band_part(tf.ones([chunk_size, chunk_size], qs.dtype), -1,
+                             0)
+
+  def _chunk_terms(qs, ks, vs):
+    """Returns the chunked inputs, prefix sums and chunk scores."""
+    q = _to_chunks(qs, chunk_size)  # [N,C,B,H,M]
+    k = _to_chunks(ks, chunk_size)  # [N,C,B,H,M]
+    v = _to_chunks(vs, chunk_size)  # [N,C,B,H,D]
+    # Sums of ks[i] x vs[i] of the previous chunks, [N,B,H,M,D].
+    sums = tf.cumsum(
+        tf.einsum("ncbhm,ncbhd->nbhmd", k, v), axis=0, exclusive=True)
+    scores = tf.einsum("ncbhm,nebhm->nbhce", q, k) * mask
+    return q, k, v, sums, scores
+
+  @tf.custom_gradient
+  def _causal_numerator(qs, ks, vs):
+    q, _, v, sums, scores = _chunk_terms(qs, ks, vs)
+    result = (
+        tf.einsum("ncbhm,nbhmd->ncbhd", q, sums) +
+        tf.einsum("nbhce,nebhd->ncbhd", scores, v))
+    result = _from_chunks(result, length,
+                          qs.shape[:-1].concatenate(vs.shape[-1:]))
+
+    def grad(res_grad):
+      q, k, v, sums, scores = _chunk_terms(qs, ks, vs)
+      g = _to_chunks(res_grad, chunk_size)  # [N,C,B,H,D]
+      # Sums of qs[i] x res_grad[i] of the next chunks, [N,B,H,M,D].
+      grad_sums = tf.cumsum(
+          tf.einsum("ncbhm,ncbhd->nbhmd", q, g),
+          axis=0,
+          exclusive=True,
+          reverse=True)
+      grad_scores = tf.einsum("ncbhd,nebhd->nbhce", g, v) * mask
+      q_grads = (
+          tf.einsum("ncbhd,nbhmd->ncbhm", g, sums) +
+          tf.einsum("nbhce,nebhm->ncbhm", grad_scores, k))
+      k_grads = (
+          tf.einsum("nbhmd,nebhd->nebhm", grad_sums, v) +
+          tf.einsum("nbhce,ncbhm->nebhm", grad_scores, q))
+      v_grads = (
+          tf.einsum("nbhmd,nebhm->nebhd", grad_sums, k) +
+          tf.einsum("nbhce,ncbhd->nebhd", scores, g))
+      return (_from_chunks(q_grads, length, qs.shape),
+              _from_chunks(k_grads, length, ks.shape),
+              _from_chunks(v_grads, length, vs.shape))
+
+    return result, grad
+
+  return _causal_numerator(qs, ks, vs)
 
-  result = []
-  sums = tf.zeros_like(tf.einsum("ijk,ijl->ijkl", ks[0], vs[0]))
-
-  for index in range(qs.shape[0]):
-    sums = sums + tf.einsum("ijk,ijl->ijkl", ks[index], vs[index])
-    result.append(tf.einsum("ijkl,ijk->ijl", sums, qs[index])[None, ...])
-
-  result = tf.concat(result, axis=0)
-
-  def grad(res_grad):
-
-    grads = tf.zeros_like(tf.einsum("ijk,ijl->ijkl", ks[0], vs[0]))
-
-    gr_sums = sums
-
-    q_grads = []
-    k_grads = []
-    v_grads = []
-
-    for index in range(qs.shape[0] - 1, -1, -1):
-
-      q_grads.append(
-          tf.einsum("ijkl,ijl->ijk", gr_sums, res_grad[index])[None, ...])
-      grads = grads + tf.einsum("ijk,ijl->ijkl", qs[index], res_grad[index])
-      k_grads.append(tf.einsum("ijkl,ijl->ijk", grads, vs[index])[None, ...])
-      v_grads.append(tf.einsum("ijkl,ijk->ijl", grads, ks[index])[None, ...])
-      gr_sums = gr_sums - tf.einsum("ijk,ijl->ijkl", ks[index], vs[index])
-
-    q_grads = tf.concat(q_grads[::-1], axis=0)
-    k_grads = tf.concat(k_grads[::-1], axis=0)
-    v_grads = tf.concat(v_grads[::-1], axis=0)
 
-    return q_grads, k_grads, v_grads
-
-  return result, grad
-
-
-@tf.custom_gradient
 def causal_denominator(qs, ks):
   """Computes FAVOR normalizer in causal attention.
 
+  The prefix sums of ks are of the size of ks, so they are computed with a
+  single cumsum, and the gradient of TF keeps no larger tensor.
+
   Args:
     qs: query_prime tensor of the shape [L,B,H,M].
     ks: key_prime tensor of the shape [L,B,H,M].
@@ -295,39 +342,7 @@ def causal_denominator(qs, ks):
   Returns:
     FAVOR normalizer in causal attention.
   """
-
-  result = []
-  sums = tf.zeros_like(ks[0])
-
-  for index in range(qs.shape[0]):
-    sums = sums + ks[index]
-    result.append(tf.reduce_sum(qs[index] * sums, axis=2)[None, ...])
-
-  result = tf.concat(result, axis=0)
-
-  def grad(res_grad):
-
-    k_grad = tf.zeros_like(ks[0])
-
-    gr_sums = sums
-
-    q_grads = []
-    k_grads = []
-
-    for index in range(qs.shape[0] - 1, -1, -1):
-
-      q_grads.append(
-          tf.einsum("ijk,ij->ijk", gr_sums, res_grad[index])[None, ...])
-      k_grad = k_grad + tf.einsum("ijk,ij->ijk", qs[index], res_grad[index])
-      k_grads.append(k_grad[None, ...])
-      gr_sums = gr_sums - ks[index]
-
-    q_grads = tf.concat(q_grads[::-1], axis=0)
-    k_grads = tf.concat(k_grads[::-1], axis=0)
-
-    return q_grads, k_grads
-
-  return result, grad
+  return tf.einsum("lbhm,lbhm->lbh", qs, tf.cumsum(ks, axis=0))
 
 
 def favor_attention(query,
@@ -335,7 +350,8 @@ def favor_attention(query,
                     value,
                     kernel_transformation,
                     causal,
-                    projection_matrix=None):
+                    projection_matrix=None,
+                    causal_chunk_size=CAUSAL_CHUNK_SIZE):
   """Computes FAVOR normalized attention.
 
   Args:
@@ -345,6 +361,7 @@ def favor_attention(query,
     kernel_transformation: transformation used to get finite kernel features.
     causal: whether attention is causal or not.
     projection_matrix: projection matrix to be used.
+    causal_chunk_size: chunk size of the causal attention numerator.
 
   Returns:
     FAVOR normalized attention.
@@ -359,7 +376,8 @@ def favor_attention(query,
   # bidirectional variant.
 
   if causal:
-    av_attention = causal_numerator(query_prime, key_prime, value)
+    av_attention = causal_numerator(query_prime, key_prime, value,
+                                    causal_chunk_size)
     attention_normalizer = causal_denominator(query_prime, key_prime)
   else:
     av_attention = noncausal_numerator(query_prime, key_prime, value)
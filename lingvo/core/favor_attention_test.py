@@ -98,6 +98,56 @@ class FAVORTest(test_utils.TestCase, parameterized.TestCase):
           np.abs((groundtruth_output - favor_output) / groundtruth_output))
       self.assertLess(error, max_error)
 
+  @parameterized.parameters((1,), (4,), (7,), (64,))
+  def test_causal_prefix_sums(self, chunk_size):
+    length, batch_size, num_heads, num_features, dim = 23, 2, 3, 5, 4
+    np.random.seed(1234)
+    qs = tf.constant(
+        np.random.uniform(
+            size=[length, batch_size, num_heads, num_features]), tf.float64)
+    ks = tf.constant(
+        np.random.uniform(
+            size=[length, batch_size, num_heads, num_features]), tf.float64)
+    vs = tf.constant(
+        np.random.normal(size=[length, batch_size, num_heads, dim]),
+        tf.float64)
+    numerator = favor.causal_numerator(qs, ks, vs, chunk_size)
+    denominator = favor.causal_denominator(qs, ks)
+    self.assertEqual([length, batch_size, num_heads, dim],
+                     numerator.shape.as_list())
+
+    # Masked quadratic attention.
+    mask = np.tril(np.ones([length, length]))
+    scores = tf.einsum("lbhm,sbhm->bhls", qs, ks) * mask
+    expected_numerator = tf.einsum("bhls,sbhd->lbhd", scores, vs)
+    expected_denominator = tf.transpose(tf.reduce_sum(scores, -1), [2, 0, 1])
+
+    grad_weights = tf.constant(
+        np.random.normal(size=[length, batch_size, num_heads, dim]))
+    loss = tf.reduce_sum(numerator * grad_weights) + tf.reduce_sum(
+        tf.square(denominator))
+    expected_loss = tf.reduce_sum(
+        expected_numerator * grad_weights) + tf.reduce_sum(
+            tf.square(expected_denominator))
+    with self.session(use_gpu=False) as sess:
+      actual, expected = sess.run([
+          [numerator, denominator] + tf.gradients(loss, [qs, ks, vs]),
+          [expected_numerator, expected_denominator] +
+          tf.gradients(expected_loss, [qs, ks, vs])
+      ])
+    for actual_val, expected_val in zip(actual, expected):
+      self.assertAllClose(expected_val, actual_val)
+
+  def test_causal_graph_size(self):
+
+    def num_ops(length):
+      with tf.Graph().as_default() as graph:
+        qs = tf.random.uniform([length, 1, 1, 4])
+        vs = tf.random.normal([length, 1, 1, 4])
+        tf.gradients(favor.causal_numerator(qs, qs, vs, 8), [qs, vs])
+      return len(graph.get_operations())
+
+    self.assertEqual(num_ops(16), num_ops(1024))
 
 if __name__ == "__main__":
   tf.test.main()
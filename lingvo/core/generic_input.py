@@ -15,11 +15,38 @@
 # ==============================================================================
 """Generic input."""
 
+import contextlib
+
 import lingvo.compat as tf
 from lingvo.core import ops
 from lingvo.core import py_utils
 from tensorflow.python.util import tf_inspect  # pylint: disable=g-direct-tensorflow-import
 
+_PROCESSOR_CAPTURES = py_utils.ThreadLocalStack()
+
+
+@contextlib.contextmanager
+def CaptureProcessors():
+  """Collects the record processors of the GenericInput() calls in the scope.
+
+  E.g. to time the processor of an input generator on single records.
+
+  Yields:
+    A list, to which a `.NestedMap` is appended for each GenericInput() call,
+    with
+
+    - processor - The concrete function taking a tf.int32 source_id and a
+      tf.string record and returning the flattened outputs of the processor
+      followed by the bucketing key.
+    - file_pattern - The file pattern of the records, or None.
+  """
+  processors = []
+  _PROCESSOR_CAPTURES.stack.append(processors)
+  try:
+    yield processors
+  finally:
+    _PROCESSOR_CAPTURES.stack.pop()
+
 
 def GenericInput(processor, **kwargs):
   """Builds a generic input pipeline.
@@ -118,6 +145,11 @@ def GenericInput(processor, **kwargs):
     proc_fn = _FlatOutputProcessor.get_concrete_function(
         tf.TensorSpec([], tf.int32), tf.TensorSpec([], tf.string))
 
+  for processors in _PROCESSOR_CAPTURES.stack:
+    processors.append(
+        py_utils.NestedMap(
+            processor=proc_fn, file_pattern=kwargs.get('file_pattern')))
+
   out_types = [
       tf.DType(a.type) for a in proc_fn.function_def.signature.output_arg
   ]
@@ -97,6 +97,24 @@ class GenericInputOpTest(test_utils.TestCase, parameterized.TestCase):
       for i in range(100):
         self.assertIn(('%08d' % i).encode('utf-8'), record_seen)
 
+  def testCaptureProcessors(self):
+    with generic_input.CaptureProcessors() as processors:
+      input_batch = run_basic_graph(use_nested_map=True)
+    self.assertLen(processors, 1)
+    self.assertEqual('tfrecord:' + os.path.join(tf.test.get_temp_dir(),
+                                                'basic'),
+                     processors[0].file_pattern)
+    outputs = processors[0].processor(
+        tf.constant(3, tf.int32), tf.constant(b'00000005'))
+    with self.session():
+      # The flattened num, record and source_id, and the bucketing key.
+      num, record, source_id, bucket_key = self.evaluate(outputs)
+      self.assertAllEqual([5., 25.], num)
+      self.assertEqual(b'00000005', record)
+      self.assertEqual(3, source_id)
+      self.assertEqual(1, bucket_key)
+      self.assertLen(self.evaluate(input_batch.record), 8)
+
   def testPadding(self):
     # Generate a test file w/ 50 records of different lengths.
     tmp = os.path.join(tf.test.get_temp_dir(), 'basic')
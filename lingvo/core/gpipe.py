@@ -37,7 +37,9 @@ from lingvo.core import base_layer
 from lingvo.core import builder_layers
 from lingvo.core import py_utils
 from lingvo.core import recurrent
+from lingvo.core import symbolic
 from lingvo.core import tshape
+import numpy as np
 
 
 _MICRO_BATCH_STATE_NAME = 'micro_batch_state'
@@ -177,20 +179,56 @@ class FeatureExtractionLayer(base_layer.BaseLayer):
     return py_utils.NestedMap(flops=total, out_shapes=seq_args + extra_args)
 
 
-def PartitionSequentialLayers(params, num_partitions, *shapes):
-  r"""Partition a layer composed of sequential layers.
+def PlanPartitions(params,
+                   num_partitions,
+                   *shapes,
+                   memory_limit=None,
+                   transfer_cost_per_byte=0.,
+                   num_micro_batches=None):
+  """Splits a layer composed of sequential layers into balanced partitions.
 
-  This routine strives to partition layers so that each partition costs roughly
-  the same flops given the input shapes.
+  The pipeline runs at the speed of its slowest partition, so the layers are
+  split into `num_partitions` contiguous partitions which minimize the largest
+  partition cost, by dynamic programming. The cost of a partition is the flops
+  of its layers, plus `transfer_cost_per_byte` times the bytes of the
+  activations it sends to the next partition, as a fraction of the total flops
+  of the layers. Symbols in the input shapes which cancel out in these
+  fractions, e.g. a symbolic batch size, need no static value, unless
+  `memory_limit` is set.
 
   Args:
     params: A layer param or a list of layer param.
     num_partitions: The desired number of partitions.
     *shapes: A tuple of tshape.Shape representing input tensors to the first
       layer.
+    memory_limit: If set, the largest bytes of the activations of a partition,
+      i.e. of the outputs of its layers, given the input shapes.
+    transfer_cost_per_byte: The cost, in flops, of sending one byte of
+      activations between two partitions.
+    num_micro_batches: If set, the bubble and efficiency of the pipeline with
+      this many micro batches are reported.
 
   Returns:
-    A list of FeatureExtractionLayer params.
+    A `.NestedMap` with
+
+    - subs - The list of the layer params of each partition. The layers are
+      renamed 'cell_%03d'.
+    - costs - The cost of each partition, as a fraction of the total flops.
+    - activation_bytes - The activation bytes of each partition, possibly
+      symbolic.
+    - transfer_bytes - The bytes sent by each partition to the next one,
+      possibly symbolic.
+    - balance - The mean partition cost over the largest one.
+    - bubble - The fraction of the pipeline steps where a partition is idle
+      waiting for the others, or None if num_micro_batches is None.
+    - efficiency - The fraction of the time of the pipeline spent on the
+      partition costs, accounting for the bubble and the imbalance, or None if
+      num_micro_batches is None.
+
+  Raises:
+    ValueError: if a layer has no FPropMeta, there are fewer layers than
+      partitions, no partitioning fits in memory_limit, or the costs depend on
+      symbols without a static value.
   """
 
   # Recursively concatenate SequentialLayer into a list.
@@ -210,42 +248,122 @@ def PartitionSequentialLayers(params, num_partitions, *shapes):
   assert len(shapes) == 1
   tf.logging.info('num_partitions: {} input_shape: {}'.format(
       num_partitions, shapes[0]))
+  num_layers = len(subs)
+  if num_layers < num_partitions:
+    raise ValueError('Can not split %d layers into %d partitions.' %
+                     (num_layers, num_partitions))
 
-  # Computes the estimate cost for each sub layer.
-  total, histo, output_shapes = 0, [], []
+  # Computes the estimate cost and activations of each sub layer.
+  flops, out_bytes = [], []
   for i, s in enumerate(subs):
     s.name = 'cell_%03d' % i
-    meta = s.cls.FPropMeta(s, *shapes)
-    total += meta.flops
-    histo.append(total)
-    output_shapes.append(meta.out_shapes)
+    try:
+      meta = s.cls.FPropMeta(s, *shapes)
+    except NotImplementedError:
+      raise ValueError('Layer %s of %s has no FPropMeta to estimate its cost.' %
+                       (i, s.cls.__name__))
+    flops.append(meta.flops)
     shapes = meta.out_shapes
-  tf.logging.vlog(1, 'len %d histogram = %s', len(subs), histo)
+    out_bytes.append(py_utils.ShapesBytes(shapes, py_utils.FPropDtype(s)))
+  tf.logging.vlog(1, 'len %d flops = %s', num_layers, flops)
+
+  # Normalizes the costs by the total flops, so that symbols common to all the
+  # costs cancel out.
+  total = symbolic.ToStatic(sum(flops))
+  if total == 0:
+    total = 1.
+  flops_sums = np.cumsum([0.] +
+                         [symbolic.ToStaticFloat(f / total) for f in flops])
+  transfer_costs = [
+      symbolic.ToStaticFloat(transfer_cost_per_byte * b / total)
+      if transfer_cost_per_byte else 0. for b in out_bytes
+  ]
+  if memory_limit is not None:
+    bytes_sums = np.cumsum([0.] +
+                           [symbolic.ToStaticFloat(b) for b in out_bytes])
+
+  def Cost(start, end):
+    cost = flops_sums[end] - flops_sums[start]
+    if end < num_layers:
+      cost += transfer_costs[end - 1]
+    return float(cost)
+
+  def Fits(start, end):
+    return (memory_limit is None or
+            bytes_sums[end] - bytes_sums[start] <= memory_limit)
+
+  # best[k][i] is the smallest largest cost of splitting the first i layers
+  # into k partitions, and cut[k][i] the start of the last partition.
+  inf = float('inf')
+  best = [[inf] * (num_layers + 1) for _ in range(num_partitions + 1)]
+  cut = [[0] * (num_layers + 1) for _ in range(num_partitions + 1)]
+  best[0][0] = 0.
+  for k in range(1, num_partitions + 1):
+    for i in range(k, num_layers - num_partitions + k + 1):
+      for j in range(k - 1, i):
+        if best[k - 1][j] == inf or not Fits(j, i):
+          continue
+        cost = max(best[k - 1][j], Cost(j, i))
+        if cost < best[k][i]:
+          best[k][i], cut[k][i] = cost, j
+  if best[num_partitions][num_layers] == inf:
+    raise ValueError('No partitioning fits in memory_limit %d.' % memory_limit)
+
+  bounds = [num_layers]
+  for k in range(num_partitions, 0, -1):
+    bounds.append(cut[k][bounds[-1]])
+  bounds.reverse()
+  spans = list(zip(bounds[:-1], bounds[1:]))
+  costs = [Cost(start, end) for start, end in spans]
+  max_cost = max(costs)
+  plan = py_utils.NestedMap(
+      subs=[subs[start:end] for start, end in spans],
+      costs=costs,
+      activation_bytes=[
+          symbolic.ToStatic(sum(out_bytes[start:end])) for start, end in spans
+      ],
+      transfer_bytes=[
+          symbolic.ToStatic(out_bytes[end - 1]) for _, end in spans[:-1]
+      ] + [0],
+      balance=sum(costs) / num_partitions / max_cost if max_cost else 1.,
+      bubble=None,
+      efficiency=None)
+  if num_micro_batches:
+    # Each of the num_micro_batches + num_partitions - 1 pipeline steps takes
+    # as long as the slowest partition.
+    num_steps = num_micro_batches + num_partitions - 1
+    plan.bubble = (num_partitions - 1) / num_steps
+    plan.efficiency = plan.balance * num_micro_batches / num_steps
+  return plan
+
+
+def PartitionSequentialLayers(params, num_partitions, *shapes, **kwargs):
+  r"""Partition a layer composed of sequential layers.
 
-  # Computes the normalized cumulative histogram of the layer's cost.
-  histo_pct = [float(x / total) for x in histo]
-  tf.logging.vlog(1, 'cost pct = %s', histo_pct)
+  This routine splits the layers into the contiguous partitions minimizing the
+  cost of the most costly partition given the input shapes. See
+  `PlanPartitions()`.
 
-  # i-th sub layer is put into partition j, where j is roughly i-th cumulative
-  # histogram times num_partitions.
-  parts = [[] for _ in range(num_partitions)]
-  parts_cost = [0] * num_partitions
-  pre_hist_cost = 0
-  for i, s in enumerate(subs):
-    j = min(int(histo_pct[i] * num_partitions), num_partitions - 1)
-    # The boundary at parts[j] where j > 0
-    if j > 0 and not parts[j]:
-      parts_cost[j - 1] = histo_pct[i - 1] - pre_hist_cost
-      pre_hist_cost = histo_pct[i - 1]
-    parts[j].append(s)
-
-  parts_cost[num_partitions - 1] = 1.0 - pre_hist_cost
-  seqs = []
-  for i, pa in enumerate(parts):
-    tf.logging.info('Partition %d #subs %d #cost %.3f', i, len(pa),
-                         parts_cost[i])
+  Args:
+    params: A layer param or a list of layer param.
+    num_partitions: The desired number of partitions.
+    *shapes: A tuple of tshape.Shape representing input tensors to the first
+      layer.
+    **kwargs: The optional arguments of `PlanPartitions()`.
 
+  Returns:
+    A list of FeatureExtractionLayer params.
+  """
+  plan = PlanPartitions(params, num_partitions, *shapes, **kwargs)
+  seqs = []
+  for i, pa in enumerate(plan.subs):
+    tf.logging.info('Partition %d #subs %d #cost %.3f #activations %s', i,
+                    len(pa), plan.costs[i], plan.activation_bytes[i])
     seqs.append(FeatureExtractionLayer.Params().Set(name='d%d' % i, sub=pa))
+  tf.logging.info('Partition balance %.3f', plan.balance)
+  if plan.bubble is not None:
+    tf.logging.info('Pipeline bubble %.3f efficiency %.3f', plan.bubble,
+                    plan.efficiency)
   return seqs
 
 
@@ -15,14 +15,18 @@
 # ==============================================================================
 """Tests for lingvo gpipe."""
 
+import itertools
+
 import lingvo.compat as tf
 from lingvo.core import base_layer
 from lingvo.core import py_utils
+from lingvo.core import symbolic
 from lingvo.core import test_utils
 from lingvo.core import tshape
 from lingvo.core.gpipe import FeatureExtractionLayer
 from lingvo.core.gpipe import PartitionSequentialLayers
 from lingvo.core.gpipe import PipeliningLayer
+from lingvo.core.gpipe import PlanPartitions
 from lingvo.core.layers import Conv2DLayerNoPadding
 from lingvo.core.layers import FetchLayer
 
@@ -78,6 +82,32 @@ class _SimpyLayerWithNestedMapInput(_SimpyLayer):
     return py_utils.NestedMap(flops=1, out_shapes=(inputs,))
 
 
+class _CostLayer(base_layer.BaseLayer):
+  """Layer of given flops and output depth, for the partitioning costs."""
+
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.Define('flops', 1, 'Flops of the layer per example.')
+    p.Define('out_dim', 1, 'Depth of the output.')
+    return p
+
+  @classmethod
+  def FPropMeta(cls, p, inputs):
+    py_utils.CheckShapes((inputs,))
+    return py_utils.NestedMap(
+        flops=p.flops * inputs[0],
+        out_shapes=(tshape.Shape([inputs[0], p.out_dim]),))
+
+
+def _CostLayers(flops, out_dims=None):
+  out_dims = out_dims or [1] * len(flops)
+  return [
+      _CostLayer.Params().Set(name='layer_%d' % i, flops=f, out_dim=d)
+      for i, (f, d) in enumerate(zip(flops, out_dims))
+  ]
+
+
 def _Partition(params, num_splits, *shapes):
   seqs = PartitionSequentialLayers(params, num_splits, *shapes)
   return [
@@ -237,5 +267,120 @@ class DummyPipelineCnnTest(test_utils.TestCase):
       self.assertEqual(outputs.vec.shape, (batch_size, 8, 8, 1))
 
 
+class PartitionSequentialLayersTest(test_utils.TestCase):
+
+  def testMinimizesMaxCost(self):
+    flops = [4, 1, 1, 1, 8, 2, 2, 5, 1, 3, 6, 1]
+    for num_partitions in range(1, 6):
+      expected = min(
+          max(sum(flops[s:e]) for s, e in zip((0,) + cuts, cuts + (12,)))
+          for cuts in itertools.combinations(range(1, 12), num_partitions - 1))
+      plan = PlanPartitions(
+          _CostLayers(flops), num_partitions, tshape.Shape([2, 1]))
+      self.assertLen(plan.subs, num_partitions)
+      self.assertAllClose(expected / sum(flops), max(plan.costs))
+      self.assertEqual(flops, [sub.flops for pa in plan.subs for sub in pa])
+      self.assertEqual(['cell_%03d' % i for i in range(12)],
+                       [sub.name for pa in plan.subs for sub in pa])
+
+  def testBeatsHistogramBucketing(self):
+    # Bucketing the cumulative flops puts the two heaviest layers together.
+    seqs = PartitionSequentialLayers(
+        _CostLayers([1, 1, 1, 5, 5, 1]), 2, tshape.Shape([2, 1]))
+    self.assertEqual([[1, 1, 1, 5], [5, 1]],
+                     [[sub.flops for sub in seq.sub] for seq in seqs])
+
+  def testMemoryLimit(self):
+    flops = [1, 1, 1, 1, 1, 1]
+    out_dims = [8, 8, 8, 1, 1, 1]
+    # 2 examples of 8 float32.
+    plan = PlanPartitions(
+        _CostLayers(flops, out_dims), 2, tshape.Shape([2, 1]))
+    self.assertEqual([3, 3], [len(pa) for pa in plan.subs])
+    self.assertEqual([192, 24], plan.activation_bytes)
+    plan = PlanPartitions(
+        _CostLayers(flops, out_dims),
+        2,
+        tshape.Shape([2, 1]),
+        memory_limit=128)
+    self.assertEqual([2, 4], [len(pa) for pa in plan.subs])
+    self.assertEqual([128, 88], plan.activation_bytes)
+    with self.assertRaisesRegex(ValueError, 'memory_limit'):
+      PlanPartitions(
+          _CostLayers(flops, out_dims),
+          2,
+          tshape.Shape([2, 1]),
+          memory_limit=64)
+
+  def testTransferCost(self):
+    flops = [2, 2, 2, 2]
+    out_dims = [1, 16, 1, 1]
+    plan = PlanPartitions(
+        _CostLayers(flops, out_dims), 2, tshape.Shape([2, 1]))
+    self.assertEqual([2, 2], [len(pa) for pa in plan.subs])
+    self.assertEqual([128, 0], plan.transfer_bytes)
+    # Sending the 128 bytes after the second layer costs more than the
+    # imbalance of cutting after the first one.
+    plan = PlanPartitions(
+        _CostLayers(flops, out_dims),
+        2,
+        tshape.Shape([2, 1]),
+        transfer_cost_per_byte=0.1)
+    self.assertEqual([1, 3], [len(pa) for pa in plan.subs])
+    self.assertEqual([8, 0], plan.transfer_bytes)
+    self.assertAllClose([0.3, 0.75], plan.costs)
+
+  def testBubbleAndBalance(self):
+    plan = PlanPartitions(
+        _CostLayers([2, 2, 2, 6]), 2, tshape.Shape([2, 1]),
+        num_micro_batches=3)
+    self.assertEqual([0.5, 0.5], plan.costs)
+    self.assertEqual(1., plan.balance)
+    self.assertAllClose(0.25, plan.bubble)
+    self.assertAllClose(0.75, plan.efficiency)
+    plan = PlanPartitions(_CostLayers([2, 2, 2, 6]), 3, tshape.Shape([2, 1]))
+    self.assertEqual(0.5, max(plan.costs))
+    self.assertAllClose(2. / 3., plan.balance)
+    self.assertIsNone(plan.bubble)
+
+  def testSymbolicBatch(self):
+    batch = symbolic.Symbol('batch')
+    flops = [1, 1, 1, 1, 1, 1]
+    out_dims = [8, 8, 8, 1, 1, 1]
+    plan = PlanPartitions(
+        _CostLayers(flops, out_dims), 2, tshape.Shape([batch, 1]))
+    self.assertEqual([3, 3], [len(pa) for pa in plan.subs])
+    self.assertAllClose([0.5, 0.5], plan.costs)
+    self.assertEqual([96 * batch, 12 * batch], plan.activation_bytes)
+    plan = PlanPartitions(
+        _CostLayers(flops, out_dims),
+        2,
+        tshape.Shape([batch, 1]),
+        transfer_cost_per_byte=0.25)
+    self.assertEqual([4, 2], [len(pa) for pa in plan.subs])
+    with self.assertRaisesRegex(ValueError, 'symbolic'):
+      PlanPartitions(
+          _CostLayers(flops, out_dims),
+          2,
+          tshape.Shape([batch, 1]),
+          memory_limit=128)
+    with symbolic.SymbolToValueMap(symbolic.STATIC_VALUES, {batch: 2}):
+      plan = PlanPartitions(
+          _CostLayers(flops, out_dims),
+          2,
+          tshape.Shape([batch, 1]),
+          memory_limit=128)
+    self.assertEqual([2, 4], [len(pa) for pa in plan.subs])
+
+  def testErrors(self):
+    with self.assertRaisesRegex(ValueError, '2 layers into 3 partitions'):
+      PlanPartitions(_CostLayers([1, 1]), 3, tshape.Shape([2, 1]))
+    layers = _CostLayers([1, 1]) + [
+        base_layer.BaseLayer.Params().Set(name='no_meta')
+    ]
+    with self.assertRaisesRegex(ValueError, 'has no FPropMeta'):
+      PlanPartitions(layers, 2, tshape.Shape([2, 1]))
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,172 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Converts ids to strings on the host, without running any TF op.
+
+Decoders fetch the ids of their hypotheses and convert them to strings in
+`PostProcessDecodeOut()`, which keeps the detokenization ops out of the decode
+graph. The strings are the same as those of the `IdsToStrings()` ops of the
+corresponding tokenizers.
+"""
+
+import functools
+
+from lingvo.core import py_utils
+import numpy as np
+import six
+
+# Same whitespace as tf.strings.strip().
+_ASCII_WHITESPACE = ' \t\n\v\f\r'
+
+_WPM_BOW_STR = '▁'
+
+
+def _ReadLines(filepath):
+  """Returns the non-empty lines of `filepath` without line endings."""
+  lines = []
+  for line in py_utils.ReadFileLines(filepath):
+    line = six.ensure_text(line, 'utf-8').rstrip('\n')
+    if line:
+      lines.append(line)
+  return lines
+
+
+class HostDetokenizer:
+  """Converts batches of ids to strings with numpy.
+
+  The vocabulary is loaded once into an array of the string of each id. The
+  ids of a whole batch are mapped to indices of this array at once, and the
+  strings of each sequence are then joined with `separator`. The strings of
+  the most recent distinct sequences are kept in an LRU cache, as decoders
+  often produce the same hypothesis many times.
+  """
+
+  def __init__(self, pieces, unk_piece, separator='', strip=False,
+               cache_size=1 << 16):
+    """Constructor.
+
+    Args:
+      pieces: a list of strings, the string of each id.
+      unk_piece: the string of ids out of the range of `pieces`.
+      separator: the string joining the pieces of a sequence.
+      strip: whether to strip leading and trailing whitespace from the joined
+        strings.
+      cache_size: the maximum number of sequences whose string is cached. 0
+        disables the cache.
+    """
+    self._num_pieces = len(pieces)
+    self._pieces = np.array(list(pieces) + [unk_piece], dtype=object)
+    self._separator = separator
+    self._strip = strip
+    if cache_size:
+      self._detokenize = functools.lru_cache(maxsize=cache_size)(
+          self._Detokenize)
+    else:
+      self._detokenize = self._Detokenize
+
+  def _Detokenize(self, key):
+    """Returns the utf-8 encoded string of `key`, the bytes of int32 ids."""
+    txt = self._separator.join(self._pieces[np.frombuffer(key, np.int32)])
+    if self._strip:
+      txt = txt.strip(_ASCII_WHITESPACE)
+    return txt.encode('utf-8')
+
+  def IdsToStrings(self, ids, lens):
+    """Converts ids to strings.
+
+    Args:
+      ids: an int array of shape [..., seqlen].
+      lens: an int array of the shape of `ids` without the last dimension, the
+        number of valid ids of each sequence.
+
+    Returns:
+      An object array of the shape of `lens` holding the bytes of the string of
+      each sequence, like the values fetched from `IdsToStrings()` ops.
+    """
+    ids = np.asarray(ids)
+    lens = np.asarray(lens)
+    assert ids.shape[:-1] == lens.shape, (ids.shape, lens.shape)
+    ids = ids.reshape([-1, ids.shape[-1]])
+    # Map unknown ids to the unk piece, at the end of the array.
+    ids = np.where((ids >= 0) & (ids < self._num_pieces), ids,
+                   self._num_pieces).astype(np.int32)
+    strs = np.empty([ids.shape[0]], dtype=object)
+    for i, (row, n) in enumerate(zip(ids, lens.reshape([-1]))):
+      strs[i] = self._detokenize(row[:max(n, 0)].tobytes())
+    return strs.reshape(lens.shape)
+
+  def CacheInfo(self):
+    """Returns the statistics of the cache, or None if disabled."""
+    if hasattr(self._detokenize, 'cache_info'):
+      return self._detokenize.cache_info()
+    return None
+
+
+def FromVocabFile(vocab_filepath, separator):
+  """Same as the `ngram_id_to_token` op, used by `VocabFileTokenizer`.
+
+  Ids are line numbers, ignoring empty lines, and the string of an id is the
+  first tab separated field of its line.
+
+  Args:
+    vocab_filepath: the token or ngram vocab file.
+    separator: the string joining the tokens.
+
+  Returns:
+    A `HostDetokenizer`.
+  """
+  pieces = [line.split('\t')[0] for line in _ReadLines(vocab_filepath)]
+  unk_piece = '<unk>' if '<s>' in pieces else '<UNK>'
+  return HostDetokenizer(pieces, unk_piece, separator=separator)
+
+
+def FromBpeCodes(codes_filepath):
+  """Same as the `bpe_ids_to_words` op, used by `BpeTokenizer`.
+
+  The first '@@' of a code marks it as continued by the next one. Other codes
+  end a word and are followed by a space.
+
+  Args:
+    codes_filepath: the BPE codes vocab file.
+
+  Returns:
+    A `HostDetokenizer`.
+  """
+  pieces = []
+  for line in _ReadLines(codes_filepath):
+    code = line.split(' ')[0]
+    if '@@' in code:
+      pieces.append(code.replace('@@', '', 1))
+    else:
+      pieces.append(code + ' ')
+  return HostDetokenizer(pieces, '<unk>')
+
+
+def FromWpmVocab(vocab_filepath):
+  """Same as `WpmEncoder.Decode`, used by `WpmTokenizer`.
+
+  The beginning of word marker of the wordpieces is replaced by a space, and
+  the strings are stripped.
+
+  Args:
+    vocab_filepath: the WPM vocab file.
+
+  Returns:
+    A `HostDetokenizer`.
+  """
+  pieces = [line.strip().split('\t')[0] for line in _ReadLines(vocab_filepath)]
+  # Lines with only whitespace are empty pieces, which the vocab ops skip.
+  pieces = [piece.replace(_WPM_BOW_STR, ' ') for piece in pieces if piece]
+  return HostDetokenizer(pieces, '<unk>', strip=True)
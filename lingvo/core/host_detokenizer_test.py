@@ -0,0 +1,94 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for host_detokenizer."""
+
+import lingvo.compat as tf
+from lingvo.core import host_detokenizer
+from lingvo.core import test_helper
+from lingvo.core import test_utils
+from lingvo.core import tokenizers
+from lingvo.core import wpm_encoder
+import numpy as np
+
+
+class HostDetokenizerTest(test_utils.TestCase):
+
+  def testNgramVocab(self):
+    # Same as tokenizer_ops_test.testNgramIdToToken.
+    vocab = test_helper.test_src_dir_path('core/ops/testdata/test_ngrams.txt')
+    ngram_ids = [[14, 11, 6, 24, 7, 3, 13, 82, 2, 2],
+                 [57, 3, 73, 17, 22, 9, 2, 2, 2, 2]]
+    lengths = [8, 6]
+    detok = host_detokenizer.FromVocabFile(vocab, '')
+    self.assertEqual([b'pn?o"{twe', b'gh{rtlcr'],
+                     detok.IdsToStrings(ngram_ids, lengths).tolist())
+    detok = host_detokenizer.FromVocabFile(vocab, '.')
+    self.assertEqual([b'p.n.?.o.".{.t.we', b'gh.{.rt.l.c.r'],
+                     detok.IdsToStrings(ngram_ids, lengths).tolist())
+
+  def testBpeCodes(self):
+    # Same as tokenizer_ops_test.testBpeTokenization.
+    p = tokenizers.BpeTokenizer.Params().Set(
+        codes_filepath=test_helper.test_src_dir_path(
+            'core/ops/testdata/bpe_codes.vocab'))
+    detok = p.Instantiate().CreateHostDetokenizer()
+    token_ids = [
+        [27, 9, 30, 14, 28, 14, 52, 11, 4, 6, 6, 10, 2, 2, 2],
+        [16, 4, 10, 12, 9, 30, 24, 7, 12, 49, 14, 2, 2, 2, 2],
+        [16, 4, 10, 27, 9, 30, 14, 28, 14, 52, 11, 4, 6, 6, 10],
+    ]
+    self.assertEqual([
+        b'GIVE ME A PENNY </s> ',
+        b'THEY LIVED ALONE </s> ',
+        b'THEY GIVE ME A PENNY ',
+    ], detok.IdsToStrings(token_ids, [13, 12, 15]).tolist())
+
+  def testWpmVocab(self):
+    vocab = test_helper.test_src_dir_path('tasks/mt/wpm-ende-2k.voc')
+    host_enc = wpm_encoder.HostWpmEncoder(vocab)
+    detok = host_detokenizer.FromWpmVocab(vocab)
+    texts = ['would that it were so simple', 'this is it', '']
+    ids = np.full([3, 2, 20], 2, np.int32)
+    lens = np.zeros([3, 2], np.int32)
+    for i, text in enumerate(texts):
+      text_ids = host_enc.EncodeIds(text)
+      ids[i, 0, :len(text_ids)] = text_ids
+      lens[i, 0] = len(text_ids)
+      # Also checks the conversion of the ids out of the vocabulary.
+      ids[i, 1, :3] = [-1, 100 + i, 1 << 20]
+      lens[i, 1] = 3
+    strs = detok.IdsToStrings(ids, lens)
+    self.assertEqual((3, 2), strs.shape)
+    self.assertEqual([t.encode('utf-8') for t in texts], strs[:, 0].tolist())
+    unk_id = host_enc.unk_id
+    self.assertEqual(
+        [host_enc.Decode([unk_id, 100 + i, unk_id]).encode('utf-8')
+         for i in range(3)], strs[:, 1].tolist())
+
+  def testCache(self):
+    detok = host_detokenizer.HostDetokenizer(['a', 'b', 'c'], '?', ' ')
+    strs = detok.IdsToStrings([[0, 1, 2], [0, 1, 1], [0, 1, 0], [2, 5, 0]],
+                              [2, 2, 3, 2])
+    self.assertEqual([b'a b', b'a b', b'a b a', b'c ?'], strs.tolist())
+    info = detok.CacheInfo()
+    self.assertEqual(1, info.hits)
+    self.assertEqual(3, info.misses)
+    self.assertIsNone(
+        host_detokenizer.HostDetokenizer(['a'], '?', cache_size=0).CacheInfo())
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,194 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""A persistent cache of the preprocessed batches of resettable inputs."""
+
+import hashlib
+import json
+import os
+import uuid
+
+import lingvo.compat as tf
+
+# pylint: disable=g-direct-tensorflow-import
+from tensorflow.core.framework import tensor_pb2
+# pylint: enable=g-direct-tensorflow-import
+
+_OPTIONS = tf.io.TFRecordOptions(compression_type='GZIP')
+
+
+class PreprocessedBatchCache:
+  """Caches the preprocessed batches of one pass over a resettable input.
+
+  The first pass over the input after `StartPass()` runs the input pipeline as
+  usual and writes each batch fetched by `Run()` to a file in the cache
+  directory, which is committed when the input is exhausted or at
+  `FinishPass()`. Later passes, in this process or in a later one, feed the cached
+  batches in place of the input batch tensors, so that none of the ops reading
+  and preprocessing the input run.
+
+  The file name contains a fingerprint of the input params and of the dtypes
+  and shapes of the batch: changing either starts a new cache. The cache is not
+  invalidated when the content of the input files changes.
+  """
+
+  def __init__(self, cache_dir, params, batch):
+    """Constructor.
+
+    Args:
+      cache_dir: the directory of the cache files.
+      params: the params of the input generator.
+      batch: the `.NestedMap` of tensors returned by the input generator.
+
+    Raises:
+      ValueError: if `batch` holds anything other than dense tensors.
+    """
+    self._tensors = batch.Flatten()
+    signature = []
+    for key, tensor in batch.FlattenItems():
+      if not isinstance(tensor, tf.Tensor):
+        raise ValueError('Cannot cache %s of type %s.' % (key, type(tensor)))
+      signature.append((key, tensor.dtype.name, str(tensor.shape)))
+    fingerprint = hashlib.sha256(
+        (params.ToText() + repr(signature)).encode('utf-8')).hexdigest()
+    self._path = os.path.join(
+        cache_dir, '%s-%s.tfrecord' % (params.name, fingerprint[:16]))
+    self._metadata = None
+    self._writer = None
+    self._tmp_path = None
+    self._num_recorded = 0
+    self._reader = None
+    self._num_replayed = 0
+
+  @property
+  def path(self):
+    return self._path
+
+  @property
+  def _metadata_path(self):
+    return self._path + '.json'
+
+  def _LoadMetadata(self):
+    """Returns the metadata of a complete cache, or None if there is none."""
+    if not tf.io.gfile.exists(self._metadata_path):
+      return None
+    with tf.io.gfile.GFile(self._metadata_path) as f:
+      return json.load(f)
+
+  def _ReadBatches(self):
+    """Yields the cached batches, each a list of numpy arrays."""
+    values = []
+    for record in tf.io.tf_record_iterator(self._path, _OPTIONS):
+      values.append(tf.make_ndarray(tensor_pb2.TensorProto.FromString(record)))
+      if len(values) == len(self._tensors):
+        yield values
+        values = []
+
+  def _FinishRecording(self, exhausted):
+    """Commits the batches recorded so far.
+
+    Args:
+      exhausted: whether the pass ended because the input was exhausted, in
+        which case replays end with an `OutOfRangeError` too.
+    """
+    if self._writer is None:
+      return
+    self._writer.close()
+    self._writer = None
+    tmp_path = self._tmp_path
+    if not self._num_recorded:
+      tf.io.gfile.remove(tmp_path)
+      return
+    # The data file is complete once its metadata exists.
+    tf.io.gfile.rename(tmp_path, self._path, overwrite=True)
+    self._metadata = {
+        'num_batches': self._num_recorded,
+        'exhausted': exhausted,
+    }
+    with tf.io.gfile.GFile(tmp_path, 'w') as f:
+      json.dump(self._metadata, f)
+    tf.io.gfile.rename(tmp_path, self._metadata_path, overwrite=True)
+    tf.logging.info('Cached %d preprocessed batches in %s', self._num_recorded,
+                    self._path)
+
+  def StartPass(self):
+    """Starts a pass over the input. Call right after the input is reset."""
+    self._FinishRecording(exhausted=False)
+    self._reader = None
+    self._num_replayed = 0
+    if self._metadata is None:
+      self._metadata = self._LoadMetadata()
+    if self._metadata is not None:
+      tf.logging.info('Replaying %d preprocessed batches from %s',
+                      self._metadata['num_batches'], self._path)
+      self._reader = self._ReadBatches()
+      return
+    tf.io.gfile.makedirs(os.path.dirname(self._path))
+    # Several jobs may record the same cache concurrently.
+    self._tmp_path = '%s.tmp-%s' % (self._path, uuid.uuid4().hex)
+    self._writer = tf.io.TFRecordWriter(self._tmp_path, _OPTIONS)
+    self._num_recorded = 0
+
+  def FinishPass(self):
+    """Finishes a pass over the input, committing the batches it recorded."""
+    self._FinishRecording(exhausted=False)
+    self._reader = None
+
+  def Run(self, sess, fetches, **kwargs):
+    """Runs `fetches` on the next input batch, like `sess.run()`.
+
+    Args:
+      sess: a tf.Session.
+      fetches: the fetches, which may depend on the input batch.
+      **kwargs: other arguments of `sess.run()`.
+
+    Returns:
+      The values of `fetches`.
+
+    Raises:
+      tf.errors.OutOfRangeError: if the input is exhausted.
+    """
+    if self._reader is not None:
+      try:
+        values = next(self._reader)
+      except StopIteration:
+        self._reader = None
+        if self._metadata['exhausted']:
+          raise tf.errors.OutOfRangeError(  # pylint: disable=raise-missing-from
+              None, None, 'End of the cached preprocessed batches.')
+        # This pass reads more batches than the cached one: continue with the
+        # input pipeline past the cached batches.
+        tf.logging.warning(
+            'Ran out of cached preprocessed batches after %d batches.',
+            self._num_replayed)
+        for _ in range(self._num_replayed):
+          sess.run(self._tensors)
+        return sess.run(fetches, **kwargs)
+      self._num_replayed += 1
+      feed_dict = dict(kwargs.pop('feed_dict', None) or {})
+      feed_dict.update(zip(self._tensors, values))
+      return sess.run(fetches, feed_dict=feed_dict, **kwargs)
+
+    if self._writer is None:
+      return sess.run(fetches, **kwargs)
+    try:
+      outputs, values = sess.run([fetches, self._tensors], **kwargs)
+    except tf.errors.OutOfRangeError:
+      self._FinishRecording(exhausted=True)
+      raise
+    for value in values:
+      self._writer.write(tf.make_tensor_proto(value).SerializeToString())
+    self._num_recorded += 1
+    return outputs
@@ -0,0 +1,145 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for input_cache."""
+
+import lingvo.compat as tf
+from lingvo.core import base_input_generator
+from lingvo.core import py_utils
+from lingvo.core import test_utils
+import numpy as np
+
+
+class _CountingInput(base_input_generator.BaseInputGenerator):
+  """Emits 5 batches of 2 examples, counting the examples preprocessed."""
+
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.resettable = True
+    p.batch_size = 2
+    return p
+
+  def __init__(self, params):
+    super().__init__(params)
+    self.num_preprocessed = 0
+
+  def _Preprocess(self, x):
+    self.num_preprocessed += 1
+    return np.float32(x * 2)
+
+  def _InputBatch(self):
+    dataset = tf.data.Dataset.range(10).map(
+        lambda x: tf.py_func(self._Preprocess, [x], tf.float32))
+    dataset = dataset.batch(self.params.batch_size, drop_remainder=True)
+    self._iterator = tf.data.make_initializable_iterator(dataset)
+    x = self._iterator.get_next()
+    x.set_shape([self.params.batch_size])
+    return py_utils.NestedMap(x=x, label=tf.strings.as_string(x))
+
+  def Reset(self, sess):
+    sess.run(self._iterator.initializer)
+
+
+class PreprocessedBatchCacheTest(test_utils.TestCase):
+
+  def _RunPass(self, sess, inp, fetches, max_batches=None):
+    inp.Reset(sess)
+    inp.StartPreprocessedCachePass()
+    outputs = []
+    while max_batches is None or len(outputs) < max_batches:
+      try:
+        outputs.append(inp.RunWithPreprocessedCache(sess, fetches))
+      except tf.errors.OutOfRangeError:
+        break
+    inp.FinishPreprocessedCachePass()
+    return outputs
+
+  def testReplay(self):
+    cache_dir = self.create_tempdir().full_path
+    p = _CountingInput.Params().Set(preprocessed_cache_dir=cache_dir)
+    expected = [[0., 2.], [4., 6.], [8., 10.], [12., 14.], [16., 18.]]
+    with self.session(graph=tf.Graph()) as sess:
+      inp = p.Instantiate()
+      batch = inp.GetPreprocessedInputBatch()
+      fetches = py_utils.NestedMap(
+          sum=tf.reduce_sum(batch.x), x=batch.x, label=batch.label)
+      outputs = self._RunPass(sess, inp, fetches)
+      self.assertEqual(10, inp.num_preprocessed)
+      self.assertAllEqual(expected, [o.x for o in outputs])
+      # The second pass replays from the cache.
+      replayed = self._RunPass(sess, inp, fetches)
+      self.assertEqual(10, inp.num_preprocessed)
+      self.assertAllEqual(expected, [o.x for o in replayed])
+      self.assertAllEqual([o.sum for o in outputs], [o.sum for o in replayed])
+      self.assertAllEqual([b'0.000000', b'2.000000'], replayed[0].label)
+      path = inp._preprocessed_cache.path
+
+    # A new process with the same params uses the same cache.
+    with self.session(graph=tf.Graph()) as sess:
+      inp = p.Instantiate()
+      batch = inp.GetPreprocessedInputBatch()
+      self.assertEqual(path, inp._preprocessed_cache.path)
+      replayed = self._RunPass(sess, inp, batch.x)
+      self.assertEqual(0, inp.num_preprocessed)
+      self.assertAllEqual(expected, replayed)
+
+    # Changing the params invalidates the cache.
+    with self.session(graph=tf.Graph()) as sess:
+      inp = p.Copy().Set(batch_size=5).Instantiate()
+      batch = inp.GetPreprocessedInputBatch()
+      self.assertNotEqual(path, inp._preprocessed_cache.path)
+      outputs = self._RunPass(sess, inp, batch.x)
+      self.assertEqual(10, inp.num_preprocessed)
+      self.assertLen(outputs, 2)
+
+  def testPartialPass(self):
+    cache_dir = self.create_tempdir().full_path
+    p = _CountingInput.Params().Set(preprocessed_cache_dir=cache_dir)
+    with self.session(graph=tf.Graph()) as sess:
+      inp = p.Instantiate()
+      batch = inp.GetPreprocessedInputBatch()
+      self.assertLen(self._RunPass(sess, inp, batch.x, max_batches=2), 2)
+      # Only 2 batches are cached: the rest is read from the input.
+      outputs = self._RunPass(sess, inp, batch.x)
+      self.assertAllEqual([[0., 2.], [4., 6.], [8., 10.], [12., 14.],
+                           [16., 18.]], outputs)
+
+  def testPartialPassInNewProcess(self):
+    cache_dir = self.create_tempdir().full_path
+    p = _CountingInput.Params().Set(preprocessed_cache_dir=cache_dir)
+    with self.session(graph=tf.Graph()) as sess:
+      inp = p.Instantiate()
+      batch = inp.GetPreprocessedInputBatch()
+      self.assertLen(self._RunPass(sess, inp, batch.x, max_batches=2), 2)
+    # The partial pass is committed without a later pass in its process.
+    with self.session(graph=tf.Graph()) as sess:
+      inp = p.Instantiate()
+      batch = inp.GetPreprocessedInputBatch()
+      outputs = self._RunPass(sess, inp, batch.x, max_batches=2)
+      self.assertEqual(0, inp.num_preprocessed)
+      self.assertAllEqual([[0., 2.], [4., 6.]], outputs)
+
+  def testRequiresResettable(self):
+    p = _CountingInput.Params().Set(
+        preprocessed_cache_dir=self.create_tempdir().full_path,
+        resettable=False)
+    with self.session(graph=tf.Graph()):
+      with self.assertRaisesRegex(ValueError, 'resettable'):
+        p.Instantiate().GetPreprocessedInputBatch()
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -22,6 +22,7 @@ from lingvo.core import gshard_utils
 from lingvo.core import layers
 from lingvo.core import py_utils
 from lingvo.core import symbolic
+from lingvo.core import tshape
 
 
 class TransformerAttentionLayer(base_layer.BaseLayer):
@@ -288,7 +289,8 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
                         query_vec,
                         unnormalized_query_vec,
                         extended_packed_src,
-                        t=None):
+                        t=None,
+                        per_step_source_padding=None):
     """Finish extending prefix by one more time step.
 
     Isolating this function from ExtendStep allows generalizing self-attention
@@ -302,6 +304,8 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
       extended_packed_src: A `.NestedMap` object containing source_vecs,
         source_contexts, source_paddings, and source_segment_ids
       t: a scalar, the current time step, 0-based.
+      per_step_source_padding: If not None, [target_batch, source_seq_len], the
+        padding to apply instead of the one derived from t or the mask type.
 
     Returns:
       A triplet (cur_output, atten_prob, new_state) where cur_output is a tensor
@@ -317,7 +321,9 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
     zero_padding = tf.fill([source_seq_len],
                            tf.constant(0.0, dtype=query_vec.dtype))
     ones_padding = tf.ones_like(zero_padding, dtype=query_vec.dtype)
-    if t is not None:
+    if per_step_source_padding is not None:
+      pass
+    elif t is not None:
       per_step_source_padding = tf.where(
           tf.less(tf.range(source_seq_len), tf.fill([source_seq_len], t + 1)),
           zero_padding, ones_padding)
@@ -402,6 +408,74 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
     return self._FinishExtendStep(theta, query_vec, unnormalized_query_vec,
                                   extended_packed_src, t)
 
+  def ExtendSteps(self, theta, query_vec, prefix_state, prefix_paddings=None):
+    """Extend prefix by several time steps at once.
+
+    The new steps are computed in one batched attention, each of them
+    attending to the prefix and to the new steps up to itself, which gives the
+    same results as calling ExtendStep() once per step.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      query_vec: [num_steps, target_batch, dim]
+      prefix_state: dict, containing tensors which are the results of previous
+        attentions, used for fast decoding.
+      prefix_paddings: If not None, [prefix_len, target_batch], 1.0 for the
+        prefix steps that the new steps must not attend to.
+
+    Returns:
+      A triplet (cur_output, atten_prob, new_state) where cur_output is a tensor
+      of shape [num_steps, target_batch, dim], atten_prob is of shape
+      [num_steps, target_batch, prefix_len + num_steps] and new_state is the
+      new state `.NestedMap`.
+    """
+    p = self.params
+    assert p.is_masked and p.mask_type == 'future'
+    num_steps, batch_size, dim = py_utils.GetShape(query_vec, 3)
+    prefix_len = py_utils.GetShape(prefix_state.key)[0]
+    unnormalized_query_vec = query_vec
+    if p.pre_layer_norm:
+      query_vec = self.layer_norm.FProp(theta.layer_norm, query_vec)
+
+    cached_packed_src = py_utils.NestedMap(
+        source_vecs=prefix_state.key,
+        source_contexts=prefix_state.value,
+        source_padding=None,
+        source_segment_id=None)
+    extended_packed_src = self.atten.ExtendSourcePacked(theta.atten, query_vec,
+                                                        query_vec, None, None,
+                                                        cached_packed_src)
+
+    # [num_steps, prefix_len + num_steps], 1.0 for the future new steps.
+    causal_padding = 1.0 - tf.linalg.band_part(
+        tf.ones([num_steps, num_steps], dtype=query_vec.dtype), -1, 0)
+    per_step_source_padding = tf.concat(
+        [tf.zeros([num_steps, prefix_len], dtype=query_vec.dtype),
+         causal_padding], axis=1)
+    # [num_steps, target_batch, prefix_len + num_steps].
+    per_step_source_padding = tf.tile(
+        tf.expand_dims(per_step_source_padding, 1), [1, batch_size, 1])
+    if prefix_paddings is not None:
+      prefix_paddings = tf.pad(
+          tf.transpose(prefix_paddings), [[0, 0], [0, num_steps]])
+      per_step_source_padding = tf.maximum(per_step_source_padding,
+                                           tf.expand_dims(prefix_paddings, 0))
+    # The queries are [num_steps * target_batch, dim], step major like the
+    # queries of FProp().
+    h, atten_prob, new_states = self._FinishExtendStep(
+        theta,
+        tf.reshape(query_vec, [num_steps * batch_size, dim]),
+        tf.reshape(unnormalized_query_vec, [num_steps * batch_size, dim]),
+        extended_packed_src,
+        per_step_source_padding=tf.reshape(
+            per_step_source_padding,
+            [num_steps * batch_size, prefix_len + num_steps]))
+    h = tf.reshape(h, [num_steps, batch_size, dim])
+    atten_prob = tf.reshape(atten_prob,
+                            [num_steps, batch_size, prefix_len + num_steps])
+    return h, atten_prob, new_states
+
 
 class TransformerMultiSourceAttentionLayer(TransformerAttentionLayer):
   """Multi-source multi-headed attention.
@@ -588,6 +662,23 @@ class TransformerFeedForwardLayer(base_layer.BaseLayer):
         h = self.layer_norm.FProp(theta.layer_norm, h)
       return h
 
+  @classmethod
+  def FPropMeta(cls, p, inputs, paddings=None):
+    py_utils.CheckShapes((inputs,))
+    assert inputs[-1] == p.input_dim
+    out_dim = cls.NumOutputNodes(p)
+    other_dims = inputs.num_elements() / p.input_dim
+    # The two matmuls, the hidden activation, and about 10 flops per element of
+    # the layer norm and 2 of the residual.
+    flops = other_dims * (
+        2 * p.hidden_dim * (p.input_dim + out_dim) +
+        p.hidden_dim * activations.GetFlops(p.activation) + 10 * p.input_dim +
+        2 * out_dim)
+    if out_dim != p.input_dim:
+      flops += other_dims * 2 * p.input_dim * out_dim
+    out_shape = tshape.Shape(inputs[:-1] + [out_dim])
+    return py_utils.NestedMap(flops=flops, out_shapes=(out_shape,))
+
 
 # TODO(shibow/wangtao) remove this after b/174094694 is done.
 class ReshapedTransformerFeedForwardLayer(TransformerFeedForwardLayer):
@@ -894,6 +985,61 @@ class TransformerLayer(base_layer.BaseLayer):
     h = tf.squeeze(h, 0)
     return h, atten_prob, new_states
 
+  def ExtendSteps(self,
+                  theta,
+                  source_vecs,
+                  prefix_states,
+                  prefix_paddings=None,
+                  aux_vecs=None,
+                  aux_paddings=None,
+                  **kwargs):
+    """Transformer Layer, extend several steps at once in decoding.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      source_vecs: [num_steps, source_batch, dim].
+      prefix_states: dict, containing tensors which are the results of previous
+        attentions, used for fast decoding.
+      prefix_paddings: If not None, [prefix_len, source_batch], 1.0 for the
+        prefix steps that the new steps must not attend to.
+      aux_vecs: [aux_time, aux_batch, dim]
+      aux_paddings: [aux_time, aux_batch]
+      **kwargs: Can be optional params for the attention layer, eg. attention
+        projection index tensor.
+
+    Returns:
+      The attention context vector, [num_steps, target_batch, source_dim]
+
+      The attention probability vector, [num_steps, target_batch, source_time]
+
+      Updated prefix states
+    """
+    p = self.params
+
+    if p.has_aux_atten:
+      assert aux_vecs is not None
+      assert aux_paddings is not None
+
+    num_steps, batch_size = py_utils.GetShape(source_vecs, 2)
+
+    # First the self-attention layer.
+    atten_vec, atten_prob, new_states = self.self_atten.ExtendSteps(
+        theta.self_atten, source_vecs, prefix_states, prefix_paddings)
+
+    # Next the source attention layer.
+    if p.has_aux_atten:
+      atten_vec, atten_prob = self.atten.FProp(theta.atten, atten_vec,
+                                               aux_paddings, aux_vecs, **kwargs)
+
+    # Finally, the feedforward layer.
+    h = self.fflayer.FProp(
+        theta.fflayer, atten_vec,
+        tf.zeros([num_steps, batch_size], dtype=py_utils.FPropDtype(p)))
+    if p.tr_post_ln_tpl:
+      h = self.layer_norm.FProp(theta.layer_norm, h)
+    return h, atten_prob, new_states
+
 
 class EvolvedTransformerEncoderBranchedConvsLayer(base_layer.BaseLayer):
   """Evolved Transformer encoder branched convolutions layer.
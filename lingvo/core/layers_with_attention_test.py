@@ -1358,6 +1358,57 @@ class LayersWithAttentionTest(test_utils.TestCase, parameterized.TestCase):
       self.assertAllClose(h1_v, h2_v)
       self.assertAllClose(probs1_v, probs2_v)
 
+  def testTransformerLayerExtendSteps(self):
+    with self.session(use_gpu=True):
+      np.random.seed(6348575)
+      depth = 4
+      p = layers_with_attention.TransformerLayer.Params()
+      p.name = 'transformer'
+      p.source_dim = depth
+      p.has_aux_atten = True
+      p.mask_self_atten = True
+      p.tr_atten_tpl.num_attention_heads = 2
+      transformer = layers_with_attention.TransformerLayer(p)
+
+      (source_vecs, _, aux_vecs, aux_paddings,
+       _) = self._testTransformerAttentionLayerInputs(depth=depth)
+      source_padding = tf.zeros([5, 2])
+
+      h1, probs1 = transformer.FPropDefaultTheta(
+          source_vecs,
+          source_padding,
+          aux_vecs=aux_vecs,
+          aux_paddings=aux_paddings)
+
+      prefix_states = py_utils.NestedMap(
+          key=tf.zeros([0, 2, 4]), value=tf.zeros([0, 2, 4]))
+      h2, probs2, prefix_states = transformer.ExtendSteps(
+          transformer.theta,
+          source_vecs[:2],
+          prefix_states,
+          aux_vecs=aux_vecs,
+          aux_paddings=aux_paddings)
+      # A step that the following ones do not attend to.
+      _, _, prefix_states = transformer.ExtendSteps(
+          transformer.theta,
+          source_vecs[4:],
+          prefix_states,
+          aux_vecs=aux_vecs,
+          aux_paddings=aux_paddings)
+      h3, probs3, _ = transformer.ExtendSteps(
+          transformer.theta,
+          source_vecs[2:],
+          prefix_states,
+          prefix_paddings=tf.constant([[0., 0.], [0., 0.], [1., 1.]]),
+          aux_vecs=aux_vecs,
+          aux_paddings=aux_paddings)
+
+      self.evaluate(tf.global_variables_initializer())
+      h1_v, probs1_v, h2_v, probs2_v, h3_v, probs3_v = self.evaluate(
+          [h1, probs1, h2, probs2, h3, probs3])
+      self.assertAllClose(h1_v, np.concatenate([h2_v, h3_v]))
+      self.assertAllClose(probs1_v, np.concatenate([probs2_v, probs3_v]))
+
   def testMultiAuxSourceTransformerLayerExtendStep(self):
     with self.session(use_gpu=True):
       np.random.seed(6348575)
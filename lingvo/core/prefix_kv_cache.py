@@ -0,0 +1,202 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Caches the attention keys and values of prefixes shared across requests.
+
+Decoding requests often start with the same prompt, e.g. a system prefix. The
+self-attention states of a prefix, computed once by
+`batch_major_attention.StackedTransformerLayers.PrefixStates()`, are kept on
+the host by `PrefixKVCache` and fed to `ExtendStep()` as its `prefix_states`
+for all the requests with this prefix, without recomputing or copying them per
+request or per hyp:
+
+  cache = prefix_kv_cache.PrefixKVCache(max_bytes=1 << 30)
+  missing = [ids for ids in prefixes if cache.Lookup(ids) is None]
+  if missing:
+    # Runs PrefixStates() on the missing prefixes.
+    states = ...
+    for ids, s in zip(missing, SplitPrefixStates(states, map(len, missing))):
+      cache.Insert(ids, s)
+  for ids in prefixes:
+    cache.Acquire(ids)
+  # Fed as the prefix_states of ExtendStep().
+  prefix_states = cache.Batch(prefixes)
+  ...
+  for ids in prefixes:
+    cache.Release(ids)
+"""
+
+import collections
+
+import numpy as np
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ['hits', 'misses', 'evictions', 'num_entries', 'num_bytes'])
+
+
+def SplitPrefixStates(states, prefix_lens):
+  """Splits the fetched `PrefixStates()` of a batch into per prefix states.
+
+  Args:
+    states: a `.NestedMap` of arrays of shape [max_len, num_prefixes, ...], and
+      paddings of shape [num_prefixes, max_len].
+    prefix_lens: the length of each of the prefixes.
+
+  Returns:
+    A list of `.NestedMap` of arrays of shape [prefix_len, ...], without
+    paddings, one per prefix.
+  """
+  states = states.copy()
+  del states.paddings
+
+  def _Slice(i, n):
+    return states.Transform(lambda x: x[:n, i])
+
+  return [_Slice(i, n) for i, n in enumerate(prefix_lens)]
+
+
+class _Entry:
+  """The states of a prefix, with the number of their users."""
+
+  def __init__(self, states):
+    self.states = states
+    self.num_bytes = sum(x.nbytes for x in states.Flatten())
+    self.refcount = 0
+
+
+class PrefixKVCache:
+  """Reference counted LRU cache of the attention states of prefixes.
+
+  The states of a prefix are a `.NestedMap` of arrays of shape
+  [prefix_len, ...], keyed by the tuple of the prefix ids. Entries in use, i.e.
+  acquired more times than released, are never evicted. The least recently
+  used of the other entries are evicted when the total bytes of the entries
+  exceed `max_bytes`.
+  """
+
+  def __init__(self, max_bytes):
+    """Constructor.
+
+    Args:
+      max_bytes: the byte budget of the states of the cached prefixes. It can
+        be exceeded by entries in use.
+    """
+    self._max_bytes = max_bytes
+    # From the prefix ids tuple to its _Entry, least recently used first.
+    self._entries = collections.OrderedDict()
+    self._num_bytes = 0
+    self._hits = 0
+    self._misses = 0
+    self._evictions = 0
+
+  def _Key(self, prefix_ids):
+    return tuple(int(x) for x in prefix_ids)
+
+  def _Evict(self):
+    """Evicts the least recently used entries not in use, if over budget."""
+    for key in list(self._entries):
+      if self._num_bytes <= self._max_bytes:
+        break
+      entry = self._entries[key]
+      if not entry.refcount:
+        del self._entries[key]
+        self._num_bytes -= entry.num_bytes
+        self._evictions += 1
+
+  def Lookup(self, prefix_ids):
+    """Returns the states of `prefix_ids`, or None if they are not cached."""
+    key = self._Key(prefix_ids)
+    entry = self._entries.get(key)
+    if entry is None:
+      self._misses += 1
+      return None
+    self._hits += 1
+    self._entries.move_to_end(key)
+    return entry.states
+
+  def Insert(self, prefix_ids, states):
+    """Caches the states of `prefix_ids`, then evicts entries if over budget.
+
+    Args:
+      prefix_ids: a sequence of ids.
+      states: a `.NestedMap` of arrays of shape [len(prefix_ids), ...].
+
+    Raises:
+      ValueError: if the states have a different length than the prefix.
+    """
+    key = self._Key(prefix_ids)
+    states = states.Transform(np.asarray)
+    for x in states.Flatten():
+      if x.shape[0] != len(key):
+        raise ValueError('States of shape {} for a prefix of length {}.'.format(
+            x.shape, len(key)))
+    old_entry = self._entries.pop(key, None)
+    entry = _Entry(states)
+    if old_entry is not None:
+      self._num_bytes -= old_entry.num_bytes
+      entry.refcount = old_entry.refcount
+    self._entries[key] = entry
+    self._num_bytes += entry.num_bytes
+    self._Evict()
+
+  def Acquire(self, prefix_ids):
+    """Marks the states of `prefix_ids` as in use, and returns them."""
+    key = self._Key(prefix_ids)
+    entry = self._entries[key]
+    entry.refcount += 1
+    self._entries.move_to_end(key)
+    return entry.states
+
+  def Release(self, prefix_ids):
+    """Releases the states acquired by `Acquire()`."""
+    entry = self._entries[self._Key(prefix_ids)]
+    if entry.refcount <= 0:
+      raise ValueError('Prefix {} is not in use.'.format(prefix_ids))
+    entry.refcount -= 1
+    self._Evict()
+
+  def Batch(self, prefixes):
+    """Returns the cached states of `prefixes` as the inputs of ExtendStep().
+
+    Args:
+      prefixes: a list of sequences of ids, which must be cached.
+
+    Returns:
+      A `.NestedMap` of arrays of shape [max_len, len(prefixes), ...], the
+      states of the prefixes padded with zeros to their maximum length, and
+      paddings, a float32 array of shape [len(prefixes), max_len].
+    """
+    keys = [self._Key(ids) for ids in prefixes]
+    entries = [self._entries[key] for key in keys]
+    max_len = max(len(key) for key in keys)
+    paddings = np.ones([len(keys), max_len], np.float32)
+    for i, key in enumerate(keys):
+      paddings[i, :len(key)] = 0.
+
+    def _Stack(*xs):
+      batch = np.zeros((max_len, len(xs)) + xs[0].shape[1:], xs[0].dtype)
+      for i, x in enumerate(xs):
+        batch[:x.shape[0], i] = x
+      return batch
+
+    flat = [_Stack(*xs) for xs in zip(*[e.states.Flatten() for e in entries])]
+    states = entries[0].states.Pack(flat)
+    states.paddings = paddings
+    return states
+
+  def CacheInfo(self):
+    """Returns the statistics of the cache."""
+    return CacheInfo(self._hits, self._misses, self._evictions,
+                     len(self._entries), self._num_bytes)
@@ -0,0 +1,100 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for prefix_kv_cache."""
+
+import lingvo.compat as tf
+from lingvo.core import prefix_kv_cache
+from lingvo.core import py_utils
+from lingvo.core import test_utils
+import numpy as np
+
+
+def _States(prefix_len, value):
+  # 8 bytes per step.
+  return py_utils.NestedMap(
+      x_layers=[py_utils.NestedMap(key=np.full([prefix_len, 2], value,
+                                               np.float32))])
+
+
+class PrefixKVCacheTest(test_utils.TestCase):
+
+  def testLookup(self):
+    cache = prefix_kv_cache.PrefixKVCache(max_bytes=1 << 10)
+    self.assertIsNone(cache.Lookup([1, 2]))
+    cache.Insert([1, 2], _States(2, 1.))
+    self.assertAllEqual([[1., 1.]] * 2,
+                        cache.Lookup(np.array([1, 2])).x_layers[0].key)
+    self.assertIsNone(cache.Lookup([1]))
+    self.assertEqual((1, 2, 0, 1, 16), cache.CacheInfo())
+    with self.assertRaisesRegex(ValueError, 'prefix of length 3'):
+      cache.Insert([1, 2, 3], _States(2, 1.))
+
+  def testEvictsLeastRecentlyUsedNotInUse(self):
+    cache = prefix_kv_cache.PrefixKVCache(max_bytes=48)
+    cache.Insert([1, 1], _States(2, 1.))
+    cache.Insert([2, 2], _States(2, 2.))
+    cache.Insert([3, 3], _States(2, 3.))
+    cache.Acquire([1, 1])
+    cache.Lookup([2, 2])
+    # Over budget: [3, 3] is the least recently used entry not in use.
+    cache.Insert([4, 4], _States(2, 4.))
+    self.assertIsNone(cache.Lookup([3, 3]))
+    self.assertIsNotNone(cache.Lookup([2, 2]))
+    # Entries in use are kept over budget.
+    cache.Acquire([2, 2])
+    cache.Acquire([4, 4])
+    cache.Insert([5, 5, 5], _States(3, 5.))
+    self.assertIsNone(cache.Lookup([5, 5, 5]))
+    info = cache.CacheInfo()
+    self.assertEqual(2, info.evictions)
+    self.assertEqual(3, info.num_entries)
+    self.assertEqual(48, info.num_bytes)
+    # Released entries are evicted only when over budget.
+    cache.Release([1, 1])
+    self.assertIsNotNone(cache.Lookup([1, 1]))
+    cache.Insert([6], _States(1, 6.))
+    self.assertIsNone(cache.Lookup([1, 1]))
+
+  def testBatch(self):
+    cache = prefix_kv_cache.PrefixKVCache(max_bytes=1 << 10)
+    cache.Insert([1, 2, 3], _States(3, 1.))
+    cache.Insert([4], _States(1, 2.))
+    states = cache.Batch([[4], [1, 2, 3], [4]])
+    self.assertAllEqual([[0, 1, 1], [0, 0, 0], [0, 1, 1]], states.paddings)
+    key = states.x_layers[0].key
+    self.assertEqual((3, 3, 2), key.shape)
+    self.assertAllEqual([[2., 1., 2.], [0., 1., 0.], [0., 1., 0.]],
+                        key[:, :, 0])
+
+  def testSplitPrefixStates(self):
+    states = py_utils.NestedMap(
+        key=np.arange(6).reshape([3, 2]), paddings=np.zeros([2, 3]))
+    split = prefix_kv_cache.SplitPrefixStates(states, [3, 1])
+    self.assertEqual(2, len(split))
+    self.assertAllEqual([0, 2, 4], split[0].key)
+    self.assertAllEqual([1], split[1].key)
+    self.assertNotIn('paddings', split[0])
+    self.assertIn('paddings', states)
+
+  def testRelease(self):
+    cache = prefix_kv_cache.PrefixKVCache(max_bytes=1 << 10)
+    cache.Insert([1], _States(1, 1.))
+    with self.assertRaisesRegex(ValueError, 'not in use'):
+      cache.Release([1])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -4037,6 +4037,20 @@ def CheckShapes(shapes):
       assert isinstance(s, tshape.Shape), '{}: {}'.format(type(s), s)
 
 
+def ShapesBytes(shapes, dtype):
+  """Returns the bytes of the tensors of `dtype` of tshape.Shape `shapes`.
+
+  Args:
+    shapes: a nested structure of tshape.Shape, e.g. the out_shapes of
+      FPropMeta(). None values are skipped.
+    dtype: the tf.DType of the tensors.
+
+  Returns:
+    The bytes, a sympy expression if the shapes are symbolic.
+  """
+  return sum(s.size * dtype.size for s in Flatten(shapes) if s is not None)
+
+
 def FPropDtype(params):
   return params.fprop_dtype if params.fprop_dtype is not None else params.dtype
 
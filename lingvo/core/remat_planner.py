@@ -0,0 +1,313 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Plans which layers of a sequential stack to rematerialize.
+
+`PlanRematerialization()` picks the layers of a `builder_layers` sequential
+stack, or of a batch-major `StackedTransformerLayers`, to rematerialize, so
+that the activations kept for the backward pass fit in a memory budget at the
+smallest recompute cost.
+
+The costs come from `FPropMeta()` and the shapes of the inputs, which may be
+symbolic (see `symbolic.SymbolToValueMap`):
+
+- the flops of a layer are its `FPropMeta()` flops;
+- the activations of a layer are the outputs of the leaf layers inside it,
+  found by descending into the builder layers and the transformer layers
+  composing it, plus the hidden activations of the feed-forward layers.
+
+The stack is cut into segments. A plain layer keeps its input and inner
+activations until the backward pass. A rematerialized segment only keeps its
+input, and recomputes the others during its backward pass, where they are held
+until its gradients are computed. A RepeatLayer already recomputes its body in
+the backward pass of each repeat, and holds those activations meanwhile. The
+peak is estimated as the kept bytes plus the largest of those transient bytes,
+which a dynamic programming over the segments minimizes the recompute flops
+under.
+"""
+
+import collections
+
+import lingvo.compat as tf
+from lingvo.core import batch_major_attention
+from lingvo.core import builder_layers
+from lingvo.core import layers_with_attention
+from lingvo.core import py_utils
+from lingvo.core import symbolic
+from lingvo.core import tshape
+
+_Candidate = collections.namedtuple(
+    '_Candidate', ['kept_bytes', 'transient_bytes', 'flops', 'segments'])
+
+
+def _ShapesBytes(p, shapes):
+  """Returns the bytes of the tensors of `shapes` computed by layer `p`."""
+  return int(
+      symbolic.ToStaticFloat(
+          py_utils.ShapesBytes(shapes, py_utils.FPropDtype(p))))
+
+
+def _Activations(p, *shapes):
+  """Estimates the activations of the layer `p` on inputs of `shapes`.
+
+  Args:
+    p: a layer param.
+    *shapes: the tshape.Shape of the inputs.
+
+  Returns:
+    (bytes, meta): the estimated bytes of the activations computed by the
+    layer, its outputs included, and its `FPropMeta()`.
+  """
+  cls = p.cls
+  if cls in (builder_layers.SequentialLayer,
+             builder_layers.UnarySequentialLayer):
+    total = 0
+    args = shapes
+    for _ in range(getattr(p, 'repeat', 1)):
+      for sub in p.sub:
+        sub_bytes, meta = _Activations(sub, *args)
+        total += sub_bytes
+        args = meta.out_shapes
+    return total, cls.FPropMeta(p, *shapes)
+  meta = cls.FPropMeta(p, *shapes)
+  if issubclass(cls, batch_major_attention.TransformerLayer):
+    # shapes are those of query_vec, paddings and aux_vec.
+    with tf.Graph().as_default():  # throw-away graph.
+      instance = p.Instantiate()
+    total = _Activations(instance.self_atten.params, shapes[0])[0]
+    if p.has_aux_atten:
+      total += _Activations(instance.cross_atten.params, shapes[0],
+                            shapes[2])[0]
+    total += _Activations(instance.fflayer.params, shapes[0], shapes[1])[0]
+    return total, meta
+  if issubclass(cls, layers_with_attention.TransformerFeedForwardLayer):
+    hidden = tshape.Shape(shapes[0][:-1] + [p.hidden_dim])
+    return _ShapesBytes(p, (hidden,) + meta.out_shapes), meta
+  if cls is builder_layers.ParallelLayer:
+    total = sum(_Activations(sub, *shapes)[0] for sub in p.sub)
+    return total + _ShapesBytes(p, meta.out_shapes), meta
+  if cls is builder_layers.RepeatLayer:
+    # Recurrent only keeps the states between the repeats.
+    return p.repeat * _ShapesBytes(p, meta.out_shapes), meta
+  return _ShapesBytes(p, meta.out_shapes), meta
+
+
+def _RecomputeBytes(p, *shapes):
+  """Returns the bytes held while the layer `p` recomputes its activations.
+
+  Args:
+    p: a layer param.
+    *shapes: the tshape.Shape of the inputs.
+
+  Returns:
+    The bytes of the activations that the backward pass of the layer `p`
+    recomputes by itself, i.e. those of one repeat of a RepeatLayer.
+  """
+  cls = p.cls
+  if cls is builder_layers.RepeatLayer:
+    return _Activations(p.body, *shapes)[0]
+  if cls in (builder_layers.SequentialLayer,
+             builder_layers.UnarySequentialLayer):
+    peak = 0
+    for _ in range(getattr(p, 'repeat', 1)):
+      for sub in p.sub:
+        peak = max(peak, _RecomputeBytes(sub, *shapes))
+        shapes = sub.cls.FPropMeta(sub, *shapes).out_shapes
+    return peak
+  if cls is builder_layers.ParallelLayer:
+    return max(_RecomputeBytes(sub, *shapes) for sub in p.sub)
+  return 0
+
+
+def _FlattenSeq(p):
+  """Recursively concatenates the layers of SequentialLayers into a list."""
+  if isinstance(p, list):
+    return sum([_FlattenSeq(s) for s in p], [])
+  if p.cls is not builder_layers.SequentialLayer:
+    return [p.Copy()]
+  subs = []
+  for _ in range(p.repeat):
+    for s in p.sub:
+      subs += _FlattenSeq(s)
+  return subs
+
+
+def _Prune(candidates, memory_budget):
+  """Drops the candidates over budget or dominated by another."""
+  candidates = sorted(
+      (c for c in candidates
+       if c.kept_bytes + c.transient_bytes <= memory_budget),
+      key=lambda c: (c.flops, c.kept_bytes, c.transient_bytes))
+  kept = []
+  for c in candidates:
+    if not any(k.kept_bytes <= c.kept_bytes and
+               k.transient_bytes <= c.transient_bytes for k in kept):
+      kept.append(c)
+  return kept
+
+
+def _UniqueNames(subs):
+  """Renames the layers whose name is not unique among `subs` by index."""
+  counts = collections.Counter(s.name for s in subs)
+  for i, s in enumerate(subs):
+    if counts[s.name] > 1:
+      s.name = '%s_%03d' % (s.name, i)
+
+
+def PlanRematerialization(params, memory_budget, *shapes):
+  """Rematerializes the fewest flops of a sequential stack under a budget.
+
+  Args:
+    params: a builder_layers.SequentialLayer param, a list of layer params
+      applied in sequence, or a batch_major_attention.StackedTransformerLayers
+      param. Nested SequentialLayers are flattened.
+    memory_budget: the budget of the activations kept for the backward pass,
+      in bytes.
+    *shapes: a tuple of tshape.Shape representing input tensors to the first
+      layer, e.g. those of query_vec and paddings for StackedTransformerLayers.
+
+  Returns:
+    A `.NestedMap` with
+
+    - params - the params of the planned stack. For StackedTransformerLayers,
+      a copy of `params` with the remat_segments of the plan, so its variables
+      are unchanged. Otherwise a SequentialLayer param of the flattened layers,
+      where the rematerialized segments are wrapped in RematerializationLayers
+      named 'remat_' + the name of their first layer. The layers keep their
+      names, except those repeated in the flattened layers, which get their
+      index as suffix.
+    - segments - the list of (start, end) layer indices of the rematerialized
+      segments, end excluded.
+    - peak_bytes - the estimated peak of the activations of the plan.
+    - activation_bytes - the estimated activations without rematerialization.
+    - flops - the flops of one FProp of the stack.
+    - recompute_flops - the flops recomputed during the backward pass.
+    - recompute_overhead - recompute_flops / flops.
+
+  Raises:
+    ValueError: if no plan fits in `memory_budget`.
+  """
+  stacked = not isinstance(params, list) and issubclass(
+      params.cls, batch_major_attention.StackedTransformerLayers)
+  if stacked:
+    subs = [
+        params.cls.LayerParams(params, i) for i in range(params.num_layers)
+    ]
+    total_flops = int(
+        symbolic.ToStaticFloat(params.cls.FPropMeta(params, *shapes).flops))
+  else:
+    subs = _FlattenSeq(params)
+    _UniqueNames(subs)
+
+  def _Carried(shapes):
+    # The layers of StackedTransformerLayers share all their inputs but
+    # query_vec, which are kept anyway.
+    return shapes[:1] if stacked else shapes
+
+  # Computes the inputs, inner activations and flops of each layer.
+  input_bytes, inner_bytes, recompute_bytes, flops = [], [], [], []
+  for s in subs:
+    input_bytes.append(_ShapesBytes(s, _Carried(shapes)))
+    recompute_bytes.append(_RecomputeBytes(s, *shapes))
+    activation_bytes, meta = _Activations(s, *shapes)
+    if stacked:
+      shapes = meta.out_shapes[:1] + shapes[1:]
+    else:
+      shapes = meta.out_shapes
+    output_bytes = _ShapesBytes(s, _Carried(shapes))
+    # The outputs are the input of the next layer.
+    inner_bytes.append(activation_bytes - output_bytes)
+    flops.append(int(symbolic.ToStaticFloat(meta.flops)))
+  # The outputs of the stack are kept for the loss.
+  final_bytes = _ShapesBytes(subs[-1], _Carried(shapes))
+  if stacked and params.final_layer_norm:
+    # And so are the inputs of the final layer norm.
+    final_bytes *= 2
+  num_layers = len(subs)
+  tf.logging.vlog(1, 'input bytes = %s inner bytes = %s flops = %s',
+                  input_bytes, inner_bytes, flops)
+
+  # frontiers[i] are the non dominated plans of the first i layers.
+  frontiers = [[_Candidate(final_bytes, 0, 0, ())]]
+  for end in range(1, num_layers + 1):
+    candidates = []
+    for c in frontiers[end - 1]:
+      # Layer end - 1 is plain.
+      candidates.append(
+          c._replace(
+              kept_bytes=c.kept_bytes + input_bytes[end - 1] +
+              inner_bytes[end - 1],
+              transient_bytes=max(c.transient_bytes,
+                                  recompute_bytes[end - 1])))
+    for start in range(end):
+      transient = (
+          sum(input_bytes[start + 1:end]) + sum(inner_bytes[start:end]) +
+          max(recompute_bytes[start:end]))
+      recompute = sum(flops[start:end])
+      for c in frontiers[start]:
+        # Layers [start, end) are rematerialized.
+        candidates.append(
+            _Candidate(c.kept_bytes + input_bytes[start],
+                       max(c.transient_bytes, transient), c.flops + recompute,
+                       c.segments + ((start, end),)))
+    frontiers.append(_Prune(candidates, memory_budget))
+
+  if not frontiers[-1]:
+    raise ValueError('No rematerialization plan fits in %d bytes.' %
+                     memory_budget)
+  best = frontiers[-1][0]
+
+  if stacked:
+    stack_params = params.Copy().Set(remat_segments=list(best.segments))
+  else:
+    new_subs = []
+    segments = dict(best.segments)
+    i = 0
+    while i < num_layers:
+      if i not in segments:
+        new_subs.append(subs[i])
+        i += 1
+        continue
+      end = segments[i]
+      if end - i == 1:
+        body = subs[i]
+      else:
+        body = builder_layers.SequentialLayer.Params().Set(
+            name='seq', sub=subs[i:end])
+      new_subs.append(builder_layers.RematerializationLayer.Params().Set(
+          name='remat_' + subs[i].name, body=body))
+      i = end
+    if isinstance(params, list):
+      stack_params = builder_layers.SequentialLayer.Params().Set(name='seq')
+    else:
+      # Keeps the base params of the stack, e.g. params_init, for its layers.
+      stack_params = params.Copy().Set(repeat=1)
+    stack_params.sub = new_subs
+    total_flops = sum(flops)
+  plan = py_utils.NestedMap(
+      params=stack_params,
+      segments=list(best.segments),
+      peak_bytes=best.kept_bytes + best.transient_bytes,
+      activation_bytes=final_bytes + sum(input_bytes) + sum(inner_bytes) +
+      max(recompute_bytes),
+      flops=total_flops,
+      recompute_flops=best.flops,
+      recompute_overhead=best.flops / max(total_flops, 1))
+  tf.logging.info(
+      'Rematerializes %d of %d layers in %s: %d -> %d activation bytes, '
+      '%.1f%% more flops.', sum(e - s for s, e in plan.segments), num_layers,
+      plan.segments, plan.activation_bytes, plan.peak_bytes,
+      100. * plan.recompute_overhead)
+  return plan
@@ -0,0 +1,218 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for remat_planner."""
+
+import itertools
+
+import lingvo.compat as tf
+from lingvo.core import batch_major_attention
+from lingvo.core import builder
+from lingvo.core import builder_layers
+from lingvo.core import py_utils
+from lingvo.core import remat_planner
+from lingvo.core import symbolic
+from lingvo.core import test_utils
+from lingvo.core import tshape
+import numpy as np
+
+
+def _FnParams(name, out_dims, flops):
+  """A layer with output [batch, out_dims] and `flops` per example."""
+
+  def FnMeta(x):
+    return py_utils.NestedMap(
+        flops=x[0] * flops, out_shapes=(tshape.Shape([x[0], out_dims]),))
+
+  return builder_layers.FnLayer.Params().Set(
+      name=name, fn=lambda x: x, fn_meta=FnMeta)
+
+
+def _BruteForce(input_bytes, flops, final_bytes, budget):
+  """Returns the fewest recompute flops of all the plans under budget."""
+  n = len(input_bytes)
+  best = None
+  # Each layer either starts a rematerialized segment, continues the previous
+  # one, or is plain.
+  for choice in itertools.product(('start', 'cont', 'plain'), repeat=n):
+    if choice[0] == 'cont' or any(
+        c == 'cont' and prev == 'plain' for prev, c in zip(choice, choice[1:])):
+      continue
+    kept, transient, recompute = final_bytes, 0, 0
+    segment = 0
+    for i, c in enumerate(choice):
+      if c == 'plain':
+        kept += input_bytes[i]
+        continue
+      if c == 'start':
+        kept += input_bytes[i]
+        segment = 0
+      else:
+        segment += input_bytes[i]
+      transient = max(transient, segment)
+      recompute += flops[i]
+    if kept + transient <= budget and (best is None or recompute < best):
+      best = recompute
+  return best
+
+
+class RematPlannerTest(test_utils.TestCase):
+
+  def _Stack(self):
+    dims = [8, 32, 4, 64, 16, 8]
+    flops = [5, 1, 7, 2, 3, 11]
+    subs = [
+        _FnParams('fn%d' % i, d, f) for i, (d, f) in enumerate(zip(dims, flops))
+    ]
+    return builder_layers.SequentialLayer.Params().Set(
+        name='stack', sub=subs), dims, flops
+
+  def testNoRematUnderLargeBudget(self):
+    p, _, _ = self._Stack()
+    plan = remat_planner.PlanRematerialization(p, 1 << 30,
+                                               tshape.Shape([2, 16]))
+    self.assertEqual([], plan.segments)
+    self.assertEqual(plan.activation_bytes, plan.peak_bytes)
+    self.assertEqual(0, plan.recompute_flops)
+    self.assertEqual(0., plan.recompute_overhead)
+    self.assertEqual(['fn%d' % i for i in range(6)],
+                     [sub.name for sub in plan.params.sub])
+    # Inputs of the 6 layers and the outputs, of 2 float32 examples.
+    self.assertEqual(2 * 4 * (16 + 8 + 32 + 4 + 64 + 16 + 8),
+                     plan.activation_bytes)
+    self.assertEqual(2 * (5 + 1 + 7 + 2 + 3 + 11), plan.flops)
+
+  def testPlanIsOptimal(self):
+    p, dims, flops = self._Stack()
+    input_bytes = [4 * d for d in [16] + dims[:-1]]
+    final_bytes = 4 * dims[-1]
+    for budget in range(200, 600, 20):
+      expected = _BruteForce(input_bytes, flops, final_bytes, budget)
+      if expected is None:
+        with self.assertRaisesRegex(ValueError, 'No rematerialization plan'):
+          remat_planner.PlanRematerialization(p, budget, tshape.Shape([1, 16]))
+        continue
+      plan = remat_planner.PlanRematerialization(p, budget,
+                                                 tshape.Shape([1, 16]))
+      self.assertLessEqual(plan.peak_bytes, budget)
+      self.assertEqual(expected, plan.recompute_flops, budget)
+      self.assertEqual(
+          sum(flops[s] for start, end in plan.segments
+              for s in range(start, end)), plan.recompute_flops)
+
+  def testSymbolicShapes(self):
+    p, _, _ = self._Stack()
+    batch = symbolic.Symbol('batch')
+    with self.assertRaisesRegex(ValueError, 'symbolic'):
+      remat_planner.PlanRematerialization(p, 1 << 30,
+                                          tshape.Shape([batch, 16]))
+    with symbolic.SymbolToValueMap(symbolic.STATIC_VALUES, {batch: 2}):
+      plan = remat_planner.PlanRematerialization(p, 1 << 30,
+                                                 tshape.Shape([batch, 16]))
+    self.assertEqual(2 * 4 * 148, plan.activation_bytes)
+
+  def testRematerializedStack(self):
+    b = builder.Base.Params().Instantiate()
+    ffn = b._Seq('ffn', b._Linear('w1', 8, 32), b._Fn('relu', tf.nn.relu),
+                 b._Linear('w2', 32, 8))
+    p = b._Rep('stack', 3, ffn)
+    p.params_init = py_utils.WeightInit.Gaussian(0.5, seed=1234)
+    shape = tshape.Shape([4, 8])
+    no_remat = remat_planner.PlanRematerialization(p, 1 << 30, shape)
+    budget = no_remat.activation_bytes * 3 // 4
+    plan = remat_planner.PlanRematerialization(p, budget, shape)
+    self.assertNotEmpty(plan.segments)
+    self.assertLessEqual(plan.peak_bytes, budget)
+    self.assertGreater(plan.recompute_overhead, 0.)
+    self.assertLess(plan.recompute_overhead, 1.)
+    self.assertIn(builder_layers.RematerializationLayer,
+                  [sub.cls for sub in plan.params.sub])
+    # The repeated layers of the flattened stack are renamed by index.
+    self.assertEqual(['w1_000', 'relu_001', 'w2_002'],
+                     [sub.name for sub in no_remat.params.sub[:3]])
+
+    with self.session(use_gpu=False, graph=tf.Graph()):
+      x = tf.constant(np.random.RandomState(1).normal(size=[4, 8]), tf.float32)
+      outputs = []
+      for name, stack_p in [('no_remat', no_remat.params),
+                            ('remat', plan.params)]:
+        layer = stack_p.Copy().Set(name=name).Instantiate()
+        y = layer.FProp(layer.theta, x)
+        loss = tf.reduce_sum(y * y)
+        outputs.append([y, tf.gradients(loss, x)[0]] +
+                       tf.gradients(loss, layer.vars.Flatten()))
+      self.evaluate(tf.global_variables_initializer())
+      expected, actual = self.evaluate(outputs)
+    self.assertEqual(len(expected), len(actual))
+    for e, a in zip(expected, actual):
+      self.assertAllClose(e, a)
+
+  def testRepeatLayerRecomputesItsBody(self):
+    p = builder_layers.RepeatLayer.Params().Set(
+        name='repeat', repeat=4, body=_FnParams('fn', 16, 3))
+    plan = remat_planner.PlanRematerialization([p], 1 << 30,
+                                               tshape.Shape([2, 16]))
+    # The input, the 4 states and the activations of the recomputed body.
+    self.assertEqual(2 * 4 * 16 * (1 + 4 + 1), plan.activation_bytes)
+    self.assertEqual(plan.activation_bytes, plan.peak_bytes)
+    self.assertEqual(2 * 3 * 4, plan.flops)
+
+  def testStackedTransformerLayers(self):
+    p = batch_major_attention.StackedTransformerLayers.Params().Set(
+        name='stack',
+        num_layers=4,
+        mdl_dim=8,
+        hidden_dim=32,
+        num_atten_heads=2,
+        final_layer_norm=True,
+        random_seed=12345)
+    p.params_init = py_utils.WeightInit.Gaussian(0.5, seed=1234)
+    shapes = (tshape.Shape([2, 6, 8]), tshape.Shape([2, 6]))
+    no_remat = remat_planner.PlanRematerialization(p, 1 << 30, *shapes)
+    self.assertEqual([], no_remat.segments)
+    self.assertEqual(
+        p.cls.FPropMeta(p, *shapes).flops, no_remat.flops)
+    budget = no_remat.activation_bytes // 2
+    plan = remat_planner.PlanRematerialization(p, budget, *shapes)
+    self.assertNotEmpty(plan.segments)
+    self.assertLessEqual(plan.peak_bytes, budget)
+    self.assertEqual(plan.segments, plan.params.remat_segments)
+
+    with self.session(use_gpu=False, graph=tf.Graph()):
+      x = tf.constant(
+          np.random.RandomState(1).normal(size=[2, 6, 8]), tf.float32)
+      paddings = tf.constant([[0.] * 6, [0.] * 4 + [1.] * 2])
+      outputs = []
+      names = []
+      for name, stack_p in [('no_remat', p), ('remat', plan.params)]:
+        layer = stack_p.Copy().Set(name=name).Instantiate()
+        y, _ = layer.FProp(layer.theta, x, paddings)
+        loss = tf.reduce_sum(y * y)
+        outputs.append([y, tf.gradients(loss, x)[0]] +
+                       tf.gradients(loss, layer.vars.Flatten()))
+        names.append([
+            v.name[len(name):] for v in layer.vars.Flatten()
+        ])
+      self.evaluate(tf.global_variables_initializer())
+      expected, actual = self.evaluate(outputs)
+    # The plan keeps the variables of the stack.
+    self.assertEqual(names[0], names[1])
+    self.assertEqual(len(expected), len(actual))
+    for e, a in zip(expected, actual):
+      self.assertAllClose(e, a)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -125,3 +125,17 @@ def ToStatic(expr):
 
 def ToTensor(expr):
   return EvalExpr(TENSOR_VALUES, expr)
+
+
+def ToStaticFloat(expr):
+  """Returns the static value of `expr` as a float.
+
+  Raises:
+    ValueError: if `expr` has symbols without a static value.
+  """
+  value = ToStatic(expr)
+  try:
+    return float(value)
+  except TypeError:
+    raise ValueError('%s is symbolic. Bind its symbols with '
+                     'SymbolToValueMap(STATIC_VALUES, ...).' % value)
@@ -63,6 +63,14 @@ class SymbolicTest(test_utils.TestCase):
         with symbolic.SymbolToValueMap(symbolic.STATIC_VALUES, {x: 9}):
           self.assertEqual(27, symbolic.ToStatic(x3))
 
+  def testToStaticFloat(self):
+    x = symbolic.Symbol('x')
+    self.assertEqual(0.5, symbolic.ToStaticFloat(x / (2 * x)))
+    with self.assertRaisesRegex(ValueError, 'symbolic'):
+      symbolic.ToStaticFloat(3 * x)
+    with symbolic.SymbolToValueMap(symbolic.STATIC_VALUES, {x: 2}):
+      self.assertEqual(6., symbolic.ToStaticFloat(3 * x))
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,197 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Record offset indices of TFRecord files, for random access to records.
+
+The index of `path` is stored next to it in `path + '.idx'`, as the little
+endian int64 byte offsets of the start of each record followed by the size of
+the file. A TFRecord is framed as a uint64 length, a uint32 crc of the length,
+the data and a uint32 crc of the data.
+
+Indexed files can be read record by record in any order, which allows striping
+records, rather than files, across input hosts, shuffling all the records of
+an epoch and resuming reading at any record.
+"""
+
+import struct
+
+import lingvo.compat as tf
+import numpy as np
+
+INDEX_SUFFIX = '.idx'
+
+_HEADER_SIZE = 12
+_FOOTER_SIZE = 4
+
+
+def IndexPath(path):
+  return path + INDEX_SUFFIX
+
+
+def ScanRecordOffsets(path):
+  """Returns the index of the TFRecord file `path`, without compression."""
+  offsets = []
+  with tf.io.gfile.GFile(path, 'rb') as f:
+    offset = 0
+    while True:
+      header = f.read(_HEADER_SIZE)
+      if not header:
+        break
+      if len(header) < _HEADER_SIZE:
+        raise ValueError('Truncated record at offset %d of %s' % (offset, path))
+      offsets.append(offset)
+      length, = struct.unpack('<Q', header[:8])
+      offset += _HEADER_SIZE + length + _FOOTER_SIZE
+      f.seek(offset)
+    offsets.append(offset)
+  return np.array(offsets, dtype=np.int64)
+
+
+def BuildIndex(path):
+  """Writes the index of the TFRecord file `path`, returns its record count."""
+  offsets = ScanRecordOffsets(path)
+  with tf.io.gfile.GFile(IndexPath(path), 'wb') as f:
+    f.write(offsets.astype('<i8').tobytes())
+  return len(offsets) - 1
+
+
+def ReadIndex(path):
+  """Returns the index of `path`.
+
+  Args:
+    path: a TFRecord file, indexed with `BuildIndex()`.
+
+  Returns:
+    An int64 numpy array of the offsets of the records, followed by the size of
+    the file.
+
+  Raises:
+    ValueError: if the index is missing or stale.
+  """
+  index_path = IndexPath(path)
+  if not tf.io.gfile.exists(index_path):
+    raise ValueError('%s has no index. Build it with '
+                     '//lingvo/tools:build_tfrecord_index.' % path)
+  with tf.io.gfile.GFile(index_path, 'rb') as f:
+    offsets = np.frombuffer(f.read(), dtype='<i8').astype(np.int64)
+  if not offsets.size or offsets[-1] != tf.io.gfile.stat(path).length:
+    raise ValueError('The index of %s is stale.' % path)
+  return offsets
+
+
+class IndexedRecordReader:
+  """Reads the records of indexed TFRecord files by global record id.
+
+  Records are numbered consecutively across `paths`, in order.
+  """
+
+  def __init__(self, paths):
+    self._paths = list(paths)
+    self._offsets = [ReadIndex(path) for path in self._paths]
+    self._starts = np.cumsum([0] + [len(o) - 1 for o in self._offsets])
+    self._files = {}
+
+  @property
+  def num_records(self):
+    return int(self._starts[-1])
+
+  def Read(self, record_id):
+    """Returns the data of record `record_id`."""
+    i = int(np.searchsorted(self._starts, record_id, side='right')) - 1
+    offset = self._offsets[i][record_id - self._starts[i]]
+    if i not in self._files:
+      self._files[i] = tf.io.gfile.GFile(self._paths[i], 'rb')
+    f = self._files[i]
+    f.seek(offset)
+    length, = struct.unpack('<Q', f.read(_HEADER_SIZE)[:8])
+    return f.read(length)
+
+  def Close(self):
+    for f in self._files.values():
+      f.close()
+    self._files = {}
+
+
+def ShardRecordIds(num_records, num_shards, shard_id, epoch, shuffle_seed):
+  """Returns the record ids read by shard `shard_id` in epoch `epoch`.
+
+  Records are striped across shards so that the number of records read by the
+  shards differ by at most one.
+
+  Args:
+    num_records: the total number of records.
+    num_shards: the number of shards, e.g. input hosts.
+    shard_id: the shard, in [0, num_shards).
+    epoch: the epoch.
+    shuffle_seed: if not None, the records of each epoch are a permutation of
+      all the records seeded by this and the epoch.
+
+  Returns:
+    An int64 numpy array of record ids.
+  """
+  if shuffle_seed is None:
+    record_ids = np.arange(num_records, dtype=np.int64)
+  else:
+    record_ids = np.random.RandomState(
+        (shuffle_seed + epoch) % 2**32).permutation(num_records)
+  return record_ids[shard_id::num_shards]
+
+
+def IndexedRecordDataset(paths,
+                         num_shards=1,
+                         shard_id=0,
+                         shuffle_seed=None,
+                         repeat=True,
+                         start_position=0):
+  """Returns a dataset of the records of indexed TFRecord files of one shard.
+
+  Args:
+    paths: a list of indexed TFRecord files.
+    num_shards: the number of shards the records are striped across.
+    shard_id: the shard read.
+    shuffle_seed: see `ShardRecordIds()`.
+    repeat: whether to read the records repeatedly.
+    start_position: an int64 scalar, the number of records of this shard
+      already read, e.g. from a checkpoint, at which reading resumes.
+
+  Returns:
+    A dataset of (position, record) tuples, where position is the number of
+    records of this shard read before the record.
+  """
+  num_records = IndexedRecordReader(paths).num_records
+  num_per_epoch = len(
+      ShardRecordIds(num_records, num_shards, shard_id, 0, shuffle_seed))
+
+  def Generator(start):
+    reader = IndexedRecordReader(paths)
+    position = int(start)
+    try:
+      while num_per_epoch:
+        epoch, i = divmod(position, num_per_epoch)
+        if epoch and not repeat:
+          return
+        record_ids = ShardRecordIds(num_records, num_shards, shard_id, epoch,
+                                    shuffle_seed)
+        for record_id in record_ids[i:]:
+          yield position, reader.Read(int(record_id))
+          position += 1
+    finally:
+      reader.Close()
+
+  return tf.data.Dataset.from_generator(
+      Generator,
+      output_signature=(tf.TensorSpec([], tf.int64),
+                        tf.TensorSpec([], tf.string)),
+      args=(start_position,))
@@ -0,0 +1,111 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for tfrecord_index."""
+
+import os
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.core import tfrecord_index
+
+
+class TfrecordIndexTest(test_utils.TestCase):
+
+  def _WriteRecords(self, name, records):
+    path = os.path.join(self.get_temp_dir(), name)
+    with tf.io.TFRecordWriter(path) as w:
+      for record in records:
+        w.write(record)
+    return path
+
+  def _MakeFiles(self):
+    records = [b'record %d' % i + b'x' * i for i in range(23)]
+    paths = [
+        self._WriteRecords('a.tfrecord', records[:10]),
+        self._WriteRecords('b.tfrecord', []),
+        self._WriteRecords('c.tfrecord', records[10:]),
+    ]
+    return paths, records
+
+  def testIndex(self):
+    paths, records = self._MakeFiles()
+    self.assertEqual([10, 0, 13], [tfrecord_index.BuildIndex(p) for p in paths])
+    reader = tfrecord_index.IndexedRecordReader(paths)
+    self.assertEqual(23, reader.num_records)
+    for i in (0, 9, 10, 22, 5, 15):
+      self.assertEqual(records[i], reader.Read(i))
+    reader.Close()
+
+  def testStaleIndex(self):
+    path = self._WriteRecords('a.tfrecord', [b'a', b'b'])
+    with self.assertRaisesRegex(ValueError, 'has no index'):
+      tfrecord_index.ReadIndex(path)
+    tfrecord_index.BuildIndex(path)
+    self._WriteRecords('a.tfrecord', [b'a', b'b', b'c'])
+    with self.assertRaisesRegex(ValueError, 'stale'):
+      tfrecord_index.ReadIndex(path)
+
+  def testShardRecordIds(self):
+    for shuffle_seed in (None, 1234):
+      shards = [
+          tfrecord_index.ShardRecordIds(23, 4, i, 0, shuffle_seed)
+          for i in range(4)
+      ]
+      self.assertEqual([6, 6, 6, 5], [len(s) for s in shards])
+      self.assertCountEqual(range(23), sum([list(s) for s in shards], []))
+    self.assertNotEqual(
+        list(tfrecord_index.ShardRecordIds(23, 1, 0, 0, 1234)),
+        list(tfrecord_index.ShardRecordIds(23, 1, 0, 1, 1234)))
+
+  def testDatasetResume(self):
+    paths, _ = self._MakeFiles()
+    for path in paths:
+      tfrecord_index.BuildIndex(path)
+    with self.session(graph=tf.Graph()) as sess:
+      start = tf.placeholder_with_default(tf.constant(0, tf.int64), [])
+      dataset = tfrecord_index.IndexedRecordDataset(
+          paths, num_shards=2, shard_id=1, shuffle_seed=1, start_position=start)
+      it = tf.data.make_initializable_iterator(dataset)
+      next_record = it.get_next()
+      sess.run(it.initializer)
+      # Shard 1 has 11 records per epoch.
+      outputs = [sess.run(next_record) for _ in range(30)]
+      self.assertEqual(list(range(30)), [p for p, _ in outputs])
+      # Each epoch reads a different stripe of a new permutation.
+      self.assertLen(set(r for _, r in outputs[:11]), 11)
+      self.assertNotEqual([r for _, r in outputs[:11]],
+                          [r for _, r in outputs[11:22]])
+      # Resuming at position 17, in the second epoch.
+      sess.run(it.initializer, feed_dict={start: 17})
+      self.assertEqual(outputs[17:20],
+                       [sess.run(next_record) for _ in range(3)])
+
+  def testDatasetNoRepeat(self):
+    paths, records = self._MakeFiles()
+    for path in paths:
+      tfrecord_index.BuildIndex(path)
+    with self.session(graph=tf.Graph()) as sess:
+      dataset = tfrecord_index.IndexedRecordDataset(paths, repeat=False)
+      next_record = tf.data.make_one_shot_iterator(dataset).get_next()
+      outputs = []
+      with self.assertRaises(tf.errors.OutOfRangeError):
+        while True:
+          outputs.append(sess.run(next_record)[1])
+      self.assertEqual(records, outputs)
+
+
+if __name__ == '__main__':
+  tf.test.main()
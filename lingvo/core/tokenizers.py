@@ -17,9 +17,11 @@
 
 import lingvo.compat as tf
 from lingvo.core import base_layer
+from lingvo.core import host_detokenizer
 from lingvo.core import ops
 from lingvo.core import py_utils
 from lingvo.core import wpm_encoder
+import numpy as np
 
 
 class BaseTokenizer(base_layer.BaseLayer):
@@ -110,6 +112,11 @@ class BaseTokenizer(base_layer.BaseLayer):
     """
     raise NotImplementedError('Abstract method.')
 
+  def CreateHostDetokenizer(self):
+    """Returns a `host_detokenizer.HostDetokenizer` like `IdsToStrings`."""
+    raise NotImplementedError(
+        '%s has no host detokenizer.' % type(self).__name__)
+
 
 class AsciiTokenizer(BaseTokenizer):
   """A simple grapheme tokenizer.
@@ -194,6 +201,15 @@ class VocabFileTokenizer(BaseTokenizer):
         ngram_vocab_filepath=ngram_vocab_filepath,
         ngram_separator=ngram_separator)
 
+  def CreateHostDetokenizer(self):
+    self._CheckParams()
+    p = self.params
+    if p.token_vocab_filepath:
+      return host_detokenizer.FromVocabFile(p.token_vocab_filepath,
+                                            p.tokens_delimiter)
+    return host_detokenizer.FromVocabFile(p.ngram_vocab_filepath,
+                                          p.ngram_separator)
+
 
 class BpeTokenizer(BaseTokenizer):
   """Tokenizers that use BPE vocab files and word to id lists for look-up."""
@@ -222,6 +238,9 @@ class BpeTokenizer(BaseTokenizer):
     return ops.bpe_ids_to_words(
         token_ids=ids, seq_lengths=lens, vocab_filepath=p.codes_filepath)
 
+  def CreateHostDetokenizer(self):
+    return host_detokenizer.FromBpeCodes(self.params.codes_filepath)
+
 
 class WpmTokenizer(BaseTokenizer):
   """Tokenizer for word-piece models."""
@@ -238,6 +257,11 @@ class WpmTokenizer(BaseTokenizer):
         'Probability of merging WPMs. If less than 1, then decomposition '
         'of words into wordpieces will no longer be deterministic, and '
         'result in longer ID sequences. At 0, it will be graphemes.')
+    p.Define(
+        'use_host_encoder', False,
+        'If true, strings are encoded by a wpm_encoder.HostWpmEncoder inside '
+        'a tf.py_func instead of by the graph encoder. Much faster, but the '
+        'graph can then not be serialized or run on TPU hosts without Python.')
     return p
 
   def __init__(self, params):
@@ -247,6 +271,39 @@ class WpmTokenizer(BaseTokenizer):
     assert p.target_unk_id == self._wpm_encoder.unk_id
     assert p.target_sos_id == self._wpm_encoder.sentence_start_id
     assert p.target_eos_id == self._wpm_encoder.sentence_end_id
+    if p.use_host_encoder:
+      self._host_wpm_encoder = wpm_encoder.HostWpmEncoder(
+          p.vocab_filepath, p.merge_prob)
+      assert p.target_unk_id == self._host_wpm_encoder.unk_id
+
+  def _HostStringsToIds(self, strs, max_length, append_eos):
+    """Same as `_StringsToIdsImpl`, encoding with the host encoder."""
+
+    def _Encode(strs):
+      batch_size = len(strs)
+      token_ids = np.full([batch_size, max_length], self.eos_id, np.int32)
+      target_ids = np.full([batch_size, max_length], self.eos_id, np.int32)
+      paddings = np.ones([batch_size, max_length], np.float32)
+      for i, ids in enumerate(
+          self._host_wpm_encoder.EncodeIds(s) for s in strs):
+        if append_eos:
+          ids.append(self.eos_id)
+        # This truncates after the eos is added, so some sentences might
+        # not have </s> at the end.
+        token = ([self.sos_id] + ids)[:max_length]
+        target = ids[:max_length]
+        token_ids[i, :len(token)] = token
+        target_ids[i, :len(target)] = target
+        paddings[i, :len(target)] = 0.
+      return token_ids, target_ids, paddings
+
+    token_ids, target_ids, paddings = tf.py_func(
+        _Encode, [strs], [tf.int32, tf.int32, tf.float32], stateful=False)
+    batch_size = py_utils.GetShape(strs)[0]
+    token_ids = tf.reshape(token_ids, [batch_size, max_length])
+    target_ids = tf.reshape(target_ids, [batch_size, max_length])
+    paddings = tf.reshape(paddings, [batch_size, max_length])
+    return token_ids, target_ids, paddings
 
   def _StringsToIdsImpl(self, strs, max_length, append_eos, languages):
     """Takes a tensor of strings and returns id/padding tensors.
@@ -277,6 +334,11 @@ class WpmTokenizer(BaseTokenizer):
     if append_eos is None:
       append_eos = p.append_eos
 
+    if p.use_host_encoder:
+      token_ids, target_ids, paddings = self._HostStringsToIds(
+          strs, max_length, append_eos)
+      return self._TrimToMaxLength(token_ids, target_ids, paddings)
+
     batch_size = py_utils.GetShape(strs)[0]
     token_ids_ta = tf.TensorArray(tf.int32, batch_size)
     target_ids_ta = tf.TensorArray(tf.int32, batch_size)
@@ -316,8 +378,11 @@ class WpmTokenizer(BaseTokenizer):
     token_ids = token_ids_ta.stack()
     target_ids = target_ids_ta.stack()
     paddings = paddings_ta.stack()
+    return self._TrimToMaxLength(token_ids, target_ids, paddings)
 
-    if not p.pad_to_max_length:
+  def _TrimToMaxLength(self, token_ids, target_ids, paddings):
+    """Trims the padding columns unless p.pad_to_max_length."""
+    if not self.params.pad_to_max_length:
       maxlen = tf.cast(
           tf.round(tf.reduce_max(tf.reduce_sum(1.0 - paddings, axis=1))),
           tf.int32)
@@ -337,3 +402,6 @@ class WpmTokenizer(BaseTokenizer):
         dtype=tf.string,
         parallel_iterations=30,
         back_prop=False)
+
+  def CreateHostDetokenizer(self):
+    return host_detokenizer.FromWpmVocab(self.params.vocab_filepath)
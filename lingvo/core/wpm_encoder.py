@@ -24,6 +24,11 @@ Speech and Signal Processing, 2012
 
 https://static.googleusercontent.com/media/research.google.com/en//pubs/archive/37842.pdf
 """
+import functools
+import heapq
+import random
+import re
+
 import lingvo.compat as tf
 from lingvo.core import ops
 from lingvo.core import py_utils
@@ -38,6 +43,21 @@ SENTENCE_END_STRING = '</s>'
 
 BOW_STR = '▁'
 
+# Same whitespace as tf.strings.split() with the default separator.
+_WHITESPACE_RE = re.compile('[ \t\n\v\f\r]+')
+
+
+def _LoadPieces(wpm_filepath):
+  """Returns the list of wordpieces in the vocabulary file."""
+  lines = py_utils.ReadFileLines(wpm_filepath)
+  pieces = []
+  for line in lines:
+    if isinstance(line, bytes):
+      line = six.ensure_text(line, 'utf-8')
+    piece = line.strip().split('\t')[0]
+    pieces.append(piece)
+  return pieces
+
 
 class WpmEncoder:
   """WPM encoder."""
@@ -50,14 +70,7 @@ class WpmEncoder:
       merge_prob: the probability of merging tokens while encoding.
     """
     # Load vocabulary file.
-    lines = py_utils.ReadFileLines(wpm_filepath)
-
-    self._pieces = []
-    for line in lines:
-      if isinstance(line, bytes):
-        line = six.ensure_text(line, 'utf-8')
-      piece = line.strip().split('\t')[0]
-      self._pieces.append(piece)
+    self._pieces = _LoadPieces(wpm_filepath)
     self._merge_prob = merge_prob
 
   def _TokenToString(self, token):
@@ -195,3 +208,157 @@ class WpmEncoder:
   @property
   def unk_id(self):
     return self._pieces.index(NO_TOKEN_STRING)
+
+
+class HostWpmEncoder:
+  """WPM encoder running in Python on the host.
+
+  Produces the same segmentation as `WpmEncoder.Encode` without building a
+  graph, which makes it suitable for encoding large corpora offline.
+
+  The vocabulary is compiled into a table mapping each pair of pieces to the
+  piece of their concatenation, if any. Each word is then encoded by greedily
+  applying the merge with the smallest resulting id, using a heap over a linked
+  list of tokens. Encodings of frequent words are kept in an LRU cache.
+  """
+
+  def __init__(self, wpm_filepath, merge_prob=1., cache_size=1 << 20):
+    """Create a host WPM encoder.
+
+    Args:
+      wpm_filepath: a path to the file containing the vocabulary.
+      merge_prob: the probability of merging tokens while encoding. The word
+        cache is disabled when less than 1, as encoding is then stochastic.
+      cache_size: the maximum number of words whose encoding is cached. 0
+        disables the cache.
+    """
+    self._pieces = _LoadPieces(wpm_filepath)
+    self._merge_prob = merge_prob
+    # Mirror the vocab ops: empty lines are skipped and later duplicates of a
+    # piece take precedence.
+    self._id_to_piece = [piece for piece in self._pieces if piece]
+    self._piece_to_id = {
+        piece: i for i, piece in enumerate(self._id_to_piece)
+    }
+    self._unk_id = self._piece_to_id[NO_TOKEN_STRING]
+    self._num_pieces = len(self._id_to_piece)
+    self._merges = self._CompileMerges()
+    if merge_prob >= 1. and cache_size:
+      self._encode_word = functools.lru_cache(maxsize=cache_size)(
+          self._EncodeWord)
+    else:
+      self._encode_word = self._EncodeWord
+
+  def _CompileMerges(self):
+    """Returns a dict from `left_id * num_pieces + right_id` to merged id."""
+    merges = {}
+    for piece, piece_id in self._piece_to_id.items():
+      for k in range(1, len(piece)):
+        left = self._piece_to_id.get(piece[:k])
+        right = self._piece_to_id.get(piece[k:])
+        if left is not None and right is not None:
+          merges[left * self._num_pieces + right] = piece_id
+    return merges
+
+  def _EncodeWord(self, word):
+    """Returns a tuple of the ids of `word`, including the BOW prefix."""
+    tokens = [self._piece_to_id.get(c, self._unk_id) for c in BOW_STR + word]
+    n = len(tokens)
+    # Doubly linked list over the positions of the remaining tokens, and a
+    # version per position to invalidate stale heap entries.
+    next_pos = list(range(1, n)) + [-1]
+    prev_pos = list(range(-1, n - 1))
+    version = [0] * n
+    merges = self._merges
+    num_pieces = self._num_pieces
+
+    heap = []
+    for i in range(n - 1):
+      merged = merges.get(tokens[i] * num_pieces + tokens[i + 1])
+      if merged is not None:
+        heap.append((merged, i, 0))
+    heapq.heapify(heap)
+
+    while heap:
+      merged, i, v = heapq.heappop(heap)
+      if v != version[i]:
+        continue
+      if self._merge_prob < 1. and random.random() >= self._merge_prob:
+        break
+      # Merge the token at i with its right neighbor.
+      right = next_pos[i]
+      tokens[i] = merged
+      tokens[right] = None
+      next_pos[i] = next_pos[right]
+      if next_pos[i] >= 0:
+        prev_pos[next_pos[i]] = i
+      version[right] += 1
+      version[i] += 1
+      if next_pos[i] >= 0:
+        candidate = merges.get(merged * num_pieces + tokens[next_pos[i]])
+        if candidate is not None:
+          heapq.heappush(heap, (candidate, i, version[i]))
+      left = prev_pos[i]
+      if left >= 0:
+        version[left] += 1
+        candidate = merges.get(tokens[left] * num_pieces + merged)
+        if candidate is not None:
+          heapq.heappush(heap, (candidate, left, version[left]))
+    return tuple(t for t in tokens if t is not None)
+
+  def EncodeIds(self, text):
+    """Converts `text` to a list of integer ids.
+
+    Encoding includes prefixing the beginning-of-word token to each word.
+    """
+    if isinstance(text, bytes):
+      text = six.ensure_text(text, 'utf-8')
+    ids = []
+    for word in _WHITESPACE_RE.split(text):
+      if word:
+        ids.extend(self._encode_word(word))
+    return ids
+
+  def Encode(self, text):
+    """Converts `text` to integer ids and the encoded string.
+
+    Returns:
+      (ids, tokens) where ids is the list of encoded integer ids and tokens is
+      the list of corresponding wordpieces.
+    """
+    ids = self.EncodeIds(text)
+    return ids, [self._id_to_piece[i] for i in ids]
+
+  def EncodeMany(self, texts):
+    """Encodes each of `texts`. Returns a list of (ids, tokens) tuples."""
+    return [self.Encode(text) for text in texts]
+
+  def Decode(self, ids):
+    txt = ''.join(self._id_to_piece[i] for i in ids)
+    return txt.replace(BOW_STR, ' ').strip()
+
+  def CacheInfo(self):
+    """Returns the statistics of the word cache, or None if disabled."""
+    if hasattr(self._encode_word, 'cache_info'):
+      return self._encode_word.cache_info()
+    return None
+
+  @property
+  def sentence_start_id(self):
+    return self._piece_to_id[SENTENCE_START_STRING]
+
+  @property
+  def sentence_start_string(self):
+    return SENTENCE_START_STRING
+
+  @property
+  def sentence_end_id(self):
+    return self._piece_to_id[SENTENCE_END_STRING]
+
+  @property
+  def sentence_end_string(self):
+    return SENTENCE_END_STRING
+
+  @property
+  def unk_id(self):
+    return self._unk_id
@@ -16,9 +16,12 @@
 """Tests for wpm_encoder."""
 
 import os
+import time
 import lingvo.compat as tf
+from lingvo.core import test_helper
 from lingvo.core import test_utils
 from lingvo.core import wpm_encoder
+import numpy as np
 
 
 class WpmEncoderTest(test_utils.TestCase):
@@ -58,6 +61,7 @@ class WpmEncoderTest(test_utils.TestCase):
   def setUp(self):
     voc = self._CreateVocab()
     self._enc = wpm_encoder.WpmEncoder(voc)
+    self._host_enc = wpm_encoder.HostWpmEncoder(voc)
 
   def testDitto(self):
     with tf.Session():
@@ -99,6 +103,84 @@ class WpmEncoderTest(test_utils.TestCase):
                        tf.strings.reduce_join(strs, separator=' ').eval())
       self.assertEqual(u'føö'.encode('utf-8'), self._enc.Decode(ids).eval())
 
+  def testHostEncode(self):
+    ids, strs = self._host_enc.Encode('Ditto  Ditto\tfor')
+    self.assertEqual(u'▁ D itt o ▁ D itt o ▁ for'.split(), strs)
+    self.assertEqual('Ditto Ditto for', self._host_enc.Decode(ids))
+    self.assertEqual(([], []), self._host_enc.Encode(''))
+    self.assertEqual(u'▁ f ø ö'.split(),
+                     self._host_enc.Encode('føö'.encode('utf-8'))[1])
+    # Unknown characters map to <unk>.
+    self.assertEqual(u'▁ to <unk>'.split(), self._host_enc.Encode('toX')[1])
+
+  def testHostMergeProb(self):
+    enc = wpm_encoder.HostWpmEncoder(self._CreateVocab(), merge_prob=0.)
+    self.assertEqual(u'▁ D i t t o'.split(), enc.Encode('Ditto')[1])
+    self.assertIsNone(enc.CacheInfo())
+
+  def testHostCache(self):
+    self._host_enc.EncodeMany(['Ditto for', 'Ditto to'])
+    info = self._host_enc.CacheInfo()
+    self.assertEqual(1, info.hits)
+    self.assertEqual(3, info.misses)
+
+  def testHostMatchesGraph(self):
+    rng = np.random.RandomState(12345)
+    chars = list('tiofrD-.øö\\X')
+    texts = []
+    for _ in range(20):
+      words = [
+          ''.join(rng.choice(chars, rng.randint(1, 10)))
+          for _ in range(rng.randint(0, 5))
+      ]
+      texts.append(' '.join(words))
+    with self.session() as sess:
+      text = tf.placeholder(tf.string, [])
+      encoded = self._enc.Encode(text)
+      for t, (host_ids, host_strs) in zip(texts,
+                                          self._host_enc.EncodeMany(texts)):
+        ids, strs = sess.run(encoded, feed_dict={text: t})
+        self.assertAllEqual(ids, host_ids)
+        self.assertEqual([s.decode('utf-8') for s in strs], host_strs)
+
+
+class WpmEncoderBenchmark(tf.test.Benchmark):
+  """Compares the graph and host encoders on the MT vocabulary."""
+
+  def benchmarkEncode(self):
+    vocab = test_helper.test_src_dir_path('tasks/mt/wpm-ende-2k.voc')
+    rng = np.random.RandomState(12345)
+    alphabet = list('abcdefghijklmnopqrstuvwxyz')
+    # Zipfian words so that the cache sees a realistic hit rate.
+    vocab_words = [
+        ''.join(rng.choice(alphabet, rng.randint(2, 12))) for _ in range(5000)
+    ]
+    texts = []
+    for _ in range(200):
+      idx = np.minimum(rng.zipf(1.2, size=20), len(vocab_words)) - 1
+      texts.append(' '.join(vocab_words[i] for i in idx))
+
+    graph_enc = wpm_encoder.WpmEncoder(vocab)
+    with tf.Graph().as_default(), tf.Session() as sess:
+      text = tf.placeholder(tf.string, [])
+      ids = graph_enc.Encode(text)[0]
+      sess.run(ids, feed_dict={text: texts[0]})
+      start = time.time()
+      for t in texts:
+        sess.run(ids, feed_dict={text: t})
+      graph_time = time.time() - start
+
+    host_enc = wpm_encoder.HostWpmEncoder(vocab)
+    start = time.time()
+    host_enc.EncodeMany(texts)
+    host_time = time.time() - start
+    print('%d sentences: graph %.3fs, host %.4fs (%s)' %
+          (len(texts), graph_time, host_time, host_enc.CacheInfo()))
+    self.report_benchmark(
+        iters=len(texts),
+        wall_time=host_time,
+        extras={'graph_wall_time': graph_time})
+
 
 if __name__ == '__main__':
   tf.test.main()
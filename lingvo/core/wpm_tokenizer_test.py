@@ -44,6 +44,21 @@ class WpmTokenizerTest(test_utils.TestCase):
                         [[0., 0., 0., 0., 0., 0.], [0., 0., 0., 0., 1., 1.],
                          [0., 1., 1., 1., 1., 1.]])
 
+  def testStringsTokenIdsHostEncoder(self):
+    p = tokenizers.WpmTokenizer.Params()
+    p.vocab_filepath = test_helper.test_src_dir_path('tasks/mt/wpm-ende.voc')
+    p.vocab_size = 32000
+    p.use_host_encoder = True
+    p.pad_to_max_length = False
+    wpm_tokenizer = p.Instantiate()
+    with self.session(use_gpu=False):
+      token_ids, target_ids, paddings = self.evaluate(
+          wpm_tokenizer.StringsToIds(
+              tf.constant(['this is it', ''], dtype=tf.string), 6, True))
+    self.assertAllEqual(token_ids, [[1, 647, 470, 560], [1, 2, 2, 2]])
+    self.assertAllEqual(target_ids, [[647, 470, 560, 2], [2, 2, 2, 2]])
+    self.assertAllEqual(paddings, [[0., 0., 0., 0.], [0., 1., 1., 1.]])
+
   def testIdsToStrings(self):
     p = tokenizers.WpmTokenizer.Params()
     p.vocab_filepath = test_helper.test_src_dir_path('tasks/mt/wpm-ende.voc')
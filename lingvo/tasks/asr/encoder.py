@@ -17,6 +17,8 @@
 import collections
 import lingvo.compat as tf
 from lingvo.core import base_layer
+from lingvo.core import bn_layers
+from lingvo.core import conformer_layer
 from lingvo.core import layers
 from lingvo.core import model_helper
 from lingvo.core import py_utils
@@ -473,3 +475,220 @@ class AsrEncoder(base_layer.BaseLayer):
       outputs['padding'] = tf.squeeze(rnn_padding, [2])
       outputs['state'] = py_utils.NestedMap()
       return outputs
+
+
+class ConformerEncoder(base_layer.BaseLayer):
+  """Conformer speech encoder, which supports streaming inference.
+
+  The input frames are stacked and subsampled by `StackingOverTime`, projected
+  to `model_dim`, then encoded by a stack of causal conformer layers.
+
+  `StreamStep()` encodes the audio chunk by chunk, with the same outputs as
+  `FProp()` on the whole utterance. The state carried across the chunks has a
+  fixed size: the last `stacking.left_context` frames, the buffers of the
+  causal convolutions and the keys and values of the local self-attention left
+  context. The compute per chunk then doesn't grow with the audio length.
+  """
+
+  @classmethod
+  def Params(cls):
+    """Configs for ConformerEncoder."""
+    p = super().Params()
+    p.Define('specaugment_network',
+             spectrum_augmenter.SpectrumAugmenter.Params(),
+             'Configs template for the augmentation network.')
+    p.Define('use_specaugment', False, 'Use specaugmentation or not.')
+    p.Define('input_shape', [None, None, 80, 1],
+             'Shape of the input. This should a TensorShape with rank 4.')
+    p.Define(
+        'stacking_tpl',
+        layers.StackingOverTime.Params().Set(left_context=2, stride=3),
+        'Stacking and subsampling of the input frames. right_context must be '
+        '0 for StreamStep().')
+    p.Define('model_dim', 256, 'Dimension of the conformer layers.')
+    p.Define(
+        'input_proj_tpl',
+        layers.ProjectionLayer.Params().Set(
+            batch_norm=False, has_bias=True, activation='NONE'),
+        'Projection of the stacked frames to model_dim.')
+    p.Define('num_conformer_layers', 4, 'Number of conformer layers.')
+    p.Define(
+        'conformer_tpl',
+        conformer_layer.ConformerLayer.CommonParams(
+            input_dim=256,
+            is_causal=True,
+            atten_num_heads=4,
+            atten_left_context=64,
+            atten_right_context=0,
+            use_relative_atten=False,
+            kernel_size=32,
+            fflayer_hidden_dim=1024,
+            layer_order='conv_before_mhsa',
+            conv_norm_layer_tpl=layers.LayerNorm.Params()),
+        'Configs template for the conformer layers. Its input_dim is set to '
+        'model_dim. StreamStep() requires is_causal, atten_right_context=0, '
+        'layer_order=conv_before_mhsa and a LayerNorm or cumulative '
+        'GroupNormLayer conv_norm_layer_tpl.')
+    return p
+
+  def __init__(self, params):
+    super().__init__(params)
+    p = self.params
+    assert len(p.input_shape) == 4
+    if p.use_specaugment:
+      self.CreateChild('specaugment', p.specaugment_network.Copy())
+    self.CreateChild('stacking', p.stacking_tpl.Copy().Set(name='stacking'))
+    _, _, num_bins, num_channels = p.input_shape
+    self.CreateChild(
+        'input_proj',
+        p.input_proj_tpl.Copy().Set(
+            name='input_proj',
+            input_dim=num_bins * num_channels * self.stacking.window_size,
+            output_dim=p.model_dim))
+    params_conformers = []
+    for i in range(p.num_conformer_layers):
+      conformer_p = p.conformer_tpl.Copy().Set(
+          name='conformer_%d' % i, input_dim=p.model_dim)
+      params_conformers.append(conformer_p)
+    self.CreateChildren('conformers', params_conformers)
+
+  @property
+  def supports_streaming(self):
+    p = self.params
+    conformer_p = p.conformer_tpl
+    norm_p = conformer_p.lconv_tpl.conv_norm_layer_tpl
+    # LConvLayer.StreamStep() only supports these conv norms.
+    streaming_norm = (
+        issubclass(norm_p.cls, layers.LayerNorm) or
+        (issubclass(norm_p.cls, bn_layers.GroupNormLayer) and
+         norm_p.cumulative))
+    return (p.stacking_tpl.right_context == 0 and conformer_p.is_causal and
+            conformer_p.atten_right_context == 0 and
+            conformer_p.layer_order == 'conv_before_mhsa' and
+            not conformer_p.remat and streaming_norm)
+
+  def _Frames(self, inputs):
+    """Flattens [batch, time, num_bins, num_channels] to [batch, time, -1]."""
+    batch, time = py_utils.GetShape(inputs, 2)
+    return tf.reshape(inputs, [batch, time, -1])
+
+  def FProp(self, theta, batch, state0=None):
+    """Encodes source as represented by 'inputs' and 'paddings'.
+
+    Args:
+      theta: A NestedMap object containing weights' values of this
+        layer and its children layers.
+      batch: A NestedMap with fields:
+
+        - src_inputs - The inputs tensor. It is expected to be of shape [batch,
+          time, feature_dim, channels].
+        - paddings - The paddings tensor. It is expected to be of shape [batch,
+          time].
+      state0: Recurrent input state. Not supported/ignored by this encoder.
+
+    Returns:
+      A NestedMap containing
+
+      - 'encoded': a feature tensor of shape [time, batch, depth]
+      - 'padding': a 0/1 tensor of shape [time, batch]
+      - 'state': the updated recurrent state
+    """
+    p = self.params
+    inputs, paddings = batch.src_inputs, batch.paddings
+    with tf.name_scope(p.name):
+      if p.use_specaugment and not self.do_eval:
+        inputs, paddings = self.specaugment.FProp(theta.specaugment, inputs,
+                                                  paddings)
+      inputs, paddings = self.stacking.FProp(
+          self._Frames(inputs), tf.expand_dims(paddings, -1))
+      paddings = tf.squeeze(paddings, -1)
+      outputs, _ = self._Encode(theta, inputs, paddings)
+      outputs.state = py_utils.NestedMap()
+      return outputs
+
+  def _Encode(self, theta, inputs, paddings, state0=None):
+    """Encodes the stacked frames, with StreamStep() if state0 is not None."""
+    features = self.input_proj.FProp(theta.input_proj, inputs)
+    state1 = py_utils.NestedMap(conformers=[])
+    for i, conformer in enumerate(self.conformers):
+      if state0 is None:
+        out_nmap = conformer.FProp(
+            theta.conformers[i],
+            py_utils.NestedMap(features=features, paddings=paddings))
+        features, paddings = out_nmap.features, out_nmap.paddings
+      else:
+        features, paddings, conformer_state1 = conformer.StreamStep(
+            theta.conformers[i], features, paddings, state0.conformers[i])
+        state1.conformers.append(conformer_state1)
+    features *= tf.expand_dims(1. - paddings, -1)
+    outputs = py_utils.NestedMap(
+        encoded=tf.transpose(features, [1, 0, 2]),
+        padding=tf.transpose(paddings))
+    return outputs, state1
+
+  def zero_state(self, theta, batch_size):
+    """Returns the initial state of StreamStep()."""
+    p = self.params
+    if not self.supports_streaming:
+      return py_utils.NestedMap()
+    _, _, num_bins, num_channels = p.input_shape
+    left_context = p.stacking_tpl.left_context
+    return py_utils.NestedMap(
+        stacking=py_utils.NestedMap(
+            frames=tf.zeros(
+                [batch_size, left_context, num_bins * num_channels],
+                py_utils.FPropDtype(p)),
+            paddings=tf.ones([batch_size, left_context],
+                             py_utils.FPropDtype(p))),
+        conformers=[c.zero_state(batch_size) for c in self.conformers])
+
+  def StreamStep(self, theta, frames, paddings, state0):
+    """Encodes a chunk of frames, following those encoded into state0.
+
+    Args:
+      theta: A NestedMap object containing weights' values of this
+        layer and its children layers.
+      frames: The frames of the chunk, of shape [batch, time, feature_dim,
+        channels]. time must be a multiple of the stacking stride.
+      paddings: A 0/1 tensor of shape [batch, time].
+      state0: A NestedMap returned by zero_state() for the first chunk, or by
+        the previous StreamStep() after.
+
+    Returns:
+      (outputs, state1):
+
+      - outputs: a NestedMap with 'encoded', a feature tensor of shape
+        [time / stride, batch, depth], and 'padding', a 0/1 tensor of shape
+        [time / stride, batch], the same as the frames of FProp() for this
+        chunk.
+      - state1: the state after this chunk, of the same structure as state0.
+
+    Raises:
+      ValueError: if this encoder does not support streaming.
+    """
+    p = self.params
+    if not self.supports_streaming:
+      raise ValueError('StreamStep() needs causal conformer layers without '
+                       'right context, remat or a batch norm.')
+    stacking_p = self.stacking.params
+    with tf.name_scope('%s/StreamStep' % p.name):
+      _, time = py_utils.GetShape(frames, 2)
+      frames = py_utils.with_dependencies([
+          py_utils.assert_equal(time % stacking_p.stride, 0)
+      ], self._Frames(frames))
+      # Stacks the frames with the last ones of the previous chunks, as
+      # StackingOverTime does with its left padding.
+      frames = tf.concat([state0.stacking.frames, frames], 1)
+      paddings = tf.concat([state0.stacking.paddings, paddings], 1)
+      window = self.stacking.window_size
+      inputs = tf.concat([frames[:, i:i + time] for i in range(window)], 2)
+      inputs = inputs[:, ::stacking_p.stride]
+      stacked_paddings = tf.reduce_min(
+          tf.stack([paddings[:, i:i + time] for i in range(window)], 2), 2)
+      stacked_paddings = stacked_paddings[:, ::stacking_p.stride]
+      outputs, state1 = self._Encode(theta, inputs, stacked_paddings, state0)
+      left_context = stacking_p.left_context
+      state1.stacking = py_utils.NestedMap(
+          frames=frames[:, time:time + left_context],
+          paddings=paddings[:, time:time + left_context])
+      return outputs, state1
@@ -15,6 +15,8 @@
 """Tests for ASR encoder."""
 
 import lingvo.compat as tf
+from lingvo.core import bn_layers
+from lingvo.core import cluster_factory
 from lingvo.core import py_utils
 from lingvo.core import test_utils
 from lingvo.tasks.asr import encoder
@@ -333,5 +335,97 @@ class EncoderTest(test_utils.TestCase):
                                             regular_encoded_sum.eval())
 
 
+class ConformerEncoderTest(test_utils.TestCase):
+
+  def _EncoderParams(self):
+    p = encoder.ConformerEncoder.Params().Set(
+        name='encoder',
+        input_shape=[None, None, 4, 2],
+        model_dim=16,
+        num_conformer_layers=2)
+    p.stacking_tpl.Set(left_context=2, stride=2)
+    p.conformer_tpl.Set(
+        atten_num_heads=2,
+        atten_left_context=5,
+        kernel_size=3,
+        fflayer_hidden_dim=32)
+    p.params_init = py_utils.WeightInit.Uniform(0.1, seed=12345)
+    return p
+
+  def testForwardPass(self):
+    with self.session(use_gpu=False):
+      p = self._EncoderParams()
+      enc = p.Instantiate()
+      batch = py_utils.NestedMap(
+          src_inputs=tf.random.normal([3, 12, 4, 2], seed=1),
+          paddings=tf.zeros([3, 12]))
+      enc_out = enc.FProp(enc.theta, batch)
+      self.evaluate(tf.global_variables_initializer())
+      encoded, padding = self.evaluate([enc_out.encoded, enc_out.padding])
+      self.assertAllEqual([6, 3, 16], encoded.shape)
+      self.assertAllEqual(np.zeros([6, 3]), padding)
+
+  def testStreamStep(self):
+    batch_size, seq_len, chunk_len = 2, 24, 4
+    with self.session(use_gpu=False), cluster_factory.SetEval(True):
+      p = self._EncoderParams()
+      enc = p.Instantiate()
+      self.assertTrue(enc.supports_streaming)
+      np.random.seed(12345)
+      src_inputs = tf.constant(
+          np.random.normal(size=[batch_size, seq_len, 4, 2]), tf.float32)
+      seq_lens = np.array([seq_len, seq_len - 5])
+      paddings = tf.constant(
+          (np.arange(seq_len)[np.newaxis, :] >=
+           seq_lens[:, np.newaxis]).astype(np.float32))
+      enc_out = enc.FProp(
+          enc.theta,
+          py_utils.NestedMap(src_inputs=src_inputs, paddings=paddings))
+
+      state = enc.zero_state(enc.theta, batch_size)
+      encoded, padding = [], []
+      for t in range(0, seq_len, chunk_len):
+        outputs, state = enc.StreamStep(enc.theta,
+                                        src_inputs[:, t:t + chunk_len],
+                                        paddings[:, t:t + chunk_len], state)
+        encoded.append(outputs.encoded)
+        padding.append(outputs.padding)
+      stream_encoded = tf.concat(encoded, 0)
+      stream_padding = tf.concat(padding, 0)
+
+      self.evaluate(tf.global_variables_initializer())
+      expected, expected_padding, actual, actual_padding = self.evaluate([
+          enc_out.encoded, enc_out.padding, stream_encoded, stream_padding
+      ])
+      self.assertAllEqual(expected_padding, actual_padding)
+      self.assertAllClose(expected, actual, atol=1e-5)
+
+  def testStreamStepNotSupported(self):
+    p = self._EncoderParams()
+    p.stacking_tpl.right_context = 1
+    enc = p.Instantiate()
+    self.assertFalse(enc.supports_streaming)
+    with self.assertRaisesRegex(ValueError, 'StreamStep'):
+      enc.StreamStep(enc.theta, tf.zeros([1, 2, 4, 2]), tf.zeros([1, 2]),
+                     py_utils.NestedMap())
+
+  def testSupportsStreaming(self):
+    p = self._EncoderParams()
+    self.assertTrue(p.Copy().Set(name='enc0').Instantiate().supports_streaming)
+    p.conformer_tpl.lconv_tpl.conv_norm_layer_tpl = (
+        bn_layers.GroupNormLayer.Params().Set(num_groups=2, cumulative=True))
+    self.assertTrue(p.Copy().Set(name='enc1').Instantiate().supports_streaming)
+    for name, update in [
+        ('batch_norm', lambda c: c.lconv_tpl.Set(
+            conv_norm_layer_tpl=bn_layers.BatchNormLayer.Params())),
+        ('group_norm', lambda c: c.lconv_tpl.conv_norm_layer_tpl.Set(
+            cumulative=False)),
+        ('remat', lambda c: c.Set(remat=True)),
+    ]:
+      p_i = p.Copy().Set(name=name)
+      update(p_i.conformer_tpl)
+      self.assertFalse(p_i.Instantiate().supports_streaming, name)
+
+
 if __name__ == '__main__':
   tf.test.main()
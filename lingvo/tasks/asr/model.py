@@ -238,8 +238,43 @@ class AsrModel(base_model.BaseTask):
     subgraphs = {}
     with tf.name_scope('inference'):
       subgraphs['default'] = self._InferenceSubgraph_Default()
+      if getattr(self.encoder, 'supports_streaming', False):
+        subgraphs['stream_step'] = self._InferenceSubgraph_StreamStep()
     return subgraphs
 
+  def _InferenceSubgraph_StreamStep(self):
+    """Constructs graph for streaming inference of the encoder.
+
+    Encodes one chunk of feature frames of a single utterance per run. The
+    frames are those of the frontend, which is not streamed. The state of the
+    encoder is fed back from the 'state/*' fetches of the previous chunk; the
+    'state/*' feeds default to the initial state for the first chunk.
+
+    Returns:
+      (fetches, feeds) where both fetches and feeds are dictionaries. Each
+      dictionary consists of keys corresponding to tensor names, and values
+      corresponding to a tensor in the graph which should be input/read from.
+    """
+    encoder_p = self.encoder.params
+    with tf.name_scope('stream_step'):
+      _, _, num_bins, num_channels = encoder_p.input_shape
+      frames = tf.placeholder(
+          py_utils.FPropDtype(encoder_p), [1, None, num_bins, num_channels],
+          name='frames')
+      paddings = tf.placeholder(
+          py_utils.FPropDtype(encoder_p), [1, None], name='paddings')
+      zero_state = self.encoder.zero_state(self.encoder.theta, 1)
+      state0 = zero_state.Transform(
+          lambda x: tf.placeholder_with_default(x, x.shape))
+      outputs, state1 = self.encoder.StreamStep(self.encoder.theta, frames,
+                                                paddings, state0)
+
+      feeds = {'frames': frames, 'paddings': paddings}
+      feeds.update(('state/' + k, v) for k, v in state0.FlattenItems())
+      fetches = {'encoded': outputs.encoded, 'padding': outputs.padding}
+      fetches.update(('state/' + k, v) for k, v in state1.FlattenItems())
+      return fetches, feeds
+
   def _InferenceSubgraph_Default(self):
     """Constructs graph for offline inference.
 
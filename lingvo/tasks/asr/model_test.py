@@ -23,6 +23,7 @@ from lingvo.core import summary_utils
 from lingvo.core import test_helper
 from lingvo.core import test_utils
 from lingvo.tasks.asr import decoder
+from lingvo.tasks.asr import encoder
 from lingvo.tasks.asr import input_generator
 from lingvo.tasks.asr import model
 from lingvo.tasks.asr import model_test_input_generator as tig
@@ -437,6 +438,49 @@ class AsrModelTest(test_utils.TestCase):
       self.assertAllEqual((80, 1, 2 * p.encoder.lstm_cell_size),
                           fetches['encoder_frames'].shape)
 
+  def testInferenceStreamStep(self):
+    p = model.AsrModel.Params().Set(name='test_config')
+    p.encoder = encoder.ConformerEncoder.Params().Set(
+        input_shape=[None, None, 8, 1], model_dim=16, num_conformer_layers=1)
+    p.encoder.conformer_tpl.Set(
+        atten_num_heads=2, kernel_size=3, fflayer_hidden_dim=32)
+    p.decoder.source_dim = 16
+    p.input = tig.TestInputGenerator.Params()
+
+    with self.session(
+        use_gpu=False, graph=tf.Graph()) as sess, self.SetEval(True):
+      mdl = p.Instantiate()
+      fetches, feeds = mdl._InferenceSubgraph_StreamStep()
+      for name in ['frames', 'paddings']:
+        self.assertIn(name, feeds)
+      for name in ['encoded', 'padding']:
+        self.assertIn(name, fetches)
+      state_names = [name for name in feeds if name.startswith('state/')]
+      self.assertNotEmpty(state_names)
+      self.assertCountEqual(state_names,
+                            [name for name in fetches if name in feeds])
+
+      np.random.seed(12345)
+      frames = np.random.normal(size=[1, 18, 8, 1]).astype(np.float32)
+      full = mdl.encoder.FPropDefaultTheta(
+          py_utils.NestedMap(
+              src_inputs=tf.constant(frames), paddings=tf.zeros([1, 18])))
+      self.evaluate(tf.global_variables_initializer())
+      expected = self.evaluate(full.encoded)
+
+      encoded = []
+      state = {}
+      for t in range(0, 18, 6):
+        feed_dict = {
+            feeds['frames']: frames[:, t:t + 6],
+            feeds['paddings']: np.zeros([1, 6], np.float32),
+        }
+        feed_dict.update((feeds[name], state[name]) for name in state)
+        outputs = sess.run(fetches, feed_dict)
+        encoded.append(outputs['encoded'])
+        state = {name: outputs[name] for name in state_names}
+      self.assertAllClose(expected, np.concatenate(encoded, 0), atol=1e-5)
+
 
 if __name__ == '__main__':
   tf.test.main()
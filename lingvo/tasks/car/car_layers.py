@@ -41,6 +41,15 @@ class SamplingAndGroupingLayer(base_layer.BaseLayer):
         'sample_neighbors_uniformly', True,
         'Whether to sample neighbors uniformly within the ball radius. '
         'If False, this will pick the nearest neighbors by distance.')
+    p.Define(
+        'sampling_method', 'farthest_point',
+        'One of farthest_point or voxel_farthest_point. The latter is an '
+        'approximation that is faster on large point clouds, with a slightly '
+        'larger coverage radius, see car_lib.VoxelFarthestPointSampler.')
+    p.Define(
+        'num_fps_candidates', None,
+        'For voxel_farthest_point sampling, the number of voxel-bucketed '
+        'candidate points. Defaults to 8 * num_samples.')
     return p
 
   def FProp(self, theta, input_data):
@@ -68,8 +77,18 @@ class SamplingAndGroupingLayer(base_layer.BaseLayer):
     padding = py_utils.HasShape(input_data.padding, [n, p1])
 
     # Sampling
-    sampled_idx, _ = car_lib.FarthestPointSampler(
-        points, padding, num_sampled_points=p.num_samples)
+    if p.sampling_method == 'farthest_point':
+      sampled_idx, _ = car_lib.FarthestPointSampler(
+          points, padding, num_sampled_points=p.num_samples)
+    elif p.sampling_method == 'voxel_farthest_point':
+      sampled_idx, _ = car_lib.VoxelFarthestPointSampler(
+          points,
+          padding,
+          num_sampled_points=p.num_samples,
+          num_candidates=p.num_fps_candidates)
+    else:
+      raise ValueError('Unsupported sampling_method: {}'.format(
+          p.sampling_method))
     query_points = car_lib.MatmulGather(points, tf.expand_dims(sampled_idx, -1))
     query_points = tf.squeeze(query_points, -2)
 
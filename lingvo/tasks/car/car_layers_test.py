@@ -77,6 +77,21 @@ class CarLayersTest(test_utils.TestCase):
           self._testNestedOutShape(p, (8, num_points, input_dims),
                                    expected_shape)
 
+  def testSamplingAndGroupingVoxelFarthestPoint(self):
+    p = car_layers.SamplingAndGroupingLayer.Params().Set(
+        name='SampleGroupTest',
+        num_samples=64,
+        ball_radius=0.2,
+        group_size=16,
+        sampling_method='voxel_farthest_point')
+    expected_shape = py_utils.NestedMap(
+        grouped_points=py_utils.NestedMap(
+            features=(2, 64, 16, 4),
+            points=(2, 64, 16, 3),
+            padding=(2, 64, 16)),
+        query_points=py_utils.NestedMap(points=(2, 64, 3), padding=(2, 64)))
+    self._testNestedOutShape(p, (2, 512, 4), expected_shape)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -19,6 +19,7 @@
 # pylint:enable=g-direct-tensorflow-import
 import lingvo.compat as tf
 from lingvo.core import py_utils
+from lingvo.tasks.car import voxel_hash
 
 
 def SquaredDistanceMatrix(pa, pb, mem_optimized=False):
@@ -84,7 +85,13 @@ def NeighborSquaredDistanceMatrix(points, neighbor_points):
   return py_utils.HasShape(sq_dist, [n, p1, k])
 
 
-def KnnIndices(points, query_points, k, valid_num=None, max_distance=None):
+def KnnIndices(points,
+               query_points,
+               k,
+               valid_num=None,
+               max_distance=None,
+               use_spatial_hash=False,
+               max_points_per_cell=32):
   """k-nearest neighbors of query_points in points.
 
   The caller should ensure that points[i, :valid_num[i], :] are the non-padding
@@ -117,6 +124,11 @@ def KnnIndices(points, query_points, k, valid_num=None, max_distance=None):
       be. If there are no points within the distance, then the closest point is
       returned (regardless of distance). If this is set to None, then
       max_distance is not used.
+    use_spatial_hash: If True, use `voxel_hash.NeighborhoodIndices` instead of
+      a dense distance matrix. Requires max_distance. See
+      `NeighborhoodIndices`.
+    max_points_per_cell: Maximum number of candidate points per hash cell if
+      use_spatial_hash is True.
 
   Returns:
     A pair of tensors:
@@ -131,7 +143,14 @@ def KnnIndices(points, query_points, k, valid_num=None, max_distance=None):
   if valid_num is not None:
     padding = tf.greater_equal(tf.range(p1), tf.expand_dims(
         valid_num, -1))  # [N, P1], False/True padding
-  return NeighborhoodIndices(points, query_points, k, padding, max_distance)
+  return NeighborhoodIndices(
+      points,
+      query_points,
+      k,
+      padding,
+      max_distance,
+      use_spatial_hash=use_spatial_hash,
+      max_points_per_cell=max_points_per_cell)
 
 
 def NeighborhoodIndices(points,
@@ -139,7 +158,9 @@ def NeighborhoodIndices(points,
                         k,
                         points_padding=None,
                         max_distance=None,
-                        sample_neighbors_uniformly=False):
+                        sample_neighbors_uniformly=False,
+                        use_spatial_hash=False,
+                        max_points_per_cell=32):
   """Get indices to k-neighbors of query_points in points.
 
   Padding is returned along-side indices. Non-padded points are guaranteed to
@@ -169,6 +190,14 @@ def NeighborhoodIndices(points,
       filtering by distance is performed.
     sample_neighbors_uniformly: boolean specifying whether to sample neighbors
       uniformly if they are within max distance.
+    use_spatial_hash: If True, candidates are looked up in a voxel spatial hash
+      with cells of size max_distance instead of computing the full [N, P2, P1]
+      distance matrix. Requires max_distance, and dims to be 3. The result is
+      the same as long as no cell holds more than max_points_per_cell points,
+      except that neighborhoods without any point within max_distance may not
+      refer to the closest point. See `voxel_hash.NeighborhoodIndices`.
+    max_points_per_cell: Maximum number of candidate points per hash cell if
+      use_spatial_hash is True.
 
   Returns:
     A pair of tensors:
@@ -178,6 +207,16 @@ def NeighborhoodIndices(points,
       0 represents an unpadded (real) point.
 
   """
+  if use_spatial_hash:
+    return voxel_hash.NeighborhoodIndices(
+        points,
+        query_points,
+        k,
+        max_distance,
+        points_padding=points_padding,
+        max_points_per_cell=max_points_per_cell,
+        sample_neighbors_uniformly=sample_neighbors_uniformly)
+
   n, p1 = py_utils.GetShape(points, 2)
   query_points = py_utils.HasShape(query_points, [n, -1, -1])
   _, p2 = py_utils.GetShape(query_points, 2)
@@ -461,6 +500,197 @@ def FarthestPointSampler(points,
   return sampled_idx, closest_idx
 
 
+def ClosestSampledIndices(points, sampled_points, chunk_size=8192):
+  """Returns the index of the closest sampled point of each point.
+
+  Distances are computed in chunks of `chunk_size` points, so memory is
+  O(N * chunk_size * P2) rather than O(N * P1 * P2).
+
+  Args:
+    points: floating point tf.Tensor of shape [N, P1, dims].
+    sampled_points: floating point tf.Tensor of shape [N, P2, dims].
+    chunk_size: Number of points processed at once.
+
+  Returns:
+    tf.int32 tf.Tensor of shape [N, P1] with values in [0, P2).
+  """
+  points = py_utils.HasRank(points, 3)
+  n, p1, dims = py_utils.GetShape(points, 3)
+  sampled_points = py_utils.HasShape(sampled_points, [n, -1, dims])
+  num_chunks = (p1 + chunk_size - 1) // chunk_size
+  chunks = py_utils.PadOrTrimTo(points, [n, num_chunks * chunk_size, dims])
+  chunks = tf.transpose(
+      tf.reshape(chunks, [n, num_chunks, chunk_size, dims]), [1, 0, 2, 3])
+
+  def _Closest(chunk):
+    dist = SquaredDistanceMatrix(chunk, sampled_points, mem_optimized=True)
+    return tf.argmin(dist, axis=-1, output_type=tf.int32)
+
+  closest_idx = tf.map_fn(_Closest, chunks, dtype=tf.int32, back_prop=False)
+  closest_idx = tf.reshape(tf.transpose(closest_idx, [1, 0, 2]), [n, -1])
+  return closest_idx[:, :p1]
+
+
+def VoxelFarthestPointSampler(points,
+                              padding,
+                              num_sampled_points,
+                              num_candidates=None,
+                              voxel_size=None,
+                              num_seeded_points=0,
+                              num_refinement_points=None,
+                              random_seed=None):
+  """Approximate farthest point sampling on a voxel-bucketed candidate set.
+
+  A faster alternative to `FarthestPointSampler` for large point clouds:
+
+  1. Points are bucketed into voxels, and a random representative is chosen
+     per voxel.
+  2. num_candidates points are kept: voxel representatives first (in random
+     order), then second points of each voxel, etc.
+  3. Exact farthest point sampling runs on the candidates only, for all but
+     the last num_refinement_points samples.
+  4. The last num_refinement_points samples are picked by exact farthest point
+     steps over all the points, which fill the largest gaps left by the
+     candidates.
+
+  The sequential part of the sampler is therefore O(num_candidates *
+  num_sampled_points + P1 * num_refinement_points) instead of
+  O(P1 * num_sampled_points), and the bucketing is O(P1 log P1).
+
+  The result is an approximation of farthest point sampling. On 100k
+  lidar-like 2D points with 1024 samples on CPU (FarthestPointSamplerBenchmark
+  in car_lib_test), the default settings give a coverage radius (the largest
+  distance of a point to its closest sample) within about 3% of exact farthest
+  point sampling in less than half the time. Without refinement steps, the
+  coverage radius is 10-25% larger, depending on num_candidates.
+
+  Args:
+    points: floating point tf.Tensor of shape [N, P1, dims], with dims 2 or 3.
+    padding: A floating point tf.Tensor of shape [N, P1] with 0 if the point is
+      real, and 1 otherwise.
+    num_sampled_points: integer number of points to sample.
+    num_candidates: integer number of candidate points to run farthest point
+      sampling on. Defaults to 8 * num_sampled_points.
+    voxel_size: optional voxel edge length. If None, the voxel size is chosen
+      per example such that the bounding box of the real points spans about
+      num_candidates voxels.
+    num_seeded_points: If num_seeded_points > 0, then the first
+      num_seeded_points in points are considered to be seeded in the FPS
+      sampling, as in `FarthestPointSampler`.
+    num_refinement_points: integer number of samples picked by exact farthest
+      point steps over all the points. Defaults to num_sampled_points // 16.
+    random_seed: optional integer random seed to use with all the random ops.
+
+  Returns:
+    A tuple of tf.Tensors (sampled_idx, closest_idx) of types
+    (tf.int32, tf.int32), with the same meaning as in `FarthestPointSampler`.
+  """
+  points = py_utils.HasRank(points, 3)
+  batch_size, num_points, dims = py_utils.GetShape(points, 3)
+  if dims not in (2, 3):
+    raise ValueError('VoxelFarthestPointSampler supports 2 or 3 dims, '
+                     'got {}.'.format(dims))
+  padding = py_utils.HasShape(
+      tf.cast(padding, tf.float32), [batch_size, num_points])
+  if num_candidates is None:
+    num_candidates = 8 * num_sampled_points
+  if num_refinement_points is None:
+    num_refinement_points = num_sampled_points // 16
+  num_refinement_points = max(
+      0,
+      min(num_refinement_points,
+          num_sampled_points - max(num_seeded_points, 1)))
+  num_candidate_samples = num_sampled_points - num_refinement_points
+  if isinstance(num_points, int):
+    num_candidates = min(num_candidates, num_points)
+  else:
+    num_candidates = tf.minimum(num_candidates, num_points)
+
+  # Voxels are relative to the lower corner of the real points.
+  is_real = tf.broadcast_to(
+      tf.equal(padding, 0.)[..., tf.newaxis], tf.shape(points))
+  large = tf.fill(tf.shape(points), points.dtype.max)
+  lower = tf.reduce_min(tf.where(is_real, points, large), axis=1, keepdims=True)
+  upper = tf.reduce_max(tf.where(is_real, points, -large), axis=1, keepdims=True)
+  if voxel_size is None:
+    extent = tf.maximum(upper - lower, 1e-3)
+    volume = tf.reduce_prod(extent, axis=-1, keepdims=True)
+    voxel_size = tf.pow(volume / tf.cast(num_candidates, tf.float32),
+                        1. / dims)
+  cell_coords = tf.clip_by_value(
+      tf.floor((points - lower) / voxel_size), 0., 2.**20 - 1.)
+  cell_coords = tf.cast(cell_coords, tf.int64)
+  if dims == 2:
+    cell_coords = tf.pad(cell_coords, [[0, 0], [0, 0], [0, 1]])
+  keys = voxel_hash.PaddedCellKeys(cell_coords, padding)
+
+  # Sort points by voxel in a random order within each voxel, and rank each
+  # point by its slot in its voxel (0 for the voxel representative).
+  random_values = tf.random.uniform([batch_size, num_points], seed=random_seed)
+  shuffle = tf.argsort(random_values, axis=1)
+  shuffled_keys = tf.gather(keys, shuffle, batch_dims=1)
+  order = tf.argsort(shuffled_keys, axis=1, stable=True)
+  sorted_keys = tf.gather(shuffled_keys, order, batch_dims=1)
+  sorted_idx = tf.gather(shuffle, order, batch_dims=1)
+  slot = tf.range(num_points) - tf.searchsorted(
+      sorted_keys, sorted_keys, side='left')
+
+  # Candidates are taken by increasing score: seeded points (in order), then
+  # real points by slot with random ties, then padded points.
+  score = tf.cast(slot, tf.float32) + tf.gather(
+      random_values, sorted_idx, batch_dims=1)
+  sorted_padding = tf.gather(padding, sorted_idx, batch_dims=1)
+  score += sorted_padding * 2. * tf.cast(num_points, tf.float32)
+  score = tf.where(
+      tf.less(sorted_idx, num_seeded_points),
+      tf.cast(sorted_idx - num_points, tf.float32), score)
+  _, candidate_pos = tf.nn.top_k(-score, k=num_candidates, sorted=True)
+  candidate_idx = tf.gather(sorted_idx, candidate_pos, batch_dims=1)
+
+  sampled_candidates, _ = FarthestPointSampler(
+      tf.gather(points, candidate_idx, batch_dims=1),
+      tf.gather(padding, candidate_idx, batch_dims=1),
+      num_candidate_samples,
+      num_seeded_points=num_seeded_points,
+      random_seed=random_seed)
+  sampled_idx = tf.gather(candidate_idx, sampled_candidates, batch_dims=1)
+  sampled_points = tf.gather(points, sampled_idx, batch_dims=1)
+  closest_idx = ClosestSampledIndices(points, sampled_points)
+  if not num_refinement_points:
+    return sampled_idx, closest_idx
+
+  # Exact farthest point steps, from the squared distance of each point to its
+  # closest sample. Padded points are only picked after all real points.
+  distance_to_selected = tf.reduce_sum(
+      tf.square(points - tf.gather(sampled_points, closest_idx, batch_dims=1)),
+      axis=-1)
+  distance_to_selected = tf.where(
+      tf.equal(padding, 0.), distance_to_selected,
+      -tf.ones_like(distance_to_selected))
+
+  def _RefineFn(curr_idx, distance_to_selected, refined_idx):
+    new_selected = tf.argmax(
+        distance_to_selected, axis=1, output_type=tf.int32)
+    refined_idx = refined_idx.write(curr_idx, new_selected)
+    new_points = tf.gather(points, new_selected, batch_dims=1)[:, tf.newaxis]
+    new_distance = tf.reduce_sum(tf.square(points - new_points), axis=-1)
+    distance_to_selected = tf.minimum(distance_to_selected, new_distance)
+    return curr_idx + 1, distance_to_selected, refined_idx
+
+  _, _, refined_idx = tf.while_loop(
+      lambda curr_idx, *args: tf.less(curr_idx, num_refinement_points),
+      _RefineFn,
+      loop_vars=(0, distance_to_selected,
+                 tf.TensorArray(tf.int32, num_refinement_points)),
+      back_prop=False,
+      maximum_iterations=num_refinement_points)
+  sampled_idx = tf.concat(
+      [sampled_idx, tf.transpose(refined_idx.stack(), [1, 0])], axis=1)
+  closest_idx = ClosestSampledIndices(
+      points, tf.gather(points, sampled_idx, batch_dims=1))
+  return sampled_idx, closest_idx
+
+
 # TODO(bencaine): This was moved so that we can make this more generic in the
 # future and provide min/avg/max pooling with one function.
 def MaxPool3D(points, point_features, pooling_idx, closest_idx):
@@ -15,6 +15,8 @@
 # ==============================================================================
 """Tests for car_lib."""
 
+import time
+
 import lingvo.compat as tf
 from lingvo.core import test_utils
 from lingvo.tasks.car import car_lib
@@ -406,6 +408,101 @@ class CarLibTest(test_utils.TestCase):
       np_selected_idx.sort(axis=1)
       self.assertAllEqual(np_selected_idx, np_expected_selected_idx)
 
+  def testClosestSampledIndices(self):
+    np.random.seed(1234)
+    points = np.random.uniform(size=(2, 50, 3)).astype(np.float32)
+    sampled_points = np.random.uniform(size=(2, 7, 3)).astype(np.float32)
+    closest_idx = car_lib.ClosestSampledIndices(
+        tf.constant(points), tf.constant(sampled_points), chunk_size=16)
+    with self.session():
+      closest_idx = self.evaluate(closest_idx)
+    expected = np.argmin(
+        np.sum(
+            np.square(points[:, :, np.newaxis] - sampled_points[:, np.newaxis]),
+            axis=-1),
+        axis=-1)
+    self.assertAllEqual(expected, closest_idx)
+
+  def testVoxelFarthestPointSamplerAllPoints(self):
+    np.random.seed(1234)
+    points = np.random.uniform(size=(3, 40, 2)).astype(np.float32)
+    padding = np.zeros((3, 40), dtype=np.float32)
+    sampled_idx, closest_idx = car_lib.VoxelFarthestPointSampler(
+        tf.constant(points), tf.constant(padding), 40, num_candidates=64)
+    with self.session():
+      sampled_idx, closest_idx = self.evaluate([sampled_idx, closest_idx])
+    for batch_n in range(3):
+      self.assertSetEqual(set(sampled_idx[batch_n]), set(range(40)))
+      # Each point is closest to itself.
+      self.assertAllEqual(np.arange(40), sampled_idx[batch_n,
+                                                     closest_idx[batch_n]])
+
+  def testVoxelFarthestPointSamplerSeededAndPadding(self):
+    np.random.seed(1234)
+    points = np.random.uniform(size=(2, 200, 3)).astype(np.float32)
+    padding = np.zeros((2, 200), dtype=np.float32)
+    padding[:, 150:] = 1.
+    sampled_idx, closest_idx = car_lib.VoxelFarthestPointSampler(
+        tf.constant(points),
+        tf.constant(padding),
+        20,
+        num_candidates=40,
+        num_seeded_points=3)
+    with self.session():
+      sampled_idx, closest_idx = self.evaluate([sampled_idx, closest_idx])
+    self.assertAllEqual([[0, 1, 2]] * 2, sampled_idx[:, :3])
+    self.assertTrue(np.all(sampled_idx < 150))
+    for batch_n in range(2):
+      self.assertLen(set(sampled_idx[batch_n]), 20)
+    self.assertTrue(np.all((closest_idx >= 0) & (closest_idx < 20)))
+
+  def testVoxelFarthestPointSamplerCoverage(self):
+    # Four well separated clusters must all be covered by 4 samples.
+    np.random.seed(1234)
+    centers = np.array([[0., 0.], [10., 0.], [0., 10.], [10., 10.]])
+    points = np.concatenate(
+        [c + np.random.uniform(-.5, .5, size=(250, 2)) for c in centers])
+    points = points[np.random.permutation(1000)][np.newaxis].astype(np.float32)
+    sampled_idx, _ = car_lib.VoxelFarthestPointSampler(
+        tf.constant(points), tf.zeros([1, 1000]), 4, num_candidates=32)
+    with self.session():
+      sampled_idx = self.evaluate(sampled_idx)
+    sampled_points = points[0, sampled_idx[0]]
+    self.assertSetEqual({0, 1, 2, 3},
+                        set(np.argmin(
+                            np.linalg.norm(
+                                sampled_points[:, np.newaxis] - centers,
+                                axis=-1),
+                            axis=-1)))
+
+  def testVoxelFarthestPointSamplerRefinement(self):
+    np.random.seed(1234)
+    points = np.random.uniform(size=(2, 1000, 2)).astype(np.float32)
+    padding = np.zeros((2, 1000), dtype=np.float32)
+    padding[:, 900:] = 1.
+    points[:, 900:] = 100.
+    sampled_idx, _ = car_lib.VoxelFarthestPointSampler(
+        tf.constant(points),
+        tf.constant(padding),
+        8,
+        num_candidates=8,
+        num_refinement_points=2)
+    with self.session():
+      sampled_idx = self.evaluate(sampled_idx)
+    self.assertTrue(np.all(sampled_idx < 900))
+    for batch_n in range(2):
+      self.assertLen(set(sampled_idx[batch_n]), 8)
+      # The last samples are exact farthest point steps over all real points.
+      real_points = points[batch_n, :900]
+      for i in (6, 7):
+        distances = np.min(
+            np.linalg.norm(
+                real_points[:, np.newaxis] -
+                points[batch_n, sampled_idx[batch_n, :i]],
+                axis=-1),
+            axis=-1)
+        self.assertEqual(np.argmax(distances), sampled_idx[batch_n, i])
+
   def _testPooling3D(self, pooling_fn):
     num_points_in = 100
     num_points_out = 10
@@ -462,5 +559,64 @@ class CarLibTest(test_utils.TestCase):
     return self._testPooling3D(car_lib.SegmentPool3D)
 
 
+class FarthestPointSamplerBenchmark(tf.test.Benchmark):
+  """Compares exact and voxel-bucketed FPS for speed and coverage."""
+
+  def _Benchmark(self,
+                 use_voxels,
+                 num_points=100000,
+                 num_sampled_points=1024,
+                 name_suffix='',
+                 **kwargs):
+    np.random.seed(1234)
+    xy = np.random.uniform(-75., 75., size=(1, num_points, 2))
+    # Lidar-like density: many more points close to the sensor.
+    xy *= np.random.uniform(size=(1, num_points, 1))**2
+    points = xy.astype(np.float32)
+    with tf.Graph().as_default():
+      points_ph = tf.placeholder(tf.float32, [1, None, 2])
+      padding = tf.zeros(tf.shape(points_ph)[:2])
+      if use_voxels:
+        sampled_idx, closest_idx = car_lib.VoxelFarthestPointSampler(
+            points_ph, padding, num_sampled_points, **kwargs)
+      else:
+        sampled_idx, closest_idx = car_lib.FarthestPointSampler(
+            points_ph, padding, num_sampled_points)
+      with tf.Session() as sess:
+        sess.run(sampled_idx, {points_ph: points})
+        iters = 3
+        start = time.time()
+        for _ in range(iters):
+          np_sampled_idx, np_closest_idx = sess.run([sampled_idx, closest_idx],
+                                                    {points_ph: points})
+        wall_time = (time.time() - start) / iters
+    # Coverage radius: the largest distance of a point to its closest sample.
+    sampled_points = points[0, np_sampled_idx[0]]
+    distances = np.linalg.norm(
+        points[0] - sampled_points[np_closest_idx[0]], axis=-1)
+    name = 'FarthestPointSampler_%s%s' % ('voxel' if use_voxels else 'exact',
+                                          name_suffix)
+    print('%s: %.3fs, coverage radius %.3f, mean distance %.3f' %
+          (name, wall_time, np.max(distances), np.mean(distances)))
+    self.report_benchmark(
+        name=name,
+        iters=iters,
+        wall_time=wall_time,
+        extras={
+            'coverage_radius': np.max(distances),
+            'mean_distance': np.mean(distances)
+        })
+
+  def benchmarkExact(self):
+    self._Benchmark(use_voxels=False)
+
+  def benchmarkVoxel(self):
+    self._Benchmark(use_voxels=True)
+
+  def benchmarkVoxelWithoutRefinement(self):
+    self._Benchmark(
+        use_voxels=True, name_suffix='_no_refinement', num_refinement_points=0)
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -767,6 +767,240 @@ class Utils3D:
     valid_mask = py_utils.PadOrTrimTo(valid_mask, output_shape)
     return bbox_indices, bbox_scores, valid_mask
 
+  def PairedIOU3DBoxes(self, bboxes_u, bboxes_v):
+    """Computes the 3D IoU between corresponding pairs of bboxes.
+
+    Unlike `ops.pairwise_iou3d`, which computes a [U, V] matrix, this computes
+    the IoU of bboxes_u[i] and bboxes_v[i] only, with the same conventions:
+    boxes with a dimension below 1e-3 or above 1e6 have an IoU of 0.
+
+    The geometry is computed in float64 with TensorFlow ops, so this is usable
+    on any device and on any subset of box pairs.
+
+    Args:
+      bboxes_u: tf.float32. [..., 7] bboxes in [x, y, z, dx, dy, dz, phi]
+        format.
+      bboxes_v: tf.float32. [..., 7], with the same shape as bboxes_u.
+
+    Returns:
+      tf.float32 tensor with shape [...] with the IoU of each pair.
+    """
+    shape = tf.shape(bboxes_u)[:-1]
+    bboxes_u = tf.cast(tf.reshape(bboxes_u, [-1, 7]), tf.float64)
+    bboxes_v = tf.cast(tf.reshape(bboxes_v, [-1, 7]), tf.float64)
+
+    def _IsValid(bboxes):
+      dims = bboxes[:, 3:5]
+      return tf.logical_and(
+          tf.reduce_all((dims > 1e-3) & (dims < 1e6), axis=-1),
+          bboxes[:, 5] > 0.)
+
+    def _ZRange(bboxes):
+      return bboxes[:, 2] - bboxes[:, 5] / 2., bboxes[:, 2] + bboxes[:, 5] / 2.
+
+    z_min_u, z_max_u = _ZRange(bboxes_u)
+    z_min_v, z_max_v = _ZRange(bboxes_v)
+    z_inter = tf.maximum(
+        tf.minimum(z_max_u, z_max_v) - tf.maximum(z_min_u, z_min_v), 0.)
+    base_inter = _ConvexPolygonIntersectionArea(
+        _BEVBoxCorners(bboxes_u), _BEVBoxCorners(bboxes_v))
+    volume_inter = base_inter * z_inter
+    volume_u = bboxes_u[:, 3] * bboxes_u[:, 4] * bboxes_u[:, 5]
+    volume_v = bboxes_v[:, 3] * bboxes_v[:, 4] * bboxes_v[:, 5]
+    volume_union = volume_u + volume_v - volume_inter
+    is_valid = _IsValid(bboxes_u) & _IsValid(bboxes_v) & (volume_inter > 0.)
+    iou = tf.where(is_valid, volume_inter / tf.where(
+        is_valid, volume_union, tf.ones_like(volume_union)),
+                   tf.zeros_like(volume_inter))
+    return tf.reshape(tf.cast(iou, tf.float32), shape)
+
+  def ClassBatchedOrientedNMSIndices(self,
+                                     bboxes,
+                                     scores,
+                                     nms_iou_threshold,
+                                     score_threshold,
+                                     max_boxes_per_class,
+                                     pre_nms_top_k=None,
+                                     block_size=256):
+    """Per-Class 3D (7-DOF) NMS for all examples and classes at once.
+
+    A graph implementation of `BatchedOrientedNMSIndices`, with the same
+    arguments and outputs (up to the relative order of boxes with equal
+    scores). Rather than computing IoUs between all boxes of each class, it:
+
+    1. Keeps the boxes above the score threshold of each class, sorted by
+       score, optionally only the `pre_nms_top_k` best.
+    2. Processes these candidates in blocks of `block_size`, for all examples
+       and classes in lockstep, until max_boxes_per_class boxes are selected
+       or the candidates are exhausted. A block is compared to the boxes
+       selected so far and to itself only.
+    3. Culls the pairs whose axis-aligned bird's-eye-view extents or z ranges
+       do not overlap, and computes the exact rotated 3D IoU (see
+       `PairedIOU3DBoxes`) for the remaining pairs only.
+
+    Memory is therefore O(block_size * (block_size + max_boxes_per_class)) per
+    example and class, rather than O(num_boxes^2).
+
+    Args:
+      bboxes: A [batch_size, num_boxes, 7] floating point Tensor of bounding
+        boxes in [x, y, z, dx, dy, dz, phi] format.
+      scores: A [batch_size, num_boxes, num_classes] floating point Tensor
+        containing box scores.
+      nms_iou_threshold: Either a float or a list of floats of len num_classes
+        with the IoU threshold to use when determining whether two boxes overlap
+        for purposes of suppression.
+      score_threshold: Either a float or a list of floats of len num_classes
+        with the score threshold that allows NMS to quickly ignore boxes.
+      max_boxes_per_class: An integer scalar with the maximum number of boxes
+        per example to emit per class.
+      pre_nms_top_k: If set, only the pre_nms_top_k highest scoring boxes per
+        example and class are considered. This bounds the cost of NMS, but may
+        change the outputs when more boxes are above the score threshold.
+      block_size: Number of candidates processed at once.
+
+    Returns:
+      A tuple of 3 tensors of shape [batch_size, num_classes,
+      max_boxes_per_class]:
+
+      - bbox_indices: An int32 Tensor with the indices of the chosen boxes.
+        Values are in sort order until the class_idx switches.
+      - bbox_scores: A float32 Tensor with the score for each box.
+      - valid_mask: A float32 Tensor with 1/0 values indicating the validity of
+        each box. 1 indicates valid, and 0 invalid.
+    """
+    bboxes = py_utils.HasShape(bboxes, [-1, -1, 7])
+    batch_size, num_boxes = py_utils.GetShape(bboxes, 2)
+    scores = py_utils.HasShape(scores, [batch_size, num_boxes, -1])
+    _, _, num_classes = py_utils.GetShape(scores)
+
+    nms_iou_threshold = tf.broadcast_to(
+        tf.cast(nms_iou_threshold, tf.float32), [num_classes])
+    score_threshold = tf.broadcast_to(
+        tf.cast(score_threshold, tf.float32), [num_classes])
+
+    # [batch_size, num_classes, num_boxes]
+    scores = tf.transpose(scores, [0, 2, 1])
+    is_candidate = scores >= score_threshold[:, tf.newaxis]
+    num_candidates = tf.reduce_sum(tf.cast(is_candidate, tf.int32), axis=-1)
+    k = tf.reduce_max(num_candidates)
+    if pre_nms_top_k is not None:
+      k = tf.minimum(k, pre_nms_top_k)
+      num_candidates = tf.minimum(num_candidates, pre_nms_top_k)
+    candidate_scores, candidate_idx = tf.nn.top_k(
+        tf.where(is_candidate, scores,
+                 tf.fill(tf.shape(scores), scores.dtype.min)),
+        k=k,
+        sorted=True)
+    candidate_valid = tf.range(k) < num_candidates[..., tf.newaxis]
+    # [batch_size, num_classes, k, 7]
+    candidate_bboxes = tf.gather(bboxes, candidate_idx, batch_dims=1)
+
+    def _Extents(boxes):
+      """Centers and axis-aligned half extents of [..., 7] boxes."""
+      x, y, z, dx, dy, dz, phi = tf.unstack(boxes, axis=-1)
+      cos, sin = tf.abs(tf.cos(phi)), tf.abs(tf.sin(phi))
+      return tf.stack([x, y, z], axis=-1), tf.stack(
+          [dx * cos + dy * sin, dx * sin + dy * cos, dz], axis=-1) / 2.
+
+    def _Suppresses(boxes_u, boxes_v, may_overlap):
+      """Whether each of [b, c, P] boxes_u suppresses [b, c, Q] boxes_v.
+
+      Only pairs whose extents overlap in x, y and z can have a positive IoU,
+      so the exact IoU is only computed for those among `may_overlap`.
+
+      Returns:
+        A bool Tensor of shape [b, c, P, Q].
+      """
+      centers_u, extents_u = _Extents(boxes_u)
+      centers_v, extents_v = _Extents(boxes_v)
+      may_overlap &= tf.reduce_all(
+          tf.abs(centers_u[:, :, :, tf.newaxis] -
+                 centers_v[:, :, tf.newaxis]) <
+          extents_u[:, :, :, tf.newaxis] + extents_v[:, :, tf.newaxis],
+          axis=-1)
+      pairs = tf.cast(tf.where(may_overlap), tf.int32)
+      ious = self.PairedIOU3DBoxes(
+          tf.gather_nd(boxes_u, pairs[:, :3]),
+          tf.gather_nd(boxes_v, tf.gather(pairs, [0, 1, 3], axis=1)))
+      suppresses = tf.cast(ious > tf.gather(nms_iou_threshold, pairs[:, 1]),
+                           tf.int32)
+      return tf.scatter_nd(pairs, suppresses,
+                           tf.shape(may_overlap, out_type=tf.int32)) > 0
+
+    def _SelectBlock(block_start, selected_bboxes, selected_idx,
+                     selected_scores, num_selected):
+      """Runs the greedy selection on candidates [block_start, +block_size)."""
+      block = tf.minimum(block_start + tf.range(block_size), k - 1)
+      block_valid = tf.gather(
+          candidate_valid, block, axis=2) & (
+              block_start + tf.range(block_size) < k)
+      block_bboxes = tf.gather(candidate_bboxes, block, axis=2)
+      block_idx = tf.gather(candidate_idx, block, axis=2)
+      block_scores = tf.gather(candidate_scores, block, axis=2)
+
+      # Suppression by the boxes selected in previous blocks.
+      slot_used = tf.range(max_boxes_per_class) < num_selected[..., tf.newaxis]
+      suppressed = tf.reduce_any(
+          _Suppresses(selected_bboxes, block_bboxes,
+                      slot_used[..., tf.newaxis] &
+                      block_valid[:, :, tf.newaxis]),
+          axis=2)
+      block_valid &= tf.logical_not(suppressed)
+      # Suppression within the block, by higher scoring candidates.
+      earlier = tf.linalg.band_part(tf.ones([block_size] * 2, tf.bool), 0, -1)
+      earlier &= tf.logical_not(tf.eye(block_size, dtype=tf.bool))
+      suppresses = _Suppresses(
+          block_bboxes, block_bboxes,
+          earlier & block_valid[..., tf.newaxis] &
+          block_valid[:, :, tf.newaxis])
+
+      def _GreedyBody(i, keep, num_kept):
+        """Decides whether to keep candidate i of every example and class."""
+        suppressed = tf.reduce_any(suppresses[:, :, :, i] & keep, axis=-1)
+        take = (block_valid[:, :, i] & tf.logical_not(suppressed) &
+                (num_selected + num_kept < max_boxes_per_class))
+        keep |= take[..., tf.newaxis] & tf.equal(tf.range(block_size), i)
+        return i + 1, keep, num_kept + tf.cast(take, tf.int32)
+
+      _, keep, num_kept = tf.while_loop(
+          lambda i, *_: i < block_size,
+          _GreedyBody,
+          loop_vars=(tf.constant(0), tf.zeros_like(block_valid),
+                     tf.zeros_like(num_selected)),
+          back_prop=False)
+
+      # Append the kept candidates to the selected ones.
+      slot = num_selected[..., tf.newaxis] + tf.cumsum(
+          tf.cast(keep, tf.int32), axis=-1, exclusive=True)
+      scatter = tf.cast(tf.where(keep), tf.int32)
+      target = tf.concat(
+          [scatter[:, :2], tf.gather_nd(slot, scatter)[:, tf.newaxis]], axis=1)
+
+      def _Append(selected, block_values):
+        return tf.tensor_scatter_nd_update(selected, target,
+                                           tf.gather_nd(block_values, scatter))
+
+      return (block_start + block_size,
+              _Append(selected_bboxes, block_bboxes),
+              _Append(selected_idx, block_idx),
+              _Append(selected_scores, block_scores),
+              num_selected + num_kept)
+
+    output_shape = [batch_size, num_classes, max_boxes_per_class]
+    _, _, bbox_indices, bbox_scores, num_selected = tf.while_loop(
+        lambda block_start, *args: tf.logical_and(  # pylint: disable=g-long-lambda
+            block_start < k,
+            tf.reduce_any(args[-1] < max_boxes_per_class)),
+        _SelectBlock,
+        loop_vars=(tf.constant(0), tf.zeros(output_shape + [7]),
+                   tf.zeros(output_shape, tf.int32), tf.zeros(output_shape),
+                   tf.zeros([batch_size, num_classes], tf.int32)),
+        back_prop=False)
+    valid_mask = tf.cast(
+        tf.range(max_boxes_per_class) < num_selected[..., tf.newaxis],
+        tf.float32)
+    return bbox_indices, bbox_scores, valid_mask
+
   def CornersToImagePlane(self, corners, velo_to_image_plane):
     """Project 3d box corners to the image plane.
 
@@ -862,3 +1096,92 @@ def RandomPadOrTrimTo(tensor_list, num_points_out, seed=None):
       actual_num > num_points_out,
       _Slicing, lambda: tf.cond(tf.equal(actual_num, 0), _PadZeros, _Padding))
   return (data, padding_tensor)
+
+
+def _BEVBoxCorners(bboxes):
+  """Returns the [M, 4, 2] counter-clockwise BEV corners of [M, 7] bboxes."""
+  x, y, _, dx, dy, _, phi = tf.unstack(bboxes, axis=-1)
+  cos, sin = tf.cos(phi), tf.sin(phi)
+  dxcos, dxsin = dx / 2. * cos, dx / 2. * sin
+  dycos, dysin = dy / 2. * cos, dy / 2. * sin
+  return tf.stack([
+      tf.stack([x - dxcos + dysin, y - dxsin - dycos], axis=-1),
+      tf.stack([x + dxcos + dysin, y + dxsin - dycos], axis=-1),
+      tf.stack([x + dxcos - dysin, y + dxsin + dycos], axis=-1),
+      tf.stack([x - dxcos - dysin, y - dxsin + dycos], axis=-1),
+  ], axis=1)  # pyformat: disable
+
+
+def _Cross(a, b):
+  return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def _ConvexPolygonIntersectionArea(polygon_u, polygon_v, eps=1e-8):
+  """Intersection areas of pairs of counter-clockwise convex polygons.
+
+  The intersection is the convex hull of the vertices of each polygon inside the
+  other one and of the intersections of their edges. Its area is computed by
+  sorting these points by angle around their centroid.
+
+  Args:
+    polygon_u: [M, V, 2] vertices.
+    polygon_v: [M, V, 2] vertices.
+    eps: Tolerance of the geometric predicates.
+
+  Returns:
+    [M] intersection areas.
+  """
+
+  def _Inside(points, polygon):
+    """Whether each of [M, P, 2] points is inside [M, V, 2] polygon."""
+    edges = tf.roll(polygon, shift=-1, axis=1) - polygon
+    # [M, P, V]
+    side = _Cross(edges[:, tf.newaxis], points[:, :, tf.newaxis] -
+                  polygon[:, tf.newaxis])
+    return tf.reduce_all(side >= -eps, axis=-1)
+
+  # Intersections of every edge of u with every edge of v: [M, V, V, 2].
+  p = polygon_u[:, :, tf.newaxis]
+  r = tf.roll(polygon_u, shift=-1, axis=1)[:, :, tf.newaxis] - p
+  q = polygon_v[:, tf.newaxis]
+  s = tf.roll(polygon_v, shift=-1, axis=1)[:, tf.newaxis] - q
+  denom = _Cross(r, s)
+  is_parallel = tf.abs(denom) <= eps
+  safe_denom = tf.where(is_parallel, tf.ones_like(denom), denom)
+  t = _Cross(q - p, s) / safe_denom
+  w = _Cross(q - p, r) / safe_denom
+  edge_points = p + t[..., tf.newaxis] * r
+  edge_valid = (
+      tf.logical_not(is_parallel) & (t >= 0.) & (t <= 1.) & (w >= 0.) &
+      (w <= 1.))
+
+  m = tf.shape(polygon_u)[0]
+  points = tf.concat(
+      [polygon_u, polygon_v,
+       tf.reshape(edge_points, [m, -1, 2])], axis=1)
+  valid = tf.concat([
+      _Inside(polygon_u, polygon_v),
+      _Inside(polygon_v, polygon_u),
+      tf.reshape(edge_valid, [m, -1])
+  ], axis=1)
+
+  # Sort the valid points by angle around their centroid; invalid points are
+  # moved last and replaced by the first point, which adds no area.
+  valid_f = tf.cast(valid, points.dtype)
+  num_valid = tf.reduce_sum(valid_f, axis=1)
+  centroid = tf.reduce_sum(
+      points * valid_f[..., tf.newaxis], axis=1, keepdims=True) / tf.maximum(
+          num_valid, 1.)[:, tf.newaxis, tf.newaxis]
+  offsets = points - centroid
+  angle = tf.atan2(offsets[..., 1], offsets[..., 0])
+  angle = tf.where(valid, angle, tf.fill(tf.shape(angle), tf.cast(
+      10., angle.dtype)))
+  order = tf.argsort(angle, axis=1)
+  offsets = tf.gather(offsets, order, batch_dims=1)
+  valid = tf.gather(valid, order, batch_dims=1)
+  offsets = tf.where(
+      tf.broadcast_to(valid[..., tf.newaxis], tf.shape(offsets)), offsets,
+      tf.broadcast_to(offsets[:, :1], tf.shape(offsets)))
+  area = 0.5 * tf.abs(
+      tf.reduce_sum(_Cross(offsets, tf.roll(offsets, shift=-1, axis=1)), axis=1))
+  return tf.where((num_valid >= 3.) & (area > eps), area, tf.zeros_like(area))
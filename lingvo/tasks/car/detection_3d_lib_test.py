@@ -15,6 +15,9 @@
 # ==============================================================================
 """Tests for detection_3d_lib."""
 
+import functools
+import time
+
 from lingvo import compat as tf
 from lingvo.core import test_utils
 from lingvo.tasks.car import detection_3d_lib
@@ -471,6 +474,145 @@ class Utils3DTest(test_utils.TestCase):
       self.assertAllEqual(indices[0, 2, class_masks[2]], [2])
       self.assertAllClose(scores[0, 2, class_masks[2]], [0.49])
 
+  def testPairedIOU3DBoxes(self):
+    utils_3d = detection_3d_lib.Utils3D()
+    bboxes_u = tf.constant([[0., 0., 0., 2., 2., 2., 0.]] * 6)
+    bboxes_v = tf.constant([
+        [0., 0., 0., 2., 2., 2., 0.],  # Identical.
+        [0., 0., 0., 2., 2., 2., np.pi / 2],  # Same box rotated 90 deg.
+        [0., 0., 0., 2., 2., 2., np.pi / 4],  # Square rotated 45 deg.
+        [1., 0., 0., 2., 2., 2., 0.],  # Translated by half in x.
+        [0., 0., 1., 2., 2., 2., 0.],  # Translated by half in z.
+        [0., 0., 0., 2., 0., 2., 0.],  # Degenerate.
+    ])
+    with self.session():
+      iou = self.evaluate(utils_3d.PairedIOU3DBoxes(bboxes_u, bboxes_v))
+    self.assertAllClose([1., 1., 1. / np.sqrt(2.), 1. / 3., 1. / 3., 0.], iou)
+
+  def _OrientedNMSData(self):
+    # Same data as testOrientedNMSIndices and nms_3d_op_test.
+    bboxes = tf.constant([[
+        [10.35, 8.429, -1.003, 3.7, 1.64, 1.49, 1.582],
+        [10.35, 8.429, -1.003, 3.7, 1.64, 1.49, 0.0],
+        [11.5, 8.429, -1.003, 3.7, 1.64, 1.49, 1.0],
+        [13.01, 8.149, -0.953, 4.02, 1.55, 1.52, 1.592],
+        [13.51, 8.39, -1.0, 4.02, 1.55, 1.52, 1.592],
+        [13.51, 8.39, -1.0, 1.0, 1.0, 1.52, 1.592],
+        [13.51, 8.39, -1.0, 1.0, 1.0, 1.52, 1.9],
+    ]])
+    scores = tf.constant([[
+        [0.9, 0.09, 0.0],
+        [0.88, 0.109, 0.011],
+        [0.5, 0.01, 0.49],
+        [0.8, 0.1, 0.1],
+        [0.79, 0.12, 0.19],
+        [0.2, 0.79, 0.11],
+        [0.1, 0.9, 0.0],
+    ]])
+    return bboxes, scores
+
+  def _CheckNMSOutputs(self, outputs, expected_indices, max_boxes_per_class):
+    indices, scores, valid_mask = outputs
+    num_classes = len(expected_indices)
+    expected_shape = (1, num_classes, max_boxes_per_class)
+    self.assertEqual(expected_shape, indices.shape)
+    self.assertEqual(expected_shape, scores.shape)
+    self.assertEqual(expected_shape, valid_mask.shape)
+    for cls_idx in range(num_classes):
+      num_valid = len(expected_indices[cls_idx])
+      self.assertAllEqual([1.] * num_valid + [0.] *
+                          (max_boxes_per_class - num_valid),
+                          valid_mask[0, cls_idx])
+      self.assertAllEqual(expected_indices[cls_idx],
+                          indices[0, cls_idx, :num_valid])
+      self.assertAllEqual(np.zeros(max_boxes_per_class - num_valid),
+                          indices[0, cls_idx, num_valid:])
+
+  def testClassBatchedOrientedNMSIndices(self):
+    utils_3d = detection_3d_lib.Utils3D()
+    bboxes, scores = self._OrientedNMSData()
+    # (nms_iou_threshold, score_threshold, max_boxes_per_class, expected).
+    cases = [
+        (0.1, 0.3, 5, [[0, 3], [6], [2]]),
+        ([0.1, 0.1, 0.1], [0.01, 0.01, 0.01], 5, [[0, 3], [6, 1], [2, 4]]),
+        (0.999, 0.01, 10, [[0, 1, 3, 4, 2, 5, 6], [6, 5, 4, 1, 3, 0, 2],
+                           [2, 4, 5, 3, 1]]),
+        ([0.1, 0.1, 0.1], [0.899, 0.5, 0.3], 5, [[0], [6], [2]]),
+        # max_boxes_per_class stops the selection.
+        (0.999, 0.01, 2, [[0, 1], [6, 5], [2, 4]]),
+        # No candidates.
+        (0.1, 0.95, 3, [[], [], []]),
+    ]
+    with self.session():
+      for nms_iou_threshold, score_threshold, max_boxes, expected in cases:
+        outputs = utils_3d.ClassBatchedOrientedNMSIndices(
+            bboxes,
+            scores,
+            nms_iou_threshold=nms_iou_threshold,
+            score_threshold=score_threshold,
+            max_boxes_per_class=max_boxes)
+        self._CheckNMSOutputs(self.evaluate(outputs), expected, max_boxes)
+
+  def testClassBatchedOrientedNMSIndicesPreNMSTopK(self):
+    utils_3d = detection_3d_lib.Utils3D()
+    bboxes, scores = self._OrientedNMSData()
+    outputs = utils_3d.ClassBatchedOrientedNMSIndices(
+        bboxes,
+        scores,
+        nms_iou_threshold=0.999,
+        score_threshold=0.01,
+        max_boxes_per_class=4,
+        pre_nms_top_k=3)
+    with self.session():
+      outputs = self.evaluate(outputs)
+    self._CheckNMSOutputs(outputs, [[0, 1, 3], [6, 5, 4], [2, 4, 5]], 4)
+    self.assertAllClose([0.9, 0.88, 0.8, 0.], outputs[1][0, 0])
+
+  def testClassBatchedOrientedNMSIndicesMatchesGreedy(self):
+    utils_3d = detection_3d_lib.Utils3D()
+    np.random.seed(1234)
+    batch_size, num_boxes, num_classes = 2, 60, 3
+    bboxes = np.concatenate([
+        np.random.uniform(0., 10., size=(batch_size, num_boxes, 3)),
+        np.random.uniform(0.5, 3., size=(batch_size, num_boxes, 3)),
+        np.random.uniform(-np.pi, np.pi, size=(batch_size, num_boxes, 1)),
+    ], axis=-1).astype(np.float32)
+    scores = np.random.uniform(
+        size=(batch_size, num_boxes, num_classes)).astype(np.float32)
+    nms_iou_threshold = [0.1, 0.3, 0.5]
+    score_threshold = [0.2, 0.5, 0.1]
+    max_boxes_per_class = 20
+    with self.session():
+      # All pairwise IoUs, to run a reference greedy NMS in numpy.
+      ious = self.evaluate(
+          utils_3d.PairedIOU3DBoxes(
+              tf.tile(bboxes[:, :, np.newaxis], [1, 1, num_boxes, 1]),
+              tf.tile(bboxes[:, np.newaxis], [1, num_boxes, 1, 1])))
+      # Small blocks exercise the suppression across blocks.
+      outputs = [
+          utils_3d.ClassBatchedOrientedNMSIndices(
+              bboxes,
+              scores,
+              nms_iou_threshold,
+              score_threshold,
+              max_boxes_per_class,
+              block_size=block_size) for block_size in (7, 256)
+      ]
+      outputs = self.evaluate(outputs)
+    for b in range(batch_size):
+      for c in range(num_classes):
+        selected = []
+        for i in np.argsort(-scores[b, :, c], kind='stable'):
+          if scores[b, i, c] < score_threshold[c]:
+            break
+          if len(selected) == max_boxes_per_class:
+            break
+          if all(ious[b, i, j] <= nms_iou_threshold[c] for j in selected):
+            selected.append(i)
+        for indices, _, valid_mask in outputs:
+          num_valid = int(np.sum(valid_mask[b, c]))
+          self.assertAllEqual(selected, indices[b, c, :num_valid])
+
   def testRandomPadOrTrimToTrim(self):
     points = tf.constant([[1., 2., 3.], [4., 5., 6.], [7., 8., 9.],
                           [10., 11., 12.]])
@@ -524,5 +666,58 @@ class Utils3DTest(test_utils.TestCase):
     self.assertEqual([batch, num_boxes, 8, 2], corners_to_image_plane.shape)
 
 
+class OrientedNMSBenchmark(tf.test.Benchmark):
+  """Latency of oriented per-class NMS versus the number of candidates."""
+
+  def _Benchmark(self, name, nms_fn, num_boxes, num_classes=3):
+    np.random.seed(1234)
+    # Boxes of car-like sizes in a 150m x 150m scene, where most anchors have
+    # low scores.
+    bboxes = np.concatenate([
+        np.random.uniform(-75., 75., size=(1, num_boxes, 2)),
+        np.random.uniform(-2., 2., size=(1, num_boxes, 1)),
+        np.random.uniform(1., 5., size=(1, num_boxes, 3)),
+        np.random.uniform(-np.pi, np.pi, size=(1, num_boxes, 1)),
+    ], axis=-1).astype(np.float32)
+    scores = np.random.uniform(size=(1, num_boxes, num_classes))**4
+    with tf.Graph().as_default():
+      bboxes_ph = tf.placeholder(tf.float32, [1, None, 7])
+      scores_ph = tf.placeholder(tf.float32, [1, None, num_classes])
+      outputs = nms_fn(
+          bboxes_ph,
+          scores_ph,
+          nms_iou_threshold=0.3,
+          score_threshold=0.1,
+          max_boxes_per_class=256)
+      feed_dict = {bboxes_ph: bboxes, scores_ph: scores.astype(np.float32)}
+      with tf.Session() as sess:
+        sess.run(outputs, feed_dict)
+        iters = 5
+        start = time.time()
+        for _ in range(iters):
+          sess.run(outputs, feed_dict)
+        wall_time = (time.time() - start) / iters
+    name = '%s_%d' % (name, num_boxes)
+    print('%s: %.4fs' % (name, wall_time))
+    self.report_benchmark(name=name, iters=iters, wall_time=wall_time)
+
+  def benchmarkOrientedNMS(self):
+    utils_3d = detection_3d_lib.Utils3D()
+    for num_boxes in [1000, 4000, 16000, 64000]:
+      self._Benchmark('BatchedOrientedNMSIndices',
+                      utils_3d.BatchedOrientedNMSIndices, num_boxes)
+      self._Benchmark('ClassBatchedOrientedNMSIndices',
+                      utils_3d.ClassBatchedOrientedNMSIndices, num_boxes)
+
+  def benchmarkOrientedNMSPreNMSTopK(self):
+    utils_3d = detection_3d_lib.Utils3D()
+    for num_boxes in [1000, 4000, 16000, 64000]:
+      self._Benchmark(
+          'ClassBatchedOrientedNMSIndices_top2048',
+          functools.partial(
+              utils_3d.ClassBatchedOrientedNMSIndices, pre_nms_top_k=2048),
+          num_boxes)
+
+
 if __name__ == '__main__':
   tf.test.main()
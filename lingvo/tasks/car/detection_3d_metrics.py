@@ -20,7 +20,6 @@ from lingvo.core import metrics
 from lingvo.core import plot
 from lingvo.core import py_utils
 from lingvo.tasks.car import summary
-from lingvo.tasks.car import transform_util
 import matplotlib.colors as matplotlib_colors
 import matplotlib.patches as matplotlib_patches
 import matplotlib.patheffects as path_effects
@@ -65,7 +64,8 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
                image_width=1024,
                figsize=None,
                ground_removal_threshold=-1.35,
-               sampler_num_samples=8):
+               sampler_num_samples=8,
+               draw_num_threads=1):
     """Initialize TopDownVisualizationMetric.
 
     Args:
@@ -84,6 +84,8 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
       ground_removal_threshold: Floating point value used to color ground points
         differently.  Defaults to -1.35 which happens to work well for KITTI.
       sampler_num_samples: Number of batches to keep for visualizing.
+      draw_num_threads: Number of threads used to draw the bboxes of each
+        batch. See summary.DrawBBoxesOnImages.
     """
     self._class_id_to_name = class_id_to_name or {}
     self._image_width = image_width
@@ -95,6 +97,7 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
     self._ground_removal_threshold = ground_removal_threshold
     self._sampler = py_utils.UniformSampler(num_samples=sampler_num_samples)
     self._top_down_transform = top_down_transform
+    self._draw_num_threads = draw_num_threads
     self._summary = None
 
   def Update(self, decoded_outputs):
@@ -125,22 +128,23 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
 
   def _DrawLasers(self, images, points_xyz, points_padding, transform):
     """Draw laser points."""
-    for batch_idx in range(images.shape[0]):
-      for points_idx in range(points_xyz.shape[1]):
-        if points_padding[batch_idx, points_idx] == 0:
-          x, y, z = points_xyz[batch_idx, points_idx, :3]
-          tx, ty, _ = transform_util.TransformPoint(transform, x, y, z)
-          if tx < 0 or ty < 0 or tx >= images.shape[2] or ty >= images.shape[1]:
-            continue
-
-          # Drop ground points from visualization.
-          if z < self._ground_removal_threshold:
-            # Brown out the color for ground points.
-            color = (64, 48, 48)
-          else:
-            color = (255, 255, 255)
-
-          images[batch_idx, int(ty), int(tx), :] = color
+    points_xyz = np.asarray(points_xyz)[..., :3]
+    points = np.concatenate(
+        [points_xyz, np.ones_like(points_xyz[..., :1])], axis=-1)
+    transformed = np.matmul(points, np.asarray(transform).T)
+    tx, ty = transformed[..., 0], transformed[..., 1]
+    visible = ((np.asarray(points_padding) == 0) & (tx >= 0) & (ty >= 0) &
+               (tx < images.shape[2]) & (ty < images.shape[1]))
+    batch_ids, point_ids = np.nonzero(visible)
+    # Drop ground points from visualization.
+    is_ground = points_xyz[batch_ids, point_ids, 2] < (
+        self._ground_removal_threshold)
+    # Brown out the color for ground points.
+    colors = np.where(is_ground[:, np.newaxis],
+                      np.array([64, 48, 48], dtype=np.uint8),
+                      np.array([255, 255, 255], dtype=np.uint8))
+    images[batch_ids, ty[batch_ids, point_ids].astype(np.int64),
+           tx[batch_ids, point_ids].astype(np.int64), :] = colors
 
   def Summary(self, name):
     self._EvaluateIfNecessary(name)
@@ -189,7 +193,8 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
           gt_bboxes_2d_weights,
           labels,
           self._class_id_to_name,
-          groundtruth=True)
+          groundtruth=True,
+          num_threads=self._draw_num_threads)
 
       # Draw predicted bboxes.
       predicted_bboxes = np.where(
@@ -204,7 +209,8 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
           visualization_weights,
           visualization_labels,
           self._class_id_to_name,
-          groundtruth=False)
+          groundtruth=False,
+          num_threads=self._draw_num_threads)
 
       # Draw the difficulties on the image.
       self.DrawDifficulty(images, transformed_gt_bboxes_2d,
@@ -15,6 +15,8 @@
 # ==============================================================================
 """Functions to help with decoding detector model outputs."""
 
+import functools
+
 from lingvo import compat as tf
 from lingvo.core import py_utils
 from lingvo.tasks.car import detection_3d_lib
@@ -25,7 +27,9 @@ def DecodeWithNMS(predicted_bboxes,
                   nms_iou_threshold,
                   score_threshold,
                   max_boxes_per_class=None,
-                  use_oriented_per_class_nms=False):
+                  use_oriented_per_class_nms=False,
+                  use_class_batched_nms=False,
+                  pre_nms_top_k=None):
   """Perform NMS on predicted bounding boxes / associated logits.
 
   Args:
@@ -44,6 +48,10 @@ def DecodeWithNMS(predicted_bboxes,
         predicted_bboxes.
     use_oriented_per_class_nms: Whether to use the oriented per class NMS
       or treat everything as one class and having no orientation.
+    use_class_batched_nms: For oriented per class NMS, whether to use
+      `Utils3D.ClassBatchedOrientedNMSIndices` instead of the NMS op.
+    pre_nms_top_k: For class batched NMS, the maximum number of highest
+      scoring boxes per example and class to consider.
 
   Returns:
     bbox_indices: Indices of the boxes selected after NMS. Tensor of shape
@@ -59,7 +67,10 @@ def DecodeWithNMS(predicted_bboxes,
       [batch_size, num_classes, max_boxes_per_class].
   """
   if use_oriented_per_class_nms:
-    nms_fn = _MultiClassOrientedDecodeWithNMS
+    nms_fn = functools.partial(
+        _MultiClassOrientedDecodeWithNMS,
+        use_class_batched_nms=use_class_batched_nms,
+        pre_nms_top_k=pre_nms_top_k)
   else:
     nms_fn = _SingleClassDecodeWithNMS
 
@@ -75,7 +86,9 @@ def _MultiClassOrientedDecodeWithNMS(predicted_bboxes,
                                      classification_scores,
                                      nms_iou_threshold,
                                      score_threshold,
-                                     max_boxes_per_class=None):
+                                     max_boxes_per_class=None,
+                                     use_class_batched_nms=False,
+                                     pre_nms_top_k=None):
   """Perform Oriented Per Class NMS on predicted bounding boxes / logits.
 
   Args:
@@ -92,6 +105,10 @@ def _MultiClassOrientedDecodeWithNMS(predicted_bboxes,
       classes (like background) be set to 1 so they are discarded.
     max_boxes_per_class: The maximum number of boxes per example to emit. If
       None, this value is set to num_boxes from the shape of predicted_bboxes.
+    use_class_batched_nms: Whether to use
+      `Utils3D.ClassBatchedOrientedNMSIndices` instead of the NMS op.
+    pre_nms_top_k: For class batched NMS, the maximum number of highest
+      scoring boxes per example and class to consider.
 
   Returns:
     bbox_indices: Indices of the boxes selected after NMS. Tensor of shape
@@ -115,7 +132,12 @@ def _MultiClassOrientedDecodeWithNMS(predicted_bboxes,
     max_boxes_per_class = num_predicted_boxes
 
   # Compute NMS for every sample in the batch.
-  bbox_indices, bbox_scores, valid_mask = utils_3d.BatchedOrientedNMSIndices(
+  if use_class_batched_nms:
+    nms_fn = functools.partial(
+        utils_3d.ClassBatchedOrientedNMSIndices, pre_nms_top_k=pre_nms_top_k)
+  else:
+    nms_fn = utils_3d.BatchedOrientedNMSIndices
+  bbox_indices, bbox_scores, valid_mask = nms_fn(
       predicted_bboxes,
       classification_scores,
       nms_iou_threshold=nms_iou_threshold,
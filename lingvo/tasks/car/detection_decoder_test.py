@@ -18,6 +18,7 @@
 from lingvo import compat as tf
 from lingvo.core import test_utils
 from lingvo.tasks.car import detection_decoder
+import numpy as np
 
 
 class DetectionDecoderTest(test_utils.TestCase):
@@ -77,6 +78,60 @@ class DetectionDecoderTest(test_utils.TestCase):
               mask[:, cls_idx, :].sum(),
               (output_scores[:, cls_idx, :] > score_threshold[cls_idx]).sum())
 
+  def testDecoderWithClassBatchedNMS(self):
+    batch_size = 4
+    num_preds = 8
+    num_classes = 10
+
+    score_threshold = [1.0] * num_classes
+    score_threshold[1] = 0.05
+
+    nms_iou_threshold = [0.0] * num_classes
+    nms_iou_threshold[1] = 0.5
+
+    with tf.Graph().as_default():
+      tf.random.set_seed(12345)
+      predicted_bboxes = tf.random.normal([batch_size, num_preds, 7])
+      classification_scores = tf.random.uniform(
+          [batch_size, num_preds, num_classes], minval=0, maxval=1)
+
+      idxs, bboxes, bbox_scores, valid_mask = detection_decoder.DecodeWithNMS(
+          predicted_bboxes,
+          classification_scores,
+          nms_iou_threshold=nms_iou_threshold,
+          score_threshold=score_threshold,
+          use_oriented_per_class_nms=True,
+          use_class_batched_nms=True)
+
+      with self.session():
+        outputs = self.evaluate([
+            classification_scores, idxs, bboxes, bbox_scores, valid_mask
+        ])
+        (input_scores, output_idxs, output_bboxes, output_scores,
+         mask) = outputs
+
+        self.assertEqual((batch_size, num_classes, num_preds),
+                         output_idxs.shape)
+        self.assertEqual((batch_size, num_classes, num_preds, 7),
+                         output_bboxes.shape)
+        self.assertEqual((batch_size, num_classes, num_preds),
+                         output_scores.shape)
+        self.assertEqual((batch_size, num_classes, num_preds), mask.shape)
+
+        # No boxes of the ignored classes are selected.
+        for cls_idx in range(num_classes):
+          if cls_idx == 1:
+            continue
+          self.assertEqual(0, mask[:, cls_idx, :].sum())
+        # Every kept box of class 1 passes the score threshold.
+        self.assertGreater(mask[:, 1, :].sum(), 0)
+        self.assertLessEqual(
+            mask[:, 1, :].sum(),
+            (input_scores[:, :, 1] > score_threshold[1]).sum())
+        self.assertTrue(
+            np.all(output_scores[:, 1, :][mask[:, 1, :] > 0] >
+                   score_threshold[1]))
+
   def testDecoderSingleClassNMS(self):
     batch_size = 4
     num_preds = 8
@@ -0,0 +1,439 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Memory-mapped columnar store for groundtruth object databases.
+
+The groundtruth database used by `input_preprocessors.GroundTruthAugmentor` is
+normally a set of TFRecords of tf.Examples, one per object crop (see
+`tools/create_kitti_crop_dataset.py`), that every input worker reads, filters
+and holds in memory. This module compacts such a database once, offline, into a
+directory of flat binary columns that can be memory-mapped, so that readers
+only touch the pages of the objects they actually sample.
+
+Layout of a compacted database directory:
+
+  metadata.json: Shapes, dtypes and the filtering parameters used to build the
+    store, plus the [start, end) range of every class in `class_index.bin`.
+
+  points_xyz.bin: float32 [num_points, 3], the points of all objects,
+    concatenated.
+
+  points_feature.bin: float32 [num_points, num_point_features].
+
+  point_offsets.bin: int64 [num_objects + 1]. The points of object i are
+    rows [point_offsets[i], point_offsets[i + 1]) of the two point columns.
+
+  bboxes_3d.bin: float32 [num_objects, 7].
+
+  labels.bin: int32 [num_objects].
+
+  difficulties.bin: int32 [num_objects].
+
+  class_index.bin: int64 [num_objects]. Object ids sorted by label, so the ids
+    of one class are a contiguous slice.
+"""
+
+import json
+import os
+
+from lingvo import compat as tf
+import numpy as np
+
+_METADATA_FILENAME = 'metadata.json'
+
+# Column name -> dtype, for the per-object and per-point columns.
+_COLUMN_DTYPES = {
+    'points_xyz': np.float32,
+    'points_feature': np.float32,
+    'point_offsets': np.int64,
+    'bboxes_3d': np.float32,
+    'labels': np.int32,
+    'difficulties': np.int32,
+    'class_index': np.int64,
+}
+
+
+def _ColumnPath(db_dir, name):
+  return os.path.join(db_dir, name + '.bin')
+
+
+def ParseGroundTruthExample(serialized, num_point_features=None):
+  """Parses a serialized groundtruth tf.Example into a dict of numpy arrays.
+
+  Args:
+    serialized: A serialized tf.train.Example with the features described in
+      `tools/create_kitti_crop_dataset.py`.
+    num_point_features: Number of features per point F. If None, it is inferred
+      from the points of the object, and is 0 for objects without points.
+
+  Returns:
+    A dict with points_xyz [num_points, 3], points_feature [num_points, F],
+    bbox_3d [7], label and difficulty.
+  """
+  example = tf.train.Example.FromString(serialized)
+  feature = example.features.feature
+  num_points = int(feature['num_points'].int64_list.value[0])
+  points_xyz = np.array(
+      feature['points'].float_list.value, dtype=np.float32).reshape(
+          [num_points, 3])
+  points_feature = np.array(
+      feature['points_feature'].float_list.value, dtype=np.float32)
+  if num_point_features is None:
+    num_point_features = (
+        points_feature.shape[0] // num_points if num_points else 0)
+  points_feature = points_feature.reshape([num_points, num_point_features])
+  return {
+      'points_xyz': points_xyz,
+      'points_feature': points_feature,
+      'bbox_3d': np.array(feature['bbox_3d'].float_list.value,
+                          dtype=np.float32).reshape([7]),
+      'label': int(feature['label'].int64_list.value[0]),
+      'difficulty': int(feature['difficulty'].int64_list.value[0]),
+  }
+
+
+class GroundTruthDatabaseWriter:
+  """Streams groundtruth objects into a compacted database directory.
+
+  Points are appended to the point columns as objects are added, so memory use
+  only grows with the (small) per-object columns.
+
+  Usage:
+    with GroundTruthDatabaseWriter(output_dir, ...) as writer:
+      for obj in objects:
+        writer.Add(**obj)
+  """
+
+  def __init__(self,
+               output_dir,
+               max_num_points_per_bbox=2048,
+               filter_min_points=0,
+               filter_min_difficulty=0,
+               num_point_features=1):
+    """Constructor.
+
+    Args:
+      output_dir: Local directory to write the database to.
+      max_num_points_per_bbox: Only the first this many points of each object
+        are kept, matching `GroundTruthAugmentor.max_num_points_per_bbox`.
+      filter_min_points: Objects with fewer (kept) points are dropped.
+      filter_min_difficulty: Objects with a smaller difficulty are dropped.
+      num_point_features: Number of features per point.
+    """
+    self._output_dir = output_dir
+    self._max_num_points_per_bbox = max_num_points_per_bbox
+    self._filter_min_points = filter_min_points
+    self._filter_min_difficulty = filter_min_difficulty
+    self._num_point_features = num_point_features
+
+    tf.io.gfile.makedirs(output_dir)
+    self._points_xyz_file = open(_ColumnPath(output_dir, 'points_xyz'), 'wb')
+    self._points_feature_file = open(
+        _ColumnPath(output_dir, 'points_feature'), 'wb')
+    self._point_offsets = [0]
+    self._bboxes_3d = []
+    self._labels = []
+    self._difficulties = []
+    self._num_dropped = 0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.Close()
+
+  @property
+  def num_objects(self):
+    return len(self._labels)
+
+  @property
+  def num_dropped(self):
+    return self._num_dropped
+
+  def Add(self, points_xyz, points_feature, bbox_3d, label, difficulty):
+    """Adds one object; returns False if it was dropped by the filters."""
+    points_xyz = np.asarray(points_xyz, dtype=np.float32).reshape([-1, 3])
+    points_feature = np.asarray(
+        points_feature, dtype=np.float32).reshape(
+            [points_xyz.shape[0], self._num_point_features])
+    # TODO(vrv): Use random selection instead of first N points.
+    points_xyz = points_xyz[:self._max_num_points_per_bbox]
+    points_feature = points_feature[:self._max_num_points_per_bbox]
+    num_points = points_xyz.shape[0]
+    if (num_points < self._filter_min_points or
+        difficulty < self._filter_min_difficulty):
+      self._num_dropped += 1
+      return False
+
+    self._points_xyz_file.write(points_xyz.tobytes())
+    self._points_feature_file.write(points_feature.tobytes())
+    self._point_offsets.append(self._point_offsets[-1] + num_points)
+    self._bboxes_3d.append(np.asarray(bbox_3d, dtype=np.float32).reshape([7]))
+    self._labels.append(int(label))
+    self._difficulties.append(int(difficulty))
+    return True
+
+  def Close(self):
+    """Writes the per-object columns, the class index and the metadata."""
+    self._points_xyz_file.close()
+    self._points_feature_file.close()
+
+    labels = np.array(self._labels, dtype=np.int32)
+    num_objects = labels.shape[0]
+    columns = {
+        'point_offsets':
+            np.array(self._point_offsets),
+        'bboxes_3d':
+            np.stack(self._bboxes_3d) if num_objects else np.zeros([0, 7]),
+        'labels':
+            labels,
+        'difficulties':
+            np.array(self._difficulties),
+        'class_index':
+            np.argsort(labels, kind='stable'),
+    }
+    for name, value in columns.items():
+      with open(_ColumnPath(self._output_dir, name), 'wb') as f:
+        f.write(np.ascontiguousarray(value, dtype=_COLUMN_DTYPES[name]).tobytes())
+
+    classes, class_counts = np.unique(labels, return_counts=True)
+    class_starts = np.cumsum(class_counts) - class_counts
+    class_ranges = {
+        str(c): [int(s), int(s + n)]
+        for c, s, n in zip(classes, class_starts, class_counts)
+    }
+    metadata = {
+        'num_objects': int(num_objects),
+        'num_points': int(self._point_offsets[-1]),
+        'num_point_features': self._num_point_features,
+        'max_num_points_per_bbox': self._max_num_points_per_bbox,
+        'filter_min_points': self._filter_min_points,
+        'filter_min_difficulty': self._filter_min_difficulty,
+        'class_ranges': class_ranges,
+    }
+    with open(os.path.join(self._output_dir, _METADATA_FILENAME), 'w') as f:
+      json.dump(metadata, f, indent=2, sort_keys=True)
+
+
+def ReadMetadata(db_dir):
+  """Returns the metadata dict of the database at `db_dir`."""
+  with tf.io.gfile.GFile(os.path.join(db_dir, _METADATA_FILENAME)) as f:
+    return json.load(f)
+
+
+class GroundTruthDatabase:
+  """Read-only, memory-mapped view of a compacted groundtruth database."""
+
+  def __init__(self, db_dir):
+    self._metadata = ReadMetadata(db_dir)
+    num_objects = self._metadata['num_objects']
+    num_points = self._metadata['num_points']
+    shapes = {
+        'points_xyz': (num_points, 3),
+        'points_feature': (num_points, self._metadata['num_point_features']),
+        'point_offsets': (num_objects + 1,),
+        'bboxes_3d': (num_objects, 7),
+        'labels': (num_objects,),
+        'difficulties': (num_objects,),
+        'class_index': (num_objects,),
+    }
+    self._columns = {}
+    for name, shape in shapes.items():
+      if np.prod(shape) == 0:
+        # np.memmap does not support empty files.
+        self._columns[name] = np.zeros(shape, dtype=_COLUMN_DTYPES[name])
+      else:
+        self._columns[name] = np.memmap(
+            _ColumnPath(db_dir, name),
+            dtype=_COLUMN_DTYPES[name],
+            mode='r',
+            shape=shape)
+    offsets = self._columns['point_offsets']
+    self._num_points = np.diff(offsets).astype(np.int32)
+
+  @property
+  def metadata(self):
+    return self._metadata
+
+  @property
+  def num_objects(self):
+    return self._metadata['num_objects']
+
+  @property
+  def labels(self):
+    return self._columns['labels']
+
+  @property
+  def difficulties(self):
+    return self._columns['difficulties']
+
+  @property
+  def bboxes_3d(self):
+    return self._columns['bboxes_3d']
+
+  @property
+  def num_points(self):
+    """[num_objects] int32 number of stored points of each object."""
+    return self._num_points
+
+  def ClassIndices(self, label):
+    """Returns the ids of all objects with `label`, without copying."""
+    start, end = self._metadata['class_ranges'].get(str(label), (0, 0))
+    return self._columns['class_index'][start:end]
+
+  def EligibleIndices(self,
+                      min_points=0,
+                      max_points=None,
+                      max_num_points_per_bbox=None,
+                      min_difficulty=0,
+                      labels=None):
+    """Returns the sorted int64 ids of the objects passing the static filters.
+
+    Args:
+      min_points: Minimum number of points of an object.
+      max_points: If set, maximum number of points of an object.
+      max_num_points_per_bbox: If set, the point counts used for filtering are
+        first clipped to this value.
+      min_difficulty: Minimum difficulty of an object.
+      labels: If set, a list of labels that objects must have one of. Only the
+        per-class indices of these labels are visited.
+
+    Returns:
+      A sorted int64 array of object ids.
+    """
+    if labels is None:
+      ids = np.arange(self.num_objects, dtype=np.int64)
+    else:
+      ids = np.sort(
+          np.concatenate([np.asarray(self.ClassIndices(l)) for l in labels] +
+                         [np.zeros([0], dtype=np.int64)]))
+    num_points = self._num_points[ids]
+    if max_num_points_per_bbox is not None:
+      num_points = np.minimum(num_points, max_num_points_per_bbox)
+    keep = num_points >= min_points
+    if max_points:
+      keep &= num_points <= max_points
+    if min_difficulty:
+      keep &= self.difficulties[ids] >= min_difficulty
+    return ids[keep]
+
+  def AcceptanceProbability(self,
+                            difficulty_sampling_probability=None,
+                            class_sampling_probability=None):
+    """Returns the per-object sampling probability, or None if uniform.
+
+    Args:
+      difficulty_sampling_probability: Optional list of sampling probabilities
+        indexed by difficulty.
+      class_sampling_probability: Optional list of sampling probabilities
+        indexed by label.
+
+    Returns:
+      A [num_objects] float32 array, the product of the probabilities of the
+      difficulty and label of each object (0 if out of range), or None if
+      neither is given.
+    """
+
+    def _Lookup(probs, values):
+      probs = np.asarray(probs, dtype=np.float32)
+      values = np.asarray(values)
+      in_range = (values >= 0) & (values < probs.shape[0])
+      return np.where(in_range, probs[np.clip(values, 0, probs.shape[0] - 1)],
+                      np.float32(0.))
+
+    acceptance_prob = None
+    if difficulty_sampling_probability is not None:
+      acceptance_prob = _Lookup(difficulty_sampling_probability,
+                                self.difficulties)
+    if class_sampling_probability is not None:
+      class_prob = _Lookup(class_sampling_probability, self.labels)
+      acceptance_prob = (
+          class_prob if acceptance_prob is None else acceptance_prob *
+          class_prob)
+    return acceptance_prob
+
+  def Gather(self, object_ids, max_num_points_per_bbox):
+    """Gathers objects into padded arrays.
+
+    Only the rows of the selected objects are read from the memory-mapped
+    columns.
+
+    Args:
+      object_ids: A [K] int array of object ids.
+      max_num_points_per_bbox: Number of points P to pad or trim each object to.
+
+    Returns:
+      A tuple (points_xyz [K, P, 3] float32, points_feature [K, P, F] float32,
+      points_mask [K, P] bool, bboxes_3d [K, 7] float32, labels [K] int32,
+      difficulties [K] int32).
+    """
+    object_ids = np.asarray(object_ids, dtype=np.int64)
+    num_objects = object_ids.shape[0]
+    num_features = self._metadata['num_point_features']
+    offsets = self._columns['point_offsets']
+    points_xyz = np.zeros([num_objects, max_num_points_per_bbox, 3],
+                          dtype=np.float32)
+    points_feature = np.zeros(
+        [num_objects, max_num_points_per_bbox, num_features], dtype=np.float32)
+    points_mask = np.zeros([num_objects, max_num_points_per_bbox], dtype=bool)
+    for i, object_id in enumerate(object_ids):
+      start = offsets[object_id]
+      n = min(offsets[object_id + 1] - start, max_num_points_per_bbox)
+      points_xyz[i, :n] = self._columns['points_xyz'][start:start + n]
+      points_feature[i, :n] = self._columns['points_feature'][start:start + n]
+      points_mask[i, :n] = True
+    return (points_xyz, points_feature, points_mask,
+            np.asarray(self.bboxes_3d[object_ids], dtype=np.float32),
+            np.asarray(self.labels[object_ids], dtype=np.int32),
+            np.asarray(self.difficulties[object_ids], dtype=np.int32))
+
+  def Sample(self, rng, eligible_ids, num_samples, acceptance_prob=None):
+    """Samples objects uniformly without replacement.
+
+    If `acceptance_prob` is given, every drawn object is independently kept with
+    its acceptance probability, which is equivalent to first thinning the whole
+    database and then sampling from what is left, but only visits as many
+    objects as needed.
+
+    Args:
+      rng: A np.random.Generator.
+      eligible_ids: An int array of ids to sample from, e.g. from
+        `EligibleIndices`.
+      num_samples: Maximum number of ids to return.
+      acceptance_prob: Optional [num_objects] float array indexed by object id.
+
+    Returns:
+      An int64 array of at most `num_samples` object ids, in random order.
+    """
+    eligible_ids = np.asarray(eligible_ids, dtype=np.int64)
+    num_eligible = eligible_ids.shape[0]
+    if acceptance_prob is None:
+      num_draws = min(num_samples, num_eligible)
+      return rng.choice(eligible_ids, size=num_draws, replace=False)
+
+    # Visit the eligible objects in a uniformly random order, first drawing a
+    # prefix that most likely contains enough accepted objects, and only if not,
+    # the rest of the permutation.
+    def _Accept(candidates):
+      keep = rng.uniform(size=candidates.shape[0]) < acceptance_prob[candidates]
+      return candidates[keep]
+
+    num_draws = min(4 * num_samples, num_eligible)
+    order = rng.choice(num_eligible, size=num_draws, replace=False)
+    accepted = _Accept(eligible_ids[order])
+    if accepted.shape[0] < num_samples and num_draws < num_eligible:
+      rest = rng.permutation(np.setdiff1d(np.arange(num_eligible), order))
+      accepted = np.concatenate([accepted, _Accept(eligible_ids[rest])])
+    return accepted[:num_samples]
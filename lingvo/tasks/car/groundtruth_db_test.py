@@ -0,0 +1,164 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for groundtruth_db."""
+
+import os
+
+from lingvo import compat as tf
+from lingvo.core import py_utils
+from lingvo.core import test_utils
+from lingvo.tasks.car import groundtruth_db
+from lingvo.tasks.car import input_preprocessors
+import numpy as np
+
+
+def _MakeExample(num_points, label, difficulty, center):
+  example = tf.train.Example()
+  feature = example.features.feature
+  points = np.tile(np.array(center, np.float32), [num_points, 1])
+  feature['num_points'].int64_list.value[:] = [num_points]
+  feature['points'].float_list.value[:] = points.ravel().tolist()
+  feature['points_feature'].float_list.value[:] = (
+      np.arange(num_points, dtype=np.float32).tolist())
+  feature['bbox_3d'].float_list.value[:] = list(center) + [1., 1., 1., 0.]
+  feature['label'].int64_list.value[:] = [label]
+  feature['difficulty'].int64_list.value[:] = [difficulty]
+  return example.SerializeToString()
+
+
+class GroundTruthDatabaseTest(test_utils.TestCase):
+
+  def _WriteDatabase(self, **kwargs):
+    db_dir = os.path.join(self.get_temp_dir(), 'gt_db')
+    # (num_points, label, difficulty) of each object.
+    self._objects = [(10, 1, 1), (2, 1, 1), (20, 2, 0), (5, 3, 2), (8, 2, 3)]
+    with groundtruth_db.GroundTruthDatabaseWriter(db_dir, **kwargs) as writer:
+      for i, (num_points, label, difficulty) in enumerate(self._objects):
+        writer.Add(**groundtruth_db.ParseGroundTruthExample(
+            _MakeExample(num_points, label, difficulty,
+                         [10. * i, 0., 0.])))
+    return db_dir
+
+  def testWriteAndRead(self):
+    db_dir = self._WriteDatabase(
+        max_num_points_per_bbox=8, filter_min_points=3)
+    db = groundtruth_db.GroundTruthDatabase(db_dir)
+    # The object with 2 points is dropped.
+    self.assertEqual(4, db.num_objects)
+    self.assertAllEqual([1, 2, 3, 2], db.labels)
+    self.assertAllEqual([1, 0, 2, 3], db.difficulties)
+    # Points are trimmed to max_num_points_per_bbox.
+    self.assertAllEqual([8, 8, 5, 8], db.num_points)
+    self.assertAllEqual([1, 3], db.ClassIndices(2))
+    self.assertAllEqual([], db.ClassIndices(7))
+
+    points_xyz, points_feature, points_mask, bboxes, labels, difficulties = (
+        db.Gather([2, 0], 6))
+    self.assertAllEqual([2, 6, 3], points_xyz.shape)
+    self.assertAllEqual([2, 6, 1], points_feature.shape)
+    self.assertAllEqual([[1, 1, 1, 1, 1, 0], [1, 1, 1, 1, 1, 1]], points_mask)
+    self.assertAllClose([30., 0., 0.], points_xyz[0, 0])
+    self.assertAllClose([0., 1., 2., 3., 4., 0.], points_feature[0, :, 0])
+    self.assertAllClose([0., 0., 0., 1., 1., 1., 0.], bboxes[1])
+    self.assertAllEqual([3, 1], labels)
+    self.assertAllEqual([2, 1], difficulties)
+
+  def testObjectWithoutPoints(self):
+    serialized = _MakeExample(0, 1, 1, [0., 0., 0.])
+    parsed = groundtruth_db.ParseGroundTruthExample(serialized)
+    self.assertAllEqual([0, 3], parsed['points_xyz'].shape)
+    self.assertAllEqual([0, 0], parsed['points_feature'].shape)
+    parsed = groundtruth_db.ParseGroundTruthExample(
+        serialized, num_point_features=1)
+    self.assertAllEqual([0, 1], parsed['points_feature'].shape)
+
+    db_dir = os.path.join(self.get_temp_dir(), 'gt_db_empty')
+    with groundtruth_db.GroundTruthDatabaseWriter(db_dir) as writer:
+      for num_points in (3, 0, 2):
+        writer.Add(**groundtruth_db.ParseGroundTruthExample(
+            _MakeExample(num_points, 1, 1, [1., 2., 3.])))
+    db = groundtruth_db.GroundTruthDatabase(db_dir)
+    self.assertEqual(3, db.num_objects)
+    self.assertAllEqual([3, 0, 2], db.num_points)
+    points_xyz, points_feature, points_mask, _, _, _ = db.Gather([1, 2], 4)
+    self.assertAllEqual([[0, 0, 0, 0], [1, 1, 0, 0]], points_mask)
+    self.assertAllClose([1., 2., 3.], points_xyz[1, 1])
+    self.assertAllClose([0., 1., 0., 0.], points_feature[1, :, 0])
+
+  def testEligibleIndices(self):
+    db = groundtruth_db.GroundTruthDatabase(self._WriteDatabase())
+    self.assertAllEqual([0, 2, 3, 4], db.EligibleIndices(min_points=5))
+    self.assertAllEqual([0, 3, 4],
+                        db.EligibleIndices(min_points=5, max_points=10))
+    self.assertAllEqual([0, 2, 4],
+                        db.EligibleIndices(
+                            min_points=5,
+                            max_points=10,
+                            max_num_points_per_bbox=6,
+                            labels=[1, 2]))
+    self.assertAllEqual([3, 4], db.EligibleIndices(min_difficulty=2))
+
+  def testSample(self):
+    db = groundtruth_db.GroundTruthDatabase(self._WriteDatabase())
+    rng = np.random.default_rng(1234)
+    eligible = db.EligibleIndices()
+    samples = db.Sample(rng, eligible, 3)
+    self.assertLen(samples, 3)
+    self.assertLen(set(samples.tolist()), 3)
+    self.assertLen(db.Sample(rng, eligible, 10), 5)
+
+    # Only objects with label 2 can be accepted.
+    acceptance_prob = db.AcceptanceProbability(
+        class_sampling_probability=[0., 0., 1.])
+    self.assertAllClose([0., 0., 1., 0., 1.], acceptance_prob)
+    for _ in range(10):
+      self.assertCountEqual([2, 4],
+                            db.Sample(rng, eligible, 10, acceptance_prob))
+    self.assertLen(db.Sample(rng, eligible, 1, acceptance_prob), 1)
+
+  def testGroundTruthAugmentorWithIndex(self):
+    db_dir = self._WriteDatabase(max_num_points_per_bbox=16)
+    p = input_preprocessors.GroundTruthAugmentor.Params().Set(
+        groundtruth_database_index=db_dir,
+        max_num_points_per_bbox=16,
+        max_augmented_bboxes=2,
+        label_filter=[2])
+    features = py_utils.NestedMap(
+        lasers=py_utils.NestedMap(
+            points_xyz=tf.zeros([4, 3]),
+            points_feature=tf.zeros([4, 1]),
+            points_padding=tf.constant([0., 0., 1., 1.])),
+        labels=py_utils.NestedMap(
+            bboxes_3d=tf.constant([[-100., 0., 0., 1., 1., 1., 0.]] +
+                                  [[0.] * 7] * 3),
+            bboxes_3d_mask=tf.constant([1., 0., 0., 0.]),
+            labels=tf.constant([1, 0, 0, 0])))
+    features = p.Instantiate().TransformFeatures(features)
+    with self.session() as sess:
+      features = sess.run(features)
+    self.assertAllEqual([1., 1., 1., 0.], features.labels.bboxes_3d_mask)
+    self.assertAllEqual([1, 2, 2], features.labels.labels[:3])
+
+  def testGroundTruthAugmentorRejectsStricterIndex(self):
+    db_dir = self._WriteDatabase(filter_min_points=5)
+    p = input_preprocessors.GroundTruthAugmentor.Params().Set(
+        groundtruth_database_index=db_dir, filter_min_points=0)
+    with self.assertRaisesRegex(ValueError, 'stricter'):
+      p.Instantiate()
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -15,6 +15,8 @@
 # ==============================================================================
 """Input preprocessors."""
 
+import threading
+
 from lingvo import compat as tf
 from lingvo.core import base_layer
 from lingvo.core import py_utils
@@ -22,7 +24,9 @@ from lingvo.core import schedule
 from lingvo.tasks.car import car_lib
 from lingvo.tasks.car import detection_3d_lib
 from lingvo.tasks.car import geometry
+from lingvo.tasks.car import groundtruth_db
 from lingvo.tasks.car import ops
+from lingvo.tasks.car import voxel_hash
 import numpy as np
 # pylint:disable=g-direct-tensorflow-import
 from tensorflow.python.ops import inplace_ops
@@ -807,10 +811,7 @@ class GridToPillars(Preprocessor):
   def _GumbelTransform(self, probs):
     """Adds gumbel noise to log probabilities for multinomial sampling.
 
-    This enables fast sampling from a multinomial distribution without
-    replacement. See https://arxiv.org/abs/1611.01144 for details.
-    A colab that demonstrates this in practice is here:
-    http://colab/drive/1iuMt2n_r7dKPQG9T0UVMuK3fkbBayKjd
+    See voxel_hash.GumbelTransform.
 
     Args:
       probs: A 1-D float tensor containing probabilities, summing to 1.
@@ -820,16 +821,7 @@ class GridToPillars(Preprocessor):
       log probabilities. Taking the top k elements from this provides a
       multinomial sample without replacement.
     """
-    p = self.params
-    log_prob = tf.math.log(probs)
-    probs_shape = tf.shape(probs)
-    uniform_samples = tf.random.uniform(
-        shape=probs_shape,
-        dtype=probs.dtype,
-        seed=p.random_seed,
-        name='uniform_samples')
-    gumbel_noise = -tf.math.log(-tf.math.log(uniform_samples))
-    return gumbel_noise + log_prob
+    return voxel_hash.GumbelTransform(probs, seed=self.params.random_seed)
 
   def _DensitySample(self, num_points):
     p = self.params
@@ -925,6 +917,121 @@ class GridToPillars(Preprocessor):
     return dtypes
 
 
+class PointsToPillars(PointsToGrid):
+  """Bins points into pillars directly, using a voxel spatial hash.
+
+  A fast path equivalent to PointsToGrid followed by GridToPillars with
+  drop_laser_grid=True. Points are grouped by cell with sort and segment ops
+  (see voxel_hash.PointsToPillars), and only the points of the selected pillars
+  are gathered, so the [gx, gy, gz, num_points_per_cell, F] laser_grid is never
+  materialized.
+
+  Expects the same features as PointsToGrid.
+
+  Adds the following features:
+    grid_centers: [gx, gy, gz, 3]: For each grid cell, the (x,y,z)
+      floating point coordinate of its center.
+
+    grid_num_points: [gx, gy, gz]: The number of points in each grid
+      cell (integer).
+
+    pillar_count: []. The number of non-padded pillars.
+
+    pillar_locations: [num_pillars, 3]. The grid location of each pillar.
+
+    pillar_points: [num_pillars, num_points_per_cell, F]. Points of each
+    pillar.
+
+    pillar_centers: [num_pillars, 1, 3]. The center of each pillar.
+
+  Modifies the bboxes in labels to also be within the grid range x/y by default.
+  """
+
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.Define('num_pillars', 12000, 'The maximum number of pillars to produce.')
+    p.Define('use_density_sampler', False,
+             'Use a density based sampler during pillar selection.')
+    return p
+
+  def TransformFeatures(self, features):
+    p = self.params
+
+    points_xyz = features.lasers.points_xyz
+    points_feature = features.lasers.points_feature
+    points_padding = features.lasers.get('points_padding', None)
+
+    points_full = tf.concat([points_xyz, points_feature], axis=-1)
+    pillars = voxel_hash.PointsToPillars(
+        points_full,
+        points_padding,
+        num_points_per_cell=p.num_points_per_cell,
+        num_pillars=p.num_pillars,
+        grid_size=p.grid_size,
+        grid_range_x=p.grid_range_x,
+        grid_range_y=p.grid_range_y,
+        grid_range_z=p.grid_range_z,
+        density_sampling=p.use_density_sampler,
+        seed=p.random_seed)
+
+    grid_coords = tf.stack(
+        tf.meshgrid(
+            tf.range(p.grid_size[0]),
+            tf.range(p.grid_size[1]),
+            tf.range(p.grid_size[2]),
+            indexing='ij'),
+        axis=-1)
+    features.grid_centers = voxel_hash.GridCellCenters(grid_coords,
+                                                       p.grid_size,
+                                                       p.grid_range_x,
+                                                       p.grid_range_y,
+                                                       p.grid_range_z)
+    features.grid_num_points = pillars.grid_num_points
+    features.pillar_count = pillars.pillar_count
+    features.pillar_locations = pillars.pillar_locations
+    features.pillar_points = pillars.pillar_points
+    features.pillar_centers = pillars.pillar_centers
+
+    if p.normalize_td_labels:
+      # Normalize bboxes_td w.r.t grid range.
+      obb = features.labels
+      ymin, xmin, ymax, xmax = tf.unstack(obb.bboxes_td[..., :4], axis=-1)
+      ymin, xmin, ymax, xmax = self._NormalizeLabels(
+          ymin,
+          xmin,
+          ymax,
+          xmax,
+          x_range=p.grid_range_x,
+          y_range=p.grid_range_y)
+      obb.bboxes_td = tf.concat(
+          [tf.stack([ymin, xmin, ymax, xmax], axis=-1), obb.bboxes_td[..., 4:]],
+          axis=-1)
+
+    return features
+
+  def TransformShapes(self, shapes):
+    p = self.params
+    num_features = 3 + shapes.lasers.points_feature[-1]
+    shapes.grid_centers = tf.TensorShape(list(p.grid_size) + [3])
+    shapes.grid_num_points = tf.TensorShape(list(p.grid_size))
+    shapes.pillar_count = tf.TensorShape([])
+    shapes.pillar_locations = tf.TensorShape([p.num_pillars, 3])
+    shapes.pillar_points = tf.TensorShape(
+        [p.num_pillars, p.num_points_per_cell, num_features])
+    shapes.pillar_centers = tf.TensorShape([p.num_pillars, 1, 3])
+    return shapes
+
+  def TransformDTypes(self, dtypes):
+    dtypes.grid_centers = tf.float32
+    dtypes.grid_num_points = tf.int32
+    dtypes.pillar_count = tf.int32
+    dtypes.pillar_locations = tf.int32
+    dtypes.pillar_points = tf.float32
+    dtypes.pillar_centers = tf.float32
+    return dtypes
+
+
 class GridAnchorCenters(Preprocessor):
   """Create anchor centers on a grid.
 
@@ -1021,7 +1128,9 @@ class SparseCenterSelector(Preprocessor):
       the center (x, y, z) locations for each cell to featurize.
   """
 
-  _SAMPLING_METHODS = ['farthest_point', 'random_uniform']
+  _SAMPLING_METHODS = [
+      'farthest_point', 'voxel_farthest_point', 'random_uniform'
+  ]
 
   @classmethod
   def Params(cls):
@@ -1036,7 +1145,20 @@ class SparseCenterSelector(Preprocessor):
         'instead, a copy will be made.')
     p.Define(
         'sampling_method', 'farthest_point',
-        'Which sampling method to use. One of {}'.format(cls._SAMPLING_METHODS))
+        'Which sampling method to use. One of {}. voxel_farthest_point is '
+        'an approximation of farthest_point that is faster on large point '
+        'clouds, with a slightly larger coverage radius, see '
+        'car_lib.VoxelFarthestPointSampler.'.format(
+            cls._SAMPLING_METHODS))
+    p.Define(
+        'fps_num_candidates', None,
+        'For voxel_farthest_point sampling, the number of voxel-bucketed '
+        'candidate points. Defaults to 8 * num_cell_centers.')
+    p.Define(
+        'fps_voxel_size', None,
+        'For voxel_farthest_point sampling, the voxel edge length. If None, '
+        'it is chosen such that the point cloud spans about '
+        'fps_num_candidates voxels.')
     p.Define(
         'fix_z_to_zero', True, 'Whether to fix z to 0 when retrieving the '
         'center xyz coordinates.')
@@ -1079,12 +1201,22 @@ class SparseCenterSelector(Preprocessor):
     points_padding = py_utils.PadOrTrimTo(
         points_padding, [padded_num_points], pad_val=1.0)
 
-    sampled_idx, _ = car_lib.FarthestPointSampler(
-        points_xy[tf.newaxis, ...],
-        points_padding[tf.newaxis, ...],
-        p.num_cell_centers,
-        num_seeded_points=num_seeded_points,
-        random_seed=p.random_seed)
+    if p.sampling_method == 'voxel_farthest_point':
+      sampled_idx, _ = car_lib.VoxelFarthestPointSampler(
+          points_xy[tf.newaxis, ...],
+          points_padding[tf.newaxis, ...],
+          p.num_cell_centers,
+          num_candidates=p.fps_num_candidates,
+          voxel_size=p.fps_voxel_size,
+          num_seeded_points=num_seeded_points,
+          random_seed=p.random_seed)
+    else:
+      sampled_idx, _ = car_lib.FarthestPointSampler(
+          points_xy[tf.newaxis, ...],
+          points_padding[tf.newaxis, ...],
+          p.num_cell_centers,
+          num_seeded_points=num_seeded_points,
+          random_seed=p.random_seed)
     sampled_idx = sampled_idx[0, :]
 
     # Gather centers.
@@ -1121,7 +1253,7 @@ class SparseCenterSelector(Preprocessor):
 
   def _SampleCenters(self, points_xyz, num_seeded_points):
     p = self.params
-    if p.sampling_method == 'farthest_point':
+    if p.sampling_method in ('farthest_point', 'voxel_farthest_point'):
       return self._FarthestPointSampleCenters(points_xyz, num_seeded_points)
     elif p.sampling_method == 'random_uniform':
       if num_seeded_points > 0:
@@ -1199,6 +1331,15 @@ class SparseCellGatherFeatures(Preprocessor):
         'Whether to sample the neighbor points for every cell center '
         'uniformly at random. If False, this will default to selecting by '
         'distance.')
+    p.Define(
+        'use_spatial_hash', False,
+        'If True, find the points near each cell center with a voxel spatial '
+        'hash instead of a dense [centers, points] distance matrix. See '
+        'voxel_hash.NeighborhoodIndices.')
+    p.Define(
+        'max_points_per_hash_cell', 128,
+        'If use_spatial_hash, the maximum number of candidate points per '
+        'hash cell of size max_distance.')
     return p
 
   def TransformFeatures(self, features):
@@ -1225,7 +1366,9 @@ class SparseCellGatherFeatures(Preprocessor):
         p.num_points_per_cell,
         points_padding=None,
         max_distance=p.max_distance,
-        sample_neighbors_uniformly=p.sample_neighbors_uniformly)
+        sample_neighbors_uniformly=p.sample_neighbors_uniformly,
+        use_spatial_hash=p.use_spatial_hash,
+        max_points_per_cell=p.max_points_per_hash_cell)
 
     # Take first example since NeighboorhoodIndices expects batch dimension.
     sample_indices = sample_indices[0, :, :]
@@ -2724,8 +2867,100 @@ class GroundTruthAugmentor(Preprocessor):
         'usage. Setting to False loads the whole ground truth database into '
         'memory. Otherwise, only a fraction of the data will be loaded into '
         'the memory.')
+    p.Define(
+        'groundtruth_database_index', None,
+        'If not None, a directory holding a groundtruth database compacted '
+        'by tools/compact_groundtruth_db.py. Objects are then sampled from '
+        'the memory-mapped store instead of reading groundtruth_database, '
+        'so startup time and memory do not grow with the database size.')
     return p
 
+  def __init__(self, params):
+    super().__init__(params)
+    p = self.params
+    if p.groundtruth_database_index:
+      metadata = groundtruth_db.ReadMetadata(p.groundtruth_database_index)
+      if p.max_num_points_per_bbox > metadata['max_num_points_per_bbox']:
+        raise ValueError(
+            'max_num_points_per_bbox={} is larger than the {} points per bbox '
+            'kept in {}.'.format(p.max_num_points_per_bbox,
+                                 metadata['max_num_points_per_bbox'],
+                                 p.groundtruth_database_index))
+      if (p.filter_min_points < metadata['filter_min_points'] or
+          (p.difficulty_sampling_probability is None and
+           p.filter_min_difficulty < metadata['filter_min_difficulty'])):
+        raise ValueError(
+            'The groundtruth database index at {} was built with stricter '
+            'filters (filter_min_points={}, filter_min_difficulty={}) than '
+            'this augmentor uses.'.format(p.groundtruth_database_index,
+                                          metadata['filter_min_points'],
+                                          metadata['filter_min_difficulty']))
+
+  def _SampleIndexedDB(self, num_samples):
+    """Samples filtered objects from the compacted groundtruth database.
+
+    Applies the same filters as `_CreateExampleFilter` on the host, and only
+    reads the sampled objects from the memory-mapped store.
+
+    Args:
+      num_samples: Scalar int32 Tensor, the maximum number of objects to sample.
+
+    Returns:
+      A NestedMap of the same Tensors as `_ReadDB`, for the K <= num_samples
+      sampled objects, in random order.
+    """
+    p = self.params
+    state = {}
+    lock = threading.Lock()
+
+    def _Sample(num_samples):
+      """Host-side sampling."""
+      with lock:
+        return _SampleLocked(num_samples)
+
+    def _SampleLocked(num_samples):
+      if not state:
+        db = groundtruth_db.GroundTruthDatabase(p.groundtruth_database_index)
+        labels = None
+        if p.class_sampling_probability is None and p.label_filter:
+          labels = p.label_filter
+        state['db'] = db
+        state['rng'] = np.random.default_rng(p.random_seed)
+        state['eligible_ids'] = db.EligibleIndices(
+            min_points=p.filter_min_points,
+            max_points=p.filter_max_points,
+            max_num_points_per_bbox=p.max_num_points_per_bbox,
+            min_difficulty=(p.filter_min_difficulty
+                            if p.difficulty_sampling_probability is None else
+                            0),
+            labels=labels)
+        state['acceptance_prob'] = db.AcceptanceProbability(
+            p.difficulty_sampling_probability, p.class_sampling_probability)
+      db = state['db']
+      object_ids = db.Sample(state['rng'], state['eligible_ids'],
+                             int(num_samples), state['acceptance_prob'])
+      return db.Gather(object_ids, p.max_num_points_per_bbox)
+
+    outputs = tf.numpy_function(
+        _Sample, [num_samples],
+        [tf.float32, tf.float32, tf.bool, tf.float32, tf.int32, tf.int32])
+    (db_points_xyz, db_points_feature, db_points_mask, db_bboxes, db_labels,
+     db_difficulties) = outputs
+    max_points = p.max_num_points_per_bbox
+    db_points_xyz.set_shape([None, max_points, 3])
+    db_points_feature.set_shape([None, max_points, None])
+    db_points_mask.set_shape([None, max_points])
+    db_bboxes.set_shape([None, 7])
+    db_labels.set_shape([None])
+    db_difficulties.set_shape([None])
+    return py_utils.NestedMap(
+        points_xyz=db_points_xyz,
+        points_feature=db_points_feature,
+        points_mask=db_points_mask,
+        bboxes_3d=db_bboxes,
+        labels=db_labels,
+        difficulties=db_difficulties)
+
   def _ReadDB(self, file_patterns):
     """Read the groundtruth database and return as a NestedMap of Tensors."""
     p = self.params
@@ -2920,10 +3155,6 @@ class GroundTruthAugmentor(Preprocessor):
   def TransformFeatures(self, features):
     p = self.params
 
-    tf.logging.info('Loading groundtruth database at %s' %
-                    (p.groundtruth_database))
-    db = self._ReadDB(p.groundtruth_database)
-
     original_features_shape = tf.shape(features.lasers.points_feature)
 
     # Compute the number of bboxes to augment.
@@ -2933,21 +3164,32 @@ class GroundTruthAugmentor(Preprocessor):
     num_augmented_bboxes = tf.minimum(max_bboxes - num_bboxes_in_scene,
                                       p.max_augmented_bboxes)
 
-    # Compute an object index over all objects in the database.
-    num_objects_in_database = tf.shape(db.points_xyz)[0]
-    db_idx = tf.range(num_objects_in_database)
-
-    # Find those indices whose examples pass the filters, and select only those
-    # indices.
-    example_filter = self._CreateExampleFilter(db)
-    db_idx = tf.boolean_mask(db_idx, example_filter)
-
-    # At this point, we might still have a large number of object candidates,
-    # from which we only need a sample.
-    # To reduce the amount of computation, we randomly subsample to slightly
-    # more than we want to augment.
-    db_idx = tf.random.shuffle(
-        db_idx, seed=p.random_seed)[0:num_augmented_bboxes * 5]
+    if p.groundtruth_database_index:
+      tf.logging.info('Sampling groundtruth database index at %s' %
+                      (p.groundtruth_database_index))
+      # The sampled objects already pass the filters and are in random order.
+      db = self._SampleIndexedDB(num_augmented_bboxes * 5)
+      db_idx = tf.range(tf.shape(db.points_xyz)[0])
+    else:
+      tf.logging.info('Loading groundtruth database at %s' %
+                      (p.groundtruth_database))
+      db = self._ReadDB(p.groundtruth_database)
+
+      # Compute an object index over all objects in the database.
+      num_objects_in_database = tf.shape(db.points_xyz)[0]
+      db_idx = tf.range(num_objects_in_database)
+
+      # Find those indices whose examples pass the filters, and select only
+      # those indices.
+      example_filter = self._CreateExampleFilter(db)
+      db_idx = tf.boolean_mask(db_idx, example_filter)
+
+      # At this point, we might still have a large number of object candidates,
+      # from which we only need a sample.
+      # To reduce the amount of computation, we randomly subsample to slightly
+      # more than we want to augment.
+      db_idx = tf.random.shuffle(
+          db_idx, seed=p.random_seed)[0:num_augmented_bboxes * 5]
 
     # After filtering, further filter out the db boxes that would occlude with
     # other boxes (including other database boxes).
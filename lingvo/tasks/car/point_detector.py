@@ -62,6 +62,15 @@ class PointDetectorBase(base_model.BaseTask):
     p.Define(
         'use_oriented_per_class_nms', False,
         'Whether to use oriented per class nms or single class non-oriented.')
+    p.Define(
+        'use_class_batched_nms', False,
+        'For oriented per class nms, whether to run the class batched graph '
+        'implementation (Utils3D.ClassBatchedOrientedNMSIndices) instead of '
+        'the NMS op.')
+    p.Define(
+        'nms_pre_top_k', None,
+        'For class batched nms, if set, only this many highest scoring boxes '
+        'per example and class are considered.')
     p.Define(
         'inference_batch_size', None,
         'If specified, hardcodes the inference batch size to this value. '
@@ -211,7 +220,9 @@ class PointDetectorBase(base_model.BaseTask):
               nms_iou_threshold=p.nms_iou_threshold,
               score_threshold=p.nms_score_threshold,
               max_boxes_per_class=p.max_nms_boxes,
-              use_oriented_per_class_nms=p.use_oriented_per_class_nms))
+              use_oriented_per_class_nms=p.use_oriented_per_class_nms,
+              use_class_batched_nms=p.use_class_batched_nms,
+              pre_nms_top_k=p.nms_pre_top_k))
       per_cls_bbox_scores *= per_cls_valid_mask
 
       # TODO(vrv): Fix the inference graph for KITTI, since we need
@@ -253,7 +264,9 @@ class PointDetectorBase(base_model.BaseTask):
               nms_iou_threshold=p.nms_iou_threshold,
               score_threshold=p.nms_score_threshold,
               max_boxes_per_class=p.max_nms_boxes,
-              use_oriented_per_class_nms=p.use_oriented_per_class_nms))
+              use_oriented_per_class_nms=p.use_oriented_per_class_nms,
+              use_class_batched_nms=p.use_class_batched_nms,
+              pre_nms_top_k=p.nms_pre_top_k))
 
       # per_cls_valid_mask is [batch, num_classes, num_boxes] Tensor that
       # indicates which boxes were selected by NMS. Each example will have a
@@ -23,7 +23,9 @@ change in axis directions.
 """
 
 import collections
+import functools
 import math
+import multiprocessing.dummy
 
 from lingvo import compat as tf
 from lingvo.core import plot
@@ -46,6 +48,8 @@ def _PILColorList():
 
 
 PIL_COLOR_LIST = _PILColorList()
+_PIL_COLOR_RGB = np.array([ImageColor.getrgb(c) for c in PIL_COLOR_LIST],
+                          dtype=np.uint8)
 
 
 def ExtractRunIds(run_segments):
@@ -289,6 +293,38 @@ def VisualizeBoxes(image,
   return image
 
 
+def BoxCorners(bboxes):
+  """Computes the corners of a batch of rotated 2D boxes.
+
+  This is a vectorized equivalent of `transform_util.Box2D.corners`.
+
+  Args:
+    bboxes: A (..., 4 or 5) float array containing bounding box xywhh. If the
+      last dimension is 4, the heading is assumed to be 0.
+
+  Returns:
+    A (..., 4, 2) float array containing the four (x, y) corners of each box, in
+    the same order as `transform_util.Box2D`.
+  """
+  bboxes = np.asarray(bboxes, dtype=np.float64)
+  x, y, width, length = (bboxes[..., 0], bboxes[..., 1], bboxes[..., 2],
+                         bboxes[..., 3])
+  if bboxes.shape[-1] == 5:
+    heading = bboxes[..., 4]
+  else:
+    heading = np.zeros_like(x)
+  cos, sin = np.cos(heading), np.sin(heading)
+  # Half extents along the heading direction and its perpendicular.
+  lx, ly = cos * length / 2., sin * length / 2.
+  has_length = (length > 0).astype(np.float64)
+  wx, wy = -sin * width / 2. * has_length, cos * width / 2. * has_length
+  corners_x = np.stack(
+      [x - lx + wx, x + lx + wx, x + lx - wx, x - lx - wx], axis=-1)
+  corners_y = np.stack(
+      [y - ly + wy, y + ly + wy, y + ly - wy, y - ly - wy], axis=-1)
+  return np.stack([corners_x, corners_y], axis=-1)
+
+
 def TransformBBoxesToTopDown(bboxes, car_to_image_transform=None):
   """Convert bounding boxes from car coordinates to top down pixel coordinates.
 
@@ -305,46 +341,184 @@ def TransformBBoxesToTopDown(bboxes, car_to_image_transform=None):
   if car_to_image_transform is None:
     car_to_image_transform = _CarToImageTransform()
 
-  batch_size = np.shape(bboxes)[0]
-  nbboxes = np.shape(bboxes)[1]
+  bboxes = np.asarray(bboxes)
   transformed_boxes = np.zeros_like(bboxes)
+  # TODO(vrv): When we predict heading, we should assert
+  # that the length of bbox_data is 5.
+  has_heading = bboxes.shape[-1] == 5
+
+  # Skip boxes that cannot be visualized.
+  valid = np.logical_and(bboxes[..., 2] > 0, bboxes[..., 3] > 0)
+  valid = np.logical_and(valid, np.all(np.isfinite(bboxes), axis=-1))
+  if not np.any(valid):
+    return transformed_boxes
+  valid_bboxes = bboxes[valid].astype(np.float64)
+
+  # Bounding boxes are in car coordinates (smooth adjusted by car pose).
+  # Transform the corners from car coordinates to new coordinates, and use
+  # their extrema to compute the new center.
+  rotation = car_to_image_transform[0:2, 0:2]
+  shift = car_to_image_transform[0:2, 3]
+  corners = np.matmul(BoxCorners(valid_bboxes), rotation.T) + shift
+  mins = np.min(corners, axis=-2)
+  maxs = np.max(corners, axis=-2)
+  centers = mins + (maxs - mins) / 2.
+
+  # Compute the new width and length.
+  new_wl = np.abs(np.matmul(valid_bboxes[:, 2:4], rotation.T))
+
+  columns = [centers, new_wl]
+  if has_heading:
+    # Compute the transformed heading from the transformed unit ray.
+    heading = valid_bboxes[:, 4]
+    rays = np.matmul(
+        np.stack([np.cos(heading), np.sin(heading)], axis=-1), rotation.T)
+    columns.append(np.arctan2(rays[:, 1], rays[:, 0])[:, np.newaxis])
+  transformed_boxes[valid] = np.concatenate(columns, axis=-1)
+  return transformed_boxes
 
-  for batch_id in range(batch_size):
-    for box_id in range(nbboxes):
-      # TODO(vrv): When we predict heading, we should assert
-      # that the length of bbox_data is 5.
-      bbox_data = np.squeeze(bboxes[batch_id, box_id, :])
 
-      x, y, width, height = (bbox_data[0], bbox_data[1], bbox_data[2],
-                             bbox_data[3])
+@functools.lru_cache(maxsize=None)
+def _LabelFont():
+  try:
+    return ImageFont.truetype('arial.ttf', 24)
+  except IOError:
+    return ImageFont.load_default()
 
-      if len(bbox_data) == 5:
-        heading = bbox_data[4]
-      else:
-        heading = 0.0
 
-      # Skip boxes that cannot be visualized.
-      if width <= 0 or height <= 0:
-        continue
-      if any([np.isnan(c) or np.isinf(c) for c in bbox_data]):
-        continue
+@functools.lru_cache(maxsize=1024)
+def _TextMask(display_str):
+  """Returns a boolean [height, width] mask of `display_str` rendered by PIL."""
+  font = _LabelFont()
+  text_width, text_height = font.getsize(display_str)
+  mask_image = Image.new('L', (max(text_width, 1), max(text_height, 1)), 0)
+  ImageDraw.Draw(mask_image).text((0, 0), display_str, fill=255, font=font)
+  return np.array(mask_image) > 127
 
-      # Bounding boxes are in car coordinates (smooth adjusted by car pose).
-      # Transform from car coordinates to new coordinates.
-      bbox_car = transform_util.Box2D(x, y, width, height, heading)
-      bbox_transformed = bbox_car.Apply(car_to_image_transform)
-      bbox_values = bbox_transformed.AsNumpy()
-      if len(bbox_data) == 4:
-        bbox_values = bbox_values[:-1]
-      transformed_boxes[batch_id, box_id, :] = bbox_values
 
-  return transformed_boxes
+def _FillRect(image, left, top, right, bottom, color):
+  """Fills the inclusive pixel rectangle [left, right] x [top, bottom]."""
+  height, width = image.shape[:2]
+  left, top = max(int(np.floor(left)), 0), max(int(np.floor(top)), 0)
+  right = min(int(np.floor(right)), width - 1)
+  bottom = min(int(np.floor(bottom)), height - 1)
+  if left <= right and top <= bottom:
+    image[top:bottom + 1, left:right + 1] = color
+
+
+def _BlitMask(image, mask, left, top, color):
+  """Sets the pixels of `image` selected by `mask` placed at (left, top)."""
+  height, width = image.shape[:2]
+  left, top = int(np.floor(left)), int(np.floor(top))
+  y0, x0 = max(top, 0), max(left, 0)
+  y1 = min(top + mask.shape[0], height)
+  x1 = min(left + mask.shape[1], width)
+  if y0 >= y1 or x0 >= x1:
+    return
+  image[y0:y1, x0:x1][mask[y0 - top:y1 - top, x0 - left:x1 - left]] = color
+
+
+def RasterizeSegments(image, starts, ends, colors, thickness=4):
+  """Draws thick line segments directly into a uint8 image array.
 
+  All segments are sampled and stamped at once, without going through PIL.
+  Segments are drawn in order, so later segments overwrite earlier ones.
 
-def DrawBBoxesOnImages(images, bboxes, box_weights, labels, class_id_to_name,
-                       groundtruth):
+  Args:
+    image: A [height, width, 3] uint8 array, updated in place.
+    starts: A [num_segments, 2] float array of (x, y) pixel start points.
+    ends: A [num_segments, 2] float array of (x, y) pixel end points.
+    colors: A [num_segments, 3] uint8 array of RGB colors.
+    thickness: Line thickness in pixels.
+  """
+  starts = np.asarray(starts, dtype=np.float64).reshape([-1, 2])
+  ends = np.asarray(ends, dtype=np.float64).reshape([-1, 2])
+  if starts.shape[0] == 0:
+    return
+  colors = np.asarray(colors, dtype=np.uint8).reshape([-1, 3])
+  height, width = image.shape[:2]
+
+  # Sample each segment at (at least) one point per pixel along its major axis.
+  deltas = ends - starts
+  num_samples = np.ceil(np.max(np.abs(deltas), axis=-1)).astype(np.int64) + 1
+  segment_ids = np.repeat(np.arange(starts.shape[0]), num_samples)
+  offsets = np.cumsum(num_samples) - num_samples
+  steps = np.arange(segment_ids.shape[0]) - offsets[segment_ids]
+  fractions = steps / np.maximum(num_samples[segment_ids] - 1, 1)
+  points = starts[segment_ids] + fractions[:, np.newaxis] * deltas[segment_ids]
+
+  # Stamp a thickness x thickness square around each sampled point.
+  pad = np.arange(thickness) - (thickness - 1) // 2
+  stamp = np.stack(np.meshgrid(pad, pad, indexing='ij'), axis=-1).reshape(
+      [-1, 2])
+  pixels = np.round(points)[:, np.newaxis, :].astype(np.int64) + stamp
+  pixel_colors = np.broadcast_to(colors[segment_ids][:, np.newaxis, :],
+                                 pixels.shape[:2] + (3,))
+  pixels = pixels.reshape([-1, 2])
+  pixel_colors = pixel_colors.reshape([-1, 3])
+  inside = ((pixels[:, 0] >= 0) & (pixels[:, 0] < width) &
+            (pixels[:, 1] >= 0) & (pixels[:, 1] < height))
+  image[pixels[inside, 1], pixels[inside, 0]] = pixel_colors[inside]
+
+
+def _DrawBBoxesOnImage(image, boxes, colors, display_strs, text_loc,
+                       thickness):
+  """Draws preselected top down boxes and their labels onto a single image."""
+  if boxes.shape[0] == 0:
+    return
+  corners = BoxCorners(boxes)
+  # Outline segments: corner i to corner (i + 1) % 4.
+  outline_starts = corners
+  outline_ends = np.roll(corners, -1, axis=-2)
+
+  # Heading segments: from half to all of the way to max(w, l) / 2 along the
+  # heading.
+  centers = boxes[:, 0:2]
+  max_dim = np.max(boxes[:, 2:4], axis=-1) / 2.
+  directions = np.stack([np.cos(boxes[:, 4]), np.sin(boxes[:, 4])], axis=-1)
+  heading_ends = centers + max_dim[:, np.newaxis] * directions
+  heading_starts = (heading_ends - centers) / 2. + centers
+
+  # Interleave so that each box is drawn fully before the next one.
+  starts = np.concatenate([outline_starts, heading_starts[:, np.newaxis]],
+                          axis=1)
+  ends = np.concatenate([outline_ends, heading_ends[:, np.newaxis]], axis=1)
+  segment_colors = np.repeat(colors[:, np.newaxis], 5, axis=1)
+  RasterizeSegments(image, starts, ends, segment_colors, thickness)
+
+  # Compute extremes so we can anchor the labels to them.
+  lefts = np.min(corners[..., 0], axis=-1)
+  bottoms = np.min(corners[..., 1], axis=-1)
+  tops = np.max(corners[..., 1], axis=-1)
+  black = np.zeros([3], dtype=np.uint8)
+  for i, display_str in enumerate(display_strs):
+    mask = _TextMask(display_str)
+    text_height, text_width = mask.shape
+    margin = np.ceil(0.05 * text_height)
+    if text_loc == 'TOP':
+      text_bottom = tops[i]
+    else:
+      text_bottom = bottoms[i] + text_height
+    _FillRect(image, lefts[i], text_bottom - text_height - 2 * margin,
+              lefts[i] + text_width, text_bottom, colors[i])
+    _BlitMask(image, mask, lefts[i] + margin,
+              text_bottom - text_height - margin, black)
+
+
+def DrawBBoxesOnImages(images,
+                       bboxes,
+                       box_weights,
+                       labels,
+                       class_id_to_name,
+                       groundtruth,
+                       min_score_thresh=.25,
+                       line_thickness=4,
+                       num_threads=1):
   """Draw ground truth boxes on top down image.
 
+  Box selection and geometry are computed for the whole batch at once, and the
+  outlines are rasterized straight into the uint8 image arrays.
+
   Args:
     images: A 4D uint8 array (batch, height, width, depth) of images to draw on
       top of.
@@ -356,6 +530,11 @@ def DrawBBoxesOnImages(images, bboxes, box_weights, labels, class_id_to_name,
       label indices.
     class_id_to_name: Dictionary mapping from class id to name.
     groundtruth: Boolean indicating whether bounding boxes are ground truth.
+    min_score_thresh: Predicted boxes with a score below this are not drawn.
+      Unused if `groundtruth` is True.
+    line_thickness: Thickness of the box outlines in pixels.
+    num_threads: If greater than 1, images are drawn in parallel by a thread
+      pool of this size.
 
   Returns:
     'images' with the bboxes drawn on top.
@@ -370,65 +549,65 @@ def DrawBBoxesOnImages(images, bboxes, box_weights, labels, class_id_to_name,
   # Assert channel dimension is 3 dimensional.
   assert np.shape(images)[3] == 3
 
-  batch_size = np.shape(images)[0]
-  nbboxes = np.shape(bboxes)[1]
-
-  for batch_id in range(batch_size):
-    image = images[batch_id, :, :, :]
-    # Draw a box for each box and label if weights is 1.
-
-    transformed_boxes = []
-    box_scores = []
-    label_ids = []
-
-    for box_id in range(nbboxes):
-      box_weight = box_weights[batch_id, box_id]
-      # If there is no box to draw, continue.
-      if box_weight == 0.0:
-        continue
-
-      # TODO(vrv): When we predict heading, we should assert
-      # that the length of bbox_data is 5.
-      bbox_data = np.squeeze(bboxes[batch_id, box_id, :])
-      if len(bbox_data) == 5:
-        x, y, width, length, heading = bbox_data
-      else:
-        x, y, width, length = bbox_data
-        heading = 0.0
-
-      # Check whether we can draw the box.
-      bbox = transform_util.Box2D(x, y, width, length, heading)
-      ymin, xmin, ymax, xmax = bbox.Extrema()
-
-      if ymin == 0 and xmin == 0 and ymax == 0 and xmax == 0:
-        continue
-
-      # TODO(vrv): Support drawing boxes on the edge of the
-      # image.
-      if (xmin < 0 or ymin < 0 or xmax >= image.shape[1] or
-          ymax >= image.shape[0]):
-        continue
-
-      # We can draw a box on the image, so fill in the score, the boxes,
-      # and the label.
-      transformed_boxes.append([x, y, width, length, heading])
-      box_scores.append(box_weight)
-      label_ids.append(labels[batch_id, box_id])
-
-    if transformed_boxes:
-      transformed_boxes = np.stack(transformed_boxes, axis=0)
-      scores = None if groundtruth else np.array(box_scores)
-      text_loc = 'TOP' if groundtruth else 'BOTTOM'
-      VisualizeBoxes(
-          image=image,
-          boxes=transformed_boxes,
-          classes=label_ids,
-          scores=scores,
-          class_id_to_name=class_id_to_name,
-          groundtruth_box_visualization_color='cyan',
-          skip_scores=groundtruth,
-          skip_labels=False,
-          text_loc=text_loc)
+  batch_size, height, width = np.shape(images)[:3]
+  bboxes = np.asarray(bboxes, dtype=np.float64)
+  box_weights = np.asarray(box_weights)
+  labels = np.asarray(labels)
+  if bboxes.shape[-1] == 4:
+    bboxes = np.concatenate([bboxes, np.zeros_like(bboxes[..., :1])], axis=-1)
+  bboxes = bboxes[:batch_size]
+  box_weights = box_weights[:batch_size]
+  labels = labels[:batch_size]
+
+  # Draw a box for each box and label if weights is non-zero, and we can draw
+  # the box on the image.
+  corners = BoxCorners(bboxes)
+  xmin = np.min(corners[..., 0], axis=-1)
+  xmax = np.max(corners[..., 0], axis=-1)
+  ymin = np.min(corners[..., 1], axis=-1)
+  ymax = np.max(corners[..., 1], axis=-1)
+  drawable = box_weights != 0.0
+  drawable &= np.all(np.isfinite(bboxes), axis=-1)
+  drawable &= ~((xmin == 0) & (ymin == 0) & (xmax == 0) & (ymax == 0))
+  # TODO(vrv): Support drawing boxes on the edge of the
+  # image.
+  drawable &= (xmin >= 0) & (ymin >= 0) & (xmax < width) & (ymax < height)
+  if not groundtruth:
+    drawable &= box_weights >= min_score_thresh
+
+  if groundtruth:
+    gt_color = np.array(ImageColor.getrgb('cyan'), dtype=np.uint8)
+    colors = np.broadcast_to(gt_color, labels.shape + (3,))
+  else:
+    colors = _PIL_COLOR_RGB[labels.astype(np.int64) % len(PIL_COLOR_LIST)]
+  text_loc = 'TOP' if groundtruth else 'BOTTOM'
+
+  def _DisplayStr(batch_id, box_id):
+    display_str = str(class_id_to_name.get(labels[batch_id, box_id], 'N/A'))
+    if not groundtruth:
+      display_str = '{}: {}%'.format(display_str,
+                                     int(100 * box_weights[batch_id, box_id]))
+    return display_str
+
+  def _DrawOne(batch_id):
+    box_ids = np.flatnonzero(drawable[batch_id])
+    _DrawBBoxesOnImage(
+        images[batch_id],
+        bboxes[batch_id, box_ids],
+        colors[batch_id, box_ids], [_DisplayStr(batch_id, i) for i in box_ids],
+        text_loc=text_loc,
+        thickness=line_thickness)
+
+  if num_threads > 1 and batch_size > 1:
+    pool = multiprocessing.dummy.Pool(min(num_threads, batch_size))
+    try:
+      pool.map(_DrawOne, range(batch_size))
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    for batch_id in range(batch_size):
+      _DrawOne(batch_id)
   return images
 
 
@@ -18,6 +18,7 @@
 from lingvo import compat as tf
 from lingvo.core import test_utils
 from lingvo.tasks.car import summary
+from lingvo.tasks.car import transform_util
 import numpy as np
 
 
@@ -41,6 +42,54 @@ class SummaryTest(test_utils.TestCase):
     summary.DrawBBoxesOnImages(images, cbboxes, loc_weights, labels,
                                class_id_to_name, True)
 
+  def testDrawBBoxesMultiThreaded(self):
+    bs = 4
+    nbboxes = 3
+    class_id_to_name = {0: 'foo', 1: 'bar'}
+    bboxes = np.zeros(shape=(bs, nbboxes, 5))
+    bboxes[:, :, :2] = np.random.uniform(30., 70., size=(bs, nbboxes, 2))
+    bboxes[:, :, 2:4] = np.random.uniform(2., 10., size=(bs, nbboxes, 2))
+    bboxes[:, :, 4] = np.random.uniform(-np.pi, np.pi, size=(bs, nbboxes))
+    scores = np.random.uniform(0.5, 1.0, size=(bs, nbboxes))
+    labels = np.random.randint(0, 2, size=(bs, nbboxes))
+
+    images = np.zeros(shape=(bs, 100, 100, 3), dtype=np.uint8)
+    expected = summary.DrawBBoxesOnImages(images.copy(), bboxes, scores, labels,
+                                          class_id_to_name, False)
+    actual = summary.DrawBBoxesOnImages(
+        images.copy(),
+        bboxes,
+        scores,
+        labels,
+        class_id_to_name,
+        False,
+        num_threads=4)
+    self.assertGreater(np.sum(expected), 0)
+    self.assertAllEqual(expected, actual)
+
+  def testDrawBBoxesSkipsZeroWeightBoxes(self):
+    bboxes = np.array([[[50., 50., 10., 20., 0.]]])
+    images = np.zeros(shape=(1, 100, 100, 3), dtype=np.uint8)
+    images = summary.DrawBBoxesOnImages(images, bboxes, np.zeros((1, 1)),
+                                        np.zeros((1, 1)), {}, True)
+    self.assertEqual(np.sum(images), 0)
+
+  def testBoxCorners(self):
+    bboxes = np.random.uniform(-10., 10., size=(3, 4, 5))
+    bboxes[..., 2:4] = np.abs(bboxes[..., 2:4])
+    expected = np.array(
+        [[transform_util.Box2D(*box).corners for box in b] for b in bboxes])
+    self.assertAllClose(expected, summary.BoxCorners(bboxes))
+
+  def testRasterizeSegments(self):
+    image = np.zeros(shape=(10, 10, 3), dtype=np.uint8)
+    summary.RasterizeSegments(
+        image, [[1., 5.]], [[8., 5.]], [[255, 0, 0]], thickness=1)
+    expected = np.zeros(shape=(10, 10), dtype=np.uint8)
+    expected[5, 1:9] = 255
+    self.assertAllEqual(expected, image[..., 0])
+    self.assertEqual(np.sum(image[..., 1:]), 0)
+
   def testTransformBBoxesToTopDown(self):
     bs = 5
     nbboxes = 2
@@ -53,6 +102,17 @@ class SummaryTest(test_utils.TestCase):
     image_bboxes = summary.TransformBBoxesToTopDown(cbboxes)
     self.assertAllEqual(cbboxes.shape, image_bboxes.shape)
 
+  def testTransformBBoxesToTopDownMatchesBox2D(self):
+    transform = transform_util.MakeCarToImageTransform(
+        pixels_per_meter=10., image_ref_x=250, image_ref_y=750, flip_axes=True)
+    bboxes = np.random.uniform(-10., 10., size=(2, 3, 5))
+    bboxes[..., 2:4] = np.abs(bboxes[..., 2:4]) + 0.1
+    expected = np.array([[
+        transform_util.Box2D(*box).Apply(transform).AsNumpy() for box in b
+    ] for b in bboxes])
+    self.assertAllClose(expected,
+                        summary.TransformBBoxesToTopDown(bboxes, transform))
+
   def testExtractRunIds(self):
 
     def PythonExtractRunIds(run_segments):
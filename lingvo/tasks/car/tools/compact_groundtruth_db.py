@@ -0,0 +1,100 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Compacts a groundtruth object database into a memory-mapped store.
+
+Reads the TFRecords of object crops produced by create_kitti_crop_dataset.py
+and writes a directory in the format of `groundtruth_db.py`, which can be used
+by `GroundTruthAugmentor` through its `groundtruth_database_index` param.
+
+The filtering flags should be no stricter than the corresponding params of the
+augmentors that will read the store; objects dropped here cannot be sampled.
+
+To run:
+
+bazel run -c opt \
+  //lingvo/tasks/car/tools:compact_groundtruth_db -- \
+  --input_file_pattern=/path/to/gt_objects-* \
+  --output_dir=/path/to/gt_objects_index \
+  --max_num_points_per_bbox=2048 \
+  --filter_min_points=5
+"""
+
+import time
+
+from absl import app
+from absl import flags
+from lingvo import compat as tf
+from lingvo.tasks.car import groundtruth_db
+
+flags.DEFINE_string('input_file_pattern', None,
+                    'File pattern of the groundtruth database TFRecords.')
+flags.DEFINE_string('output_dir', None,
+                    'Local directory to write the compacted database to.')
+flags.DEFINE_integer('max_num_points_per_bbox', 2048,
+                     'Maximum number of points kept for each object.')
+flags.DEFINE_integer('filter_min_points', 0,
+                     'Drop objects with fewer points than this.')
+flags.DEFINE_integer('filter_min_difficulty', 0,
+                     'Drop objects whose difficulty is < this value.')
+flags.DEFINE_integer('num_point_features', 1, 'Number of features per point.')
+
+FLAGS = flags.FLAGS
+
+
+def CompactGroundTruthDatabase(input_file_pattern, output_dir,
+                               max_num_points_per_bbox, filter_min_points,
+                               filter_min_difficulty, num_point_features):
+  """Compacts all records matching `input_file_pattern` into `output_dir`.
+
+  Returns:
+    A (num_objects, num_dropped) tuple.
+  """
+  filenames = sorted(tf.io.gfile.glob(input_file_pattern))
+  if not filenames:
+    raise ValueError('No files match {}'.format(input_file_pattern))
+  with groundtruth_db.GroundTruthDatabaseWriter(
+      output_dir,
+      max_num_points_per_bbox=max_num_points_per_bbox,
+      filter_min_points=filter_min_points,
+      filter_min_difficulty=filter_min_difficulty,
+      num_point_features=num_point_features) as writer:
+    for filename in filenames:
+      tf.logging.info('Reading %s', filename)
+      for record in tf.io.tf_record_iterator(filename):
+        writer.Add(**groundtruth_db.ParseGroundTruthExample(
+            record, num_point_features))
+  return writer.num_objects, writer.num_dropped
+
+
+def main(argv):
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+  if not FLAGS.input_file_pattern or not FLAGS.output_dir:
+    raise ValueError('Must provide --input_file_pattern and --output_dir')
+
+  start_time = time.time()
+  num_objects, num_dropped = CompactGroundTruthDatabase(
+      FLAGS.input_file_pattern, FLAGS.output_dir,
+      FLAGS.max_num_points_per_bbox, FLAGS.filter_min_points,
+      FLAGS.filter_min_difficulty, FLAGS.num_point_features)
+  tf.logging.info('Wrote %d objects (%d filtered out) to %s in %.1fs',
+                  num_objects, num_dropped, FLAGS.output_dir,
+                  time.time() - start_time)
+
+
+if __name__ == '__main__':
+  tf.logging.set_verbosity(tf.logging.INFO)
+  app.run(main)
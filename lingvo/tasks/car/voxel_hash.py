@@ -0,0 +1,415 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Voxel spatial hashing of point clouds with sort and segment ops.
+
+Points are assigned to voxel cells, and each cell is identified by an integer
+key. Sorting points by key makes the points of a cell a contiguous segment, so
+per-cell point lists and neighborhood queries can be computed with argsort,
+unique and searchsorted instead of tensors sized to the full grid or to all
+pairs of points.
+
+Memory used by these functions is linear in the number of points (and, for
+neighborhood queries, in the number of query points times the number of
+candidate points per query), rather than in the grid size or P1 x P2.
+"""
+
+from lingvo import compat as tf
+from lingvo.core import py_utils
+import numpy as np
+
+# Each cell coordinate is offset by _KEY_OFFSET and packed in _KEY_BITS bits.
+_KEY_BITS = 21
+_KEY_OFFSET = 2**(_KEY_BITS - 1)
+# Key of padded points; sorts after, and never matches, any real cell key.
+_PADDING_KEY = np.iinfo(np.int64).max
+
+
+def PackCellKeys(cell_coords):
+  """Packs integer 3D cell coordinates into int64 keys.
+
+  Args:
+    cell_coords: An integer Tensor of shape [..., 3]. Coordinates must be in
+      [-2**20, 2**20).
+
+  Returns:
+    An int64 Tensor of shape [...] with a unique key per cell. Keys are ordered
+    lexicographically by (x, y, z).
+  """
+  cell_coords = tf.cast(cell_coords, tf.int64) + _KEY_OFFSET
+  x, y, z = tf.unstack(cell_coords, num=3, axis=-1)
+  return (x * 2**(2 * _KEY_BITS)) + (y * 2**_KEY_BITS) + z
+
+
+def GridCellCoordinates(points_xyz, grid_size, grid_range_x, grid_range_y,
+                        grid_range_z):
+  """Computes the grid cell of each point.
+
+  Uses the same bucketing as `ops.point_to_grid`.
+
+  Args:
+    points_xyz: A float Tensor of shape [..., 3].
+    grid_size: A (gx, gy, gz) tuple of the number of cells along each axis.
+    grid_range_x: A (min, max) tuple of the x-axis range covered by the grid.
+    grid_range_y: A (min, max) tuple of the y-axis range covered by the grid.
+    grid_range_z: A (min, max) tuple of the z-axis range covered by the grid.
+
+  Returns:
+    A tuple (cell_coords, in_grid):
+
+    - cell_coords: An int32 Tensor of shape [..., 3].
+    - in_grid: A bool Tensor of shape [...], True iff the point is within the
+      grid.
+  """
+  grid_min = tf.constant(
+      [grid_range_x[0], grid_range_y[0], grid_range_z[0]], dtype=tf.float32)
+  grid_max = tf.constant(
+      [grid_range_x[1], grid_range_y[1], grid_range_z[1]], dtype=tf.float32)
+  num_cells = tf.constant(grid_size, dtype=tf.int32)
+  cell_size = (grid_max - grid_min) / tf.cast(num_cells, tf.float32)
+  cell_coords = tf.cast(
+      tf.floor((tf.cast(points_xyz, tf.float32) - grid_min) / cell_size),
+      tf.int32)
+  in_grid = tf.reduce_all(
+      tf.logical_and(cell_coords >= 0, cell_coords < num_cells), axis=-1)
+  return cell_coords, in_grid
+
+
+def GridCellCenters(cell_coords, grid_size, grid_range_x, grid_range_y,
+                    grid_range_z):
+  """Returns the float32 [..., 3] centers of integer grid cells [..., 3]."""
+  grid_min = np.array([grid_range_x[0], grid_range_y[0], grid_range_z[0]],
+                      dtype=np.float32)
+  grid_max = np.array([grid_range_x[1], grid_range_y[1], grid_range_z[1]],
+                      dtype=np.float32)
+  cell_size = (grid_max - grid_min) / np.array(grid_size, dtype=np.float32)
+  return grid_min + (tf.cast(cell_coords, tf.float32) + 0.5) * cell_size
+
+
+def GroupPointsByCell(cell_keys, num_points_per_cell, shuffle=True, seed=None):
+  """Groups points into cells by sorting their keys.
+
+  Args:
+    cell_keys: An int64 Tensor of shape [P] with the cell key of every point.
+      Points with key `_PADDING_KEY` (see `PaddedCellKeys`) are ignored.
+    num_points_per_cell: The maximum number of points kept per cell.
+    shuffle: If True, the points kept in a cell that overflows are chosen at
+      random. Otherwise, the points with the lowest indices are kept.
+    seed: Optional random seed used if shuffle is True.
+
+  Returns:
+    A NestedMap with:
+
+    - cell_keys: int64 [C], the unique keys of the non-empty cells, sorted.
+    - num_points: int32 [C], the number of points kept in each cell, at most
+      num_points_per_cell.
+    - point_cell: int32 [P], the index into cell_keys of each point's cell, or
+      C for padded points.
+    - point_slot: int32 [P], the rank of each point within its cell.
+    - point_kept: bool [P], True iff the point is kept, i.e. it is not padding
+      and its slot is below num_points_per_cell.
+  """
+  cell_keys = py_utils.HasRank(cell_keys, 1)
+  num_points = tf.shape(cell_keys)[0]
+  order = tf.range(num_points)
+  if shuffle:
+    order = tf.random.shuffle(order, seed=seed)
+  # A stable sort keeps the (possibly shuffled) visit order within each cell.
+  order = tf.gather(
+      order, tf.argsort(tf.gather(cell_keys, order), stable=True))
+  sorted_keys = tf.gather(cell_keys, order)
+
+  unique_keys, segment_ids = tf.unique(sorted_keys, out_idx=tf.int32)
+  num_segments = tf.shape(unique_keys)[0]
+  segment_starts = tf.math.unsorted_segment_min(
+      tf.range(num_points), segment_ids, num_segments)
+  sorted_slots = tf.range(num_points) - tf.gather(segment_starts, segment_ids)
+
+  # Drop the trailing segment of padded points, if any.
+  is_padding_segment = tf.equal(unique_keys, _PADDING_KEY)
+  num_cells = num_segments - tf.reduce_sum(tf.cast(is_padding_segment,
+                                                   tf.int32))
+  counts = tf.math.unsorted_segment_sum(
+      tf.ones_like(segment_ids), segment_ids, num_segments)
+
+  # Scatter back from sorted order to the original point order.
+  inverse = tf.scatter_nd(order[:, tf.newaxis], tf.range(num_points),
+                          [num_points])
+  point_cell = tf.gather(segment_ids, inverse)
+  point_slot = tf.gather(sorted_slots, inverse)
+  point_kept = tf.logical_and(point_cell < num_cells,
+                              point_slot < num_points_per_cell)
+  return py_utils.NestedMap(
+      cell_keys=unique_keys[:num_cells],
+      num_points=tf.minimum(counts[:num_cells], num_points_per_cell),
+      point_cell=point_cell,
+      point_slot=point_slot,
+      point_kept=point_kept)
+
+
+def PaddedCellKeys(cell_coords, padding):
+  """Packs cell coordinates [..., 3] into keys, with padding [...] ignored."""
+  keys = PackCellKeys(cell_coords)
+  return tf.where(
+      tf.cast(padding, tf.bool), tf.fill(tf.shape(keys), _PADDING_KEY), keys)
+
+
+def UnpackCellKeys(cell_keys):
+  """Inverse of `PackCellKeys`; returns int32 cell coordinates [..., 3]."""
+  mask = 2**_KEY_BITS - 1
+  x = cell_keys // 2**(2 * _KEY_BITS)
+  y = (cell_keys // 2**_KEY_BITS) % (mask + 1)
+  z = cell_keys % (mask + 1)
+  return tf.cast(tf.stack([x, y, z], axis=-1) - _KEY_OFFSET, tf.int32)
+
+
+def PointsToPillars(points,
+                    points_padding,
+                    num_points_per_cell,
+                    num_pillars,
+                    grid_size,
+                    grid_range_x,
+                    grid_range_y,
+                    grid_range_z,
+                    density_sampling=False,
+                    seed=None):
+  """Bins points into grid cells and gathers the points of sampled pillars.
+
+  This computes the outputs of `ops.point_to_grid` followed by pillar
+  selection, without materializing the [gx, gy, gz, num_points_per_cell, F]
+  grid of points: only the selected pillars are gathered.
+
+  Args:
+    points: A float Tensor of shape [P, F], where points[:, :3] is xyz.
+    points_padding: Optional float Tensor of shape [P], 1 for padded points.
+    num_points_per_cell: The maximum number of points per cell.
+    num_pillars: The maximum number of pillars to produce.
+    grid_size: A (gx, gy, gz) tuple of the number of cells along each axis.
+    grid_range_x: A (min, max) tuple of the x-axis range covered by the grid.
+    grid_range_y: A (min, max) tuple of the y-axis range covered by the grid.
+    grid_range_z: A (min, max) tuple of the z-axis range covered by the grid.
+    density_sampling: If True, non-empty cells are sampled without replacement
+      with probability proportional to their number of points. Otherwise, they
+      are sampled uniformly.
+    seed: Optional random seed.
+
+  Returns:
+    A NestedMap with:
+
+    - grid_num_points: int32 [gx, gy, gz], the number of points kept per cell.
+    - pillar_count: int32 scalar, the number of non-padded pillars.
+    - pillar_locations: int32 [num_pillars, 3], the grid cell of each pillar.
+    - pillar_points: float32 [num_pillars, num_points_per_cell, F].
+    - pillar_centers: float32 [num_pillars, 1, 3].
+  """
+  points = py_utils.HasRank(points, 2)
+  num_features = py_utils.GetShape(points)[-1]
+  cell_coords, in_grid = GridCellCoordinates(points[:, :3], grid_size,
+                                             grid_range_x, grid_range_y,
+                                             grid_range_z)
+  invalid = tf.logical_not(in_grid)
+  if points_padding is not None:
+    invalid = tf.logical_or(invalid, tf.cast(points_padding, tf.bool))
+  groups = GroupPointsByCell(
+      PaddedCellKeys(cell_coords, invalid), num_points_per_cell, seed=seed)
+
+  cell_locations = UnpackCellKeys(groups.cell_keys)
+  grid_num_points = tf.scatter_nd(cell_locations, groups.num_points,
+                                  list(grid_size))
+
+  # Select pillars among the non-empty cells.
+  num_cells = tf.shape(groups.cell_keys)[0]
+  if density_sampling:
+    probs = tf.cast(groups.num_points, tf.float32)
+    probs /= tf.reduce_sum(probs)
+    logits = GumbelTransform(probs, seed)
+    _, selected = tf.nn.top_k(logits, k=tf.minimum(num_pillars, num_cells))
+  else:
+    selected = tf.random.shuffle(tf.range(num_cells), seed=seed)[:num_pillars]
+  pillar_count = tf.shape(selected)[0]
+
+  # Map each selected cell to its pillar index, and scatter the kept points of
+  # the selected cells into the pillars.
+  cell_to_pillar = tf.scatter_nd(selected[:, tf.newaxis],
+                                 tf.range(1, pillar_count + 1), [num_cells + 1])
+  point_pillar = tf.gather(cell_to_pillar, groups.point_cell) - 1
+  point_selected = tf.logical_and(groups.point_kept, point_pillar >= 0)
+  pillar_slots = tf.stack([
+      tf.boolean_mask(point_pillar, point_selected),
+      tf.boolean_mask(groups.point_slot, point_selected)
+  ],
+                          axis=-1)
+  pillar_points = tf.scatter_nd(
+      pillar_slots, tf.boolean_mask(points, point_selected),
+      [num_pillars, num_points_per_cell, num_features])
+
+  pillar_locations = py_utils.PadOrTrimTo(
+      tf.gather(cell_locations, selected), [num_pillars, 3])
+  pillar_centers = GridCellCenters(pillar_locations, grid_size, grid_range_x,
+                                   grid_range_y, grid_range_z)
+  # Padded pillars have zero-ed locations and centers.
+  pillar_centers *= tf.cast(
+      tf.range(num_pillars) < pillar_count, tf.float32)[:, tf.newaxis]
+  return py_utils.NestedMap(
+      grid_num_points=grid_num_points,
+      pillar_count=pillar_count,
+      pillar_locations=pillar_locations,
+      pillar_points=pillar_points,
+      pillar_centers=pillar_centers[:, tf.newaxis, :])
+
+
+def GumbelTransform(probs, seed=None):
+  """Adds gumbel noise to log probabilities for multinomial sampling.
+
+  This enables fast sampling from a multinomial distribution without
+  replacement. See https://arxiv.org/abs/1611.01144 for details.
+
+  Args:
+    probs: A 1-D float tensor containing probabilities, summing to 1.
+    seed: Optional random seed.
+
+  Returns:
+    A 1-D float tensor of the same size of probs, with gumbel noise added to
+    log probabilities. Taking the top k elements from this provides a
+    multinomial sample without replacement.
+  """
+  log_prob = tf.math.log(probs)
+  probs_shape = tf.shape(probs)
+  uniform_samples = tf.random.uniform(
+      shape=probs_shape, dtype=probs.dtype, seed=seed, name='uniform_samples')
+  gumbel_noise = -tf.math.log(-tf.math.log(uniform_samples))
+  return gumbel_noise + log_prob
+
+
+def _NeighborCellOffsets():
+  """Returns the [27, 3] int64 offsets of a cell and its neighbors."""
+  offsets = np.stack(
+      np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij'), axis=-1)
+  return offsets.reshape([-1, 3]).astype(np.int64)
+
+
+def NeighborhoodIndices(points,
+                        query_points,
+                        k,
+                        max_distance,
+                        points_padding=None,
+                        cell_size=None,
+                        max_points_per_cell=32,
+                        sample_neighbors_uniformly=False):
+  """Get indices to k-neighbors of query_points in points with a spatial hash.
+
+  This is a drop-in alternative to `car_lib.NeighborhoodIndices` for queries
+  with a max_distance. Points are hashed into cubic cells of size `cell_size`,
+  and the candidates of each query are the points in its cell and the 26
+  neighboring cells, so memory is O(P2 * 27 * max_points_per_cell) instead of
+  O(P1 * P2).
+
+  The result is the same as `car_lib.NeighborhoodIndices` provided that
+  cell_size >= max_distance and no cell holds more than max_points_per_cell
+  points. Otherwise, only the first max_points_per_cell points of a cell (in
+  point order) are considered.
+
+  Padded neighbors (fewer than k candidates within max_distance) refer to the
+  closest candidate of the query, or to point 0 if there is no candidate in the
+  neighboring cells at all.
+
+  Args:
+    points: tensor of shape [N, P1, 3].
+    query_points: tensor of shape [N, P2, 3].
+    k: Integer.
+    max_distance: float representing the maximum distance that each neighbor can
+      be.
+    points_padding: optional tensor of shape [N, P1] containing True/1.0 iff the
+      point is a padded point. Padded points are never returned as real
+      neighbors.
+    cell_size: Size of the hash cells. Defaults to max_distance.
+    max_points_per_cell: Maximum number of candidate points per cell.
+    sample_neighbors_uniformly: boolean specifying whether to sample neighbors
+      uniformly if they are within max distance.
+
+  Returns:
+    A pair of tensors:
+
+    - indices: int32 tensor of shape [N, P2, k].
+    - padding: float tensor of shape [N, P2, k] where 1 represents a padded
+      point, and 0 represents an unpadded (real) point.
+  """
+  if max_distance is None:
+    raise ValueError('Spatial hash neighborhoods require max_distance.')
+  cell_size = cell_size or max_distance
+  points = py_utils.HasShape(points, [-1, -1, 3])
+  n, p1 = py_utils.GetShape(points, 2)
+  query_points = py_utils.HasShape(query_points, [n, -1, 3])
+  _, p2 = py_utils.GetShape(query_points, 2)
+  num_offsets = 27
+  num_candidates = num_offsets * max_points_per_cell
+
+  def _CellCoords(xyz):
+    return tf.cast(tf.floor(xyz / cell_size), tf.int64)
+
+  # Sort the points of every example by cell key.
+  if points_padding is None:
+    points_padding = tf.zeros([n, p1], dtype=tf.bool)
+  keys = PaddedCellKeys(_CellCoords(points), points_padding)
+  order = tf.argsort(keys, axis=1, stable=True)
+  sorted_keys = tf.gather(keys, order, batch_dims=1)
+
+  # Look up the [start, end) range of the neighboring cells of each query.
+  neighbor_coords = (
+      _CellCoords(query_points)[:, :, tf.newaxis, :] + _NeighborCellOffsets())
+  neighbor_keys = tf.reshape(PackCellKeys(neighbor_coords), [n, -1])
+  starts = tf.searchsorted(sorted_keys, neighbor_keys, side='left')
+  ends = tf.searchsorted(sorted_keys, neighbor_keys, side='right')
+
+  slots = tf.range(max_points_per_cell)
+  candidate_pos = starts[..., tf.newaxis] + slots
+  candidate_valid = candidate_pos < ends[..., tf.newaxis]
+  candidate_pos = tf.minimum(candidate_pos, p1 - 1)
+  candidate_idx = tf.gather(
+      order, tf.reshape(candidate_pos, [n, -1]), batch_dims=1)
+  candidate_idx = tf.reshape(candidate_idx, [n, p2, num_candidates])
+  candidate_valid = tf.reshape(candidate_valid, [n, p2, num_candidates])
+
+  # Squared distances to the candidates only.
+  candidate_points = tf.gather(points, candidate_idx, batch_dims=1)
+  dist = tf.reduce_sum(
+      tf.square(candidate_points - query_points[:, :, tf.newaxis, :]), axis=-1)
+  max_sq_distance = tf.square(tf.cast(max_distance, dist.dtype))
+  invalid_dist = 2. * max_sq_distance + 1.
+  dist = tf.where(candidate_valid, dist, tf.fill(tf.shape(dist), invalid_dist))
+
+  if sample_neighbors_uniformly:
+    within = tf.less_equal(dist, max_sq_distance)
+    dist = tf.where(within, max_sq_distance * tf.random.uniform(tf.shape(dist)),
+                    dist)
+
+  top_k = min(k, num_candidates)
+  top_k_dist, top_k_pos = tf.nn.top_k(-dist, k=top_k, sorted=True)
+  indices = tf.gather(candidate_idx, top_k_pos, batch_dims=2)
+  paddings = tf.greater(-top_k_dist, max_sq_distance)
+  # Queries without any candidate fall back to point 0.
+  has_candidate = tf.reduce_any(candidate_valid, axis=-1, keepdims=True)
+  closest_idx = tf.where(has_candidate, indices[:, :, :1],
+                         tf.zeros_like(indices[:, :, :1]))
+  closest_idx = tf.tile(closest_idx, [1, 1, top_k])
+  indices = tf.where(paddings, closest_idx, indices)
+  if top_k < k:
+    indices = tf.concat(
+        [indices, tf.tile(closest_idx[:, :, :1], [1, 1, k - top_k])], axis=-1)
+    paddings = tf.concat(
+        [paddings, tf.ones([n, p2, k - top_k], dtype=tf.bool)], axis=-1)
+  indices = tf.reshape(indices, [n, p2, k])
+  paddings = tf.reshape(tf.cast(paddings, tf.float32), [n, p2, k])
+  return indices, paddings
@@ -0,0 +1,293 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for voxel_hash."""
+
+import time
+
+from lingvo import compat as tf
+from lingvo.core import py_utils
+from lingvo.core import test_utils
+from lingvo.tasks.car import car_lib
+from lingvo.tasks.car import input_preprocessors
+from lingvo.tasks.car import voxel_hash
+import numpy as np
+
+
+class VoxelHashTest(test_utils.TestCase):
+
+  def testPackUnpackCellKeys(self):
+    coords = np.array([[0, 0, 0], [-5, 3, 7], [1000, -1000, 2], [1, 0, 0]],
+                      dtype=np.int32)
+    with self.session():
+      keys = voxel_hash.PackCellKeys(coords)
+      unpacked = voxel_hash.UnpackCellKeys(keys)
+      keys, unpacked = self.evaluate([keys, unpacked])
+    self.assertAllEqual(coords, unpacked)
+    self.assertLen(set(keys.tolist()), 4)
+
+  def testGroupPointsByCell(self):
+    # Cells: a, b, a, padding, a, c.
+    keys = np.array([7, 3, 7, 0, 7, 11], dtype=np.int64)
+    padding = np.array([0, 0, 0, 1, 0, 0], dtype=np.float32)
+    with self.session():
+      keys = tf.where(
+          tf.cast(padding, tf.bool),
+          tf.fill([6], tf.constant(np.iinfo(np.int64).max)), keys)
+      groups = self.evaluate(
+          voxel_hash.GroupPointsByCell(
+              keys, num_points_per_cell=2, shuffle=False))
+    self.assertAllEqual([3, 7, 11], groups.cell_keys)
+    self.assertAllEqual([1, 2, 1], groups.num_points)
+    self.assertAllEqual([1, 0, 1, 3, 1, 2], groups.point_cell)
+    self.assertAllEqual([0, 0, 1, 0, 2, 0], groups.point_slot)
+    self.assertAllEqual([True, True, True, False, False, True],
+                        groups.point_kept)
+
+  def testPointsToPillars(self):
+    np.random.seed(12345)
+    num_points = 500
+    points = np.random.uniform(-1., 11., size=(num_points, 4)).astype(
+        np.float32)
+    padding = (np.random.uniform(size=num_points) < 0.1).astype(np.float32)
+    grid_size = (5, 4, 2)
+    grid_range_x, grid_range_y, grid_range_z = (0, 10), (0, 8), (0, 10)
+    num_points_per_cell = 64
+    with self.session():
+      pillars = self.evaluate(
+          voxel_hash.PointsToPillars(
+              tf.constant(points),
+              tf.constant(padding),
+              num_points_per_cell=num_points_per_cell,
+              num_pillars=64,
+              grid_size=grid_size,
+              grid_range_x=grid_range_x,
+              grid_range_y=grid_range_y,
+              grid_range_z=grid_range_z))
+
+    # Compute the expected grid in numpy.
+    cell_size = np.array([2., 2., 5.])
+    coords = np.floor((points[:, :3] - np.array([0., 0., 0.])) /
+                      cell_size).astype(np.int64)
+    valid = np.all((coords >= 0) & (coords < np.array(grid_size)), axis=-1)
+    valid &= padding == 0
+    expected_num_points = np.zeros(grid_size, dtype=np.int32)
+    np.add.at(expected_num_points, tuple(coords[valid].T), 1)
+    self.assertAllEqual(expected_num_points, pillars.grid_num_points)
+    self.assertLess(np.max(expected_num_points), num_points_per_cell)
+
+    num_nonempty = np.sum(expected_num_points > 0)
+    self.assertEqual(num_nonempty, pillars.pillar_count)
+    for i in range(64):
+      location = pillars.pillar_locations[i]
+      if i >= num_nonempty:
+        self.assertAllEqual([0, 0, 0], location)
+        self.assertAllEqual(np.zeros_like(pillars.pillar_points[i]),
+                            pillars.pillar_points[i])
+        continue
+      in_cell = valid & np.all(coords == location, axis=-1)
+      n = expected_num_points[tuple(location)]
+      # Compare point sets, sorted by x.
+      actual = pillars.pillar_points[i, :n]
+      expected = points[in_cell]
+      self.assertAllClose(expected[np.argsort(expected[:, 0])],
+                          actual[np.argsort(actual[:, 0])])
+      self.assertAllEqual(
+          np.zeros_like(pillars.pillar_points[i, n:]),
+          pillars.pillar_points[i, n:])
+      self.assertAllClose((location + 0.5) * cell_size,
+                          pillars.pillar_centers[i, 0])
+
+  def testPointsToPillarsCapsPointsPerCell(self):
+    points = np.tile(np.array([[0.5, 0.5, 0.5, 1.]], np.float32), [10, 1])
+    with self.session():
+      pillars = self.evaluate(
+          voxel_hash.PointsToPillars(
+              tf.constant(points),
+              None,
+              num_points_per_cell=4,
+              num_pillars=2,
+              grid_size=(2, 2, 1),
+              grid_range_x=(0, 2),
+              grid_range_y=(0, 2),
+              grid_range_z=(0, 2),
+              density_sampling=True))
+    self.assertEqual(1, pillars.pillar_count)
+    self.assertEqual(4, pillars.grid_num_points[0, 0, 0])
+    self.assertAllClose(np.tile(points[:1], [4, 1]), pillars.pillar_points[0])
+
+  def testPointsToPillarsPreprocessor(self):
+    p = input_preprocessors.PointsToPillars.Params().Set(
+        num_points_per_cell=64,
+        num_pillars=16,
+        grid_size=(4, 4, 1),
+        grid_range_x=(0, 4),
+        grid_range_y=(0, 4),
+        grid_range_z=(0, 4),
+        normalize_td_labels=False)
+    preprocessor = p.Instantiate()
+    features = py_utils.NestedMap(
+        lasers=py_utils.NestedMap(
+            points_xyz=tf.random.uniform([100, 3], maxval=4.),
+            points_feature=tf.random.uniform([100, 2]),
+            points_padding=tf.zeros([100])),
+        labels=py_utils.NestedMap())
+    shapes = preprocessor.TransformShapes(
+        py_utils.NestedMap(
+            lasers=py_utils.NestedMap(
+                points_xyz=tf.TensorShape([100, 3]),
+                points_feature=tf.TensorShape([100, 2]),
+                points_padding=tf.TensorShape([100])),
+            labels=py_utils.NestedMap()))
+    features = preprocessor.TransformFeatures(features)
+    with self.session():
+      features = self.evaluate(features)
+    for key in ('grid_centers', 'grid_num_points', 'pillar_count',
+                'pillar_locations', 'pillar_points', 'pillar_centers'):
+      self.assertAllEqual(shapes[key].as_list(), features[key].shape)
+    self.assertEqual(100, np.sum(features.grid_num_points))
+    self.assertEqual(16, features.pillar_count)
+
+  def _NeighborDistances(self, points, query_points, indices, paddings):
+    """Returns the sorted distances of the unpadded neighbors of each query."""
+    result = []
+    for b in range(indices.shape[0]):
+      for q in range(indices.shape[1]):
+        selected = indices[b, q][paddings[b, q] == 0]
+        dist = np.linalg.norm(points[b, selected] - query_points[b, q], axis=-1)
+        result.append(np.sort(dist))
+    return result
+
+  def testNeighborhoodIndicesMatchesDense(self):
+    np.random.seed(54321)
+    points = np.random.uniform(-5., 5., size=(2, 300, 3)).astype(np.float32)
+    query_points = np.random.uniform(
+        -5., 5., size=(2, 20, 3)).astype(np.float32)
+    padding = np.random.uniform(size=(2, 300)) < 0.2
+    k = 8
+    max_distance = 1.5
+    with self.session():
+      dense = car_lib.NeighborhoodIndices(
+          tf.constant(points),
+          tf.constant(query_points),
+          k,
+          points_padding=tf.constant(padding),
+          max_distance=max_distance)
+      hashed = car_lib.NeighborhoodIndices(
+          tf.constant(points),
+          tf.constant(query_points),
+          k,
+          points_padding=tf.constant(padding),
+          max_distance=max_distance,
+          use_spatial_hash=True,
+          max_points_per_cell=64)
+      dense, hashed = self.evaluate([dense, hashed])
+    self.assertAllEqual(dense[1], hashed[1])
+    # Padded points are never real neighbors.
+    self.assertFalse(np.any(padding[0][hashed[0][0][hashed[1][0] == 0]]))
+    expected = self._NeighborDistances(points, query_points, *dense)
+    actual = self._NeighborDistances(points, query_points, *hashed)
+    for e, a in zip(expected, actual):
+      self.assertAllClose(e, a)
+
+  def testNeighborhoodIndicesMoreNeighborsThanCandidates(self):
+    points = np.array([[[0.2, 0.5, 0.5], [-0.1, 0.5, 0.5], [5., 5., 5.]]],
+                      dtype=np.float32)
+    query_points = np.array([[[0., 0.5, 0.5], [-5., -5., -5.]]],
+                            dtype=np.float32)
+    with self.session():
+      indices, paddings = self.evaluate(
+          voxel_hash.NeighborhoodIndices(
+              tf.constant(points),
+              tf.constant(query_points),
+              k=4,
+              max_distance=1.,
+              max_points_per_cell=1))
+    # The two nearby points lie in adjacent cells. Padded neighbors refer to
+    # the closest candidate, or to point 0 without any candidate.
+    self.assertAllEqual([[[1, 0, 1, 1], [0, 0, 0, 0]]], indices)
+    self.assertAllEqual([[[0, 0, 1, 1], [1, 1, 1, 1]]], paddings)
+
+  def testNeighborhoodIndicesRequiresMaxDistance(self):
+    with self.assertRaisesRegex(ValueError, 'max_distance'):
+      voxel_hash.NeighborhoodIndices(
+          tf.zeros([1, 4, 3]), tf.zeros([1, 2, 3]), k=2, max_distance=None)
+
+
+class VoxelHashBenchmark(tf.test.Benchmark):
+  """CPU benchmarks on synthetic 200k point clouds."""
+
+  def _Points(self, num_points=200000):
+    np.random.seed(1234)
+    xy = np.random.uniform(-75., 75., size=(num_points, 2))
+    z = np.random.uniform(-2., 4., size=(num_points, 1))
+    feature = np.random.uniform(size=(num_points, 1))
+    return np.concatenate([xy, z, feature], axis=-1).astype(np.float32)
+
+  def _Run(self, name, fetches, feed_dict=None, iters=5):
+    with tf.Session() as sess:
+      sess.run(fetches, feed_dict=feed_dict)
+      start = time.time()
+      for _ in range(iters):
+        sess.run(fetches, feed_dict=feed_dict)
+      wall_time = (time.time() - start) / iters
+    print('%s: %.3fs' % (name, wall_time))
+    self.report_benchmark(name=name, iters=iters, wall_time=wall_time)
+
+  def benchmarkPointsToPillars(self):
+    with tf.Graph().as_default():
+      # Placeholders keep grappler from constant folding the whole graph.
+      points = tf.placeholder(tf.float32, [None, 4])
+      pillars = voxel_hash.PointsToPillars(
+          points,
+          None,
+          num_points_per_cell=100,
+          num_pillars=12000,
+          grid_size=(432, 496, 1),
+          grid_range_x=(-75., 75.),
+          grid_range_y=(-75., 75.),
+          grid_range_z=(-2., 4.))
+      self._Run('PointsToPillars_200k', pillars, {points: self._Points()})
+
+  def _BenchmarkNeighborhoodIndices(self, use_spatial_hash):
+    points = self._Points()[np.newaxis, :, :3]
+    np.random.seed(4321)
+    query_points = points[:, np.random.choice(points.shape[1], 1024), :]
+    with tf.Graph().as_default():
+      points_ph = tf.placeholder(tf.float32, [1, None, 3])
+      query_points_ph = tf.placeholder(tf.float32, [1, None, 3])
+      indices, _ = car_lib.NeighborhoodIndices(
+          points_ph,
+          query_points_ph,
+          64,
+          max_distance=3.,
+          use_spatial_hash=use_spatial_hash,
+          max_points_per_cell=128)
+      self._Run(
+          'NeighborhoodIndices_200k_%s' %
+          ('hash' if use_spatial_hash else 'dense'), indices, {
+              points_ph: points,
+              query_points_ph: query_points
+          })
+
+  def benchmarkNeighborhoodIndicesDense(self):
+    self._BenchmarkNeighborhoodIndices(use_spatial_hash=False)
+
+  def benchmarkNeighborhoodIndicesHash(self):
+    self._BenchmarkNeighborhoodIndices(use_spatial_hash=True)
+
+
+if __name__ == '__main__':
+  tf.test.main()
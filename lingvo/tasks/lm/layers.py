@@ -989,6 +989,73 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
     output = py_utils.NestedMap(logits=logits, last_hidden=layer_out)
     return output, state1
 
+  def ExtendSteps(self,
+                  theta,
+                  inputs,
+                  state0,
+                  positions=None,
+                  prefix_paddings=None):
+    """FProp several steps at once after the prefix states.
+
+    This gives the same results as calling Step() once per step, with one
+    batched computation.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this
+        layer and its children layers.
+      inputs: a tensor of shape [num_steps, batch, model_dim].
+      state0: A `.NestedMap` containing the prefix states.
+      positions: If not None, an int32 tensor of shape [num_steps, batch], the
+        positions of the steps. Defaults to the steps following the prefix.
+      prefix_paddings: If not None, a 0/1 tensor of shape [prefix_len, batch],
+        1 for the prefix states that the steps must not attend to.
+
+    Returns:
+      A tuple (output, state1).
+        output: A `.NestedMap` with fields.
+          logits:
+            [num_steps, batch, vocab_size].
+          last_hidden:
+            [num_steps, batch, model_dims].
+        state1:
+          The updated prefix states including the steps.
+    """
+    p = self.params
+    num_steps, batch = py_utils.GetShape(inputs, 2)
+    if positions is None:
+      prefix_len = py_utils.GetShape(state0['layer_0'].key)[0]
+      positions = tf.tile(
+          tf.expand_dims(prefix_len + tf.range(num_steps), 1), [1, batch])
+    # [num_steps, batch, model_dim]
+    posit_embs = tf.transpose(
+        self.position_emb.FPropWithPosition(theta.position_emb,
+                                            tf.transpose(positions)),
+        [1, 0, 2])
+    input_embs = inputs + posit_embs
+    input_embs = self.input_dropout.FProp(theta.input_dropout, input_embs)
+
+    # Make a copy of the input.
+    state1 = state0.Pack(state0.Flatten())
+
+    layer_in = input_embs
+    for i, (layer, layer_theta) in enumerate(zip(self.trans, theta.trans)):
+      layer_prefix_states = state0['layer_%i' % i]
+      # [num_steps, batch, model_dim]
+      layer_out, _, updated_prefix_states = layer.ExtendSteps(
+          layer_theta, layer_in, layer_prefix_states, prefix_paddings)
+      state1['layer_%i' % i] = updated_prefix_states
+      layer_in = layer_out
+
+    # [num_steps, batch, vocab_size]
+    logits = tf.reshape(
+        self.softmax.Logits(
+            theta=theta.softmax,
+            inputs=tf.reshape(layer_out, [num_steps * batch, p.model_dim])),
+        [num_steps, batch, p.vocab_size])
+
+    output = py_utils.NestedMap(logits=logits, last_hidden=layer_out)
+    return output, state1
+
   def FProp(self, theta, inputs, paddings, state0=None, labels=None):
     """Computes xent loss given the language model input activations.
 
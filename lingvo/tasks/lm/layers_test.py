@@ -740,6 +740,31 @@ class TransformerLmNoEmbeddingTest(test_utils.TestCase):
       print('xformer logits2_v', logits2_v)
       self.assertAllClose(logits1_v, logits2_v)
 
+  def testExtendSteps(self):
+    p = self._testParams(dtype=tf.float32)
+    with self.session(use_gpu=True):
+      lm = p.Instantiate()
+      inputs, paddings, _ = self._testInputs(dtype=tf.float32, last_padding=0.0)
+      xent_output, _ = lm.FPropDefaultTheta(inputs=inputs, paddings=paddings)
+      logits1 = xent_output.logits
+
+      time, batch = 5, 3
+      prefix_states = lm.zero_state(lm.theta, batch)
+      out1, prefix_states = lm.ExtendSteps(lm.theta, inputs[:2], prefix_states)
+      # A step that the following ones do not attend to.
+      _, prefix_states = lm.ExtendSteps(lm.theta, inputs[4:], prefix_states)
+      out2, _ = lm.ExtendSteps(
+          lm.theta,
+          inputs[2:],
+          prefix_states,
+          positions=tf.tile(tf.range(2, time)[:, tf.newaxis], [1, batch]),
+          prefix_paddings=tf.constant([[0.] * batch] * 2 + [[1.] * batch]))
+      logits2 = tf.concat([out1.logits, out2.logits], 0)
+
+      self.evaluate(tf.global_variables_initializer())
+      logits1_v, logits2_v = self.evaluate([logits1, logits2])
+      self.assertAllClose(logits1_v, logits2_v)
+
 
 class TransformerLmTest(test_utils.TestCase):
 
@@ -0,0 +1,281 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Speculative decoding of a Transformer LM with a smaller draft LM.
+
+Each round, the draft LM proposes `num_draft_tokens` tokens, one cached step
+each, and the target LM scores all of them with a single cached step over the
+last decoded token and the proposals, reusing its states of the previous rounds.
+The proposals are accepted with the rule of speculative sampling (Leviathan et
+al., 2023; Chen et al., 2023): the i-th proposed token d_i is accepted with
+probability min(1, p(d_i) / q(d_i)), p and q being the target and draft
+distributions. The first rejected token is replaced by a sample from
+max(p - q, 0), normalized, and if all of them are accepted, one more token is
+sampled from p. The decoded tokens then have the distribution of sampling from
+the target LM alone. In greedy mode, the proposals are accepted while they are
+the argmax of p, and the decoded tokens are those of greedy decoding with the
+target LM alone.
+
+Each row of a batch advances by its own number of accepted proposals plus one.
+The states of both LMs grow by `num_draft_tokens + 1` slots each round, shared
+by all the rows, and the slots of the rejected proposals of a row are masked
+out of the attention of the following rounds.
+"""
+
+import lingvo.compat as tf
+from lingvo.core import base_layer
+from lingvo.core import py_utils
+from lingvo.tasks.lm import layers as lm_layers
+
+
+class SpeculativeDecoder(base_layer.BaseLayer):
+  """Decodes from `target_lm`, with the proposals of `draft_lm`."""
+
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.Define('target_lm', lm_layers.TransformerLm.Params(),
+             'The LM decoded from.')
+    p.Define(
+        'draft_lm', lm_layers.TransformerLm.Params(),
+        'The LM proposing the tokens, typically a shallower TransformerLm '
+        'with the same vocab.')
+    p.Define('num_draft_tokens', 4, 'Number of tokens proposed each round.')
+    p.Define('target_seq_len', 0, 'Number of tokens to decode.')
+    p.Define(
+        'greedy', True, 'If True, decodes the argmax of the target LM at each '
+        'step, else samples from it.')
+    p.Define(
+        'temperature', 1., 'The temperature of the distributions sampled '
+        'from, if not greedy. Must be > 0.')
+    p.name = 'speculative_decoder'
+    return p
+
+  def __init__(self, params):
+    super().__init__(params)
+    p = self.params
+    assert p.num_draft_tokens > 0
+    assert p.target_seq_len > 0
+    assert p.temperature > 0
+    if p.target_lm.vocab_size != p.draft_lm.vocab_size:
+      raise ValueError('target_lm and draft_lm have different vocab sizes: '
+                       '{} vs. {}'.format(p.target_lm.vocab_size,
+                                          p.draft_lm.vocab_size))
+    self.CreateChild('target_lm', p.target_lm)
+    self.CreateChild('draft_lm', p.draft_lm)
+
+  def _ExtendSteps(self, lm, theta, ids, states, positions=None,
+                   paddings=None):
+    """Returns the logits [steps, batch, vocab] of lm after ids [steps, batch].
+
+    Args:
+      lm: The `TransformerLm` to run.
+      theta: The weights of lm.
+      ids: An int32 tensor of shape [steps, batch].
+      states: The prefix states of lm.
+      positions: If not None, an int32 tensor of shape [steps, batch], the
+        positions of ids.
+      paddings: If not None, a tensor of shape [prefix_len, batch], 1 for the
+        slots of states which ids do not follow.
+
+    Returns:
+      The logits and the new states of lm.
+    """
+    steps, batch = py_utils.GetShape(ids, 2)
+    inputs = tf.reshape(
+        lm.emb.EmbLookup(theta.emb, tf.reshape(ids, [-1])),
+        [steps, batch, lm.params.model_dim])
+    output, states = lm.ExtendSteps(theta, inputs, states, positions, paddings)
+    return output.logits, states
+
+  def _Sample(self, logits, seed):
+    """Returns the argmax or a sample [batch] of logits [batch, vocab]."""
+    p = self.params
+    if p.greedy:
+      return tf.argmax(logits, axis=-1, output_type=tf.int32)
+    return tf.cast(
+        tf.squeeze(
+            tf.random.stateless_categorical(logits / p.temperature, 1, seed),
+            -1), tf.int32)
+
+  def Decode(self, theta, prefix_ids, random_seed=None):
+    """Decodes p.target_seq_len tokens after prefix_ids.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      prefix_ids: An int32 tensor of shape [batch, prefix_len], with
+        prefix_len >= 1, the ids the decoded tokens follow.
+      random_seed: A scalar int32 tensor, the seed of the samples. Only used if
+        not p.greedy.
+
+    Returns:
+      A `.NestedMap` containing:
+
+      - ids: An int32 tensor of shape [batch, p.target_seq_len], the decoded
+        ids.
+      - num_rounds: The number of rounds, each with one cached step of the
+        target LM over p.num_draft_tokens + 1 tokens, instead of
+        p.target_seq_len single token steps without the draft LM.
+      - acceptance_rate: The fraction of the proposals to the rows not done
+        yet which were accepted, up to the first rejected one of each row.
+    """
+    p = self.params
+    k = p.num_draft_tokens
+    if random_seed is None:
+      random_seed = tf.constant(0, dtype=tf.int32)
+    batch, prefix_len = py_utils.GetShape(prefix_ids, 2)
+    max_len = prefix_len + p.target_seq_len
+    # [batch, max_len + 2 * k + 1]. A round writes k + 1 tokens from the length
+    # of each row, which is at most max_len + k in the rows already done.
+    ids = tf.concat(
+        [prefix_ids,
+         tf.zeros([batch, p.target_seq_len + 2 * k + 1], tf.int32)], 1)
+    lens = tf.fill([batch], prefix_len)
+
+    # The states of both LMs cover all the tokens but the last one of each row,
+    # which each round runs first. paddings [slots, batch] marks the slots
+    # which the following tokens do not attend to: those of the rejected
+    # proposals, and that of the last token of the prefix, run here only to
+    # have at least one step.
+    prefill_ids = tf.transpose(prefix_ids)
+    target_state0 = self.target_lm.zero_state(theta.target_lm, batch)
+    _, target_states = self._ExtendSteps(self.target_lm, theta.target_lm,
+                                         prefill_ids, target_state0)
+    draft_state0 = self.draft_lm.zero_state(theta.draft_lm, batch)
+    _, draft_states = self._ExtendSteps(self.draft_lm, theta.draft_lm,
+                                        prefill_ids, draft_state0)
+    paddings = tf.concat(
+        [tf.zeros([prefix_len - 1, batch]),
+         tf.ones([1, batch])], 0)
+
+    def LoopContinue(lens, *unused_args):
+      return tf.reduce_min(lens) < max_len
+
+    def LoopBody(lens, ids, target_states_list, draft_states_list, paddings,
+                 num_rounds, num_accepted, num_proposed):
+      """Decodes the tokens of one round."""
+      target_states = target_state0.Pack(target_states_list)
+      draft_states = draft_state0.Pack(draft_states_list)
+      seed = lambda i: tf.stack([random_seed, num_rounds * (k + 3) + i])
+      active = lens < max_len
+      # [k + 1, 1].
+      steps = tf.range(k + 1)[:, tf.newaxis]
+      # [k + 1, batch], the positions of the last token and of the proposals.
+      positions = lens[tf.newaxis] - 1 + steps
+      # [batch].
+      last_ids = tf.gather(ids, lens - 1, batch_dims=1)
+
+      # Proposes k tokens. Also runs the last proposal through the draft LM,
+      # whose states then cover all the proposals.
+      draft_logits = []
+      proposals = []
+      draft_ids = last_ids
+      for i in range(k + 1):
+        logits, draft_states = self._ExtendSteps(
+            self.draft_lm, theta.draft_lm, draft_ids[tf.newaxis], draft_states,
+            positions[i:i + 1],
+            tf.concat([paddings, tf.zeros([i, batch])], 0))
+        if i < k:
+          draft_ids = self._Sample(logits[0], seed(i))
+          draft_logits.append(logits[0])
+          proposals.append(draft_ids)
+      # [k, batch].
+      proposals = tf.stack(proposals)
+      # [k, batch, vocab].
+      draft_logits = tf.stack(draft_logits)
+
+      # [k + 1, batch, vocab], the target logits of each proposal and of the
+      # token after them.
+      target_logits, target_states = self._ExtendSteps(
+          self.target_lm, theta.target_lm,
+          tf.concat([last_ids[tf.newaxis], proposals], 0), target_states,
+          positions, paddings)
+
+      if p.greedy:
+        target_ids = tf.argmax(target_logits, axis=-1, output_type=tf.int32)
+        accepted = tf.equal(proposals, target_ids[:k])
+      else:
+        target_probs = tf.nn.softmax(target_logits / p.temperature)
+        draft_probs = tf.nn.softmax(draft_logits / p.temperature)
+        one_hot = tf.one_hot(proposals, p.target_lm.vocab_size)
+        ratios = tf.math.divide_no_nan(
+            tf.reduce_sum(target_probs[:k] * one_hot, -1),
+            tf.reduce_sum(draft_probs * one_hot, -1))
+        accepted = tf.random.stateless_uniform([k, batch], seed(k)) < ratios
+      # [batch], the number of proposals accepted in each row.
+      n = tf.reduce_sum(tf.math.cumprod(tf.cast(accepted, tf.int32), axis=0), 0)
+      # [batch, 2], the indices of position n of each row in [k + 1, batch].
+      n_indices = tf.stack([n, tf.range(batch)], 1)
+
+      # The token at position n of each row, where the proposal is rejected or
+      # past the proposals.
+      if p.greedy:
+        next_ids = tf.gather_nd(target_ids, n_indices)
+      else:
+        target_probs_n = tf.gather_nd(target_probs, n_indices)
+        residual_probs = tf.nn.relu(target_probs_n - tf.gather_nd(
+            tf.concat([draft_probs, tf.zeros_like(draft_probs[:1])], 0),
+            n_indices))
+        # The residual is 0 only if p == q, where no proposal is rejected.
+        residual_probs = tf.where(
+            tf.reduce_sum(residual_probs, -1) > 0., residual_probs,
+            target_probs_n)
+        next_ids = tf.cast(
+            tf.squeeze(
+                tf.random.stateless_categorical(
+                    tf.math.log(residual_probs), 1, seed(k + 1)), -1),
+            tf.int32)
+
+      # [k + 1, batch], the accepted proposals, then next_ids at position n.
+      new_ids = tf.where(
+          tf.equal(steps, n), tf.tile(next_ids[tf.newaxis], [k + 1, 1]),
+          tf.concat([proposals, tf.zeros([1, batch], tf.int32)], 0))
+      # [k + 1, batch, 2], the indices of the new ids in ids.
+      indices = tf.stack(
+          [tf.tile(tf.range(batch)[tf.newaxis], [k + 1, 1]), lens + steps], -1)
+      ids = tf.tensor_scatter_nd_update(ids, indices, new_ids)
+      # [batch], the number of tokens decoded in each row.
+      num_new = tf.where(active, n + 1, tf.zeros_like(n))
+      # The states of the round cover the last token and the accepted
+      # proposals, next_ids being the last token of the next round.
+      paddings = tf.concat(
+          [paddings,
+           tf.cast(steps >= num_new[tf.newaxis], paddings.dtype)], 0)
+      return (lens + num_new, ids, target_states.Flatten(),
+              draft_states.Flatten(), paddings, num_rounds + 1,
+              num_accepted + tf.reduce_sum(tf.where(active, n,
+                                                    tf.zeros_like(n))),
+              num_proposed + k * tf.reduce_sum(tf.cast(active, tf.int32)))
+
+    target_states_list = target_states.Flatten()
+    draft_states_list = draft_states.Flatten()
+    _, ids, _, _, _, num_rounds, num_accepted, num_proposed = tf.while_loop(
+        LoopContinue,
+        LoopBody,
+        loop_vars=(lens, ids, target_states_list, draft_states_list, paddings,
+                   tf.constant(0), tf.constant(0), tf.constant(0)),
+        shape_invariants=(lens.shape, ids.shape,
+                          [tf.TensorShape([None, None, None])] *
+                          len(target_states_list),
+                          [tf.TensorShape([None, None, None])] *
+                          len(draft_states_list), tf.TensorShape([None, None]),
+                          tf.TensorShape([]), tf.TensorShape([]),
+                          tf.TensorShape([])))
+    return py_utils.NestedMap(
+        ids=ids[:, prefix_len:max_len],
+        num_rounds=num_rounds,
+        acceptance_rate=tf.cast(num_accepted, tf.float32) /
+        tf.cast(num_proposed, tf.float32))
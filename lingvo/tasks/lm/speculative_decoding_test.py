@@ -0,0 +1,99 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for speculative_decoding."""
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tasks.lm import layers as lm_layers
+from lingvo.tasks.lm import speculative_decoding
+import numpy as np
+
+
+def _LmParams(num_layers, vocab=8, dims=8, hidden_dim=8):
+  p = lm_layers.TransformerLm.Params()
+  p.vocab_size = vocab
+  p.emb.vocab_size = vocab
+  p.emb.embedding_dim = dims
+  p.model_dim = dims
+  p.num_trans_layers = num_layers
+  p.position_emb.embedding_dim = dims
+  p.trans_tpl.source_dim = dims
+  p.trans_tpl.tr_atten_tpl.num_attention_heads = 2
+  p.trans_tpl.tr_fflayer_tpl.hidden_dim = hidden_dim
+  p.softmax.input_dim = dims
+  p.softmax.num_classes = vocab
+  return p
+
+
+def _DecoderParams(**kwargs):
+  return speculative_decoding.SpeculativeDecoder.Params().Set(
+      target_lm=_LmParams(3), draft_lm=_LmParams(1), **kwargs)
+
+
+class SpeculativeDecoderTest(test_utils.TestCase):
+
+  def testGreedyMatchesTargetLm(self):
+    batch, prefix_len, target_seq_len = 3, 2, 9
+    with self.session() as sess:
+      tf.random.set_seed(123)
+      decoder = _DecoderParams(
+          num_draft_tokens=3, target_seq_len=target_seq_len).Instantiate()
+      prefix_ids = np.random.RandomState(1).randint(8, size=[batch, prefix_len])
+      out = decoder.Decode(decoder.theta, tf.constant(prefix_ids, tf.int32))
+      ids_ph = tf.placeholder(tf.int32, [None, batch])
+      logits = decoder.target_lm.FPropDefaultTheta(
+          ids_ph, tf.zeros_like(ids_ph, tf.float32))[0].logits
+      self.evaluate(tf.global_variables_initializer())
+      out = self.evaluate(out)
+
+      # Greedy decoding with the target LM alone.
+      ids = prefix_ids.T
+      for _ in range(target_seq_len):
+        logits_val = sess.run(logits, {ids_ph: ids})
+        ids = np.concatenate([ids, np.argmax(logits_val[-1:], -1)], 0)
+      self.assertAllEqual(ids[prefix_len:].T, out.ids)
+      self.assertLessEqual(out.num_rounds, target_seq_len)
+      self.assertBetween(out.acceptance_rate, 0., 1.)
+
+  def testSamplingMatchesTargetDistribution(self):
+    batch, vocab = 4000, 8
+    with self.session():
+      tf.random.set_seed(123)
+      decoder = _DecoderParams(
+          num_draft_tokens=2, target_seq_len=1, greedy=False,
+          temperature=0.5).Instantiate()
+      prefix_ids = tf.fill([batch, 1], 3)
+      out = decoder.Decode(
+          decoder.theta, prefix_ids, random_seed=tf.constant(7))
+      probs = tf.nn.softmax(
+          decoder.target_lm.FPropDefaultTheta(
+              prefix_ids[:1], tf.zeros([1, 1]))[0].logits[0, 0] / 0.5)
+      self.evaluate(tf.global_variables_initializer())
+      out, probs = self.evaluate([out, probs])
+      self.assertEqual((batch, 1), out.ids.shape)
+      self.assertEqual(1, out.num_rounds)
+      freqs = np.bincount(out.ids[:, 0], minlength=vocab) / batch
+      self.assertAllClose(probs, freqs, atol=0.03)
+
+  def testDifferentVocabSizes(self):
+    p = _DecoderParams(target_seq_len=4)
+    p.draft_lm = _LmParams(1, vocab=16)
+    with self.assertRaisesRegex(ValueError, 'different vocab sizes'):
+      p.Instantiate()
+
+
+if __name__ == '__main__':
+  tf.test.main()
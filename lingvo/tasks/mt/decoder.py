@@ -2424,7 +2424,8 @@ class TransformerBatchMajorDecoder(MTBaseDecoder):
                  new_ids,
                  time_step,
                  prefix_states,
-                 use_short_seq_opt=False):
+                 use_short_seq_opt=False,
+                 shared_prefix_states=None):
     """Extend prefix as represented by `prefix_states` by one more step.
 
     This function is expected to be called during fast decoding of Transformer
@@ -2446,6 +2447,10 @@ class TransformerBatchMajorDecoder(MTBaseDecoder):
         - key: [target_time, target_batch, num_heads, dim_per_head].
         - value: [target_time, target_batch, num_heads, dim_per_head].
       use_short_seq_opt: A bool, whether using short sequence optimization.
+      shared_prefix_states: If not None, the states of prompts shared by groups
+        of target_batch / num_prompts consecutive hyps, as returned by
+        `PrefixStates()`. The hyps attend to them before prefix_states, and
+        time_step then counts the steps after the prompt.
 
     Returns:
       last_decoder_out: The last decoder layer of shape [target_batch, dim].
@@ -2476,6 +2481,8 @@ class TransformerBatchMajorDecoder(MTBaseDecoder):
       else:
         raise ValueError('Unexpected input type `%s` for `time_step`.' %
                          type(time_step))
+      if shared_prefix_states is not None:
+        time_step_t += py_utils.GetShape(shared_prefix_states.paddings)[1]
       posit_embs = self.position_emb.FPropWithPosition(theta.position_emb,
                                                        time_step_t)
       # [target_batch, 1, dim]
@@ -2491,10 +2498,15 @@ class TransformerBatchMajorDecoder(MTBaseDecoder):
       layer_in = input_embs
       for i, (layer, layer_theta) in enumerate(
           zip(self.decoder_trans, theta.decoder_trans)):
+        kwargs = {}
+        if shared_prefix_states is not None:
+          kwargs['prefix_states'] = shared_prefix_states['layer_%i' % i].copy()
+          kwargs['prefix_states'].paddings = shared_prefix_states.paddings
         # [target_batch, 1, dim]
         layer_out, _, updated_states = layer.ExtendStep(
             layer_theta, layer_in, aux_vec, aux_paddings,
-            prefix_states['layer_%i' % i], time_step, use_short_seq_opt)
+            prefix_states['layer_%i' % i], time_step, use_short_seq_opt,
+            **kwargs)
         updated_prefix_states['layer_%i' % i] = updated_states
         layer_in = layer_out
 
@@ -2504,6 +2516,102 @@ class TransformerBatchMajorDecoder(MTBaseDecoder):
         last_decoder_out = self.final_ln.FProp(theta.final_ln, last_decoder_out)
       return last_decoder_out, updated_prefix_states
 
+  def PrefixStates(self, theta, encoder_outputs, prefix_ids):
+    """Computes the self-attention states of prompts, for `ExtendStep()`.
+
+    The states of all the steps of the prompts are computed at once, with one
+    causal FProp() of each layer, and can then be shared by all the hyps
+    decoded after a prompt.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      encoder_outputs: A '.NestedMap' object computed by encoder.
+
+        - encoded: Source encoding of shape [source_time, source_batch, dim] or
+          [source_batch, source_time, dim], depending on p.input_data_format.
+        - paddings: Source encoding's padding of shape
+          [source_time, source_batch] or [source_batch, source_time].
+      prefix_ids: The ids of the prompts, of shape [source_batch, prefix_time].
+
+    Returns:
+      A `.NestedMap` with the states of each layer 'layer_%d':
+
+        - key: [prefix_time, source_batch, num_heads, dim_per_head].
+        - value: [prefix_time, source_batch, num_heads, dim_per_head].
+
+      and paddings, zeros of shape [source_batch, prefix_time].
+    """
+    p = self.params
+    encoder_out_bm = self._MaybeTransposeEncoderOutputs(encoder_outputs, 'BTC')
+    # [source_batch, source_time, dim]
+    aux_vec = encoder_out_bm.encoded
+    # [source_batch, source_time]
+    aux_paddings = encoder_out_bm.padding
+
+    with tf.name_scope(p.name):
+      # [source_batch, prefix_time, dim]
+      if not p.shared_emb:
+        token_embs = self.token_emb.EmbLookup(theta.token_emb, prefix_ids)
+      else:
+        token_embs = self.softmax.EmbLookup(theta.softmax, prefix_ids)
+      num_prefixes, prefix_time = py_utils.GetShape(prefix_ids, 2)
+      # [1, prefix_time, dim]
+      posit_embs = tf.expand_dims(
+          self.position_emb.FProp(theta.position_emb, prefix_time), 0)
+      # [source_batch, prefix_time, dim]
+      input_embs = token_embs + posit_embs
+
+      if p.input_dropout_tpl.fprop_dtype:
+        input_embs = tf.cast(input_embs, p.input_dropout_tpl.fprop_dtype)
+
+      input_embs = self.input_dropout.FProp(theta.input_dropout, input_embs)
+      paddings = tf.zeros([num_prefixes, prefix_time], dtype=input_embs.dtype)
+      states = py_utils.NestedMap(paddings=paddings)
+      layer_in = input_embs
+      for i, (layer, layer_theta) in enumerate(
+          zip(self.decoder_trans, theta.decoder_trans)):
+        # [source_batch, prefix_time, dim]
+        layer_in, states['layer_%i' % i] = layer.PrefixStates(
+            layer_theta, layer_in, paddings, aux_vec, aux_paddings)
+      return states
+
+  def BeamSearchDecodeWithTheta(self,
+                                theta,
+                                encoder_outputs,
+                                num_hyps_per_beam_override=0):
+    return super().BeamSearchDecodeWithTheta(
+        theta, self._MaybeAddSharedPrefixStates(theta, encoder_outputs),
+        num_hyps_per_beam_override)
+
+  def GreedySearchDecodeWithTheta(self, theta, encoder_outputs):
+    return super().GreedySearchDecodeWithTheta(
+        theta, self._MaybeAddSharedPrefixStates(theta, encoder_outputs))
+
+  def _MaybeAddSharedPrefixStates(self, theta, encoder_outputs):
+    """Adds the states of the prompts encoder_outputs.prefix_ids, if any.
+
+    The hyps decoded after a prompt then all attend to the same states of the
+    prompt, instead of each computing and reordering a copy of them.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      encoder_outputs: A '.NestedMap' object computed by encoder, optionally
+        with prefix_ids, the ids of a prompt of each source sequence, of shape
+        [source_batch, prefix_time], which the decoded ids follow.
+
+    Returns:
+      encoder_outputs, with shared_prefix_states, as returned by
+      `PrefixStates()`, if it has prefix_ids.
+    """
+    if encoder_outputs.get('prefix_ids', None) is None:
+      return encoder_outputs
+    encoder_outputs = encoder_outputs.copy()
+    encoder_outputs.shared_prefix_states = self.PrefixStates(
+        theta, encoder_outputs, encoder_outputs.prefix_ids)
+    return encoder_outputs
+
   def ComputePredictions(self, theta, encoder_outputs, targets):
     """Decodes `targets` given encoded source.
 
@@ -2778,9 +2886,19 @@ class TransformerBatchMajorDecoder(MTBaseDecoder):
     # [source_batch * num_hyps_per_beam, 1]
     new_ids = tf.reshape(new_ids, [-1, 1])
 
+    shared_prefix_states = encoder_outputs.get('shared_prefix_states', None)
+    if (encoder_outputs.get('prefix_ids', None) is not None and
+        shared_prefix_states is None):
+      raise ValueError('prefix_ids is only supported by beam and greedy '
+                       'search.')
     softmax_input, updated_prefix_states = self.ExtendStep(
-        theta, encoder_outputs, new_ids, time_step, prefix_states,
-        use_short_seq_opt)
+        theta,
+        encoder_outputs,
+        new_ids,
+        time_step,
+        prefix_states,
+        use_short_seq_opt,
+        shared_prefix_states=shared_prefix_states)
 
     # Transpose the outputs as num_beams by num_hyps_per_beam to match the
     # beam search requirement.
@@ -2818,3 +2936,40 @@ class TransformerBatchMajorDecoder(MTBaseDecoder):
                                   states):
     # There is nothing to do here.
     return states
+
+  def _CompactEncoderOutputsCallback(self, theta, encoder_outputs, beam_ids):
+    """Returns the encoder outputs of the source sequences of beam_ids.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      encoder_outputs: A '.NestedMap' object computed by encoder, with tensors
+        of shape [source_time, source_batch, ...] or [source_batch, ...],
+        depending on p.input_data_format.
+      beam_ids: An int32 tensor of shape [new_source_batch].
+
+    Returns:
+      encoder_outputs with new_source_batch source sequences.
+    """
+    p = self.params
+
+    def _Gather(x):
+      if x is None:
+        return x
+      if p.input_data_format == 'TBC' and x.shape.ndims >= 2:
+        return tf.gather(x, beam_ids, axis=1)
+      return tf.gather(x, beam_ids)
+
+    # The prompts are batch major, and their keys and values time major.
+    prompts = py_utils.NestedMap()
+    encoder_outputs = encoder_outputs.copy()
+    for key in ('prefix_ids', 'shared_prefix_states'):
+      if encoder_outputs.get(key, None) is not None:
+        prompts[key] = encoder_outputs.pop(key)
+    compacted = encoder_outputs.Transform(_Gather)
+    if 'prefix_ids' in prompts:
+      compacted.prefix_ids = tf.gather(prompts.prefix_ids, beam_ids)
+    if 'shared_prefix_states' in prompts:
+      compacted.shared_prefix_states = prompts.shared_prefix_states.Transform(
+          lambda x: tf.gather(x, beam_ids, axis=1 if x.shape.ndims == 4 else 0))
+    return compacted
@@ -1275,6 +1275,7 @@ class TransformerBatchMajorDecoderTest(test_utils.TestCase,
   def _ConstructTransformerBatchMajorDecoder(self,
                                              dtype=tf.float32,
                                              packed_input=False,
+                                             compact_interval=0,
                                              **kwargs):
     p = decoder.TransformerBatchMajorDecoder.Params()
     p.name = 'decoder'
@@ -1305,6 +1306,7 @@ class TransformerBatchMajorDecoderTest(test_utils.TestCase,
     p.beam_search.num_hyps_per_beam = 2
     p.beam_search.coverage_penalty = 0.0
     p.beam_search.length_normalization = 0
+    p.beam_search.compact_interval = compact_interval
     p.dtype = dtype
     for k, v in kwargs.items():
       setattr(p, k, v)
@@ -1443,6 +1445,90 @@ class TransformerBatchMajorDecoderTest(test_utils.TestCase,
       self.assertAllEqual(expected_topk_lens, actual_decode.topk_lens)
       self.assertAllClose(expected_topk_scores, actual_decode.topk_scores)
 
+  @parameterized.named_parameters(('TBC', 'TBC'), ('BTC', 'BTC'))
+  def testBeamSearchDecodeCompaction(self, input_data_format):
+    with self.session(use_gpu=False) as sess:
+      dec = self._ConstructTransformerBatchMajorDecoder(
+          compact_interval=1,
+          input_data_format=input_data_format,
+          target_seq_len=8)
+      encoder_outputs, _ = self._Inputs()
+      if input_data_format == 'BTC':
+        encoder_outputs = encoder_outputs.Transform(
+            lambda x: tf.transpose(x, [1, 0] + list(range(2, x.shape.ndims))))
+      decode = dec.BeamSearchDecode(encoder_outputs)
+      # The same search, without compaction.
+      beam_search = dec.params.beam_search.Copy().Set(
+          compact_interval=0).Instantiate()
+      expected = beam_search.BeamSearchDecode(
+          dec.theta, encoder_outputs, 0, dec._InitBeamSearchStateCallback,
+          dec._PreBeamSearchStepCallback, dec._PostBeamSearchStepCallback)
+      tf.global_variables_initializer().run()
+      actual_decode, expected_decode = sess.run([
+          (decode.topk_ids, decode.topk_lens, decode.topk_scores),
+          (expected.topk_ids, expected.topk_lens, expected.topk_scores)
+      ])
+      self.assertAllEqual(expected_decode[0], actual_decode[0])
+      self.assertAllEqual(expected_decode[1], actual_decode[1])
+      self.assertAllClose(expected_decode[2], actual_decode[2])
+
+  @parameterized.named_parameters(('NoCompaction', 0), ('Compaction', 1))
+  def testBeamSearchDecodeWithPrefix(self, compact_interval):
+    num_hyps, prefix_time, target_seq_len = 2, 3, 6
+    with self.session(use_gpu=False) as sess:
+      dec = self._ConstructTransformerBatchMajorDecoder(
+          compact_interval=compact_interval, target_seq_len=target_seq_len)
+      encoder_outputs, _ = self._Inputs()
+      prefix_ids = tf.constant(
+          np.random.RandomState(1).randint(20, size=[4, prefix_time]),
+          tf.int32)
+      # The hyps of a beam share the states of its prefix.
+      prefix_encoder_outputs = encoder_outputs.copy()
+      prefix_encoder_outputs.prefix_ids = prefix_ids
+      decode = dec.BeamSearchDecode(prefix_encoder_outputs)
+
+      def _InitBeamSearchStateWithPrefix(theta, encoder_outputs,
+                                         num_hyps_per_beam):
+        """Runs the prefix through the states of each hyp."""
+        initial_results, states = dec._InitBeamSearchStateCallback(
+            theta, encoder_outputs, num_hyps_per_beam)
+        target_batch = 4 * num_hyps_per_beam
+        for i in range(dec.params.num_trans_layers):
+          states.prefix_states['layer_%d' % i] = dec.decoder_trans[
+              i].InitStates(theta.decoder_trans[i], target_batch,
+                            prefix_time + target_seq_len)
+        # [source_batch * num_hyps_per_beam, prefix_time]
+        hyp_prefix_ids = tf.repeat(prefix_ids, num_hyps_per_beam, axis=0)
+        for t in range(prefix_time):
+          _, states.prefix_states = dec.ExtendStep(theta, encoder_outputs,
+                                                   hyp_prefix_ids[:, t:t + 1],
+                                                   t, states.prefix_states)
+        states.time_step = tf.constant(prefix_time)
+        return initial_results, states
+
+      beam_search = dec.params.beam_search.Copy().Set(
+          compact_interval=0).Instantiate()
+      expected = beam_search.BeamSearchDecode(dec.theta, encoder_outputs, 0,
+                                              _InitBeamSearchStateWithPrefix,
+                                              dec._PreBeamSearchStepCallback,
+                                              dec._PostBeamSearchStepCallback)
+      tf.global_variables_initializer().run()
+      actual_decode, expected_decode = sess.run([
+          (decode.topk_ids, decode.topk_lens, decode.topk_scores),
+          (expected.topk_ids, expected.topk_lens, expected.topk_scores)
+      ])
+      self.assertEqual(num_hyps, dec.params.beam_search.num_hyps_per_beam)
+      self.assertAllEqual(expected_decode[0], actual_decode[0])
+      self.assertAllEqual(expected_decode[1], actual_decode[1])
+      self.assertAllClose(expected_decode[2], actual_decode[2])
+
+  def testSampleTargetSequencesWithPrefixNotSupported(self):
+    dec = self._ConstructTransformerBatchMajorDecoder()
+    encoder_outputs, _ = self._Inputs()
+    encoder_outputs.prefix_ids = tf.zeros([4, 3], tf.int32)
+    with self.assertRaisesRegex(ValueError, 'prefix_ids is only supported'):
+      dec.SampleTargetSequences(dec.theta, encoder_outputs, tf.constant(1))
+
 
 if __name__ == '__main__':
   tf.test.main()
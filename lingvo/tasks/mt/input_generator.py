@@ -493,6 +493,13 @@ class TextPackedInput(base_input_generator.BaseSequenceInputGenerator):
 
     * Consider enabling multithreading for the trainer job (in the Train()
       method). For example: p.num_batcher_threads = 128.
+
+    * p.prepacked_input reads rows packed offline by
+      lingvo/tools/pack_mt_examples.py instead of raw text. The rows are
+      already tokenized and packed, so p.tokenizer is only used for its
+      sos/eos ids, no per-step packing is done and p.packing_factor must be
+      None. p.source_max_length and p.target_max_length should match the
+      lengths used by the packing tool; longer rows are filtered out.
     """
     p = super().Params()
 
@@ -508,6 +515,11 @@ class TextPackedInput(base_input_generator.BaseSequenceInputGenerator):
         'packing is disabled; otherwise the packing factor should be a '
         'float with a value greater than 1.')
 
+    p.Define(
+        'prepacked_input', False,
+        'If True, p.file_pattern holds tf.Examples packed offline by '
+        'lingvo/tools/pack_mt_examples.py.')
+
     p.Define(
         'quality_score_filter_fn', None,
         'A user defined boolean function on a float (quality score). '
@@ -555,6 +567,8 @@ class TextPackedInput(base_input_generator.BaseSequenceInputGenerator):
       raise ValueError('Only p.natural_order_model=True is supported now.')
     self.natural_order_model = p.natural_order_model
 
+    if p.prepacked_input and p.packing_factor:
+      raise ValueError('p.packing_factor must be None with p.prepacked_input.')
     if p.packing_factor:
       # Packing is enabled. We override p.bucket_batch_limit with the
       # pre-packing batch size.
@@ -792,11 +806,63 @@ class TextPackedInput(base_input_generator.BaseSequenceInputGenerator):
     sentences = tf.squeeze(sentences)
     return sentences[0], sentences[1]
 
+  def _ProcessPackedRecord(self, source_id, record):
+    """Parses a row packed by pack_mt_examples.py into padded features."""
+    p = self.params
+    outputs = [
+        ('inputs', tf.io.VarLenFeature(tf.int64)),
+        ('targets', tf.io.VarLenFeature(tf.int64)),
+        ('inputs_segmentation', tf.io.VarLenFeature(tf.int64)),
+        ('inputs_position', tf.io.VarLenFeature(tf.int64)),
+        ('targets_segmentation', tf.io.VarLenFeature(tf.int64)),
+        ('targets_position', tf.io.VarLenFeature(tf.int64)),
+    ]
+    parsed = tf.io.parse_single_example(record, dict(outputs))
+    parsed = {k: tf.cast(v.values, tf.int32) for k, v in parsed.items()}
+    fits = tf.math.logical_and(
+        tf.size(parsed['inputs']) <= p.source_max_length,
+        tf.size(parsed['targets']) <= p.target_max_length)
+
+    def _Pad(x, max_length):
+      return py_utils.PadOrTrimTo(x, [max_length])
+
+    src_task_id, tgt_task_id = self._GetLangIds(source_id)
+    features = py_utils.NestedMap()
+    for key, name, max_length, task_id in (
+        ('inputs', 'src', p.source_max_length, src_task_id),
+        ('targets', 'tgt', p.target_max_length, tgt_task_id)):
+      segment_ids = _Pad(parsed[key + '_segmentation'], max_length)
+      ids_indicator = tf.cast(segment_ids > 0, tf.float32)
+      features[name] = py_utils.NestedMap(
+          ids=_Pad(parsed[key], max_length),
+          ids_indicator=ids_indicator,
+          weights=ids_indicator,
+          paddings=1. - ids_indicator,
+          segment_ids=tf.cast(segment_ids, tf.float32),
+          segment_pos=_Pad(parsed[key + '_position'], max_length),
+          task_ids=tf.cast(ids_indicator, tf.int32) * task_id,
+          source_ids=tf.cast(ids_indicator, tf.int32) * source_id)
+    # Targets are the labels shifted right by one within each segment, with
+    # SOS at the start of each segment.
+    tgt = features.tgt
+    tgt.labels = tgt.ids
+    shifted_labels = tf.concat([[0], tgt.labels[:-1]], axis=0)
+    tgt.ids = tf.where(
+        tf.math.equal(tgt.segment_pos, 0),
+        tf.fill(tf.shape(shifted_labels), self._tgt_tokenizer.sos_id),
+        shifted_labels)
+    tgt.ids = py_utils.ApplyPadding(tgt.paddings, tgt.ids)
+    # All rows have the same padded length and go into the first bucket.
+    return features, tf.cond(fits, lambda: 1, lambda: -1)
+
   def _DataSourceFromFilePattern(self, file_pattern, input_source_weights=None):
 
     def Processor(source_id, record):
       """Parses a record, which is a line of text."""
 
+      if self.params.prepacked_input:
+        return self._ProcessPackedRecord(source_id, record)
+
       task_id = self._GetTaskIds(source_id)
 
       if self.params.input_file_type == 'tsv':
@@ -856,6 +922,14 @@ class TextPackedInput(base_input_generator.BaseSequenceInputGenerator):
     summary_utils.histogram('source_seq_lengths', src_actual_seq_len)
     summary_utils.histogram('target_seq_lengths', tgt_actual_seq_len)
 
+    if self.params.prepacked_input:
+      # Rows come with .segment_ids and .segment_pos from the packing tool.
+      summary_utils.scalar('examples/src_packed_density',
+                           tf.reduce_mean(batch.src.ids_indicator))
+      summary_utils.scalar('examples/tgt_packed_density',
+                           tf.reduce_mean(batch.tgt.ids_indicator))
+      return
+
     if not self.params.packing_factor:
       # Supply segment_ids and segment_pos with no packing.
       batch.src.segment_ids = batch.src.ids_indicator
@@ -15,12 +15,15 @@
 # ==============================================================================
 """Tests for input generator."""
 
+import os
+
 import lingvo.compat as tf
 from lingvo.core import py_utils
 from lingvo.core import test_helper
 from lingvo.core import test_utils
 from lingvo.core import tokenizers
 from lingvo.tasks.mt import input_generator
+from lingvo.tools import pack_mt_examples
 import numpy as np
 
 
@@ -447,6 +450,50 @@ class InputTest(test_utils.TestCase):
             b'Hallo!\tDaf\xc3\xbcr hat sich zu viel ver\xc3\xa4ndert.'
         ]))
 
+  def testTextPackedInputPrepacked(self):
+    # Two rows as written by pack_mt_examples.py.
+    rows = [
+        [([5, 6, 2], [7, 2]), ([8, 2], [9, 10, 2])],
+        [([11, 12, 13, 2], [14, 15, 2])],
+    ]
+    output_file = os.path.join(self.get_temp_dir(), 'packed.tfrecord')
+    with tf.io.TFRecordWriter(output_file) as outf:
+      for row in rows:
+        outf.write(
+            pack_mt_examples.MakePackedExample(row).SerializeToString())
+
+    p = input_generator.TextPackedInput.Params()
+    p.flush_every_n = 0
+    p.require_sequential_order = True
+    p.repeat_count = 1
+    p.file_pattern = 'tfrecord:' + output_file
+    p.prepacked_input = True
+    p.tokenizer = tokenizers.AsciiTokenizer.Params()
+    p.source_max_length = 6
+    p.target_max_length = 6
+    p.bucket_batch_limit = [2]
+    with self.session() as sess:
+      inp = p.Instantiate()
+      batch_tensor = inp.GetPreprocessedInputBatch()
+      batch, num_examples = sess.run([batch_tensor, inp.GlobalBatchSize()])
+    self.assertEqual(num_examples, 3)
+    self.assertAllEqual(batch.src.ids,
+                        [[5, 6, 2, 8, 2, 0], [11, 12, 13, 2, 0, 0]])
+    self.assertAllEqual(batch.src.segment_ids,
+                        [[1, 1, 1, 2, 2, 0], [1, 1, 1, 1, 0, 0]])
+    self.assertAllEqual(batch.src.segment_pos,
+                        [[0, 1, 2, 0, 1, 0], [0, 1, 2, 3, 0, 0]])
+    self.assertAllEqual(batch.src.paddings,
+                        [[0, 0, 0, 0, 0, 1], [0, 0, 0, 0, 1, 1]])
+    self.assertAllEqual(batch.tgt.ids,
+                        [[1, 7, 1, 9, 10, 0], [1, 14, 15, 0, 0, 0]])
+    self.assertAllEqual(batch.tgt.labels,
+                        [[7, 2, 9, 10, 2, 0], [14, 15, 2, 0, 0, 0]])
+    self.assertAllEqual(batch.tgt.segment_ids,
+                        [[1, 1, 2, 2, 2, 0], [1, 1, 1, 0, 0, 0]])
+    self.assertAllEqual(batch.tgt.weights,
+                        [[1, 1, 1, 1, 1, 0], [1, 1, 1, 0, 0, 0]])
+
 
 if __name__ == '__main__':
   tf.test.main()
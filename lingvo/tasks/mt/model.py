@@ -22,11 +22,22 @@ from lingvo.core import metrics
 from lingvo.core import py_utils
 from lingvo.tasks.mt import decoder
 from lingvo.tasks.mt import encoder
+import numpy as np
 
 
 class MTBaseModel(base_model.BaseTask):
   """Base Class for NMT models."""
 
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.Define(
+        'use_host_detokenizer', False,
+        'If true, the decode graph outputs the ids of the sources, targets '
+        'and hypotheses, which are converted to strings on the host in '
+        'PostProcessDecodeOut() instead of by ops in the graph.')
+    return p
+
   def _EncoderDevice(self):
     """Returns the device to run the encoder computation."""
     if self.params.device_mesh is not None:
@@ -98,35 +109,57 @@ class MTBaseModel(base_model.BaseTask):
       slen = tf.cast(
           tf.round(tf.reduce_sum(1 - input_batch.src.paddings, 1) - 1),
           tf.int32)
-      srcs = self.input_generator.IdsToStrings(
-          input_batch.src.ids, slen, self._GetTokenizerKeyToUse('src'))
-      topk_decoded = self.input_generator.IdsToStrings(
-          topk_ids, topk_lens - 1, self._GetTokenizerKeyToUse('tgt'))
-      topk_decoded = tf.reshape(topk_decoded, tf.shape(topk_hyps))
+      tlen = tf.cast(
+          tf.round(tf.reduce_sum(1.0 - input_batch.tgt.paddings, 1) - 1.0),
+          tf.int32)
       topk_scores = tf.reshape(topk_scores, tf.shape(topk_hyps))
 
-      refs = self.input_generator.IdsToStrings(
-          input_batch.tgt.labels,
-          tf.cast(
-              tf.round(tf.reduce_sum(1.0 - input_batch.tgt.paddings, 1) - 1.0),
-              tf.int32), self._GetTokenizerKeyToUse('tgt'))
-
       ret_dict = {
           'target_ids': input_batch.tgt.ids,
           'target_labels': input_batch.tgt.labels,
           'target_weights': input_batch.tgt.weights,
           'target_paddings': input_batch.tgt.paddings,
-          'sources': srcs,
-          'targets': refs,
-          'topk_decoded': topk_decoded,
           'topk_lens': topk_lens,
           'topk_scores': topk_scores,
       }
+      if p.use_host_detokenizer:
+        # The strings are computed by _HostDetokenize().
+        ret_dict.update({
+            'source_ids': input_batch.src.ids,
+            'source_lens': slen,
+            'target_lens': tlen,
+            'topk_ids': topk_ids,
+        })
+        return ret_dict
+
+      ret_dict['sources'] = self.input_generator.IdsToStrings(
+          input_batch.src.ids, slen, self._GetTokenizerKeyToUse('src'))
+      ret_dict['targets'] = self.input_generator.IdsToStrings(
+          input_batch.tgt.labels, tlen, self._GetTokenizerKeyToUse('tgt'))
+      topk_decoded = self.input_generator.IdsToStrings(
+          topk_ids, topk_lens - 1, self._GetTokenizerKeyToUse('tgt'))
+      ret_dict['topk_decoded'] = tf.reshape(topk_decoded, tf.shape(topk_hyps))
       return ret_dict
 
+  def _HostDetokenize(self, dec_out_dict):
+    """Adds the strings of the ids of `dec_out_dict` computed on the host."""
+    inp = self.input_generator
+    src_key = self._GetTokenizerKeyToUse('src')
+    tgt_key = self._GetTokenizerKeyToUse('tgt')
+    dec_out_dict['sources'] = inp.HostIdsToStrings(
+        dec_out_dict['source_ids'], dec_out_dict['source_lens'], src_key)
+    dec_out_dict['targets'] = inp.HostIdsToStrings(
+        dec_out_dict['target_labels'], dec_out_dict['target_lens'], tgt_key)
+    topk_decoded = inp.HostIdsToStrings(dec_out_dict['topk_ids'],
+                                        dec_out_dict['topk_lens'] - 1, tgt_key)
+    dec_out_dict['topk_decoded'] = np.reshape(
+        topk_decoded, np.shape(dec_out_dict['topk_scores']))
+
   def _PostProcessBeamSearchDecodeOut(self, dec_out_dict, dec_metrics_dict):
     """Post processes the output from `_BeamSearchDecode`."""
     p = self.params
+    if p.use_host_detokenizer:
+      self._HostDetokenize(dec_out_dict)
     topk_scores = dec_out_dict['topk_scores']
     topk_decoded = dec_out_dict['topk_decoded']
     targets = dec_out_dict['targets']
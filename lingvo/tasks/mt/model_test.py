@@ -360,6 +360,33 @@ class TransformerModelTest(test_utils.TestCase):
       for k, v in key_value_pairs:
         self.assertIn(k, v)
 
+  def testDecodeHostDetokenizer(self):
+    with self.session(use_gpu=False):
+      tf.random.set_seed(93820985)
+      p = self._testParams()
+      p.use_host_detokenizer = True
+      mdl = p.Instantiate()
+      input_batch = mdl.input_generator.GetPreprocessedInputBatch()
+      dec_out_dict = mdl.Decode(input_batch)
+      self.assertNotIn('topk_decoded', dec_out_dict)
+      # The strings of the same ids, converted by the graph ops.
+      inp = mdl.input_generator
+      dec_out_dict['expected_sources'] = inp.IdsToStrings(
+          dec_out_dict['source_ids'], dec_out_dict['source_lens'])
+      dec_out_dict['expected_targets'] = inp.IdsToStrings(
+          dec_out_dict['target_labels'], dec_out_dict['target_lens'])
+      dec_out_dict['expected_topk_decoded'] = tf.reshape(
+          inp.IdsToStrings(dec_out_dict['topk_ids'],
+                           dec_out_dict['topk_lens'] - 1),
+          tf.shape(dec_out_dict['topk_scores']))
+      self.evaluate(tf.global_variables_initializer())
+      dec_out = self.evaluate(dec_out_dict)
+      metrics_dict = mdl.CreateDecoderMetrics()
+      key_value_pairs = mdl.PostProcessDecodeOut(dec_out, metrics_dict)
+      self.assertLen(key_value_pairs, 8)
+      for key in ('sources', 'targets', 'topk_decoded'):
+        self.assertAllEqual(dec_out['expected_' + key], dec_out[key])
+
 
 class RNMTModelTest(test_utils.TestCase):
 
@@ -15,13 +15,23 @@
 # ==============================================================================
 """Audio library."""
 
+import io
 import subprocess
+import wave
+
 import lingvo.compat as tf
 from lingvo.core import py_utils
 from lingvo.tasks.asr import frontend as asr_frontend
+import numpy as np
 
 from tensorflow.python.ops import gen_audio_ops as audio_ops  # pylint: disable=g-direct-tensorflow-import
 
+try:
+  import soundfile  # pylint: disable=g-import-not-at-top
+  HAS_SOUNDFILE = True
+except ImportError:
+  HAS_SOUNDFILE = False
+
 
 # There are two ways to decode a wav in tensorflow:
 # Through the tensorflow native audio decoder, exported
@@ -42,6 +52,35 @@ def DecodeFlacToWav(input_bytes):
   return out
 
 
+def _ParseWav(input_bytes):
+  """Returns the sample rate and int16 samples [time, channels] of a wav."""
+  with wave.open(io.BytesIO(input_bytes)) as w:
+    assert w.getsampwidth() == 2, w.getsampwidth()
+    # The number of frames in the header of a streamed wav may be wrong.
+    data = w.readframes(w.getnframes())
+    return w.getframerate(), np.frombuffer(data, '<i2').reshape(
+        [-1, w.getnchannels()])
+
+
+def DecodeFlac(input_bytes):
+  """Decodes a FLAC byte string in-process, if possible.
+
+  Decodes with the soundfile module when installed, otherwise with sox.
+
+  Args:
+    input_bytes: the contents of a FLAC file.
+
+  Returns:
+    A pair of the sample rate and the int16 numpy array of samples shaped
+    [time, channels].
+  """
+  if HAS_SOUNDFILE:
+    samples, sample_rate = soundfile.read(
+        io.BytesIO(input_bytes), dtype='int16', always_2d=True)
+    return sample_rate, samples
+  return _ParseWav(DecodeFlacToWav(input_bytes))
+
+
 def DecodeWav(input_bytes):
   """Decode a wav file from its contents.
 
@@ -69,6 +108,21 @@ def AudioToMfcc(sample_rate, audio, window_size_ms, window_stride_ms,
   return mfcc
 
 
+def _CreateAsrFrontend():
+  """Parameters corresponding to default ASR frontend."""
+  p = asr_frontend.MelAsrFrontend.Params()
+  p.sample_rate = 16000.
+  p.frame_size_ms = 25.
+  p.frame_step_ms = 10.
+  p.num_bins = 80
+  p.lower_edge_hertz = 125.
+  p.upper_edge_hertz = 7600.
+  p.preemph = 0.97
+  p.noise_scale = 0.
+  p.pad_end = False
+  return p.Instantiate()
+
+
 def ExtractLogMelFeatures(wav_bytes_t):
   """Create Log-Mel Filterbank Features from raw bytes.
 
@@ -81,26 +135,10 @@ def ExtractLogMelFeatures(wav_bytes_t):
     A Tensor representing three stacked log-Mel filterbank energies, sub-sampled
     every three frames.
   """
-
-  def _CreateAsrFrontend():
-    """Parameters corresponding to default ASR frontend."""
-    p = asr_frontend.MelAsrFrontend.Params()
-    p.sample_rate = 16000.
-    p.frame_size_ms = 25.
-    p.frame_step_ms = 10.
-    p.num_bins = 80
-    p.lower_edge_hertz = 125.
-    p.upper_edge_hertz = 7600.
-    p.preemph = 0.97
-    p.noise_scale = 0.
-    p.pad_end = False
-    return p.Instantiate()
-
   sample_rate, audio = DecodeWav(wav_bytes_t)
   audio *= 32768
   # Remove channel dimension, since we have a single channel.
   audio = tf.squeeze(audio, axis=1)
-  # TODO(drpng): make batches.
   audio = tf.expand_dims(audio, axis=0)
   static_sample_rate = 16000
   mel_frontend = _CreateAsrFrontend()
@@ -110,3 +148,22 @@ def ExtractLogMelFeatures(wav_bytes_t):
         py_utils.NestedMap(src_inputs=audio, paddings=tf.zeros_like(audio)))
     log_mel = outputs.src_inputs
   return log_mel
+
+
+def ExtractLogMelFeaturesFromSamples(audio, paddings):
+  """Same as `ExtractLogMelFeatures` for a batch of padded 16KHz utterances.
+
+  The features of the frames with no padded samples are the same as those of
+  each utterance alone.
+
+  Args:
+    audio: a float Tensor of shape [batch, time] of int16 mono samples.
+    paddings: a 0/1 Tensor of shape [batch, time].
+
+  Returns:
+    A pair of the log-mel features of shape [batch, frames, 80, 1] and their
+    paddings of shape [batch, frames].
+  """
+  outputs = _CreateAsrFrontend().FPropDefaultTheta(
+      py_utils.NestedMap(src_inputs=audio, paddings=paddings))
+  return outputs.src_inputs, outputs.paddings
@@ -48,6 +48,30 @@ def GetPipelineRoot(options=None):
   return beam.Pipeline(options=options)
 
 
+def IsLocalRun(options=None):
+  """Returns whether a pipeline with `options` runs on this machine.
+
+  Tools with a local backend, see local_records.py, use it instead of a beam
+  pipeline for local runs, which avoids the overhead of the direct runner.
+
+  Args:
+    options: A beam.options.pipeline_options.PipelineOptions object.
+
+  Returns:
+    True if the pipeline would run with a direct runner.
+  """
+  runner = None
+  if options is not None:
+    runner = options.view_as(
+        beam.options.pipeline_options.StandardOptions).runner
+  if runner is None:
+    return True
+  if not isinstance(runner, str):
+    runner = type(runner).__name__
+  runner = runner.lower()
+  return runner == "direct" or runner.endswith("directrunner")
+
+
 def GetReader(record_format, file_pattern, value_coder, **kwargs):
   """Returns a beam Reader based on record_format and file_pattern.
 
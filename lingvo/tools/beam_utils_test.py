@@ -54,6 +54,15 @@ class BeamUtilsTest(test_utils.TestCase):
     with beam_utils.GetPipelineRoot() as root:
       _ = root | beam.Create([1, 2, 3]) | beam.Map(lambda x: x)
 
+  def testIsLocalRun(self):
+    pipeline_options = beam.options.pipeline_options.PipelineOptions
+    self.assertTrue(beam_utils.IsLocalRun())
+    self.assertTrue(beam_utils.IsLocalRun(pipeline_options([])))
+    self.assertTrue(
+        beam_utils.IsLocalRun(pipeline_options(["--runner=DirectRunner"])))
+    self.assertFalse(
+        beam_utils.IsLocalRun(pipeline_options(["--runner=DataflowRunner"])))
+
   def testGetEmitterFn(self):
     _ = beam_utils.GetEmitterFn('tfrecord')
     with self.assertRaises(ValueError):
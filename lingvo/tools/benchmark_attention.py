@@ -0,0 +1,136 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Measures the memory and time of self-attention against sequence length.
+
+Runs the forward and backward passes of a batch_major_attention
+`MultiHeadedAttention` layer on CPU, with the dense attention (block size 0)
+and with the blockwise attention of `atten_block_size`. Reports for each
+sequence length and block size:
+
+- the peak bytes allocated during one step, from the step stats of a traced
+  run;
+- the mean seconds per step over `num_iters` untraced steps.
+
+To run:
+
+bazel run -c opt //lingvo/tools:benchmark_attention -- \
+  --seq_lens=1024,2048,4096,8192 --block_sizes=0,256,1024 \
+  --output_json=/tmp/attention_benchmark.json
+"""
+
+import json
+import time
+
+from lingvo import compat as tf
+from lingvo.core import batch_major_attention
+
+tf.flags.DEFINE_string('seq_lens', '512,1024,2048,4096',
+                       'Comma separated sequence lengths.')
+tf.flags.DEFINE_string(
+    'block_sizes', '0,256',
+    'Comma separated atten_block_size values. 0 is the dense attention.')
+tf.flags.DEFINE_integer('batch_size', 1, 'Batch size.')
+tf.flags.DEFINE_integer('num_heads', 8, 'Number of attention heads.')
+tf.flags.DEFINE_integer('model_dim', 512, 'Model dimension.')
+tf.flags.DEFINE_integer('num_iters', 5, 'Number of steps timed.')
+tf.flags.DEFINE_string('output_json', None,
+                       'If set, the report is also written to this file.')
+
+FLAGS = tf.flags.FLAGS
+
+
+def _PeakBytes(run_metadata):
+  """Returns the largest peak of the allocators in the step stats."""
+  peak = 0
+  for dev_stats in run_metadata.step_stats.dev_stats:
+    for node_stats in dev_stats.node_stats:
+      for memory in node_stats.memory:
+        peak = max(peak, memory.peak_bytes)
+  return peak
+
+
+def BenchmarkAttention(seq_len,
+                       block_size,
+                       batch_size=1,
+                       num_heads=8,
+                       model_dim=512,
+                       num_iters=5):
+  """Measures one step of the forward and backward passes of self-attention.
+
+  Args:
+    seq_len: the length of the queries and keys.
+    block_size: the `atten_block_size` of the layer, 0 for dense attention.
+    batch_size: the batch size.
+    num_heads: the number of attention heads.
+    model_dim: the input and hidden dimension of the layer.
+    num_iters: the number of steps timed.
+
+  Returns:
+    A dict with `seq_len`, `block_size`, `peak_bytes` and `step_seconds`.
+  """
+  with tf.Graph().as_default(), tf.device('/cpu:0'):
+    p = batch_major_attention.MultiHeadedAttention.Params().Set(
+        name='atten',
+        input_dim=model_dim,
+        hidden_dim=model_dim,
+        num_heads=num_heads,
+        atten_block_size=block_size)
+    layer = p.Instantiate()
+    inputs = tf.random.normal([batch_size, seq_len, model_dim])
+    paddings = tf.zeros([batch_size, seq_len])
+    encoded, _ = layer.FProp(layer.theta, inputs, inputs, inputs, paddings)
+    # Grouping the gradients instead of fetching them lets grappler prune the
+    # attention.
+    step = tf.gradients(tf.reduce_sum(encoded), layer.theta.Flatten())
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      # Warms up and measures the memory.
+      run_metadata = tf.RunMetadata()
+      sess.run(
+          step,
+          options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+          run_metadata=run_metadata)
+      start = time.time()
+      for _ in range(num_iters):
+        sess.run(step)
+      step_seconds = (time.time() - start) / max(num_iters, 1)
+  return {
+      'seq_len': seq_len,
+      'block_size': block_size,
+      'peak_bytes': _PeakBytes(run_metadata),
+      'step_seconds': step_seconds,
+  }
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  report = []
+  for seq_len in [int(x) for x in FLAGS.seq_lens.split(',')]:
+    for block_size in [int(x) for x in FLAGS.block_sizes.split(',')]:
+      result = BenchmarkAttention(seq_len, block_size, FLAGS.batch_size,
+                                  FLAGS.num_heads, FLAGS.model_dim,
+                                  FLAGS.num_iters)
+      tf.logging.info('seq_len=%d block_size=%d: %.1f MiB peak, %.3f s/step',
+                      seq_len, block_size, result['peak_bytes'] / 2.**20,
+                      result['step_seconds'])
+      report.append(result)
+  if FLAGS.output_json:
+    with tf.io.gfile.GFile(FLAGS.output_json, 'w') as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+  tf.app.run(main)
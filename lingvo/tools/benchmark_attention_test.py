@@ -0,0 +1,38 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for benchmark_attention."""
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tools import benchmark_attention
+
+
+class BenchmarkAttentionTest(test_utils.TestCase):
+
+  def testBlockwiseUsesLessMemory(self):
+    kwargs = dict(seq_len=512, num_heads=4, model_dim=64, num_iters=1)
+    dense = benchmark_attention.BenchmarkAttention(block_size=0, **kwargs)
+    blockwise = benchmark_attention.BenchmarkAttention(block_size=64, **kwargs)
+    self.assertEqual(512, dense['seq_len'])
+    self.assertEqual(64, blockwise['block_size'])
+    self.assertGreater(dense['step_seconds'], 0.)
+    # The dense logits alone take 4 * 512 * 512 float32.
+    self.assertGreater(dense['peak_bytes'], 4 * 512 * 512 * 4)
+    self.assertLess(blockwise['peak_bytes'], dense['peak_bytes'] / 2)
+
+
+if __name__ == '__main__':
+  tf.test.main()
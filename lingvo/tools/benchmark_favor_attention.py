@@ -0,0 +1,130 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Measures causal FAVOR attention against sequence length.
+
+Builds the forward and backward passes of `favor_attention.favor_attention`
+with causal=True and the softmax kernel, and reports for each sequence length
+and causal chunk size:
+
+- the number of ops of the graph and the seconds taken to build it;
+- the mean seconds per step over `num_iters` steps on CPU.
+
+To run:
+
+bazel run -c opt //lingvo/tools:benchmark_favor_attention -- \
+  --seq_lens=1024,4096,16384 --chunk_sizes=64,128,256 \
+  --output_json=/tmp/favor_benchmark.json
+"""
+
+import json
+import time
+
+from lingvo import compat as tf
+from lingvo.core import favor_attention
+
+tf.flags.DEFINE_string('seq_lens', '256,1024,4096',
+                       'Comma separated sequence lengths.')
+tf.flags.DEFINE_string('chunk_sizes', '128',
+                       'Comma separated causal chunk sizes.')
+tf.flags.DEFINE_integer('batch_size', 1, 'Batch size.')
+tf.flags.DEFINE_integer('num_heads', 8, 'Number of attention heads.')
+tf.flags.DEFINE_integer('dim_per_head', 64, 'Dimension of each head.')
+tf.flags.DEFINE_integer('num_random_features', 256,
+                        'Number of random features of the softmax kernel.')
+tf.flags.DEFINE_integer('num_iters', 5, 'Number of steps timed.')
+tf.flags.DEFINE_string('output_json', None,
+                       'If set, the report is also written to this file.')
+
+FLAGS = tf.flags.FLAGS
+
+
+def BenchmarkCausalFavor(seq_len,
+                         chunk_size,
+                         batch_size=1,
+                         num_heads=8,
+                         dim_per_head=64,
+                         num_random_features=256,
+                         num_iters=5):
+  """Measures the graph and one training step of causal FAVOR attention.
+
+  Args:
+    seq_len: the length of the queries and keys.
+    chunk_size: the causal chunk size.
+    batch_size: the batch size.
+    num_heads: the number of attention heads.
+    dim_per_head: the dimension of each head.
+    num_random_features: the number of random features of the kernel.
+    num_iters: the number of steps timed.
+
+  Returns:
+    A dict with `seq_len`, `chunk_size`, `num_ops`, `build_seconds` and
+    `step_seconds`.
+  """
+  with tf.Graph().as_default() as graph, tf.device('/cpu:0'):
+    start = time.time()
+    shape = [batch_size, seq_len, num_heads, dim_per_head]
+    query = tf.random.normal(shape)
+    key = tf.random.normal(shape)
+    value = tf.random.normal(shape)
+    projection_matrix = favor_attention.create_projection_matrix(
+        num_random_features, dim_per_head)
+    encoded = favor_attention.favor_attention(
+        query,
+        key,
+        value,
+        favor_attention.softmax_kernel_transformation,
+        True,
+        projection_matrix,
+        causal_chunk_size=chunk_size)
+    step = tf.gradients(tf.reduce_sum(encoded), [query, key, value])
+    build_seconds = time.time() - start
+    num_ops = len(graph.get_operations())
+    with tf.Session() as sess:
+      # Warms up.
+      sess.run(step)
+      start = time.time()
+      for _ in range(num_iters):
+        sess.run(step)
+      step_seconds = (time.time() - start) / max(num_iters, 1)
+  return {
+      'seq_len': seq_len,
+      'chunk_size': chunk_size,
+      'num_ops': num_ops,
+      'build_seconds': build_seconds,
+      'step_seconds': step_seconds,
+  }
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  report = []
+  for seq_len in [int(x) for x in FLAGS.seq_lens.split(',')]:
+    for chunk_size in [int(x) for x in FLAGS.chunk_sizes.split(',')]:
+      result = BenchmarkCausalFavor(seq_len, chunk_size, FLAGS.batch_size,
+                                    FLAGS.num_heads, FLAGS.dim_per_head,
+                                    FLAGS.num_random_features, FLAGS.num_iters)
+      tf.logging.info(
+          'seq_len=%d chunk_size=%d: %d ops built in %.2f s, %.3f s/step',
+          seq_len, chunk_size, result['num_ops'], result['build_seconds'],
+          result['step_seconds'])
+      report.append(result)
+  if FLAGS.output_json:
+    with tf.io.gfile.GFile(FLAGS.output_json, 'w') as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+  tf.app.run(main)
@@ -0,0 +1,43 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for benchmark_favor_attention."""
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tools import benchmark_favor_attention
+
+
+class BenchmarkFavorAttentionTest(test_utils.TestCase):
+
+  def testGraphSizeIndependentOfLength(self):
+    kwargs = dict(
+        chunk_size=16,
+        num_heads=2,
+        dim_per_head=8,
+        num_random_features=16,
+        num_iters=1)
+    short = benchmark_favor_attention.BenchmarkCausalFavor(
+        seq_len=32, **kwargs)
+    long = benchmark_favor_attention.BenchmarkCausalFavor(
+        seq_len=512, **kwargs)
+    self.assertEqual(512, long['seq_len'])
+    self.assertEqual(16, long['chunk_size'])
+    self.assertEqual(short['num_ops'], long['num_ops'])
+    self.assertGreater(long['step_seconds'], 0.)
+
+
+if __name__ == '__main__':
+  tf.test.main()
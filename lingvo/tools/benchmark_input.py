@@ -0,0 +1,428 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Measures the throughput of the input generator of a registered model.
+
+Only `p.input` of the model is instantiated, and its preprocessed batches are
+pulled in a session as fast as possible. Reports:
+
+- examples/sec and tokens/sec, where tokens are the unpadded positions of all
+  `*paddings` / `*padding` tensors of the batch;
+- the padding ratio of each of those tensors, per bucket for sequence inputs
+  with `bucket_keys`, and how often each bucket is produced;
+- percentiles of the latency of each batch;
+- percentiles of the latency of processing single records, for inputs built
+  with `generic_input.GenericInput()` on tfrecord or text files. The first
+  records of the files are run one at a time through the record processor of
+  the input, before the input pipeline starts, so each latency includes the
+  overhead of a session run, which is reported too. Other inputs, e.g.
+  tf.data pipelines, only get batch latencies;
+- the process CPU utilization sampled over time.
+
+To run:
+
+bazel run -c opt //lingvo/tools:benchmark_input -- \
+  --model=mt.wmt14_en_de.WmtEnDeTransformerBase --dataset=Train \
+  --num_batches=200 --output_json=/tmp/input_benchmark.json
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+
+from lingvo import compat as tf
+from lingvo import model_registry
+from lingvo.core import cluster_factory
+from lingvo.core import generic_input
+from lingvo.core import py_utils
+from lingvo.tools import local_records
+import numpy as np
+
+tf.flags.DEFINE_string('model', None, 'Name of the registered model.')
+tf.flags.DEFINE_string('dataset', 'Train', 'Name of the dataset.')
+tf.flags.DEFINE_string(
+    'job', 'trainer_client',
+    'Job type of the cluster the input generator is built for. Use evaler or '
+    'decoder to benchmark eval inputs.')
+tf.flags.DEFINE_integer('num_batches', 100, 'Number of batches measured.')
+tf.flags.DEFINE_integer('num_warmup_batches', 5,
+                        'Number of batches read before measuring.')
+tf.flags.DEFINE_integer(
+    'num_records', 200,
+    'Number of records whose processing latency is measured, for inputs '
+    'built with generic_input.GenericInput.')
+tf.flags.DEFINE_float('cpu_sample_interval', 1.0,
+                      'Seconds between samples of the CPU utilization.')
+tf.flags.DEFINE_string('output_json', None,
+                       'If set, the report is also written to this file.')
+
+FLAGS = tf.flags.FLAGS
+
+_PERCENTILES = (50, 90, 99)
+
+
+class _CpuSampler:
+  """Samples the CPU utilization of this process in a background thread."""
+
+  def __init__(self, interval):
+    self._interval = interval
+    self._samples = []
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._Run, daemon=True)
+
+  def _CpuSeconds(self):
+    times = os.times()
+    return times.user + times.system
+
+  def _Run(self):
+    start = time.time()
+    last_wall, last_cpu = start, self._CpuSeconds()
+    while not self._stop.wait(self._interval):
+      wall, cpu = time.time(), self._CpuSeconds()
+      # Utilization in number of CPUs busy.
+      self._samples.append(
+          (wall - start, (cpu - last_cpu) / max(wall - last_wall, 1e-6)))
+      last_wall, last_cpu = wall, cpu
+
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, *args):
+    self._stop.set()
+    self._thread.join()
+
+  @property
+  def samples(self):
+    """A list of (seconds since start, number of busy CPUs) tuples."""
+    return self._samples
+
+
+def _IsPaddingKey(key):
+  return key.endswith('paddings') or key.endswith('padding')
+
+
+def BatchStats(batch):
+  """Returns statistics of one numpy batch.
+
+  Args:
+    batch: a `.NestedMap` of numpy arrays, as returned by the input generator.
+
+  Returns:
+    A dict with the number of `examples` (the leading dimension of the batch),
+    the number of unpadded `tokens` and `padding_ratio`, a dict from each
+    padding key to the fraction of its entries which are padded.
+  """
+  num_examples = None
+  tokens = 0
+  padding_ratio = {}
+  for key, value in batch.FlattenItems():
+    value = np.asarray(value)
+    if num_examples is None and value.ndim > 0 and key != 'bucket_keys':
+      num_examples = value.shape[0]
+    if _IsPaddingKey(key) and value.size:
+      padding_ratio[key] = float(np.mean(value))
+      tokens += int(np.sum(1. - value))
+  return {
+      'examples': num_examples or 0,
+      'tokens': tokens,
+      'padding_ratio': padding_ratio,
+  }
+
+
+def _MergeShardStats(shards):
+  """Returns the `BatchStats()` of a batch split into per host shards."""
+  shard_stats = [BatchStats(shard) for shard in shards]
+  stats = {
+      'examples': sum(s['examples'] for s in shard_stats),
+      'tokens': sum(s['tokens'] for s in shard_stats),
+      'padding_ratio': {},
+  }
+  for key in shard_stats[0]['padding_ratio']:
+    stats['padding_ratio'][key] = float(
+        np.mean([s['padding_ratio'][key] for s in shard_stats]))
+  bucket_keys = [
+      shard.bucket_keys for shard in shards if 'bucket_keys' in shard
+  ]
+  if bucket_keys and all(np.size(k) for k in bucket_keys):
+    stats['bucket_key'] = int(max(np.max(k) for k in bucket_keys))
+  return stats
+
+
+def _Percentiles(values):
+  if not values:
+    return {}
+  return {
+      'p%d' % q: float(v)
+      for q, v in zip(_PERCENTILES, np.percentile(values, _PERCENTILES))
+  }
+
+
+def ReadRecords(file_pattern, num_records):
+  """Returns the first records of the files of `file_pattern`.
+
+  Args:
+    file_pattern: comma separated file patterns, prefixed by their record
+      format as in 'tfrecord:/path/to/data-*'.
+    num_records: the maximum number of records returned.
+
+  Returns:
+    A list of at most `num_records` records, or an empty list if the record
+    format is neither tfrecord nor text.
+  """
+  record_format, file_pattern = py_utils.RecordFormatFromFilePattern(
+      file_pattern)
+  if record_format not in ('tfrecord', 'text'):
+    return []
+  paths = sorted(
+      set(path for pattern in file_pattern.split(',')
+          for path in tf.io.gfile.glob(pattern)))
+
+  def _FileRecords(path):
+    if record_format == 'tfrecord':
+      options = tf.io.TFRecordOptions(local_records.FileCompression(path))
+      for record in tf.io.tf_record_iterator(path, options):
+        yield record
+    else:
+      with tf.io.gfile.GFile(path, 'rb') as f:
+        for line in f:
+          yield line.rstrip(b'\n')
+
+  return list(
+      itertools.islice(
+          itertools.chain.from_iterable(_FileRecords(p) for p in paths),
+          num_records))
+
+
+def RecordSeconds(sess, processor, records):
+  """Returns the seconds taken by a record processor on each of `records`.
+
+  Each record is processed alone, by its own session run.
+
+  Args:
+    sess: a tf.Session.
+    processor: a function taking a tf.int32 source_id and a tf.string record,
+      e.g. captured by `generic_input.CaptureProcessors()`.
+    records: a list of records.
+
+  Returns:
+    A list of seconds, one per record.
+  """
+  record = tf.placeholder(tf.string, [])
+  outputs = processor(tf.constant(0, tf.int32), record)
+  if records:
+    # The first run may initialize the ops of the processor.
+    sess.run(outputs, {record: records[0]})
+  seconds = []
+  for value in records:
+    start = time.time()
+    sess.run(outputs, {record: value})
+    seconds.append(time.time() - start)
+  return seconds
+
+
+def SessionRunSeconds(sess, num_runs=100):
+  """Returns the median seconds of a session run of a trivial graph."""
+  value = tf.placeholder(tf.string, [])
+  output = tf.identity(value)
+  seconds = []
+  for _ in range(num_runs):
+    start = time.time()
+    sess.run(output, {value: b''})
+    seconds.append(time.time() - start)
+  return float(np.median(seconds))
+
+
+def Summarize(batch_stats,
+              batch_seconds,
+              bucket_upper_bound=None,
+              record_seconds=None):
+  """Aggregates per batch statistics into a report.
+
+  Args:
+    batch_stats: a list of `BatchStats()` dicts, one per batch. A batch with
+      `bucket_keys` must also have a `bucket_key` entry, its largest key.
+    batch_seconds: a list of the seconds taken to produce each batch.
+    bucket_upper_bound: the `bucket_upper_bound` param of sequence inputs.
+    record_seconds: an optional list of the seconds taken to process single
+      records, see `RecordSeconds()`.
+
+  Returns:
+    A dict report.
+  """
+  total_seconds = sum(batch_seconds)
+  num_examples = sum(s['examples'] for s in batch_stats)
+  num_tokens = sum(s['tokens'] for s in batch_stats)
+  report = {
+      'num_batches': len(batch_stats),
+      'num_examples': num_examples,
+      'seconds': total_seconds,
+      'examples_per_sec': num_examples / max(total_seconds, 1e-9),
+      'tokens_per_sec': num_tokens / max(total_seconds, 1e-9),
+      'batch_latency': _Percentiles(batch_seconds),
+      'record_latency': _Percentiles(record_seconds or []),
+      'padding_ratio': {},
+  }
+  keys = sorted(set(k for s in batch_stats for k in s['padding_ratio']))
+  for key in keys:
+    report['padding_ratio'][key] = float(
+        np.mean([
+            s['padding_ratio'][key]
+            for s in batch_stats
+            if key in s['padding_ratio']
+        ]))
+
+  if bucket_upper_bound and any('bucket_key' in s for s in batch_stats):
+    buckets = {}
+    for s in batch_stats:
+      if 'bucket_key' not in s:
+        continue
+      bucket = int(np.searchsorted(bucket_upper_bound, s['bucket_key']))
+      buckets.setdefault(bucket, []).append(s)
+    report['buckets'] = {}
+    for bucket, stats in sorted(buckets.items()):
+      upper_bound = (
+          bucket_upper_bound[bucket]
+          if bucket < len(bucket_upper_bound) else None)
+      report['buckets'][str(upper_bound)] = {
+          'occupancy': len(stats) / len(batch_stats),
+          'mean_examples': float(np.mean([s['examples'] for s in stats])),
+          'padding_ratio': {
+              key: float(
+                  np.mean([
+                      s['padding_ratio'][key]
+                      for s in stats
+                      if key in s['padding_ratio']
+                  ])) for key in keys
+          },
+      }
+  return report
+
+
+def BenchmarkInput(input_params,
+                   num_batches,
+                   num_warmup_batches=5,
+                   cpu_sample_interval=1.0,
+                   num_records=200):
+  """Measures how fast an input generator produces batches.
+
+  Args:
+    input_params: the params of the input generator.
+    num_batches: the number of batches measured.
+    num_warmup_batches: the number of batches read before measuring.
+    cpu_sample_interval: seconds between samples of the CPU utilization.
+    num_records: the number of records whose processing latency is measured,
+      split between the `generic_input.GenericInput()` processors of the
+      input, if any.
+
+  Returns:
+    A dict report, see `Summarize()`, with `cpu_utilization` samples and the
+    `session_run_seconds` overhead included in the record latencies.
+  """
+  with tf.Graph().as_default():
+    inp = input_params.Instantiate()
+    with generic_input.CaptureProcessors() as processors:
+      batch = inp.GetPreprocessedInputBatch()
+    if not isinstance(batch, (list, tuple)):
+      batch = [batch]
+    with tf.Session() as sess:
+      inp.Initialize(sess)
+      # Before the input pipeline starts, so that its threads do not compete
+      # with the processing of the timed records.
+      record_seconds = []
+      for captured in processors:
+        if not captured.file_pattern:
+          continue
+        records = ReadRecords(captured.file_pattern,
+                              num_records // len(processors))
+        record_seconds += RecordSeconds(sess, captured.processor, records)
+      session_run_seconds = SessionRunSeconds(sess) if record_seconds else None
+      for _ in range(num_warmup_batches):
+        try:
+          sess.run(batch)
+        except tf.errors.OutOfRangeError:
+          break
+      batch_stats = []
+      batch_seconds = []
+      with _CpuSampler(cpu_sample_interval) as sampler:
+        for _ in range(num_batches):
+          start = time.time()
+          try:
+            value = sess.run(batch)
+          except tf.errors.OutOfRangeError:
+            break
+          batch_seconds.append(time.time() - start)
+          batch_stats.append(_MergeShardStats(value))
+  # Only sequence inputs are bucketed.
+  bucket_upper_bound = (
+      input_params.Get('bucket_upper_bound')
+      if 'bucket_upper_bound' in input_params else None)
+  report = Summarize(batch_stats, batch_seconds, bucket_upper_bound,
+                     record_seconds)
+  report['session_run_seconds'] = session_run_seconds
+  report['cpu_utilization'] = sampler.samples
+  return report
+
+
+def _LogReport(report):
+  tf.logging.info('%d batches, %d examples in %.2fs', report['num_batches'],
+                  report['num_examples'], report['seconds'])
+  tf.logging.info('examples/sec: %.1f, tokens/sec: %.1f',
+                  report['examples_per_sec'], report['tokens_per_sec'])
+  tf.logging.info('Batch latency: %s', report['batch_latency'])
+  if report['record_latency']:
+    tf.logging.info(
+        'Record latency: %s, including %.6fs of session run overhead',
+        report['record_latency'], report['session_run_seconds'])
+  else:
+    tf.logging.info(
+        'Record latency not measured: the input has no '
+        'generic_input.GenericInput processor of tfrecord or text files.')
+  for key, ratio in report['padding_ratio'].items():
+    tf.logging.info('Padding ratio of %s: %.3f', key, ratio)
+  for upper_bound, bucket in report.get('buckets', {}).items():
+    tf.logging.info(
+        'Bucket <= %s: occupancy %.3f, %.1f examples per batch, padding %s',
+        upper_bound, bucket['occupancy'], bucket['mean_examples'],
+        bucket['padding_ratio'])
+  cpus = [cpu for _, cpu in report['cpu_utilization']]
+  if cpus:
+    tf.logging.info('CPU utilization (busy CPUs): mean %.2f, max %.2f of %d',
+                    np.mean(cpus), np.max(cpus), os.cpu_count())
+
+
+def main(_):
+  if not FLAGS.model:
+    raise ValueError('Must provide --model')
+  cluster = cluster_factory.Current()
+  cluster.params.job = FLAGS.job
+  cluster.params.mode = 'sync'
+  cluster.params.task = 0
+  with cluster_factory.Cluster(cluster.params):
+    cfg = model_registry.GetParams(FLAGS.model, FLAGS.dataset)
+    report = BenchmarkInput(cfg.input, FLAGS.num_batches,
+                            FLAGS.num_warmup_batches,
+                            FLAGS.cpu_sample_interval, FLAGS.num_records)
+  _LogReport(report)
+  if FLAGS.output_json:
+    with tf.io.gfile.GFile(FLAGS.output_json, 'w') as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+  tf.logging.set_verbosity(tf.logging.INFO)
+  tf.app.run(main)
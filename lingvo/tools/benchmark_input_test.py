@@ -0,0 +1,179 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for benchmark_input."""
+
+import os
+
+import lingvo.compat as tf
+from lingvo.core import base_input_generator
+from lingvo.core import py_utils
+from lingvo.core import test_utils
+from lingvo.tools import benchmark_input
+import numpy as np
+
+
+class _ToyInputGenerator(base_input_generator.BaseSequenceInputGenerator):
+  """Emits batches of 4 sequences of random lengths, bucketed by length."""
+
+  def _InputBatch(self):
+    lengths = tf.random.uniform([4], minval=1, maxval=9, dtype=tf.int32)
+    max_length = tf.reduce_max(lengths)
+    paddings = 1. - tf.sequence_mask(lengths, 8, dtype=tf.float32)
+    return py_utils.NestedMap(
+        ids=tf.zeros([4, 8], dtype=tf.int32),
+        paddings=paddings,
+        bucket_keys=tf.fill([4], max_length))
+
+
+class _ToyFileInputGenerator(
+    base_input_generator.BaseInputGeneratorFromFiles):
+  """Emits batches of the tf.Examples of a TFRecord file, in order."""
+
+  def _DataSourceFromFilePattern(self, file_pattern, input_source_weights=None):
+
+    def _Parse(record):
+      features = {'x': tf.io.FixedLenFeature([3], tf.float32)}
+      return tf.io.parse_single_example(record, features)['x']
+
+    dataset = tf.data.TFRecordDataset(file_pattern).map(_Parse)
+    dataset = dataset.batch(self.params.batch_size, drop_remainder=True)
+    x = tf.data.make_one_shot_iterator(dataset).get_next()
+    x.set_shape([self.params.batch_size, 3])
+    return py_utils.NestedMap(x=x)
+
+
+class BenchmarkInputTest(test_utils.TestCase):
+
+  def _FileInputParams(self, num_records):
+    path = os.path.join(self.get_temp_dir(), 'records.tfrecord')
+    with tf.io.TFRecordWriter(path) as writer:
+      for i in range(num_records):
+        example = tf.train.Example()
+        example.features.feature['x'].float_list.value.extend([i] * 3)
+        writer.write(example.SerializeToString())
+    return _ToyFileInputGenerator.Params().Set(
+        file_pattern=path, batch_size=2)
+
+  def testBatchStats(self):
+    batch = py_utils.NestedMap(
+        src=py_utils.NestedMap(
+            ids=np.zeros([2, 4]),
+            paddings=np.array([[0., 0., 1., 1.], [0., 0., 0., 1.]])),
+        tgt=py_utils.NestedMap(paddings=np.array([[0., 1.], [0., 0.]])))
+    stats = benchmark_input.BatchStats(batch)
+    self.assertEqual(2, stats['examples'])
+    self.assertEqual(5 + 3, stats['tokens'])
+    self.assertEqual({
+        'src.paddings': 3. / 8,
+        'tgt.paddings': 1. / 4
+    }, stats['padding_ratio'])
+
+  def testSummarize(self):
+    batch_stats = [
+        dict(examples=4, tokens=10, padding_ratio={'p': .5}, bucket_key=3),
+        dict(examples=2, tokens=20, padding_ratio={'p': .0}, bucket_key=8),
+        dict(examples=4, tokens=30, padding_ratio={'p': .25}, bucket_key=2),
+    ]
+    report = benchmark_input.Summarize(batch_stats, [1., 2., 2.], [4, 8])
+    self.assertEqual(10, report['num_examples'])
+    self.assertAllClose(2., report['examples_per_sec'])
+    self.assertAllClose(12., report['tokens_per_sec'])
+    self.assertAllClose(.25, report['padding_ratio']['p'])
+    self.assertAllClose(2., report['batch_latency']['p50'])
+    self.assertEqual(['4', '8'], list(report['buckets']))
+    self.assertAllClose(2. / 3, report['buckets']['4']['occupancy'])
+    self.assertAllClose(4., report['buckets']['4']['mean_examples'])
+    self.assertAllClose(.375, report['buckets']['4']['padding_ratio']['p'])
+    self.assertAllClose(1. / 3, report['buckets']['8']['occupancy'])
+    self.assertEqual({}, report['record_latency'])
+    report = benchmark_input.Summarize(
+        batch_stats, [1., 2., 2.], record_seconds=[.1, .2, .3])
+    self.assertAllClose(.2, report['record_latency']['p50'])
+    self.assertNotIn('buckets', report)
+
+  def testReadRecords(self):
+    tfrecord_path = os.path.join(self.get_temp_dir(), 'records.tfrecord.gz')
+    with tf.io.TFRecordWriter(tfrecord_path,
+                              tf.io.TFRecordOptions('GZIP')) as writer:
+      for i in range(3):
+        writer.write(b'record%d' % i)
+    text_path = os.path.join(self.get_temp_dir(), 'lines.txt')
+    with tf.io.gfile.GFile(text_path, 'w') as f:
+      f.write('a b\nc\n')
+    self.assertEqual([b'record0', b'record1', b'record2'],
+                     benchmark_input.ReadRecords('tfrecord:' + tfrecord_path,
+                                                 5))
+    self.assertEqual([b'record0', b'record1'],
+                     benchmark_input.ReadRecords('tfrecord:' + tfrecord_path,
+                                                 2))
+    self.assertEqual([b'a b', b'c'],
+                     benchmark_input.ReadRecords('text:' + text_path, 5))
+    self.assertEqual([],
+                     benchmark_input.ReadRecords('iterator:' + text_path, 5))
+
+  def testRecordSeconds(self):
+
+    @tf.function(autograph=False)
+    def _Processor(source_id, record):
+      return [tf.strings.length(record) + source_id, 1]
+
+    processor = _Processor.get_concrete_function(
+        tf.TensorSpec([], tf.int32), tf.TensorSpec([], tf.string))
+    with self.session(graph=tf.Graph()) as sess:
+      seconds = benchmark_input.RecordSeconds(sess, processor,
+                                              [b'a', b'bc', b'def'])
+      self.assertLen(seconds, 3)
+      self.assertTrue(all(t > 0 for t in seconds))
+      self.assertGreater(benchmark_input.SessionRunSeconds(sess, 3), 0)
+
+  def testBenchmarkInput(self):
+    p = _ToyInputGenerator.Params()
+    p.bucket_upper_bound = [4, 8]
+    p.bucket_batch_limit = [4, 4]
+    report = benchmark_input.BenchmarkInput(
+        p, num_batches=20, num_warmup_batches=2, cpu_sample_interval=0.01)
+    self.assertEqual(20, report['num_batches'])
+    self.assertEqual(80, report['num_examples'])
+    self.assertGreater(report['examples_per_sec'], 0)
+    self.assertGreater(report['tokens_per_sec'], 0)
+    self.assertBetween(report['padding_ratio']['paddings'], 0., 1.)
+    self.assertAllClose(
+        1., sum(b['occupancy'] for b in report['buckets'].values()))
+    # Only inputs built with generic_input have record latencies.
+    self.assertEqual({}, report['record_latency'])
+    self.assertIsNone(report['session_run_seconds'])
+
+  def testBenchmarkInputFromFiles(self):
+    # Not a sequence input, so without bucket_upper_bound.
+    p = self._FileInputParams(10)
+    self.assertNotIn('bucket_upper_bound', p)
+    report = benchmark_input.BenchmarkInput(
+        p, num_batches=20, num_warmup_batches=1, cpu_sample_interval=0.01)
+    # The 4 batches left after the warmup.
+    self.assertEqual(4, report['num_batches'])
+    self.assertEqual(8, report['num_examples'])
+    self.assertNotIn('buckets', report)
+
+  def testBenchmarkInputExhaustedInWarmup(self):
+    p = self._FileInputParams(4)
+    report = benchmark_input.BenchmarkInput(
+        p, num_batches=20, num_warmup_batches=5, cpu_sample_interval=0.01)
+    self.assertEqual(0, report['num_batches'])
+    self.assertEqual(0, report['num_examples'])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,143 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Measures the KV cache memory and speed of autoregressive decoding.
+
+Greedily decodes random tokens with a batch_major_attention
+`StackedTransformerLayers` decoder, one `ExtendStep()` per token, with float32
+and with int8 (`quantize_kv_cache`) cached keys and values. Reports for each
+maximum decode length:
+
+- the bytes of the cached states of all the layers;
+- the tokens decoded per second, over `num_iters` decodes of `seq_len` steps.
+
+To run:
+
+bazel run -c opt //lingvo/tools:benchmark_kv_cache -- \
+  --seq_lens=256,1024,4096 --output_json=/tmp/kv_cache_benchmark.json
+"""
+
+import json
+import time
+
+from lingvo import compat as tf
+from lingvo.core import batch_major_attention
+import numpy as np
+
+tf.flags.DEFINE_string('seq_lens', '128,512,2048',
+                       'Comma separated maximum decode lengths.')
+tf.flags.DEFINE_integer('batch_size', 8, 'Batch size.')
+tf.flags.DEFINE_integer('num_layers', 4, 'Number of decoder layers.')
+tf.flags.DEFINE_integer('num_heads', 8, 'Number of attention heads.')
+tf.flags.DEFINE_integer('model_dim', 512, 'Model dimension.')
+tf.flags.DEFINE_integer('vocab_size', 1024, 'Vocabulary size.')
+tf.flags.DEFINE_integer('num_iters', 3, 'Number of decodes timed.')
+tf.flags.DEFINE_string('output_json', None,
+                       'If set, the report is also written to this file.')
+
+FLAGS = tf.flags.FLAGS
+
+
+def BenchmarkKVCacheDecoding(seq_len,
+                             quantize,
+                             batch_size=8,
+                             num_layers=4,
+                             num_heads=8,
+                             model_dim=512,
+                             vocab_size=1024,
+                             num_iters=3):
+  """Measures the greedy decoding of `seq_len` tokens.
+
+  Args:
+    seq_len: the number of decode steps, also the length of the cache.
+    quantize: whether the keys and values are cached as int8.
+    batch_size: the batch size.
+    num_layers: the number of decoder layers.
+    num_heads: the number of attention heads.
+    model_dim: the model dimension of the layers.
+    vocab_size: the size of the random embedding table.
+    num_iters: the number of decodes timed.
+
+  Returns:
+    A dict with `seq_len`, `quantize`, `cache_bytes` and `tokens_per_second`.
+  """
+  with tf.Graph().as_default(), tf.device('/cpu:0'):
+    p = batch_major_attention.StackedTransformerLayers.Params().Set(
+        name='decoder',
+        mask_self_atten=True,
+        num_layers=num_layers,
+        mdl_dim=model_dim,
+        hidden_dim=4 * model_dim,
+        num_atten_heads=num_heads)
+    p.transformer_layer_params_tpl.tr_atten_tpl.atten_tpl.quantize_kv_cache = (
+        quantize)
+    decoder = p.Instantiate()
+    # The embeddings are also the softmax weights.
+    emb = tf.constant(
+        np.random.RandomState(0).normal(
+            0., model_dim**-0.5, [vocab_size, model_dim]).astype(np.float32))
+    states = decoder.InitStates(decoder.theta, batch_size, seq_len)
+    cache_bytes = sum(
+        x.shape.num_elements() * x.dtype.size for x in states.Flatten())
+
+    def _Step(time_step, ids, *flat_states):
+      outputs, new_states = decoder.ExtendStep(
+          decoder.theta, tf.expand_dims(tf.gather(emb, ids), 1), None, None,
+          states.Pack(flat_states), time_step)
+      logits = tf.matmul(tf.squeeze(outputs, 1), emb, transpose_b=True)
+      ids = tf.argmax(logits, axis=-1, output_type=tf.int32)
+      return [time_step + 1, ids] + new_states.Flatten()
+
+    outputs = tf.while_loop(
+        lambda time_step, *_: time_step < seq_len, _Step,
+        [tf.constant(0), tf.zeros([batch_size], tf.int32)] + states.Flatten())
+    # Fetches the last ids, which depend on all the steps.
+    decode = outputs[1]
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      # Warms up.
+      sess.run(decode)
+      start = time.time()
+      for _ in range(num_iters):
+        sess.run(decode)
+      seconds = (time.time() - start) / max(num_iters, 1)
+  return {
+      'seq_len': seq_len,
+      'quantize': quantize,
+      'cache_bytes': cache_bytes,
+      'tokens_per_second': batch_size * seq_len / seconds,
+  }
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  report = []
+  for seq_len in [int(x) for x in FLAGS.seq_lens.split(',')]:
+    for quantize in (False, True):
+      result = BenchmarkKVCacheDecoding(seq_len, quantize, FLAGS.batch_size,
+                                        FLAGS.num_layers, FLAGS.num_heads,
+                                        FLAGS.model_dim, FLAGS.vocab_size,
+                                        FLAGS.num_iters)
+      tf.logging.info('seq_len=%d quantize=%s: %.1f MiB cache, %.1f tokens/s',
+                      seq_len, quantize, result['cache_bytes'] / 2.**20,
+                      result['tokens_per_second'])
+      report.append(result)
+  if FLAGS.output_json:
+    with tf.io.gfile.GFile(FLAGS.output_json, 'w') as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+  tf.app.run(main)
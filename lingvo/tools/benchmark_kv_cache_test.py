@@ -0,0 +1,49 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for benchmark_kv_cache."""
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tools import benchmark_kv_cache
+
+
+class BenchmarkKVCacheTest(test_utils.TestCase):
+
+  def testQuantizedCacheIsSmaller(self):
+    kwargs = dict(
+        seq_len=16,
+        batch_size=2,
+        num_layers=2,
+        num_heads=2,
+        model_dim=32,
+        vocab_size=64,
+        num_iters=1)
+    result = benchmark_kv_cache.BenchmarkKVCacheDecoding(
+        quantize=False, **kwargs)
+    quantized = benchmark_kv_cache.BenchmarkKVCacheDecoding(
+        quantize=True, **kwargs)
+    self.assertEqual(16, result['seq_len'])
+    self.assertTrue(quantized['quantize'])
+    self.assertGreater(result['tokens_per_second'], 0.)
+    self.assertGreater(quantized['tokens_per_second'], 0.)
+    # 2 layers of float32 keys and values of shape [16, 2, 2, 16].
+    self.assertEqual(2 * 2 * 16 * 2 * 32 * 4, result['cache_bytes'])
+    # int8 keys and values, and a float32 scale per head.
+    self.assertEqual(2 * 2 * 16 * 2 * (32 + 2 * 4), quantized['cache_bytes'])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,239 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Measures decoding with and without the compaction of finished hyps.
+
+Decodes a batch whose target lengths follow a skewed (log-normal) distribution
+with a synthetic decoder, which has the costs of an attention decoder: an
+[hidden_dim, hidden_dim] recurrent projection and an attention over a
+time-major cache of its outputs at each step. The decoder emits the eos of a
+hyp at its target length, so most of the batch is done long before the
+longest hyp. Reports for each compact_interval, 0 being no compaction:
+
+- the mean seconds per decode, over `num_iters` decodes;
+- the number of hyp steps run, the sum of the batch size of each step.
+
+Greedy search runs anywhere. Beam search needs the lingvo custom ops.
+
+To run:
+
+bazel run -c opt //lingvo/tools:benchmark_search_compaction -- \
+  --search=greedy --compact_intervals=0,4,16 \
+  --output_json=/tmp/search_compaction_benchmark.json
+"""
+
+import json
+import time
+
+from lingvo import compat as tf
+from lingvo.core import beam_search_helper
+from lingvo.core import py_utils
+import numpy as np
+
+tf.flags.DEFINE_enum('search', 'greedy', ['greedy', 'beam'], 'The search.')
+tf.flags.DEFINE_string(
+    'compact_intervals', '0,4,16',
+    'Comma separated compact_interval values. 0 is no compaction.')
+tf.flags.DEFINE_integer('batch_size', 64, 'Source batch size.')
+tf.flags.DEFINE_integer('num_hyps_per_beam', 4, 'Beam search hyps per beam.')
+tf.flags.DEFINE_integer('max_len', 256, 'Maximum target length.')
+tf.flags.DEFINE_float('mean_len', 24., 'Median target length.')
+tf.flags.DEFINE_float('len_sigma', 1., 'Sigma of the log of target lengths.')
+tf.flags.DEFINE_integer('hidden_dim', 512, 'Hidden dimension of the decoder.')
+tf.flags.DEFINE_integer('num_iters', 3, 'Number of decodes timed.')
+tf.flags.DEFINE_string('output_json', None,
+                       'If set, the report is also written to this file.')
+
+FLAGS = tf.flags.FLAGS
+
+_VOCAB_SIZE = 32
+_EOS_ID = 2
+
+
+def SkewedLengths(batch_size, max_len, mean_len, len_sigma, seed=0):
+  """Returns [batch_size] log-normal target lengths in [1, max_len]."""
+  lengths = np.random.RandomState(seed).lognormal(
+      np.log(mean_len), len_sigma, size=[batch_size])
+  return np.clip(np.round(lengths), 1, max_len).astype(np.int32)
+
+
+def _DecoderCallbacks(max_len, hidden_dim, num_hyps_per_beam):
+  """Returns the search callbacks of the synthetic decoder."""
+  rng = np.random.RandomState(1)
+  w = tf.constant(
+      rng.normal(0., hidden_dim**-0.5, [hidden_dim, hidden_dim]), tf.float32)
+  emb = tf.constant(rng.normal(0., 1., [_VOCAB_SIZE, hidden_dim]), tf.float32)
+
+  def _LogProbs(encoder_outputs, states):
+    # The target length of the source sequence of each hyp.
+    lengths = tf.tile(encoder_outputs.lengths, [num_hyps_per_beam])
+    ids = tf.where(states.pos >= lengths,
+                   tf.fill(tf.shape(lengths), _EOS_ID),
+                   3 + states.pos % (_VOCAB_SIZE - 3))
+    # Depends on the decoder outputs without changing the argmax.
+    logits = 10. * tf.one_hot(ids, _VOCAB_SIZE) + 1e-3 * tf.tanh(
+        tf.matmul(states.outputs, emb, transpose_b=True))
+    return tf.nn.log_softmax(logits)
+
+  def InitBeamSearchState(unused_theta, encoder_outputs, unused_num_hyps):
+    num_hyps = tf.shape(encoder_outputs.lengths)[0] * num_hyps_per_beam
+    states = py_utils.NestedMap(
+        pos=tf.zeros([num_hyps], tf.int32),
+        outputs=tf.zeros([num_hyps, hidden_dim]),
+        cache=tf.zeros([max_len, num_hyps, hidden_dim]))
+    log_probs = _LogProbs(encoder_outputs, states)
+    return py_utils.NestedMap(
+        log_probs=log_probs, atten_probs=tf.ones([num_hyps, 1])), states
+
+  def PreBeamSearchStepCallback(unused_theta, encoder_outputs, step_ids,
+                                states, unused_num_hyps):
+    outputs = tf.tanh(
+        tf.matmul(states.outputs, w) + tf.gather(emb, step_ids[:, 0]))
+    # [max_len, num_hyps]
+    mask = tf.sequence_mask(states.pos, max_len, dtype=tf.float32)
+    logits = tf.einsum('TBD,BD->TB', states.cache, outputs)
+    probs = tf.nn.softmax(logits - 1e9 * (1. - tf.transpose(mask)), axis=0)
+    outputs += tf.einsum('TB,TBD->BD', probs, states.cache)
+    cache = states.cache + tf.one_hot(
+        states.pos, max_len, axis=0)[:, :, tf.newaxis] * outputs
+    states = py_utils.NestedMap(
+        pos=states.pos + 1, outputs=outputs, cache=cache)
+    log_probs = _LogProbs(encoder_outputs, states)
+    return py_utils.NestedMap(
+        log_probs=log_probs, atten_probs=tf.ones_like(log_probs[:, :1])), states
+
+  def PostBeamSearchStepCallback(unused_theta, unused_encoder_outputs,
+                                 unused_new_step_ids, states):
+    return states
+
+  def CompactEncoderOutputsCallback(unused_theta, encoder_outputs, beam_ids):
+    return py_utils.NestedMap(
+        lengths=tf.gather(encoder_outputs.lengths, beam_ids),
+        padding=tf.gather(encoder_outputs.padding, beam_ids, axis=1))
+
+  return (InitBeamSearchState, PreBeamSearchStepCallback,
+          PostBeamSearchStepCallback, CompactEncoderOutputsCallback)
+
+
+def BenchmarkSearchCompaction(lengths,
+                              compact_interval,
+                              search='greedy',
+                              num_hyps_per_beam=4,
+                              hidden_dim=512,
+                              num_iters=3):
+  """Measures the decoding of a batch of hyps of the given target lengths.
+
+  Args:
+    lengths: a list of the target length of each source sequence.
+    compact_interval: the compact_interval of the search, 0 for none.
+    search: 'greedy' or 'beam'.
+    num_hyps_per_beam: the number of hyps per beam of beam search.
+    hidden_dim: the hidden dimension of the decoder.
+    num_iters: the number of decodes timed.
+
+  Returns:
+    A dict with `compact_interval`, `hyp_steps`, `decode_seconds` and
+    `hyp_lens`, the decoded lengths of the best hyp of each source sequence.
+  """
+  max_len = int(max(lengths))
+  if search == 'greedy':
+    num_hyps_per_beam = 1
+  with tf.Graph().as_default(), tf.device('/cpu:0'):
+    callbacks = _DecoderCallbacks(max_len, hidden_dim, num_hyps_per_beam)
+    encoder_outputs = py_utils.NestedMap(
+        lengths=tf.constant(lengths, tf.int32),
+        padding=tf.zeros([1, len(lengths)]))
+    # Counts the hyps of each step.
+    hyp_steps = tf.Variable(0, trainable=False, dtype=tf.int64)
+
+    def PreBeamSearchStepCallback(theta, encoder_outputs, step_ids, states,
+                                  num_hyps):
+      with tf.control_dependencies([
+          tf.assign_add(hyp_steps, tf.size(step_ids, out_type=tf.int64))
+      ]):
+        step_ids = tf.identity(step_ids)
+      return callbacks[1](theta, encoder_outputs, step_ids, states, num_hyps)
+
+    if search == 'greedy':
+      p = beam_search_helper.GreedySearchHelper.Params()
+    else:
+      p = beam_search_helper.BeamSearchHelper.Params().Set(
+          num_hyps_per_beam=num_hyps_per_beam)
+    p.Set(
+        name='search',
+        target_seq_len=max_len,
+        target_eos_id=_EOS_ID,
+        batch_major_state=False,
+        compact_interval=compact_interval)
+    helper = p.Instantiate()
+    if search == 'greedy':
+      _, decoded_lens, _ = helper.GreedySearchDecode(
+          py_utils.NestedMap(),
+          encoder_outputs,
+          callbacks[0],
+          PreBeamSearchStepCallback,
+          callbacks[2],
+          compact_encoder_outputs_callback=callbacks[3])
+    else:
+      decoded = helper.BeamSearchDecode(
+          py_utils.NestedMap(),
+          encoder_outputs,
+          0,
+          callbacks[0],
+          PreBeamSearchStepCallback,
+          callbacks[2],
+          compact_encoder_outputs_callback=callbacks[3])
+      # The best hyp of each source sequence.
+      decoded_lens = decoded.topk_lens[::num_hyps_per_beam]
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      # Warms up and counts the hyp steps of one decode.
+      hyp_lens = sess.run(decoded_lens)
+      steps = sess.run(hyp_steps)
+      start = time.time()
+      for _ in range(num_iters):
+        sess.run(decoded_lens)
+      decode_seconds = (time.time() - start) / max(num_iters, 1)
+  return {
+      'compact_interval': compact_interval,
+      'hyp_steps': int(steps),
+      'decode_seconds': decode_seconds,
+      'hyp_lens': hyp_lens.tolist(),
+  }
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  lengths = SkewedLengths(FLAGS.batch_size, FLAGS.max_len, FLAGS.mean_len,
+                          FLAGS.len_sigma)
+  tf.logging.info('Target lengths: median %d, max %d, total %d',
+                  np.median(lengths), lengths.max(), lengths.sum())
+  report = []
+  for compact_interval in [int(x) for x in FLAGS.compact_intervals.split(',')]:
+    result = BenchmarkSearchCompaction(lengths, compact_interval, FLAGS.search,
+                                       FLAGS.num_hyps_per_beam,
+                                       FLAGS.hidden_dim, FLAGS.num_iters)
+    tf.logging.info('compact_interval=%d: %d hyp steps, %.3f s/decode',
+                    compact_interval, result['hyp_steps'],
+                    result['decode_seconds'])
+    del result['hyp_lens']
+    report.append(result)
+  if FLAGS.output_json:
+    with tf.io.gfile.GFile(FLAGS.output_json, 'w') as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+  tf.app.run(main)
@@ -0,0 +1,46 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for benchmark_search_compaction."""
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tools import benchmark_search_compaction
+
+
+class BenchmarkSearchCompactionTest(test_utils.TestCase):
+
+  def testCompactionRunsFewerHypSteps(self):
+    lengths = benchmark_search_compaction.SkewedLengths(
+        batch_size=16, max_len=64, mean_len=6., len_sigma=1.)
+    self.assertLessEqual(lengths.max(), 64)
+    results = [
+        benchmark_search_compaction.BenchmarkSearchCompaction(
+            lengths, compact_interval, hidden_dim=16, num_iters=1)
+        for compact_interval in (0, 1, 4)
+    ]
+    for result in results:
+      self.assertEqual(lengths.tolist(), result['hyp_lens'])
+      self.assertGreater(result['decode_seconds'], 0.)
+    # Without compaction, all the hyps run until the longest is done.
+    self.assertEqual(16 * lengths.max(), results[0]['hyp_steps'])
+    # With compaction after each step, each hyp runs for its length.
+    self.assertEqual(lengths.sum(), results[1]['hyp_steps'])
+    self.assertLess(results[2]['hyp_steps'], results[0]['hyp_steps'])
+    self.assertGreater(results[2]['hyp_steps'], results[1]['hyp_steps'])
+
+
+if __name__ == '__main__':
+  tf.test.main()
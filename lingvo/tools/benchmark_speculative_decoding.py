@@ -0,0 +1,217 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Measures the acceptance rate and speed of speculative decoding.
+
+Greedily decodes `target_seq_len` tokens after random prefixes with a
+`TransformerLm` of `target_layers` layers, one `Step()` per token, and with a
+speculative_decoding `SpeculativeDecoder` whose draft LM is the first
+`draft_layers` layers of the target LM, with its embeddings and softmax.
+The models have random weights, and the output projections of the other layers
+of the target LM are scaled by `top_layers_scale`, which sets how closely the
+draft LM predicts the target LM, as a trained draft LM would. Reports for each
+number of draft tokens:
+
+- the fraction of the draft tokens accepted;
+- the number of rounds, i.e. of cached multi-token steps of the target LM;
+- the tokens decoded per second, over `num_iters` decodes, and the speedup over
+  decoding with the target LM alone.
+
+To run:
+
+bazel run -c opt //lingvo/tools:benchmark_speculative_decoding -- \
+  --num_draft_tokens=2,4,8 --output_json=/tmp/speculative_benchmark.json
+"""
+
+import json
+import time
+
+from lingvo import compat as tf
+from lingvo.core import py_utils
+from lingvo.tasks.lm import layers as lm_layers
+from lingvo.tasks.lm import speculative_decoding
+import numpy as np
+
+tf.flags.DEFINE_string('num_draft_tokens', '2,4,8',
+                       'Comma separated numbers of draft tokens per round.')
+tf.flags.DEFINE_integer('batch_size', 4, 'Batch size.')
+tf.flags.DEFINE_integer('prefix_len', 16, 'Length of the random prefixes.')
+tf.flags.DEFINE_integer('target_seq_len', 128, 'Number of tokens decoded.')
+tf.flags.DEFINE_integer('target_layers', 12, 'Number of target LM layers.')
+tf.flags.DEFINE_integer('draft_layers', 2, 'Number of draft LM layers.')
+tf.flags.DEFINE_float(
+    'top_layers_scale', 0.1, 'Scale of the output projections of the target '
+    'LM layers above the draft LM layers.')
+tf.flags.DEFINE_integer('model_dim', 256, 'Model dimension.')
+tf.flags.DEFINE_integer('vocab_size', 1024, 'Vocabulary size.')
+tf.flags.DEFINE_integer('num_iters', 3, 'Number of decodes timed.')
+tf.flags.DEFINE_string('output_json', None,
+                       'If set, the report is also written to this file.')
+
+FLAGS = tf.flags.FLAGS
+
+# The weights of the target LM layers projecting to their residual outputs.
+_OUTPUT_PROJECTIONS = ('.fc[1].w', '.fc[1].b', '.ctx_post_proj',
+                       '.ctx_post_proj_b')
+
+
+def _LmParams(num_layers, model_dim, vocab_size):
+  p = lm_layers.TransformerLm.Params()
+  p.vocab_size = vocab_size
+  p.emb.vocab_size = vocab_size
+  p.emb.embedding_dim = model_dim
+  p.model_dim = model_dim
+  p.num_trans_layers = num_layers
+  p.position_emb.embedding_dim = model_dim
+  p.trans_tpl.source_dim = model_dim
+  p.trans_tpl.tr_atten_tpl.num_attention_heads = 4
+  p.trans_tpl.tr_fflayer_tpl.hidden_dim = 4 * model_dim
+  p.softmax.input_dim = model_dim
+  p.softmax.num_classes = vocab_size
+  return p
+
+
+def _GreedyDecode(lm, prefix_ids, target_seq_len):
+  """Returns the ids [target_seq_len, batch] greedily decoded by lm."""
+  prefix_len, batch = py_utils.GetShape(prefix_ids, 2)
+  state0 = lm.zero_state(lm.theta, batch)
+
+  def _Step(t, ids, ids_list, flat_states):
+    inputs = lm.emb.EmbLookup(lm.theta.emb, ids)
+    output, states = lm.Step(lm.theta, inputs, tf.zeros([batch]),
+                             state0.Pack(flat_states))
+    next_ids = tf.argmax(output.logits, axis=-1, output_type=tf.int32)
+    next_ids = tf.where(t < prefix_len - 1,
+                        prefix_ids[tf.minimum(t + 1, prefix_len - 1)],
+                        next_ids)
+    return t + 1, next_ids, ids_list.write(t, next_ids), states.Flatten()
+
+  _, _, ids_list, _ = tf.while_loop(
+      lambda t, *_: t < prefix_len + target_seq_len - 1,
+      _Step, (tf.constant(0), prefix_ids[0],
+              tf.TensorArray(tf.int32, prefix_len + target_seq_len - 1),
+              state0.Flatten()),
+      shape_invariants=(tf.TensorShape([]), tf.TensorShape([None]),
+                        tf.TensorShape(None),
+                        [tf.TensorShape([None, None, None])] *
+                        len(state0.Flatten())))
+  return ids_list.stack()[prefix_len - 1:]
+
+
+def BenchmarkSpeculativeDecoding(num_draft_tokens,
+                                 batch_size=4,
+                                 prefix_len=16,
+                                 target_seq_len=128,
+                                 target_layers=12,
+                                 draft_layers=2,
+                                 top_layers_scale=0.1,
+                                 model_dim=256,
+                                 vocab_size=1024,
+                                 num_iters=3):
+  """Measures the greedy decoding of `target_seq_len` tokens.
+
+  Args:
+    num_draft_tokens: the number of tokens proposed by the draft LM each round.
+    batch_size: the batch size.
+    prefix_len: the length of the random prefixes.
+    target_seq_len: the number of tokens decoded.
+    target_layers: the number of layers of the target LM.
+    draft_layers: the number of layers of the draft LM.
+    top_layers_scale: the scale of the output projections of the target LM
+      layers above the draft LM layers. The draft LM predicts the target LM
+      better for smaller scales.
+    model_dim: the model dimension of the LMs.
+    vocab_size: the vocabulary size of the LMs.
+    num_iters: the number of decodes timed.
+
+  Returns:
+    A dict with `num_draft_tokens`, `acceptance_rate`, `num_rounds`,
+    `tokens_per_second`, `baseline_tokens_per_second` and `speedup`.
+  """
+  with tf.Graph().as_default(), tf.device('/cpu:0'):
+    p = speculative_decoding.SpeculativeDecoder.Params().Set(
+        target_lm=_LmParams(target_layers, model_dim, vocab_size),
+        draft_lm=_LmParams(draft_layers, model_dim, vocab_size),
+        num_draft_tokens=num_draft_tokens,
+        target_seq_len=target_seq_len)
+    decoder = p.Instantiate()
+    prefix_ids = tf.constant(
+        np.random.RandomState(0).randint(
+            vocab_size, size=[batch_size, prefix_len]), tf.int32)
+    speculative = decoder.Decode(decoder.theta, prefix_ids)
+    baseline = _GreedyDecode(decoder.target_lm, tf.transpose(prefix_ids),
+                             target_seq_len)
+    # The draft LM is the bottom of the target LM.
+    target_vars = dict(decoder.target_lm.vars.FlattenItems())
+    copy_draft_vars = tf.group([
+        tf.assign(var, target_vars[key])
+        for key, var in decoder.draft_lm.vars.FlattenItems()
+    ])
+    scale_top_layers = tf.group([
+        tf.assign(var, var * top_layers_scale)
+        for key, var in target_vars.items()
+        if key.startswith('trans[') and
+        int(key[len('trans['):key.index(']')]) >= draft_layers and
+        key.endswith(_OUTPUT_PROJECTIONS)
+    ])
+
+    def _Time(fetch):
+      start = time.time()
+      for _ in range(num_iters):
+        sess.run(fetch)
+      return (time.time() - start) / max(num_iters, 1)
+
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      sess.run(scale_top_layers)
+      sess.run(copy_draft_vars)
+      # Warms up.
+      speculative_val, baseline_val = sess.run([speculative, baseline])
+      if not np.array_equal(speculative_val.ids, baseline_val.T):
+        raise ValueError('Speculative decoding differs from greedy decoding.')
+      seconds = _Time(speculative.ids)
+      baseline_seconds = _Time(baseline)
+  num_tokens = batch_size * target_seq_len
+  return {
+      'num_draft_tokens': num_draft_tokens,
+      'acceptance_rate': float(speculative_val.acceptance_rate),
+      'num_rounds': int(speculative_val.num_rounds),
+      'tokens_per_second': num_tokens / seconds,
+      'baseline_tokens_per_second': num_tokens / baseline_seconds,
+      'speedup': baseline_seconds / seconds,
+  }
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  report = []
+  for num_draft_tokens in [int(x) for x in FLAGS.num_draft_tokens.split(',')]:
+    result = BenchmarkSpeculativeDecoding(
+        num_draft_tokens, FLAGS.batch_size, FLAGS.prefix_len,
+        FLAGS.target_seq_len, FLAGS.target_layers, FLAGS.draft_layers,
+        FLAGS.top_layers_scale, FLAGS.model_dim, FLAGS.vocab_size,
+        FLAGS.num_iters)
+    tf.logging.info(
+        'num_draft_tokens=%d: %.2f accepted, %d rounds, %.1f tokens/s, '
+        '%.2fx speedup', num_draft_tokens, result['acceptance_rate'],
+        result['num_rounds'], result['tokens_per_second'], result['speedup'])
+    report.append(result)
+  if FLAGS.output_json:
+    with tf.io.gfile.GFile(FLAGS.output_json, 'w') as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+  tf.app.run(main)
@@ -0,0 +1,44 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for benchmark_speculative_decoding."""
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tools import benchmark_speculative_decoding
+
+
+class BenchmarkSpeculativeDecodingTest(test_utils.TestCase):
+
+  def testReport(self):
+    result = benchmark_speculative_decoding.BenchmarkSpeculativeDecoding(
+        num_draft_tokens=3,
+        batch_size=2,
+        prefix_len=4,
+        target_seq_len=12,
+        target_layers=3,
+        draft_layers=1,
+        model_dim=16,
+        vocab_size=32,
+        num_iters=1)
+    self.assertEqual(3, result['num_draft_tokens'])
+    self.assertBetween(result['acceptance_rate'], 0., 1.)
+    self.assertBetween(result['num_rounds'], 3, 12)
+    self.assertGreater(result['tokens_per_second'], 0.)
+    self.assertGreater(result['speedup'], 0.)
+
+
+if __name__ == '__main__':
+  tf.test.main()
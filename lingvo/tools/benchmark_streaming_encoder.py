@@ -0,0 +1,181 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Measures the latency of full and streaming inference of a Conformer encoder.
+
+Encodes random utterances of `utterance_seconds` of 10ms feature frames with a
+causal asr encoder `ConformerEncoder` on CPU:
+
+- at once, with `FProp()` after the end of the utterance;
+- chunk by chunk, with `StreamStep()` on each `chunk_ms` of frames as they
+  arrive, feeding back the state of the previous chunk.
+
+Reports for each utterance length and chunk size:
+
+- the seconds of the full encoding, which is also its latency after the end of
+  the utterance, and its real-time factor (compute seconds per audio second);
+- the mean seconds per chunk, the real-time factor of the chunks and the
+  latency of the last chunk, i.e. its duration plus its compute.
+
+To run:
+
+bazel run -c opt //lingvo/tools:benchmark_streaming_encoder -- \
+  --utterance_seconds=5,20 --chunk_ms=120,240,480 \
+  --output_json=/tmp/streaming_encoder_benchmark.json
+"""
+
+import json
+import time
+
+from lingvo import compat as tf
+from lingvo.core import cluster_factory
+from lingvo.core import py_utils
+from lingvo.tasks.asr import encoder
+import numpy as np
+
+tf.flags.DEFINE_string('utterance_seconds', '5,20',
+                       'Comma separated utterance lengths, in seconds.')
+tf.flags.DEFINE_string(
+    'chunk_ms', '120,240,480', 'Comma separated chunk lengths, in '
+    'milliseconds. Multiples of 30ms, the stacking stride of the encoder.')
+tf.flags.DEFINE_integer('num_bins', 80, 'Number of feature bins per frame.')
+tf.flags.DEFINE_integer('model_dim', 256, 'Model dimension.')
+tf.flags.DEFINE_integer('num_layers', 8, 'Number of conformer layers.')
+tf.flags.DEFINE_integer('left_context', 64,
+                        'Left context of the self-attention, in encoded frames.')
+tf.flags.DEFINE_integer('num_iters', 3, 'Number of utterances timed.')
+tf.flags.DEFINE_string('output_json', None,
+                       'If set, the report is also written to this file.')
+
+FLAGS = tf.flags.FLAGS
+
+# The feature frame hop.
+_FRAME_MS = 10
+
+
+def _EncoderParams(num_bins, model_dim, num_layers, left_context):
+  p = encoder.ConformerEncoder.Params().Set(
+      name='encoder',
+      input_shape=[None, None, num_bins, 1],
+      model_dim=model_dim,
+      num_conformer_layers=num_layers)
+  p.conformer_tpl.Set(
+      atten_num_heads=4,
+      atten_left_context=left_context,
+      fflayer_hidden_dim=4 * model_dim)
+  return p
+
+
+def BenchmarkStreamingEncoder(utterance_seconds,
+                              chunk_ms,
+                              num_bins=80,
+                              model_dim=256,
+                              num_layers=8,
+                              left_context=64,
+                              num_iters=3):
+  """Measures the full and chunked encoding of an utterance.
+
+  Args:
+    utterance_seconds: the length of the utterances, in seconds.
+    chunk_ms: the length of the chunks, in milliseconds. Must be a multiple of
+      the stacking stride of the encoder times 10ms.
+    num_bins: the number of feature bins per frame.
+    model_dim: the model dimension of the encoder.
+    num_layers: the number of conformer layers.
+    left_context: the left context of the self-attention, in encoded frames.
+    num_iters: the number of utterances timed.
+
+  Returns:
+    A dict with `utterance_seconds`, `chunk_ms`, `full_seconds`, `full_rtf`,
+    `chunk_seconds`, `stream_rtf` and `stream_latency_seconds`.
+  """
+  num_frames = int(utterance_seconds * 1000) // _FRAME_MS
+  chunk_frames = chunk_ms // _FRAME_MS
+  num_frames -= num_frames % chunk_frames
+  audio_seconds = num_frames * _FRAME_MS / 1000.
+  with tf.Graph().as_default(), tf.device(
+      '/cpu:0'), cluster_factory.SetEval(True):
+    p = _EncoderParams(num_bins, model_dim, num_layers, left_context)
+    enc = p.Instantiate()
+    frames = tf.placeholder(tf.float32, [1, None, num_bins, 1])
+    paddings = tf.zeros(py_utils.GetShape(frames, 2))
+    full = enc.FProp(enc.theta,
+                     py_utils.NestedMap(src_inputs=frames, paddings=paddings))
+    state0 = enc.zero_state(enc.theta, 1).Transform(
+        lambda x: tf.placeholder_with_default(x, x.shape))
+    stream, state1 = enc.StreamStep(enc.theta, frames, paddings, state0)
+    state0, state1 = state0.Flatten(), state1.Flatten()
+
+    utterance = np.random.normal(size=[1, num_frames, num_bins, 1])
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      # Warms up, with the same feeds and fetches as the timed runs.
+      sess.run(full.encoded, {frames: utterance})
+      _, state_values = sess.run([stream.encoded, state1],
+                                 {frames: utterance[:, :chunk_frames]})
+      feed_dict = dict(zip(state0, state_values))
+      feed_dict[frames] = utterance[:, :chunk_frames]
+      sess.run([stream.encoded, state1], feed_dict)
+      start = time.time()
+      for _ in range(num_iters):
+        sess.run(full.encoded, {frames: utterance})
+      full_seconds = (time.time() - start) / max(num_iters, 1)
+
+      chunk_seconds = []
+      for _ in range(num_iters):
+        state = {}
+        for t in range(0, num_frames, chunk_frames):
+          feed_dict = dict(state)
+          feed_dict[frames] = utterance[:, t:t + chunk_frames]
+          start = time.time()
+          _, state_values = sess.run([stream.encoded, state1], feed_dict)
+          chunk_seconds.append(time.time() - start)
+          state = dict(zip(state0, state_values))
+  chunk_seconds = float(np.mean(chunk_seconds))
+  return {
+      'utterance_seconds': audio_seconds,
+      'chunk_ms': chunk_ms,
+      'full_seconds': full_seconds,
+      'full_rtf': full_seconds / audio_seconds,
+      'chunk_seconds': chunk_seconds,
+      'stream_rtf': chunk_seconds * 1000. / chunk_ms,
+      'stream_latency_seconds': chunk_ms / 1000. + chunk_seconds,
+  }
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  report = []
+  for utterance_seconds in FLAGS.utterance_seconds.split(','):
+    utterance_seconds = float(utterance_seconds)
+    for chunk_ms in [int(x) for x in FLAGS.chunk_ms.split(',')]:
+      result = BenchmarkStreamingEncoder(utterance_seconds, chunk_ms,
+                                         FLAGS.num_bins, FLAGS.model_dim,
+                                         FLAGS.num_layers, FLAGS.left_context,
+                                         FLAGS.num_iters)
+      tf.logging.info(
+          'utterance=%.1fs chunk=%dms: full %.3f s (RTF %.3f), '
+          'stream %.4f s/chunk (RTF %.3f, latency %.3f s)',
+          result['utterance_seconds'], chunk_ms, result['full_seconds'],
+          result['full_rtf'], result['chunk_seconds'], result['stream_rtf'],
+          result['stream_latency_seconds'])
+      report.append(result)
+  if FLAGS.output_json:
+    with tf.io.gfile.GFile(FLAGS.output_json, 'w') as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+  tf.app.run(main)
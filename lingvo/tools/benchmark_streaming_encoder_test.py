@@ -0,0 +1,44 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for benchmark_streaming_encoder."""
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tools import benchmark_streaming_encoder
+
+
+class BenchmarkStreamingEncoderTest(test_utils.TestCase):
+
+  def testBenchmarkStreamingEncoder(self):
+    result = benchmark_streaming_encoder.BenchmarkStreamingEncoder(
+        utterance_seconds=1.,
+        chunk_ms=120,
+        num_bins=16,
+        model_dim=32,
+        num_layers=2,
+        left_context=8,
+        num_iters=1)
+    self.assertAllClose(0.96, result['utterance_seconds'])
+    self.assertEqual(120, result['chunk_ms'])
+    self.assertGreater(result['full_seconds'], 0.)
+    self.assertGreater(result['chunk_seconds'], 0.)
+    self.assertAllClose(result['full_seconds'] / 0.96, result['full_rtf'])
+    self.assertAllClose(0.12 + result['chunk_seconds'],
+                        result['stream_latency_seconds'])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -33,8 +33,20 @@ Typical workflow:
   subword-nmt get-vocab train_bpe_file vocab_file
 
   bpe_word_tokenizer train_bpe_file vocab_file words_to_ids_file
+
+The corpus is split into chunks of whole lines which are tokenized in parallel
+by --num_workers processes. Each process keeps at most --max_words_in_memory
+distinct words, which are spilled to sorted runs in a temporary directory. The
+runs are then merged into the output file, sorted by word. Memory usage is
+bounded independently of the size of the corpus.
 """
 
+import heapq
+import multiprocessing
+import os
+import shutil
+import tempfile
+
 import lingvo.compat as tf
 
 tf.flags.DEFINE_string('encoded_filepath', '',
@@ -42,8 +54,22 @@ tf.flags.DEFINE_string('encoded_filepath', '',
 tf.flags.DEFINE_string('vocab_filepath', '', 'Path to the BPE vocab file.')
 tf.flags.DEFINE_string('output_filepath', '',
                        'The output filepath (word_to_ids).')
+tf.flags.DEFINE_integer('num_workers', 0,
+                        'Number of processes. Defaults to the number of CPUs.')
+tf.flags.DEFINE_integer('chunk_size', 64 << 20,
+                        'Approximate number of bytes of the corpus chunks.')
+tf.flags.DEFINE_integer(
+    'max_words_in_memory', 1 << 22,
+    'Maximum number of distinct words held by each process before they are '
+    'spilled to disk.')
+tf.flags.DEFINE_string(
+    'tmp_dir', None,
+    'Directory of the temporary sorted runs. Defaults to the system one.')
 FLAGS = tf.flags.FLAGS
 
+# Maximum number of runs merged at once.
+_MAX_MERGE_FAN_IN = 256
+
 
 def _GetVocabulary(vocab_filepath):
   """Maps the first word in each line of the given file to its line number."""
@@ -56,6 +82,23 @@ def _GetVocabulary(vocab_filepath):
   return vocab
 
 
+def _SplitWords(line):
+  """Yields the (word, tuple of subwords) of a line of the encoded corpus."""
+  full_word = ''
+  subwords = []
+  for subword in line.strip('\r\n ').split(' '):
+    if not subword:
+      continue
+    subwords.append(subword)
+    if subword[-2:] == '@@':
+      full_word += subword[:-2]
+    else:
+      full_word += subword
+      yield full_word, tuple(subwords)
+      full_word = ''
+      subwords = []
+
+
 def _ExtractTokenization(encoded_filepath, vocab):
   """Maps the words in the encoded file to their list of token ids.
 
@@ -74,28 +117,186 @@ def _ExtractTokenization(encoded_filepath, vocab):
   word_tokenization = {}
   with open(encoded_filepath, 'r') as encoded_file:
     for line in encoded_file:
-      full_word = ''
-      ids = []
-      for word in line.strip('\r\n ').split(' '):
-        ids.append(vocab[word])
-        if word[-2:] == '@@':
-          full_word += word[:-2]
-        else:
-          full_word += word
-          word_tokenization[full_word] = ids
-          full_word = ''
-          ids = []
+      for full_word, subwords in _SplitWords(line):
+        word_tokenization[full_word] = [vocab[w] for w in subwords]
   return word_tokenization
 
 
+def _ChunkOffsets(path, chunk_size):
+  """Splits `path` into chunks of whole lines of about `chunk_size` bytes.
+
+  Returns:
+    A list of (start, end) byte offsets.
+  """
+  size = tf.io.gfile.stat(path).length
+  starts = [0]
+  with tf.io.gfile.GFile(path, 'rb') as f:
+    for offset in range(chunk_size, size, chunk_size):
+      if offset <= starts[-1]:
+        continue
+      # The first line starting at or after offset.
+      f.seek(offset - 1)
+      start = offset - 1 + len(f.readline())
+      if start < size:
+        starts.append(start)
+  return list(zip(starts, starts[1:] + [size]))
+
+
+def _ReadLines(path, start, end):
+  """Yields the decoded lines of `path` between byte offsets start and end."""
+  with tf.io.gfile.GFile(path, 'rb') as f:
+    f.seek(start)
+    pos = start
+    while pos < end:
+      line = f.readline()
+      if not line:
+        break
+      pos += len(line)
+      yield line.decode('utf-8')
+
+
+def _WriteRun(words, vocab, run_dir):
+  """Writes `words` sorted, with the ids of their subwords, to a new run."""
+  fd, path = tempfile.mkstemp(suffix='.run', dir=run_dir)
+  with os.fdopen(fd, 'w', encoding='utf-8') as f:
+    for word in sorted(words):
+      f.write('%s %s\n' % (word, ','.join(str(vocab[w]) for w in words[word])))
+  return path
+
+
+def _ReadRun(path):
+  """Yields the (word, ids) of a run written by _WriteRun or _MergeToRun."""
+  with open(path, 'r', encoding='utf-8') as f:
+    for line in f:
+      word, ids = line.rstrip('\n').split(' ', 1)
+      yield word, ids
+
+
+def _MergeRuns(paths):
+  """Yields the (word, ids) of sorted runs, sorted and without duplicates.
+
+  Like the dict built by _ExtractTokenization, the ids of a word are the ones
+  of its last occurrence, i.e. in the last of `paths` containing it.
+  """
+  merged = heapq.merge(*[_ReadRun(path) for path in paths],
+                       key=lambda item: item[0])
+  prev = None
+  for item in merged:
+    # heapq.merge yields equal words in the order of the runs.
+    if prev is not None and item[0] != prev[0]:
+      yield prev
+    prev = item
+  if prev is not None:
+    yield prev
+
+
+def _MergeToRun(paths, run_dir):
+  """Merges `paths` into a new run, removing them."""
+  fd, path = tempfile.mkstemp(suffix='.run', dir=run_dir)
+  with os.fdopen(fd, 'w', encoding='utf-8') as f:
+    for word, ids in _MergeRuns(paths):
+      f.write('%s %s\n' % (word, ids))
+  for p in paths:
+    os.remove(p)
+  return path
+
+
+# The vocabulary of each worker process, loaded by _InitWorker.
+_worker_vocab = None
+
+
+def _InitWorker(vocab_filepath):
+  global _worker_vocab
+  _worker_vocab = _GetVocabulary(vocab_filepath)
+
+
+def _TokenizeChunk(task):
+  """Writes the words of a chunk of the corpus to sorted runs.
+
+  Args:
+    task: a tuple (encoded_filepath, start, end, max_words_in_memory, run_dir).
+
+  Returns:
+    The list of the paths of the runs, in order.
+  """
+  encoded_filepath, start, end, max_words_in_memory, run_dir = task
+  runs = []
+  # Only the subwords of each distinct word are kept, they are mapped to ids
+  # when the run is written.
+  words = {}
+  for line in _ReadLines(encoded_filepath, start, end):
+    for full_word, subwords in _SplitWords(line):
+      words[full_word] = subwords
+    if len(words) >= max_words_in_memory:
+      runs.append(_WriteRun(words, _worker_vocab, run_dir))
+      words = {}
+  if words:
+    runs.append(_WriteRun(words, _worker_vocab, run_dir))
+  return runs
+
+
+def BuildWordTokenization(encoded_filepath,
+                          vocab_filepath,
+                          output_filepath,
+                          num_workers=0,
+                          chunk_size=64 << 20,
+                          max_words_in_memory=1 << 22,
+                          tmp_dir=None):
+  """Writes the words_to_ids file of a BPE encoded corpus.
+
+  Args:
+    encoded_filepath: the BPE encoded corpus file.
+    vocab_filepath: the BPE vocab file.
+    output_filepath: the output words_to_ids file.
+    num_workers: the number of processes. Defaults to the number of CPUs.
+    chunk_size: the approximate number of bytes of the chunks of the corpus.
+    max_words_in_memory: the maximum number of distinct words held in memory by
+      each process.
+    tmp_dir: the parent directory of the temporary runs.
+
+  Returns:
+    The number of words written.
+  """
+  chunks = _ChunkOffsets(encoded_filepath, chunk_size)
+  run_dir = tempfile.mkdtemp(prefix='bpe_word_tokenizer', dir=tmp_dir)
+  try:
+    runs = []
+    with multiprocessing.Pool(
+        num_workers or None,
+        initializer=_InitWorker,
+        initargs=(vocab_filepath,)) as pool:
+      tasks = [(encoded_filepath, start, end, max_words_in_memory, run_dir)
+               for start, end in chunks]
+      # The runs are kept in the order of the corpus, so that the last
+      # occurrence of each word wins.
+      for i, chunk_runs in enumerate(pool.imap(_TokenizeChunk, tasks)):
+        runs += chunk_runs
+        tf.logging.info('Tokenized chunk %d/%d.', i + 1, len(chunks))
+    tf.logging.info('Merging %d runs.', len(runs))
+    while len(runs) > _MAX_MERGE_FAN_IN:
+      runs = [
+          _MergeToRun(runs[i:i + _MAX_MERGE_FAN_IN], run_dir)
+          for i in range(0, len(runs), _MAX_MERGE_FAN_IN)
+      ]
+    num_words = 0
+    with open(output_filepath, 'w') as output:
+      for word, ids in _MergeRuns(runs):
+        output.write(word + ' ')
+        output.write(ids)
+        output.write('\r\n')
+        num_words += 1
+  finally:
+    shutil.rmtree(run_dir, ignore_errors=True)
+  return num_words
+
+
 def main(_):
-  vocab = _GetVocabulary(FLAGS.vocab_filepath)
-  word_tokenization = _ExtractTokenization(FLAGS.encoded_filepath, vocab)
-  with open(FLAGS.output_filepath, 'w') as output:
-    for word, ids in word_tokenization.items():
-      output.write(word + ' ')
-      output.write(','.join(map(str, ids)))
-      output.write('\r\n')
+  tf.logging.set_verbosity(tf.logging.INFO)
+  num_words = BuildWordTokenization(FLAGS.encoded_filepath,
+                                    FLAGS.vocab_filepath, FLAGS.output_filepath,
+                                    FLAGS.num_workers, FLAGS.chunk_size,
+                                    FLAGS.max_words_in_memory, FLAGS.tmp_dir)
+  tf.logging.info('Wrote %d words to %s', num_words, FLAGS.output_filepath)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for bpe_word_tokenizer."""
+
+import os
+from unittest import mock
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tools import bpe_word_tokenizer
+
+
+class BpeWordTokenizerTest(test_utils.TestCase):
+
+  def _WriteFile(self, name, lines):
+    path = os.path.join(self.get_temp_dir(), name)
+    with tf.io.gfile.GFile(path, 'w') as f:
+      f.write(''.join(line + '\n' for line in lines))
+    return path
+
+  def _ReadOutput(self, path):
+    with open(path, 'r', newline='') as f:
+      lines = f.read().split('\r\n')
+    self.assertEqual('', lines[-1])
+    return lines[:-1]
+
+  def testSplitWords(self):
+    self.assertEqual(
+        [('THE', ('TH@@', 'E')), ('A', ('A',))],
+        list(bpe_word_tokenizer._SplitWords('TH@@ E  A DAN@@\r\n')))
+
+  def testChunkOffsets(self):
+    path = self._WriteFile('lines.txt', ['ab', 'cde', '', 'f'])
+    # Lines start at offsets 0, 3, 7, 8 and the file has 10 bytes.
+    self.assertEqual([(0, 10)], bpe_word_tokenizer._ChunkOffsets(path, 100))
+    self.assertEqual([(0, 3), (3, 7), (7, 8), (8, 10)],
+                     bpe_word_tokenizer._ChunkOffsets(path, 1))
+    self.assertEqual([(0, 7), (7, 8), (8, 10)],
+                     bpe_word_tokenizer._ChunkOffsets(path, 4))
+
+  def testBuildWordTokenization(self):
+    vocab_path = self._WriteFile('vocab.txt', [
+        '<unk>', '<s>', '</s>', 'E@@ 44', 'TH@@ 40', 'E 30', 'A 20', 'N@@ 10',
+        'DAN@@ 9', 'CE 8', 'Y 7', 'TH 6'
+    ])
+    corpus = [
+        'TH@@ E DAN@@ CE',
+        'A N@@ E@@ E',
+        '',
+        'TH@@ E@@ Y A TH',
+        'DAN@@ CE TH@@ E',
+    ] * 5
+    corpus_path = self._WriteFile('corpus.txt', corpus)
+    vocab = bpe_word_tokenizer._GetVocabulary(vocab_path)
+    expected = [
+        '%s %s' % (word, ','.join(map(str, ids))) for word, ids in sorted(
+            bpe_word_tokenizer._ExtractTokenization(corpus_path,
+                                                    vocab).items())
+    ]
+    self.assertEqual([
+        'A 6', 'DANCE 8,9', 'NEE 7,3,5', 'TH 11', 'THE 4,5', 'THEY 4,3,10'
+    ], expected)
+    for chunk_size, max_words_in_memory, fan_in in ((1 << 20, 1 << 20, 256),
+                                                    (20, 2, 256), (7, 1, 3)):
+      output_path = os.path.join(self.get_temp_dir(), 'words_to_ids')
+      # A small fan-in merges the runs in several passes.
+      with mock.patch.object(bpe_word_tokenizer, '_MAX_MERGE_FAN_IN', fan_in):
+        num_words = bpe_word_tokenizer.BuildWordTokenization(
+            corpus_path,
+            vocab_path,
+            output_path,
+            num_workers=2,
+            chunk_size=chunk_size,
+            max_words_in_memory=max_words_in_memory,
+            tmp_dir=self.get_temp_dir())
+      self.assertEqual(6, num_words)
+      self.assertEqual(expected, self._ReadOutput(output_path))
+    # The temporary runs are removed.
+    self.assertEqual([], [
+        name for name in os.listdir(self.get_temp_dir())
+        if name.startswith('bpe_word_tokenizer')
+    ])
+
+  def testMergeKeepsLastRun(self):
+    run_dir = self.get_temp_dir()
+    runs = [
+        self._WriteFile('run0', ['A 1', 'B 2']),
+        self._WriteFile('run1', ['B 3', 'C 4']),
+        self._WriteFile('run2', ['A 5']),
+    ]
+    merged = bpe_word_tokenizer._MergeToRun(runs[:2], run_dir)
+    self.assertEqual([('A', '5'), ('B', '3'), ('C', '4')],
+                     list(bpe_word_tokenizer._MergeRuns([merged, runs[2]])))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,77 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Builds the record offset indices of TFRecord files in parallel.
+
+The indices are read by input generators with `use_record_index`, see
+lingvo/core/tfrecord_index.py.
+
+To run:
+
+bazel run -c opt //lingvo/tools:build_tfrecord_index -- \
+  --input_filepattern=/path/to/train.tfrecord-* --num_workers=32
+"""
+
+import multiprocessing
+
+import lingvo.compat as tf
+from lingvo.core import tfrecord_index
+
+tf.flags.DEFINE_string('input_filepattern', '',
+                       'Comma separated file patterns of TFRecord files.')
+tf.flags.DEFINE_integer('num_workers', 0,
+                        'Number of processes. Defaults to the number of CPUs.')
+tf.flags.DEFINE_bool('overwrite', False,
+                     'Whether to rebuild indices which are up to date.')
+
+FLAGS = tf.flags.FLAGS
+
+
+def _IndexFile(task):
+  """Indexes a file unless its index is up to date. Returns its record count."""
+  path, overwrite = task
+  if not overwrite:
+    try:
+      return path, len(tfrecord_index.ReadIndex(path)) - 1
+    except ValueError:
+      pass
+  return path, tfrecord_index.BuildIndex(path)
+
+
+def BuildIndices(paths, num_workers=0, overwrite=False):
+  """Builds the indices of `paths`, returns a dict of their record counts."""
+  num_records = {}
+  with multiprocessing.Pool(num_workers or None) as pool:
+    for path, n in pool.imap_unordered(_IndexFile,
+                                       [(path, overwrite) for path in paths]):
+      tf.logging.info('%s: %d records', path, n)
+      num_records[path] = n
+  return num_records
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  paths = []
+  for pattern in FLAGS.input_filepattern.split(','):
+    paths += sorted(tf.io.gfile.glob(pattern))
+  if not paths:
+    raise ValueError('No files match %s' % FLAGS.input_filepattern)
+  num_records = BuildIndices(paths, FLAGS.num_workers, FLAGS.overwrite)
+  tf.logging.info('Indexed %d files with %d records.', len(num_records),
+                  sum(num_records.values()))
+
+
+if __name__ == '__main__':
+  tf.app.run(main)
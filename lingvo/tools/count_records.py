@@ -25,28 +25,75 @@ It is recommended that for other file formats, simply reading the metadata
 available in their formats should work; this file should not really be
 extended to any other format that already has efficient ways of counting
 records.
+
+Runs on a single machine, e.g. with the default direct runner, instead count
+the records of the files in parallel with local_records.py, which only reads the
+length header of each record of uncompressed files, and decompresses gzip and
+zlib files, given by their suffix or by --compression. --output_manifest then
+also writes the count of each file.
 """
 
 from absl import app
 from absl import flags
 
 import apache_beam as beam
+import lingvo.compat as tf
 from lingvo.tools import beam_utils
+from lingvo.tools import local_records
 
 flags.DEFINE_string('input_file_pattern', None, 'Path to read input')
 flags.DEFINE_string('output_count_file', None, 'File to write output to.')
 flags.DEFINE_string('record_format', None,
                     'Record format of the input, e.g., tfrecord.')
+flags.DEFINE_enum(
+    'backend', 'auto', ['auto', 'beam', 'local'],
+    'How records are counted. auto counts locally when the pipeline would run '
+    'on this machine, and with a beam pipeline otherwise.')
+flags.DEFINE_integer(
+    'num_workers', 0,
+    'Number of threads counting locally. Defaults to the number of CPUs.')
+flags.DEFINE_enum(
+    'compression', None, ['NONE', 'GZIP', 'ZLIB'],
+    'Compression of the TFRecord files when counting locally. By default, '
+    'files with a .gz or .zlib suffix are decompressed.')
+flags.DEFINE_string(
+    'output_manifest', None,
+    'If set, the JSON manifest of the count of each file is written there. '
+    'Only supported when counting locally.')
 
 FLAGS = flags.FLAGS
 
 
+def _CountLocally():
+  """Counts the records with a thread pool on this machine."""
+  paths = local_records.ListFiles(FLAGS.input_file_pattern, FLAGS.record_format)
+  compression = FLAGS.compression
+  if compression == 'NONE':
+    compression = ''
+  counts = local_records.CountRecords(
+      paths, FLAGS.num_workers, compression=compression)
+  total = sum(counts.values())
+  tf.logging.info('Counted %d records in %d files.', total, len(paths))
+  # Same file name as the single shard written by beam.io.WriteToText.
+  with tf.io.gfile.GFile(FLAGS.output_count_file + '-00000-of-00001', 'w') as f:
+    f.write('%d\n' % total)
+  if FLAGS.output_manifest:
+    local_records.WriteManifest(counts, FLAGS.output_manifest)
+
+
 def main(argv):
   beam_utils.BeamInit()
 
   # Construct pipeline options from argv.
   options = beam.options.pipeline_options.PipelineOptions(argv[1:])
 
+  if FLAGS.backend == 'local' or (FLAGS.backend == 'auto' and
+                                  beam_utils.IsLocalRun(options)):
+    _CountLocally()
+    return
+  if FLAGS.output_manifest:
+    raise ValueError('--output_manifest requires counting locally.')
+
   reader = beam_utils.GetReader(
       FLAGS.record_format,
       FLAGS.input_file_pattern,
@@ -13,14 +13,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-"""Encode the audio tarball contents into tfrecords."""
+"""Encode the audio tarball contents into tfrecords.
 
+By default each of --num_shards jobs walks the whole tarball and encodes one
+utterance at a time into its range of output shards. With --num_workers, a
+single job instead reads the tarball once and spreads the utterances over that
+many processes. Each process decodes the FLAC in-process, computes the features
+of batches of utterances of similar lengths per session run, and writes its own
+output shard. Both write the same tf.Examples.
+"""
+
+import multiprocessing
 import os
+import queue as queue_lib
 import random
 import re
 import tarfile
 import lingvo.compat as tf
 from lingvo.tools import audio_lib
+import numpy as np
 
 tf.flags.DEFINE_string('input_tarball', '', 'Input .tar.gz file.')
 tf.flags.DEFINE_string('input_text', '', 'Reference text.')
@@ -42,6 +53,17 @@ tf.flags.DEFINE_integer('output_range_end', -1, 'End of output shard IDs.')
 tf.flags.DEFINE_integer('num_output_shards', -1,
                         'Total number of output shards.')
 
+tf.flags.DEFINE_integer(
+    'num_workers', 0,
+    'If > 0, the number of processes extracting features, each writing one '
+    'of the output shards, ignoring the shard flags above.')
+tf.flags.DEFINE_integer('batch_size', 16,
+                        'Number of utterances per session run of a worker.')
+tf.flags.DEFINE_integer(
+    'utterances_per_chunk', 256,
+    'Number of utterances sent to a worker at once. The utterances of a chunk '
+    'are batched by length.')
+
 FLAGS = tf.flags.FLAGS
 
 
@@ -194,10 +216,167 @@ def _CreateAsrFeatures():
   _CloseSubShards(recordio_writers)
 
 
+class _FeatureExtractor:
+  """Computes the log-mel features of batches of utterances."""
+
+  def __init__(self):
+    graph = tf.Graph()
+    with graph.as_default():
+      self._audio = tf.placeholder(tf.float32, [None, None])
+      self._paddings = tf.placeholder(tf.float32, [None, None])
+      self._log_mel, self._log_mel_paddings = (
+          audio_lib.ExtractLogMelFeaturesFromSamples(self._audio,
+                                                     self._paddings))
+    # Workers run in parallel: each uses a single thread.
+    tfconf = tf.config_pb2.ConfigProto(
+        intra_op_parallelism_threads=1, inter_op_parallelism_threads=1)
+    self._sess = tf.Session(graph=graph, config=tfconf)
+
+  def Extract(self, samples):
+    """Returns the features of a batch of utterances.
+
+    Args:
+      samples: a list of int16 numpy arrays of 16KHz mono samples.
+
+    Returns:
+      A list of the features of each utterance, shaped [1, frames, 80, 1] like
+      those of `audio_lib.ExtractLogMelFeatures`.
+    """
+    max_len = max(len(x) for x in samples)
+    audio = np.zeros([len(samples), max_len], np.float32)
+    paddings = np.ones([len(samples), max_len], np.float32)
+    for i, x in enumerate(samples):
+      audio[i, :len(x)] = x
+      paddings[i, :len(x)] = 0.
+    log_mel, log_mel_paddings = self._sess.run(
+        [self._log_mel, self._log_mel_paddings],
+        feed_dict={
+            self._audio: audio,
+            self._paddings: paddings
+        })
+    num_frames = np.sum(log_mel_paddings == 0., axis=1)
+    return [log_mel[i:i + 1, :n] for i, n in enumerate(num_frames)]
+
+  def Close(self):
+    self._sess.close()
+
+
+def _ExtractChunk(extractor, utterances, batch_size):
+  """Yields the (uttid, features) of a chunk of (uttid, samples)."""
+  # Batching utterances of similar lengths minimizes padding.
+  utterances = sorted(utterances, key=lambda utt: len(utt[1]))
+  for i in range(0, len(utterances), batch_size):
+    batch = utterances[i:i + batch_size]
+    for (uttid, _), frames in zip(
+        batch, extractor.Extract([samples for _, samples in batch])):
+      yield uttid, frames
+
+
+def _RunWorker(queue, output_filepath, trans, batch_size):
+  """Extracts the features of the chunks of `queue` into `output_filepath`."""
+  # Spawned processes do not run the main block.
+  tf.disable_eager_execution()
+  tf.logging.set_verbosity(tf.logging.INFO)
+  extractor = _FeatureExtractor()
+  n = 0
+  with tf.python_io.TFRecordWriter(output_filepath) as outf:
+    while True:
+      chunk = queue.get()
+      if chunk is None:
+        break
+      utterances = []
+      for uttid, flac_bytes in chunk:
+        sample_rate, samples = audio_lib.DecodeFlac(flac_bytes)
+        assert sample_rate == 16000, (uttid, sample_rate)
+        utterances.append((uttid, samples[:, 0]))
+      for uttid, frames in _ExtractChunk(extractor, utterances, batch_size):
+        assert uttid in trans, uttid
+        ex = _MakeTfExample(uttid, frames, trans[uttid])
+        outf.write(ex.SerializeToString())
+        n += 1
+  extractor.Close()
+  tf.logging.info('Wrote %d utterances to %s', n, output_filepath)
+
+
+def _PutChecked(queue, item, workers, timeout=1.):
+  """Puts `item` in `queue`, unless one of `workers` failed.
+
+  Args:
+    queue: the queue of chunks of the workers.
+    item: the item put.
+    workers: the worker processes reading `queue`.
+    timeout: the seconds between checks of the workers while `queue` is full.
+
+  Raises:
+    RuntimeError: if a worker exited with an error. All the workers are then
+      terminated.
+  """
+  while True:
+    failed = [w.exitcode for w in workers if w.exitcode not in (None, 0)]
+    if failed:
+      for worker in workers:
+        worker.terminate()
+      raise RuntimeError('Worker failed with exit code %d' % failed[0])
+    try:
+      queue.put(item, timeout=timeout)
+      return
+    except queue_lib.Full:
+      pass
+
+
+def _CreateAsrFeaturesInParallel():
+  """Same as _CreateAsrFeatures, in a pool of --num_workers processes."""
+  if os.path.exists(FLAGS.transcripts_filepath):
+    trans = _LoadTranscriptionsFromFile()
+  else:
+    tf.logging.info('Running first pass on the fly')
+    trans = _ReadTranscriptions()
+  tf.logging.info('Total transcripts: %d', len(trans))
+  num_workers = FLAGS.num_workers
+  # Workers must not inherit the state of TF in this process.
+  ctx = multiprocessing.get_context('spawn')
+  queue = ctx.Queue(maxsize=2 * num_workers)
+  workers = []
+  for i in range(num_workers):
+    worker = ctx.Process(
+        target=_RunWorker,
+        args=(queue, FLAGS.output_template % (i, num_workers), trans,
+              FLAGS.batch_size))
+    worker.start()
+    workers.append(worker)
+  # Reading the tarball is sequential: only this process reads it.
+  n = 0
+  chunk = []
+  with tarfile.open(FLAGS.input_tarball, mode='r:gz') as tar:
+    for tarinfo in tar:
+      if not tarinfo.name.endswith('.flac'):
+        continue
+      n += 1
+      uttid = re.sub('.*/(.+)\\.flac', '\\1', tarinfo.name).encode('utf-8')
+      f = tar.extractfile(tarinfo)
+      chunk.append((uttid, f.read()))
+      f.close()
+      if len(chunk) == FLAGS.utterances_per_chunk:
+        _PutChecked(queue, chunk, workers)
+        chunk = []
+        tf.logging.info('Read %d utterances', n)
+  if chunk:
+    _PutChecked(queue, chunk, workers)
+  for _ in workers:
+    _PutChecked(queue, None, workers)
+  for worker in workers:
+    worker.join()
+    if worker.exitcode != 0:
+      raise RuntimeError('Worker failed with exit code %d' % worker.exitcode)
+  tf.logging.info('Total utterances: %d', n)
+
+
 def main(_):
   tf.logging.set_verbosity(tf.logging.INFO)
   if FLAGS.dump_transcripts:
     _DumpTranscripts()
+  elif FLAGS.generate_tfrecords and FLAGS.num_workers > 0:
+    _CreateAsrFeaturesInParallel()
   elif FLAGS.generate_tfrecords:
     _CreateAsrFeatures()
   else:
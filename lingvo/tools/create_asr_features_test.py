@@ -0,0 +1,83 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for create_asr_features."""
+
+import io
+import multiprocessing
+import sys
+import wave
+
+import lingvo.compat as tf
+from lingvo.core import test_helper
+from lingvo.core import test_utils
+from lingvo.tools import audio_lib
+from lingvo.tools import create_asr_features
+
+
+def _ToWav(samples):
+  buf = io.BytesIO()
+  with wave.open(buf, 'wb') as w:
+    w.setnchannels(1)
+    w.setsampwidth(2)
+    w.setframerate(16000)
+    w.writeframes(samples.astype('<i2').tobytes())
+  return buf.getvalue()
+
+
+class CreateAsrFeaturesTest(test_utils.TestCase):
+
+  def testBatchedFeatures(self):
+    with open(
+        test_helper.test_src_dir_path('tools/testdata/gan_or_vae.16k.wav'),
+        'rb') as f:
+      sample_rate, samples = audio_lib._ParseWav(f.read())
+    self.assertEqual(16000, sample_rate)
+    samples = samples[:, 0]
+    utterances = [(b'full', samples), (b'short', samples[:4000]),
+                  (b'medium', samples[1000:30000])]
+
+    # The features of each utterance alone, as computed by _CreateAsrFeatures.
+    expected = {}
+    with self.session(graph=tf.Graph()) as sess:
+      wav_bytes = tf.placeholder(tf.string)
+      log_mel = audio_lib.ExtractLogMelFeatures(wav_bytes)
+      for uttid, x in utterances:
+        expected[uttid] = sess.run(log_mel, {wav_bytes: _ToWav(x)})
+    self.assertAllEqual([1, 314, 80, 1], expected[b'full'].shape)
+
+    extractor = create_asr_features._FeatureExtractor()
+    outputs = list(
+        create_asr_features._ExtractChunk(extractor, utterances, batch_size=2))
+    extractor.Close()
+    # Utterances are batched by length.
+    self.assertEqual([b'short', b'medium', b'full'], [u for u, _ in outputs])
+    for uttid, frames in outputs:
+      self.assertAllClose(expected[uttid], frames, atol=1e-4)
+
+  def testPutCheckedRaisesOnFailedWorker(self):
+    ctx = multiprocessing.get_context('spawn')
+    worker = ctx.Process(target=sys.exit, args=(3,))
+    worker.start()
+    worker.join()
+    queue = ctx.Queue(maxsize=1)
+    queue.put(b'chunk')
+    # The queue is full and will never be read.
+    with self.assertRaisesRegex(RuntimeError, 'Worker failed'):
+      create_asr_features._PutChecked(queue, b'chunk', [worker], timeout=0.1)
+
+
+if __name__ == '__main__':
+  tf.test.main()
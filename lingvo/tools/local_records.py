@@ -0,0 +1,215 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Counts and samples the records of files on a single machine.
+
+A lightweight alternative to beam pipelines for the record tools. The files of
+a pattern are scanned by a pool of threads or processes. TFRecord files are
+counted by reading only the length header of each record and seeking past its
+payload, or from their offset index if they have an up to date one. Compressed
+TFRecord files, with a '.gz' or '.zlib' suffix as for beam.io.ReadFromTFRecord
+or of an explicit compression, are decompressed and read in full instead.
+
+The per file counts can be saved in a JSON manifest, which other tools can
+read instead of scanning the files again.
+"""
+
+import concurrent.futures
+import functools
+import json
+import struct
+
+import lingvo.compat as tf
+from lingvo.core import py_utils
+from lingvo.core import tfrecord_index
+import numpy as np
+
+_SUPPORTED_FORMATS = ('tfrecord',)
+_COMPRESSION_SUFFIXES = (('.gz', 'GZIP'), ('.zlib', 'ZLIB'))
+
+
+def ListFiles(file_pattern, record_format=None):
+  """Returns the sorted files matching `file_pattern`.
+
+  Args:
+    file_pattern: comma separated file patterns, optionally prefixed by their
+      record format as in 'tfrecord:/path/to/data-*'.
+    record_format: the record format, if `file_pattern` has no prefix.
+
+  Returns:
+    A list of paths.
+
+  Raises:
+    ValueError: if the record format is not supported.
+  """
+  if record_format is None:
+    record_format, file_pattern = py_utils.RecordFormatFromFilePattern(
+        file_pattern)
+  if record_format not in _SUPPORTED_FORMATS:
+    raise ValueError('Unsupported record format: {}'.format(record_format))
+  paths = []
+  for pattern in file_pattern.split(','):
+    paths += tf.io.gfile.glob(pattern)
+  return sorted(set(paths))
+
+
+def FileCompression(path, compression=None):
+  """Returns the compression of the TFRecord file `path`, '' if none.
+
+  Args:
+    path: the path of a TFRecord file.
+    compression: if not None, the compression of all the files: '', 'GZIP' or
+      'ZLIB'. Otherwise, the compression is given by the suffix of `path`.
+
+  Returns:
+    The compression type of `tf.io.TFRecordOptions`.
+  """
+  if compression is not None:
+    return compression
+  for suffix, suffix_compression in _COMPRESSION_SUFFIXES:
+    if path.endswith(suffix):
+      return suffix_compression
+  return ''
+
+
+def _IterCompressedRecords(path, compression):
+  return tf.io.tf_record_iterator(path, tf.io.TFRecordOptions(compression))
+
+
+def CountFileRecords(path, compression=None):
+  """Returns the number of records of the TFRecord file `path`.
+
+  Args:
+    path: the path of a TFRecord file.
+    compression: the compression of the file, see `FileCompression()`.
+  """
+  compression = FileCompression(path, compression)
+  if compression:
+    return sum(1 for _ in _IterCompressedRecords(path, compression))
+  try:
+    return len(tfrecord_index.ReadIndex(path)) - 1
+  except ValueError:
+    return len(tfrecord_index.ScanRecordOffsets(path)) - 1
+
+
+def _MapFiles(fn, paths, num_workers, use_processes):
+  """Returns the list of `fn(path)` of each of `paths`, in parallel."""
+  if use_processes:
+    executor = concurrent.futures.ProcessPoolExecutor(num_workers or None)
+  else:
+    executor = concurrent.futures.ThreadPoolExecutor(num_workers or None)
+  with executor:
+    return list(executor.map(fn, paths))
+
+
+def CountRecords(paths, num_workers=0, use_processes=False, compression=None):
+  """Counts the records of each of `paths` in parallel.
+
+  Args:
+    paths: a list of TFRecord files.
+    num_workers: the number of threads or processes. Defaults to the number of
+      CPUs.
+    use_processes: whether to count with processes instead of threads.
+    compression: the compression of the files, see `FileCompression()`.
+
+  Returns:
+    A dict from each of `paths` to its number of records.
+  """
+  counts = _MapFiles(
+      functools.partial(CountFileRecords, compression=compression), paths,
+      num_workers, use_processes)
+  return dict(zip(paths, counts))
+
+
+def WriteManifest(counts, manifest_path):
+  """Writes the per file record counts returned by `CountRecords()`."""
+  manifest = {
+      'total': sum(counts.values()),
+      'files': [{
+          'path': path,
+          'num_records': n
+      } for path, n in sorted(counts.items())],
+  }
+  with tf.io.gfile.GFile(manifest_path, 'w') as f:
+    json.dump(manifest, f, indent=2)
+
+
+def ReadManifest(manifest_path):
+  """Returns the dict of per file record counts of a manifest."""
+  with tf.io.gfile.GFile(manifest_path) as f:
+    manifest = json.load(f)
+  return {entry['path']: entry['num_records'] for entry in manifest['files']}
+
+
+def _ReadFileRecords(task, compression=None):
+  """Returns the records `record_ids`, sorted, of the TFRecord file `path`."""
+  path, record_ids = task
+  compression = FileCompression(path, compression)
+  if compression:
+    wanted = set(record_ids)
+    return [
+        record
+        for i, record in enumerate(_IterCompressedRecords(path, compression))
+        if i in wanted
+    ]
+  offsets = tfrecord_index.ScanRecordOffsets(path)
+  records = []
+  with tf.io.gfile.GFile(path, 'rb') as f:
+    for record_id in record_ids:
+      f.seek(offsets[record_id])
+      length, = struct.unpack('<Q', f.read(12)[:8])
+      records.append(f.read(length))
+  return records
+
+
+def SampleRecords(counts,
+                  num_samples,
+                  seed=None,
+                  num_workers=0,
+                  compression=None):
+  """Samples records uniformly without replacement.
+
+  Args:
+    counts: a dict of per file record counts, e.g. from `CountRecords()` or
+      `ReadManifest()`.
+    num_samples: the number of records sampled. All the records are returned
+      if there are fewer.
+    seed: the random seed.
+    num_workers: the number of threads reading the files.
+    compression: the compression of the files, see `FileCompression()`.
+
+  Returns:
+    A list of (path, record id in the file, record) tuples, in file order.
+  """
+  paths = sorted(counts)
+  starts = np.cumsum([0] + [counts[path] for path in paths])
+  total = int(starts[-1])
+  # Unlike RandomState.choice(), this does not permute all the record ids when
+  # only a few are sampled.
+  sample = np.sort(
+      np.random.default_rng(seed).choice(
+          total, min(num_samples, total), replace=False))
+  file_ids = np.searchsorted(starts, sample, side='right') - 1
+  tasks = []
+  for i, path in enumerate(paths):
+    record_ids = sample[file_ids == i] - starts[i]
+    if record_ids.size:
+      tasks.append((path, [int(r) for r in record_ids]))
+  samples = []
+  read_fn = functools.partial(_ReadFileRecords, compression=compression)
+  for (path, record_ids), records in zip(
+      tasks, _MapFiles(read_fn, tasks, num_workers, False)):
+    samples += [(path, r, record) for r, record in zip(record_ids, records)]
+  return samples
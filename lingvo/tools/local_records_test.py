@@ -0,0 +1,125 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for local_records."""
+
+import os
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.core import tfrecord_index
+from lingvo.tools import local_records
+
+
+class LocalRecordsTest(test_utils.TestCase):
+
+  def _MakeFiles(self):
+    records = [b'record %d' % i + b'x' * i for i in range(23)]
+    paths = []
+    for name, shard in (('data-0', records[:10]), ('data-1', []),
+                        ('data-2', records[10:])):
+      path = os.path.join(self.get_temp_dir(), name)
+      with tf.io.TFRecordWriter(path) as w:
+        for record in shard:
+          w.write(record)
+      paths.append(path)
+    return paths, records
+
+  def testListFiles(self):
+    paths, _ = self._MakeFiles()
+    pattern = os.path.join(self.get_temp_dir(), 'data-*')
+    self.assertEqual(paths, local_records.ListFiles('tfrecord:' + pattern))
+    self.assertEqual(paths, local_records.ListFiles(pattern, 'tfrecord'))
+    self.assertEqual(
+        paths[1:],
+        local_records.ListFiles(','.join(paths[2:0:-1]), 'tfrecord'))
+    with self.assertRaisesRegex(ValueError, 'Unsupported'):
+      local_records.ListFiles(pattern, 'sstable')
+
+  def testCountRecords(self):
+    paths, _ = self._MakeFiles()
+    # The index of a file is used when it is up to date.
+    tfrecord_index.BuildIndex(paths[0])
+    expected = {paths[0]: 10, paths[1]: 0, paths[2]: 13}
+    self.assertEqual(expected, local_records.CountRecords(paths, 2))
+    self.assertEqual(
+        expected, local_records.CountRecords(paths, 2, use_processes=True))
+    manifest = os.path.join(self.get_temp_dir(), 'manifest.json')
+    local_records.WriteManifest(expected, manifest)
+    self.assertEqual(expected, local_records.ReadManifest(manifest))
+
+  def testCompressedFiles(self):
+    records = [b'record %d' % i + b'x' * i for i in range(17)]
+    paths = []
+    for name, compression in (('data.gz', 'GZIP'), ('data.zlib', 'ZLIB'),
+                              ('data', '')):
+      path = os.path.join(self.get_temp_dir(), name)
+      with tf.io.TFRecordWriter(path,
+                                tf.io.TFRecordOptions(compression)) as w:
+        for record in records:
+          w.write(record)
+      self.assertEqual(compression, local_records.FileCompression(path))
+      paths.append(path)
+    self.assertEqual({path: 17 for path in paths},
+                     local_records.CountRecords(paths))
+    samples = local_records.SampleRecords({paths[0]: 17}, 5, seed=1)
+    self.assertLen(samples, 5)
+    for _, record_id, record in samples:
+      self.assertEqual(records[record_id], record)
+
+    # Files without a compression suffix need an explicit compression.
+    path = os.path.join(self.get_temp_dir(), 'gzip_data')
+    with tf.io.TFRecordWriter(path, tf.io.TFRecordOptions('GZIP')) as w:
+      for record in records:
+        w.write(record)
+    self.assertEqual('GZIP', local_records.FileCompression(path, 'GZIP'))
+    self.assertEqual({path: 17},
+                     local_records.CountRecords([path], compression='GZIP'))
+    samples = local_records.SampleRecords({path: 17},
+                                          3,
+                                          seed=1,
+                                          compression='GZIP')
+    for _, record_id, record in samples:
+      self.assertEqual(records[record_id], record)
+
+  def testUncompressedFileWithGzipMagic(self):
+    # The length header of a record of 0x088b1f bytes starts like gzip data.
+    record = b'x' * 0x088b1f
+    path = os.path.join(self.get_temp_dir(), 'data')
+    with tf.io.TFRecordWriter(path) as w:
+      w.write(record)
+      w.write(b'y')
+    self.assertEqual('', local_records.FileCompression(path))
+    self.assertEqual({path: 2}, local_records.CountRecords([path]))
+    samples = local_records.SampleRecords({path: 2}, 1, seed=1)
+    self.assertEqual([record, b'y'][samples[0][1]], samples[0][2])
+
+  def testSampleRecords(self):
+    paths, records = self._MakeFiles()
+    counts = local_records.CountRecords(paths)
+    samples = local_records.SampleRecords(counts, 7, seed=1234)
+    self.assertLen(samples, 7)
+    self.assertLen(set(r for _, _, r in samples), 7)
+    for path, record_id, record in samples:
+      offset = 0 if path == paths[0] else 10
+      self.assertEqual(records[offset + record_id], record)
+    # Samples are in file order, and all the records are returned if there
+    # are fewer.
+    self.assertEqual(records,
+                     [r for _, _, r in local_records.SampleRecords(counts, 50)])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,236 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Packs encoded MT examples offline into fixed-length rows.
+
+Reads tf.Examples as written by wpm_encode_file.py, with `source_id`,
+`target_id` and `target_label` features, and packs them with best-fit
+decreasing over a large shuffle buffer. Each output tf.Example is one packed
+row in the format read by `MlPerfInput` with `packed_input` and by
+`TextPackedInput` with `prepacked_input`: `inputs`, `targets`,
+`{inputs,targets}_segmentation` (1-based segment ids) and
+`{inputs,targets}_position`.
+
+Unlike the packing done on each training step by `TextPackedInput`, no
+example is ever dropped for lack of room in a batch; only examples longer than
+the max lengths are filtered out.
+
+To run:
+
+bazel run -c opt //lingvo/tools:pack_mt_examples -- \
+  --input_filepattern=/path/to/train.tfrecord-* \
+  --output_filepath=/path/to/train.packed.tfrecord \
+  --source_max_length=256 --target_max_length=256
+"""
+
+import random
+
+import lingvo.compat as tf
+
+tf.flags.DEFINE_string('input_filepattern', '',
+                       'File pattern of the encoded input tf.Examples.')
+tf.flags.DEFINE_string('output_filepath', '',
+                       'The output TFRecord file of packed tf.Examples.')
+tf.flags.DEFINE_integer('source_max_length', 256,
+                        'Length of the packed source rows.')
+tf.flags.DEFINE_integer('target_max_length', 256,
+                        'Length of the packed target rows.')
+tf.flags.DEFINE_integer(
+    'buffer_size', 1 << 18,
+    'Number of examples shuffled and packed together. Larger buffers give '
+    'denser packing.')
+tf.flags.DEFINE_integer('random_seed', 1234, 'Seed of the shuffle.')
+
+FLAGS = tf.flags.FLAGS
+
+
+class BestFitPacker:
+  """Packs (source, target) sequences into rows of fixed capacity.
+
+  Sequences are sorted by decreasing length, normalized by the capacity of each
+  side, and each is placed in the open row with the least remaining target
+  capacity that can still fit both its source and its target (best fit), or in
+  a new row otherwise.
+  """
+
+  def __init__(self, source_max_length, target_max_length, max_rows_scanned=64):
+    """Constructor.
+
+    Args:
+      source_max_length: the capacity of the source side of each row.
+      target_max_length: the capacity of the target side of each row.
+      max_rows_scanned: the max number of rows with the same remaining target
+        capacity checked for room on the source side. Bounds the cost of
+        placing a sequence.
+    """
+    self._source_max_length = source_max_length
+    self._target_max_length = target_max_length
+    self._max_rows_scanned = max_rows_scanned
+
+  def Fits(self, source_length, target_length):
+    return (0 < source_length <= self._source_max_length and
+            0 < target_length <= self._target_max_length)
+
+  def Pack(self, lengths):
+    """Packs sequences of the given lengths.
+
+    Args:
+      lengths: a list of (source length, target length) tuples, all of which
+        must fit.
+
+    Returns:
+      A list of rows, each a list of indices into `lengths`.
+    """
+
+    def _NormalizedLength(i):
+      source_length, target_length = lengths[i]
+      return max(source_length / self._source_max_length,
+                 target_length / self._target_max_length)
+
+    order = sorted(range(len(lengths)), key=_NormalizedLength, reverse=True)
+    rows = []
+    source_room = []
+    # open_rows[r] holds the rows with exactly r target positions left, in
+    # insertion order.
+    open_rows = [dict() for _ in range(self._target_max_length + 1)]
+    for i in order:
+      source_length, target_length = lengths[i]
+      best = None
+      for room in range(target_length, self._target_max_length + 1):
+        for num_scanned, row in enumerate(open_rows[room]):
+          if num_scanned >= self._max_rows_scanned:
+            break
+          if source_room[row] >= source_length:
+            best = row
+            break
+        if best is not None:
+          del open_rows[room][best]
+          break
+      else:
+        room = self._target_max_length
+        best = len(rows)
+        rows.append([])
+        source_room.append(self._source_max_length)
+      rows[best].append(i)
+      source_room[best] -= source_length
+      if room > target_length and source_room[best] > 0:
+        open_rows[room - target_length][best] = None
+    return rows
+
+
+def _ParseEncodedExample(record):
+  """Returns (source ids, target labels) of an encoded tf.Example."""
+  ex = tf.train.Example.FromString(record)
+  feature = ex.features.feature
+  return (list(feature['source_id'].int64_list.value),
+          list(feature['target_label'].int64_list.value))
+
+
+def _MakeInt64Feature(value):
+  return tf.train.Feature(int64_list=tf.train.Int64List(value=value))
+
+
+def MakePackedExample(sequences):
+  """Returns the packed tf.Example of a row of (source ids, target labels)."""
+  features = {}
+  for side, key in ((0, 'inputs'), (1, 'targets')):
+    ids, segmentation, position = [], [], []
+    for segment, seq in enumerate(sequences):
+      ids += seq[side]
+      segmentation += [segment + 1] * len(seq[side])
+      position += list(range(len(seq[side])))
+    features[key] = _MakeInt64Feature(ids)
+    features[key + '_segmentation'] = _MakeInt64Feature(segmentation)
+    features[key + '_position'] = _MakeInt64Feature(position)
+  return tf.train.Example(features=tf.train.Features(feature=features))
+
+
+def PackExamples(records, packer, buffer_size, rng):
+  """Yields packed tf.Examples of the encoded tf.Example `records`.
+
+  Args:
+    records: an iterable of serialized tf.Examples.
+    packer: a `BestFitPacker`.
+    buffer_size: the number of examples shuffled and packed together.
+    rng: a `random.Random` used to shuffle the examples and rows.
+
+  Yields:
+    (tf.Example, stats) tuples. stats is a dict of running statistics.
+  """
+  stats = {
+      'num_examples': 0,
+      'num_too_long': 0,
+      'num_rows': 0,
+      'source_tokens': 0,
+      'target_tokens': 0,
+  }
+
+  def _PackBuffer(buf):
+    rng.shuffle(buf)
+    rows = packer.Pack([(len(s), len(t)) for s, t in buf])
+    rng.shuffle(rows)
+    for row in rows:
+      sequences = [buf[i] for i in row]
+      stats['num_rows'] += 1
+      stats['source_tokens'] += sum(len(s) for s, _ in sequences)
+      stats['target_tokens'] += sum(len(t) for _, t in sequences)
+      yield MakePackedExample(sequences), stats
+
+  buf = []
+  for record in records:
+    source_ids, target_labels = _ParseEncodedExample(record)
+    stats['num_examples'] += 1
+    if not packer.Fits(len(source_ids), len(target_labels)):
+      stats['num_too_long'] += 1
+      continue
+    buf.append((source_ids, target_labels))
+    if len(buf) == buffer_size:
+      yield from _PackBuffer(buf)
+      buf = []
+  if buf:
+    yield from _PackBuffer(buf)
+
+
+def _ReadRecords(filepattern):
+  for filename in sorted(tf.io.gfile.glob(filepattern)):
+    for record in tf.io.tf_record_iterator(filename):
+      yield record
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  packer = BestFitPacker(FLAGS.source_max_length, FLAGS.target_max_length)
+  stats = None
+  with tf.io.TFRecordWriter(FLAGS.output_filepath) as outf:
+    for ex, stats in PackExamples(
+        _ReadRecords(FLAGS.input_filepattern), packer, FLAGS.buffer_size,
+        random.Random(FLAGS.random_seed)):
+      outf.write(ex.SerializeToString())
+      if stats['num_rows'] % 100000 == 0:
+        tf.logging.info('Wrote %d rows', stats['num_rows'])
+  if stats is None:
+    tf.logging.info('No examples were packed.')
+    return
+  tf.logging.info(
+      'Packed %d examples (%d too long) into %d rows, %.2f examples per row. '
+      'Source density %.4f, target density %.4f.', stats['num_examples'],
+      stats['num_too_long'], stats['num_rows'],
+      (stats['num_examples'] - stats['num_too_long']) / stats['num_rows'],
+      stats['source_tokens'] / (stats['num_rows'] * FLAGS.source_max_length),
+      stats['target_tokens'] / (stats['num_rows'] * FLAGS.target_max_length))
+
+
+if __name__ == '__main__':
+  tf.app.run(main)
@@ -0,0 +1,111 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for pack_mt_examples."""
+
+import random
+
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tools import pack_mt_examples
+import numpy as np
+
+
+def _MakeEncodedExample(source_ids, target_labels):
+  feature = {
+      'source_id':
+          tf.train.Feature(int64_list=tf.train.Int64List(value=source_ids)),
+      'target_label':
+          tf.train.Feature(int64_list=tf.train.Int64List(value=target_labels)),
+  }
+  return tf.train.Example(features=tf.train.Features(
+      feature=feature)).SerializeToString()
+
+
+class PackMtExamplesTest(test_utils.TestCase):
+
+  def testBestFitPacker(self):
+    packer = pack_mt_examples.BestFitPacker(10, 8)
+    lengths = [(5, 4), (5, 4), (3, 6), (7, 2), (2, 2), (10, 8), (1, 1)]
+    rows = packer.Pack(lengths)
+    # (10, 8) fills a row, (3, 6) and (7, 2) fill another, the two (5, 4) fill
+    # a third one, and (2, 2) and (1, 1) share the last one.
+    self.assertCountEqual(range(len(lengths)), sum(rows, []))
+    self.assertLen(rows, 4)
+    for row in rows:
+      self.assertLessEqual(sum(lengths[i][0] for i in row), 10)
+      self.assertLessEqual(sum(lengths[i][1] for i in row), 8)
+
+  def testBestFitPackerDensity(self):
+    rng = np.random.RandomState(12345)
+    lengths = [(int(s), int(t)) for s, t in zip(
+        rng.randint(1, 64, size=2000), rng.randint(1, 64, size=2000))]
+    rows = pack_mt_examples.BestFitPacker(128, 128).Pack(lengths)
+    self.assertCountEqual(range(len(lengths)), sum(rows, []))
+    for row in rows:
+      self.assertLessEqual(sum(lengths[i][0] for i in row), 128)
+      self.assertLessEqual(sum(lengths[i][1] for i in row), 128)
+    # The target side, on which best fit is done, is packed densely.
+    target_density = sum(t for _, t in lengths) / (len(rows) * 128.)
+    self.assertGreater(target_density, 0.9)
+
+  def testPackExamples(self):
+    records = [
+        _MakeEncodedExample([3, 4, 2], [5, 2]),
+        _MakeEncodedExample([6, 2], [7, 8, 9, 2]),
+        _MakeEncodedExample(list(range(10, 22)), [2]),  # Source too long.
+        _MakeEncodedExample([2], [2]),
+    ]
+    packer = pack_mt_examples.BestFitPacker(8, 8)
+    outputs = list(
+        pack_mt_examples.PackExamples(records, packer, 2, random.Random(1)))
+    stats = outputs[-1][1]
+    self.assertEqual(4, stats['num_examples'])
+    self.assertEqual(1, stats['num_too_long'])
+    self.assertEqual(len(outputs), stats['num_rows'])
+    self.assertEqual(6, stats['source_tokens'])
+    self.assertEqual(7, stats['target_tokens'])
+
+    segments = []
+    for ex, _ in outputs:
+      feature = ex.features.feature
+      values = {k: list(v.int64_list.value) for k, v in feature.items()}
+      for side in ('inputs', 'targets'):
+        self.assertEqual(
+            len(values[side]), len(values[side + '_segmentation']))
+        self.assertEqual(len(values[side]), len(values[side + '_position']))
+      for segment in set(values['inputs_segmentation']):
+        src = [
+            x for x, s in zip(values['inputs'], values['inputs_segmentation'])
+            if s == segment
+        ]
+        tgt = [
+            x for x, s in zip(values['targets'],
+                              values['targets_segmentation'])
+            if s == segment
+        ]
+        pos = [
+            x for x, s in zip(values['inputs_position'],
+                              values['inputs_segmentation'])
+            if s == segment
+        ]
+        self.assertEqual(list(range(len(src))), pos)
+        segments.append((src, tgt))
+    self.assertCountEqual([([3, 4, 2], [5, 2]), ([6, 2], [7, 8, 9, 2]),
+                           ([2], [2])], segments)
+
+
+if __name__ == '__main__':
+  tf.test.main()
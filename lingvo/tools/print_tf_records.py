@@ -13,9 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-"""Debug print tf records in text format."""
+"""Debug print tf records in text format.
+
+With --count_only, or --sample_n, the files are scanned in parallel by
+local_records.py.
+"""
 
 import lingvo.compat as tf
+from lingvo.tools import local_records
 import six
 
 tf.flags.DEFINE_string('input_filepattern', '',
@@ -30,6 +35,22 @@ tf.flags.DEFINE_bool('bytes_as_utf8', True,
                      'Print byte strings as UTF-8 strings')
 tf.flags.DEFINE_bool('count_only', False,
                      'Don\'t print, just count number of entries')
+tf.flags.DEFINE_integer(
+    'sample_n', 0,
+    'If > 0, print this many records sampled uniformly from all the files '
+    'instead of the first ones.')
+tf.flags.DEFINE_integer('sample_seed', None, 'Random seed of --sample_n.')
+tf.flags.DEFINE_integer(
+    'num_workers', 0,
+    'Number of threads scanning files. Defaults to the number of CPUs.')
+tf.flags.DEFINE_enum(
+    'compression', None, ['NONE', 'GZIP', 'ZLIB'],
+    'Compression of the files with --count_only or --sample_n. By default, '
+    'files with a .gz or .zlib suffix are decompressed.')
+tf.flags.DEFINE_string(
+    'output_manifest', '',
+    'If set with --count_only or --sample_n, the JSON manifest of the count '
+    'of each file is written there.')
 
 FLAGS = tf.flags.FLAGS
 
@@ -77,6 +98,35 @@ def _PrintHeader(tf_example):
   tf.logging.info('====')
 
 
+def _PrintRecord(entry, serialized, print_header):
+  assert FLAGS.input_format == 'tf.Example'
+  ex = tf.train.Example()
+  ex.ParseFromString(serialized)
+  if print_header:
+    _PrintHeader(ex)
+  text_format = _CustomShortDebugString(ex) if FLAGS.abbreviated else str(ex)
+  tf.logging.info('== Record [%s]\n%s', entry, text_format)
+
+
+def _ScanFiles():
+  """Counts the records of each file in parallel, and prints a sample."""
+  paths = sorted(tf.io.gfile.glob(FLAGS.input_filepattern))
+  compression = FLAGS.compression
+  if compression == 'NONE':
+    compression = ''
+  counts = local_records.CountRecords(
+      paths, FLAGS.num_workers, compression=compression)
+  if FLAGS.output_manifest:
+    local_records.WriteManifest(counts, FLAGS.output_manifest)
+  if FLAGS.sample_n > 0 and not FLAGS.count_only:
+    samples = local_records.SampleRecords(counts, FLAGS.sample_n,
+                                          FLAGS.sample_seed, FLAGS.num_workers,
+                                          compression)
+    for i, (path, record_id, serialized) in enumerate(samples):
+      _PrintRecord('%s:%d' % (path, record_id), serialized, i == 0)
+  tf.logging.info('== Total entries: %d', sum(counts.values()))
+
+
 def _PrintFiles():
   entry = 0
   for filepath in tf.io.gfile.glob(FLAGS.input_filepattern):
@@ -88,26 +138,17 @@ def _PrintFiles():
       if FLAGS.print_only_n >= 0 and (entry - FLAGS.skip_first_n >
                                       FLAGS.print_only_n):
         break
-      if FLAGS.count_only:
-        entry += 1
-        if (entry % 100000) == 0:
-          tf.logging.info('Counted %d entries so far...', entry)
-        continue
-      assert FLAGS.input_format == 'tf.Example'
-      ex = tf.train.Example()
-      ex.ParseFromString(serialized)
-      if entry == FLAGS.skip_first_n:
-        _PrintHeader(ex)
-      text_format = _CustomShortDebugString(ex) if FLAGS.abbreviated else str(
-          ex)
-      tf.logging.info('== Record [%d]\n%s', entry, text_format)
+      _PrintRecord(entry, serialized, entry == FLAGS.skip_first_n)
       entry += 1
   tf.logging.info('== Total entries: %d', entry)
 
 
 def main(_):
   tf.logging.set_verbosity(tf.logging.INFO)
-  _PrintFiles()
+  if FLAGS.count_only or FLAGS.sample_n > 0:
+    _ScanFiles()
+  else:
+    _PrintFiles()
 
 
 if __name__ == '__main__':
@@ -13,11 +13,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-"""Encode file using the wpm_encoder."""
+"""Encode file using the wpm_encoder.
+
+By default only the lines of --shard_id out of --num_shards are encoded into
+--output_filepath. With --num_output_shards, the whole input is instead split
+by byte offsets into that many contiguous shards, which are encoded in parallel
+by --num_workers processes and written to
+<output_filepath>-<shard>-of-<num_output_shards>.
+"""
+
+import multiprocessing
+import os
+import time
 
 import lingvo.compat as tf
 from lingvo.core import wpm_encoder
-import numpy as np
 import six
 from six import text_type
 
@@ -34,12 +44,27 @@ tf.flags.DEFINE_integer(
     'max_len', 0,
     'Drop sentence if src/tgt tokens exceed max length, counting <s> and </s>. '
     'Only use during training. A value of 0 does not filter.')
+tf.flags.DEFINE_bool(
+    'use_tf_encoder', False,
+    'If true, encode with the TF graph encoder instead of the host encoder. '
+    'Both produce the same ids; the host encoder is much faster.')
+tf.flags.DEFINE_integer('encode_batch_size', 1000,
+                        'Number of sentence pairs encoded at once.')
+tf.flags.DEFINE_integer(
+    'num_output_shards', 0,
+    'If > 0, encode the whole input into this many output shards in '
+    'parallel, ignoring --num_shards and --shard_id.')
+tf.flags.DEFINE_integer(
+    'num_workers', 0,
+    'Number of encoding processes used with --num_output_shards. '
+    'Defaults to the number of CPUs.')
 
 FLAGS = tf.flags.FLAGS
 
 
 def _MakeBytesFeature(unicode_array):
-  value = [tf.compat.as_bytes(w) for w in unicode_array]
+  value = [w if isinstance(w, bytes) else w.encode('utf-8')
+           for w in unicode_array]
   return tf.train.Feature(bytes_list=tf.train.BytesList(value=value))
 
 
@@ -58,26 +83,26 @@ def _AssertTextFormat(text):
   assert not text.endswith('</S>')
 
 
-def _MakeTfExample(enc, src_i, src_s, tgt_i, tgt_s):
+def _MakeTfExample(enc, src_i, src_s, tgt_i, tgt_s, max_len):
   """Creates TfExample from the encoded results."""
   src_i = list(src_i) + [enc.sentence_end_id]
   src_s = list(src_s) + [enc.sentence_end_string]
-  if FLAGS.max_len > 0 and len(src_i) > FLAGS.max_len:
+  if max_len > 0 and len(src_i) > max_len:
     return None
   tgt_l = list(tgt_i) + [enc.sentence_end_id]
   tgt_i = [enc.sentence_start_id] + list(tgt_i)
   tgt_s = [enc.sentence_start_string] + list(tgt_s)
-  if FLAGS.max_len > 0 and len(tgt_i) > FLAGS.max_len:
+  if max_len > 0 and len(tgt_i) > max_len:
     return None
   feature = {
       'source_id': _MakeInt64Feature(src_i),
-      'source_padding': _MakeFloatFeature(np.zeros_like(src_i)),
+      'source_padding': _MakeFloatFeature([0.] * len(src_i)),
       'source_word': _MakeBytesFeature(src_s),
       'target_id': _MakeInt64Feature(tgt_i),
-      'target_padding': _MakeFloatFeature(np.zeros_like(tgt_i)),
+      'target_padding': _MakeFloatFeature([0.] * len(tgt_i)),
       'target_word': _MakeBytesFeature(tgt_s),
       'target_label': _MakeInt64Feature(tgt_l),
-      'target_weight': _MakeFloatFeature(np.ones_like(tgt_l)),
+      'target_weight': _MakeFloatFeature([1.] * len(tgt_l)),
       'natural_order': _MakeInt64Feature([1]),
   }
   return tf.train.Example(features=tf.train.Features(feature=feature))
@@ -89,50 +114,323 @@ def _Preprocess(text):
   return text.strip().replace(' </s>', '')
 
 
-def _RunEncoding():
+def _PrepareTexts(source_line, target_line):
+  """Returns the preprocessed (source, target) texts of a pair of lines."""
+  source_text = _Preprocess(source_line)
+  target_text = _Preprocess(target_line)
+  # By convention:
+  # * source always ends in </s>, never starts with <s>.
+  # * target never ends in </s>, always starts with <s>.
+  _AssertTextFormat(source_text)
+  _AssertTextFormat(target_text)
+  return source_text, target_text
+
+
+def _ReadShard():
+  """Yields the (source, target) text pairs of this shard."""
+  pairs = list(
+      zip(FLAGS.source_filepaths.split(','), FLAGS.target_filepaths.split(',')))
+  n = 0
+  for p in pairs:
+    with tf.io.gfile.GFile(p[0], 'r') as sourcef:
+      with tf.io.gfile.GFile(p[1], 'r') as targetf:
+        for textp in zip(sourcef.readlines(), targetf.readlines()):
+          n += 1
+          if n % 10000 == 0:
+            tf.logging.info('Watermark[%d]: %d', FLAGS.shard_id, n)
+          if n % FLAGS.num_shards != FLAGS.shard_id:
+            continue
+          yield _PrepareTexts(*textp)
+
+
+def _Batch(iterable, batch_size):
+  batch = []
+  for item in iterable:
+    batch.append(item)
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def _EncodeWithGraph(enc):
+  """Yields the encoded (src_i, src_s, tgt_i, tgt_s) using a `WpmEncoder`."""
   sess = tf.Session()
-  enc = wpm_encoder.WpmEncoder(FLAGS.wpm_filepath)
   src_txt_placeholder = tf.placeholder(tf.string, [])
   src_encode_op = enc.Encode(src_txt_placeholder)
   tgt_txt_placeholder = tf.placeholder(tf.string, [])
   tgt_encode_op = enc.Encode(tgt_txt_placeholder)
+  for source_text, target_text in _ReadShard():
+    ((src_i, src_s), (tgt_i, tgt_s)) = sess.run(
+        [src_encode_op, tgt_encode_op],
+        feed_dict={
+            src_txt_placeholder: source_text,
+            tgt_txt_placeholder: target_text
+        },
+    )
+    yield src_i, src_s, tgt_i, tgt_s
+
+
+def _EncodeWithHost(enc):
+  """Yields the encoded (src_i, src_s, tgt_i, tgt_s) with a `HostWpmEncoder`."""
+  for batch in _Batch(_ReadShard(), FLAGS.encode_batch_size):
+    sources, targets = zip(*batch)
+    for (src_i, src_s), (tgt_i, tgt_s) in zip(
+        enc.EncodeMany(sources), enc.EncodeMany(targets)):
+      yield src_i, src_s, tgt_i, tgt_s
+  tf.logging.info('Word cache: %s', enc.CacheInfo())
+
+
+def _RunEncoding():
+  if FLAGS.use_tf_encoder:
+    enc = wpm_encoder.WpmEncoder(FLAGS.wpm_filepath)
+    encoded_pairs = _EncodeWithGraph(enc)
+  else:
+    enc = wpm_encoder.HostWpmEncoder(FLAGS.wpm_filepath)
+    encoded_pairs = _EncodeWithHost(enc)
+  with tf.python_io.TFRecordWriter(FLAGS.output_filepath) as outf:
+    for src_i, src_s, tgt_i, tgt_s in encoded_pairs:
+      ex = _MakeTfExample(enc, src_i, src_s, tgt_i, tgt_s, FLAGS.max_len)
+      if not ex:  # Too long.
+        continue
+      encoded = ex.SerializeToString()
+      outf.write(encoded)
+
+
+# Size of the blocks read when scanning files for newlines.
+_SCAN_BLOCK_SIZE = 1 << 24
+
+
+def _CountNewlines(f, num_bytes):
+  """Counts the newlines in the next `num_bytes` bytes of file `f`."""
+  count = 0
+  while num_bytes > 0:
+    block = f.read(min(num_bytes, _SCAN_BLOCK_SIZE))
+    if not block:
+      break
+    count += block.count(b'\n')
+    num_bytes -= len(block)
+  return count
+
+
+def _AlignToLineStarts(path, offsets):
+  """Aligns byte offsets to the start of lines.
+
+  Args:
+    path: the path of the text file.
+    offsets: a sorted list of byte offsets.
+
+  Returns:
+    For each offset, a tuple (offset, line index) of the first line starting
+    at or after it. Offsets past the last line map to the size of the file.
+  """
+  size = tf.io.gfile.stat(path).length
+  results = []
+  start, line_index = 0, 0
+  with tf.io.gfile.GFile(path, 'rb') as f:
+    for offset in offsets:
+      if offset > 0:
+        f.seek(offset - 1)
+        new_start = min(offset - 1 + len(f.readline()), size)
+      else:
+        new_start = 0
+      new_start = max(new_start, start)
+      f.seek(start)
+      line_index += _CountNewlines(f, new_start - start)
+      start = new_start
+      results.append((start, line_index))
+  return results
+
+
+def _LineStartOffsets(path, line_indices):
+  """Returns the byte offsets of each of the sorted `line_indices` in `path`.
+
+  Lines past the end of the file map to the size of the file.
+  """
+  results = []
+  pos, num_newlines = 0, 0
+  with tf.io.gfile.GFile(path, 'rb') as f:
+    for line_index in line_indices:
+      while num_newlines < line_index:
+        f.seek(pos)
+        block = f.read(_SCAN_BLOCK_SIZE)
+        if not block:
+          break
+        count = block.count(b'\n')
+        if num_newlines + count < line_index:
+          num_newlines += count
+          pos += len(block)
+          continue
+        idx = -1
+        for _ in range(line_index - num_newlines):
+          idx = block.index(b'\n', idx + 1)
+        pos += idx + 1
+        num_newlines = line_index
+      results.append(pos)
+  return results
+
+
+def _PlanShards(pairs, num_shards):
+  """Splits aligned (source, target) files into contiguous shards.
+
+  Shards cover roughly equal numbers of source bytes and always start at the
+  beginning of a line, so no line is split between shards.
+
+  Args:
+    pairs: a list of (source path, target path) tuples.
+    num_shards: the number of shards.
+
+  Returns:
+    A list of `num_shards` lists of segments, each a tuple (source path,
+    source start, source end, target path, target start, target end) of byte
+    offsets.
+  """
+  sizes = [tf.io.gfile.stat(source).length for source, _ in pairs]
+  total = sum(sizes)
+  shard_starts = [k * total // num_shards for k in range(num_shards)]
+  shards = [[] for _ in range(num_shards)]
+  base = 0
+  for (source, target), size in zip(pairs, sizes):
+    # The shards overlapping with [base, base + size) and where they start.
+    shard_ids = [
+        k for k in range(num_shards)
+        if shard_starts[k] < base + size and
+        (k == num_shards - 1 or shard_starts[k + 1] > base)
+    ]
+    local_starts = [max(shard_starts[k] - base, 0) for k in shard_ids]
+    source_starts = _AlignToLineStarts(source, local_starts)
+    target_starts = _LineStartOffsets(
+        target, [line_index for _, line_index in source_starts])
+    source_ends = [start for start, _ in source_starts[1:]] + [size]
+    target_ends = target_starts[1:] + [tf.io.gfile.stat(target).length]
+    for k, (source_start, _), source_end, target_start, target_end in zip(
+        shard_ids, source_starts, source_ends, target_starts, target_ends):
+      if source_start < source_end:
+        shards[k].append((source, source_start, source_end, target,
+                          target_start, target_end))
+    base += size
+  return shards
+
+
+def _ReadLines(path, start, end):
+  """Yields the lines of `path` between byte offsets `start` and `end`."""
+  with tf.io.gfile.GFile(path, 'rb') as f:
+    f.seek(start)
+    pos = start
+    while pos < end:
+      line = f.readline()
+      if not line:
+        break
+      pos += len(line)
+      yield line
+
+
+# The encoder of each worker process, created by _InitWorker.
+_worker_encoder = None
+
+
+def _InitWorker(wpm_filepath):
+  global _worker_encoder
+  _worker_encoder = wpm_encoder.HostWpmEncoder(wpm_filepath)
+
+
+def _EncodeShard(task):
+  """Encodes one shard planned by _PlanShards into a TFRecord file.
+
+  Args:
+    task: a tuple (segments, output_filepath, max_len, batch_size).
+
+  Returns:
+    A dict of statistics about the shard.
+  """
+  segments, output_filepath, max_len, batch_size = task
+  enc = _worker_encoder
+  start_time = time.time()
+  stats = {'num_pairs': 0, 'num_too_long': 0, 'num_tokens': 0}
+
+  def _TextPairs():
+    for (source, source_start, source_end, target, target_start,
+         target_end) in segments:
+      for textp in zip(
+          _ReadLines(source, source_start, source_end),
+          _ReadLines(target, target_start, target_end)):
+        yield _PrepareTexts(*textp)
+
+  with tf.python_io.TFRecordWriter(output_filepath) as outf:
+    for batch in _Batch(_TextPairs(), batch_size):
+      sources, targets = zip(*batch)
+      for (src_i, src_s), (tgt_i, tgt_s) in zip(
+          enc.EncodeMany(sources), enc.EncodeMany(targets)):
+        stats['num_pairs'] += 1
+        stats['num_tokens'] += len(src_i) + len(tgt_i)
+        ex = _MakeTfExample(enc, src_i, src_s, tgt_i, tgt_s, max_len)
+        if not ex:  # Too long.
+          stats['num_too_long'] += 1
+          continue
+        outf.write(ex.SerializeToString())
+  stats['seconds'] = time.time() - start_time
+  stats['output_filepath'] = output_filepath
+  return stats
+
+
+def EncodeInParallel(pairs, wpm_filepath, output_filepath, num_output_shards,
+                     num_workers, max_len=0, batch_size=1000):
+  """Encodes aligned text files into sharded TFRecords of tf.Examples.
+
+  Args:
+    pairs: a list of (source path, target path) tuples of aligned text files.
+    wpm_filepath: the wordpiece vocabulary file.
+    output_filepath: the prefix of the output shards.
+    num_output_shards: the number of output shards.
+    num_workers: the number of encoding processes.
+    max_len: if > 0, drop pairs whose source or target exceeds this length.
+    batch_size: the number of pairs encoded at once.
+
+  Returns:
+    A list of per shard statistics.
+  """
+  shards = _PlanShards(pairs, num_output_shards)
+  tasks = [(segments, '%s-%.5d-of-%.5d' % (output_filepath, k,
+                                           num_output_shards), max_len,
+            batch_size) for k, segments in enumerate(shards)]
+  all_stats = []
+  with multiprocessing.Pool(
+      num_workers, initializer=_InitWorker,
+      initargs=(wpm_filepath,)) as pool:
+    for stats in pool.imap_unordered(_EncodeShard, tasks):
+      tf.logging.info(
+          'Wrote %s: %d pairs, %d too long, %.0f tokens/sec',
+          stats['output_filepath'], stats['num_pairs'], stats['num_too_long'],
+          stats['num_tokens'] / max(stats['seconds'], 1e-6))
+      all_stats.append(stats)
+  return all_stats
+
+
+def _RunParallelEncoding():
   pairs = list(
       zip(FLAGS.source_filepaths.split(','), FLAGS.target_filepaths.split(',')))
-  with tf.python_io.TFRecordWriter(FLAGS.output_filepath) as outf:
-    n = 0
-    for p in pairs:
-      with tf.io.gfile.GFile(p[0], 'r') as sourcef:
-        with tf.io.gfile.GFile(p[1], 'r') as targetf:
-          for textp in zip(sourcef.readlines(), targetf.readlines()):
-            n += 1
-            if n % 10000 == 0:
-              tf.logging.info('Watermark[%d]: %d', FLAGS.shard_id, n)
-            if n % FLAGS.num_shards != FLAGS.shard_id:
-              continue
-            source_text = _Preprocess(textp[0])
-            target_text = _Preprocess(textp[1])
-            # By convention:
-            # * source always ends in </s>, never starts with <s>.
-            # * target never ends in </s>, always starts with <s>.
-            _AssertTextFormat(source_text)
-            _AssertTextFormat(target_text)
-            ((src_i, src_s), (tgt_i, tgt_s)) = sess.run(
-                [src_encode_op, tgt_encode_op],
-                feed_dict={
-                    src_txt_placeholder: source_text,
-                    tgt_txt_placeholder: target_text
-                },
-            )
-            ex = _MakeTfExample(enc, src_i, src_s, tgt_i, tgt_s)
-            if not ex:  # Too long.
-              continue
-            encoded = ex.SerializeToString()
-            outf.write(encoded)
+  start_time = time.time()
+  all_stats = EncodeInParallel(pairs, FLAGS.wpm_filepath,
+                               FLAGS.output_filepath, FLAGS.num_output_shards,
+                               FLAGS.num_workers or os.cpu_count(),
+                               FLAGS.max_len, FLAGS.encode_batch_size)
+  num_pairs = sum(stats['num_pairs'] for stats in all_stats)
+  num_too_long = sum(stats['num_too_long'] for stats in all_stats)
+  num_tokens = sum(stats['num_tokens'] for stats in all_stats)
+  seconds = time.time() - start_time
+  tf.logging.info(
+      'Encoded %d pairs (%d too long) into %d shards in %.1fs, '
+      '%.0f tokens/sec', num_pairs, num_too_long, FLAGS.num_output_shards,
+      seconds, num_tokens / max(seconds, 1e-6))
 
 
 def main(_):
   tf.logging.set_verbosity(tf.logging.INFO)
-  _RunEncoding()
+  if FLAGS.num_output_shards > 0:
+    _RunParallelEncoding()
+  else:
+    _RunEncoding()
 
 
 if __name__ == '__main__':
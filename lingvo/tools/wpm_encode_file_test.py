@@ -0,0 +1,101 @@
+# Lint as: python3
+# Copyright 2021 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for wpm_encode_file."""
+
+import os
+
+import lingvo.compat as tf
+from lingvo.core import test_helper
+from lingvo.core import test_utils
+from lingvo.core import wpm_encoder
+from lingvo.tools import wpm_encode_file
+
+
+class WpmEncodeFileTest(test_utils.TestCase):
+
+  def _WriteFile(self, name, lines):
+    path = os.path.join(self.get_temp_dir(), name)
+    with tf.io.gfile.GFile(path, 'w') as f:
+      f.write(''.join(line + '\n' for line in lines))
+    return path
+
+  def testAlignToLineStarts(self):
+    path = self._WriteFile('lines.txt', ['ab', 'cde', '', 'f'])
+    # Lines start at offsets 0, 3, 7, 8 and the file has 10 bytes.
+    self.assertEqual([(0, 0), (3, 1), (3, 1), (7, 2), (8, 3), (10, 4)],
+                     wpm_encode_file._AlignToLineStarts(
+                         path, [0, 2, 3, 5, 8, 9]))
+    self.assertEqual([0, 3, 7, 8, 10, 10],
+                     wpm_encode_file._LineStartOffsets(path,
+                                                       [0, 1, 2, 3, 4, 5]))
+
+  def testPlanShards(self):
+    source_lines = ['line %d' % i for i in range(10)]
+    target_lines = ['target line %d' % i for i in range(10)]
+    pairs = [
+        (self._WriteFile('src0.txt', source_lines[:7]),
+         self._WriteFile('tgt0.txt', target_lines[:7])),
+        (self._WriteFile('src1.txt', source_lines[7:]),
+         self._WriteFile('tgt1.txt', target_lines[7:])),
+    ]
+    for num_shards in (1, 3, 4, 100):
+      shards = wpm_encode_file._PlanShards(pairs, num_shards)
+      self.assertLen(shards, num_shards)
+      sources, targets = [], []
+      for segments in shards:
+        for segment in segments:
+          sources += list(wpm_encode_file._ReadLines(*segment[:3]))
+          targets += list(wpm_encode_file._ReadLines(*segment[3:]))
+      self.assertEqual([(line + '\n').encode() for line in source_lines],
+                       sources)
+      self.assertEqual([(line + '\n').encode() for line in target_lines],
+                       targets)
+
+  def testEncodeInParallel(self):
+    vocab = test_helper.test_src_dir_path('tasks/mt/wpm-ende-2k.voc')
+    source_lines = ['would that it were so simple %d' % i for i in range(20)]
+    target_lines = ['das ist %d' % i for i in range(20)]
+    source_lines[3] = 'a much longer source sentence that will be dropped'
+    pairs = [(self._WriteFile('src.txt', source_lines),
+              self._WriteFile('tgt.txt', target_lines))]
+    output_filepath = os.path.join(self.get_temp_dir(), 'encoded')
+    all_stats = wpm_encode_file.EncodeInParallel(
+        pairs,
+        vocab,
+        output_filepath,
+        num_output_shards=3,
+        num_workers=2,
+        max_len=20,
+        batch_size=4)
+    self.assertEqual(20, sum(stats['num_pairs'] for stats in all_stats))
+    self.assertEqual(1, sum(stats['num_too_long'] for stats in all_stats))
+
+    enc = wpm_encoder.HostWpmEncoder(vocab)
+    expected = []
+    for source, target in zip(source_lines, target_lines):
+      ex = wpm_encode_file._MakeTfExample(enc, *enc.Encode(source),
+                                          *enc.Encode(target), 20)
+      if ex:
+        expected.append(ex.SerializeToString())
+    actual = []
+    for k in range(3):
+      actual += list(
+          tf.io.tf_record_iterator('%s-%.5d-of-00003' % (output_filepath, k)))
+    self.assertEqual(expected, actual)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -926,9 +926,11 @@ class Evaler(base_runner.BaseRunner):
     if global_step < self._task.params.eval.start_eval_after:
       return False
 
+    input_generator = self._task.input_generator
     if self._task.params.input.resettable:
       tf.logging.info('Resetting input_generator.')
-      self._task.input_generator.Reset(sess)
+      input_generator.Reset(sess)
+      input_generator.StartPreprocessedCachePass()
 
     metrics_dict = {
         name: metrics.AverageMetric() for name in self._task.eval_metrics
@@ -947,13 +949,15 @@ class Evaler(base_runner.BaseRunner):
         # summaries. Other types of summaries (images, audio etc.) will be
         # generated for the first eval batch.
         if num_samples_metric.total_value == 0 and self._summary_op is not None:
-          ans, summaries = sess.run([self._task.eval_metrics, self._summary_op])
+          ans, summaries = input_generator.RunWithPreprocessedCache(
+              sess, [self._task.eval_metrics, self._summary_op])
           summaries = self._RemoveScalarSummaries(summaries)
 
           # Add non-scalar summaries only for the first batch of data.
           self._summary_writer.add_summary(summaries, global_step)
         else:
-          ans = sess.run(self._task.eval_metrics)
+          ans = input_generator.RunWithPreprocessedCache(
+              sess, self._task.eval_metrics)
 
         for name, (value, weight) in ans.items():
           metrics_dict[name].Update(value, weight)
@@ -963,6 +967,7 @@ class Evaler(base_runner.BaseRunner):
         if not self._task.params.input.resettable:
           raise
         break
+    input_generator.FinishPreprocessedCachePass()
 
     # Replace average values with total values for certain metrics.
     if 'num_predictions' in metrics_dict:
@@ -347,9 +347,11 @@ class Decoder(base_runner.BaseRunner):
 
     global_step = sess.run(py_utils.GetGlobalStep())
 
+    input_generator = self._task.input
     if self._task.params.input.resettable:
       tf.logging.info('Resetting input_generator.')
-      self._task.input.Reset(sess)
+      input_generator.Reset(sess)
+      input_generator.StartPreprocessedCachePass()
 
     dec_metrics = self._task.CreateDecoderMetrics()
     if not dec_metrics:
@@ -366,10 +368,11 @@ class Decoder(base_runner.BaseRunner):
         run_options = tf.RunOptions(report_tensor_allocations_upon_oom=False)
         if self._summary_op is None:
           # No summaries were collected.
-          dec_out = sess.run(self._dec_output, options=run_options)
+          dec_out = input_generator.RunWithPreprocessedCache(
+              sess, self._dec_output, options=run_options)
         else:
-          dec_out, summary = sess.run([self._dec_output, self._summary_op],
-                                      options=run_options)
+          dec_out, summary = input_generator.RunWithPreprocessedCache(
+              sess, [self._dec_output, self._summary_op], options=run_options)
           self._summary_writer.add_summary(summary, global_step)
         self._RunTF2SummaryOps(sess)
         post_process_start = time.time()
@@ -387,6 +390,7 @@ class Decoder(base_runner.BaseRunner):
         if not self._task.params.input.resettable:
           raise
         break
+    input_generator.FinishPreprocessedCachePass()
     tf.logging.info('Done decoding ckpt: %s', checkpoint_path)
 
     summaries = {k: v.Summary(k) for k, v in dec_metrics.items()}